@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+本地 RunningHub 替身服务
+实现 comfyui-runninghub 用到的 OpenAPI 接口，用于压测与离线联调：
+- POST /task/openapi/upload        上传文件，返回 fileName
+- POST /task/openapi/ai-app/run    创建任务，返回 taskId
+- POST /task/openapi/status        QUEUED → RUNNING → SUCCESS / FAILED
+- POST /task/openapi/outputs       任务输出（fileUrl 指向本服务的 /files/）
+- GET  /files/{name}               输出文件（PNG / MP4 占位内容）
+- GET  /stats                      各接口调用次数、注入的失败数与任务数
+
+可配置接口延迟（均值 + 抖动）、接口失败率（返回 500）、任务失败率与任务耗时（视频任务单独配置）。
+
+用法：
+    python benchmarks/fake_runninghub.py --port 9090 --latency-ms 80 --jitter-ms 40 --error-rate 0.01
+然后将 comfyui-runninghub 的 RUNNINGHUB_HOST 指向 http://127.0.0.1:9090
+"""
+import argparse
+import asyncio
+import random
+import struct
+import time
+import uuid
+import zlib
+from collections import Counter
+from typing import Any, Dict
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+# 视频生成工作流的 webappId（workflows/definitions.py）
+VIDEO_WEBAPP_IDS = {"1980833864815919105"}
+
+
+def make_png(width: int, height: int, color=(200, 120, 80)) -> bytes:
+    """生成纯色 PNG（不依赖 Pillow），尺寸足够让缩略图生成产生真实开销"""
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        body = kind + data
+        return struct.pack(">I", len(data)) + body + struct.pack(">I", zlib.crc32(body) & 0xFFFFFFFF)
+
+    row = b"\x00" + bytes(color) * width
+    raw = row * height
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+class FakeRunninghub:
+    """任务状态与故障注入"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.tasks: Dict[str, Dict[str, Any]] = {}
+        self.counters: Counter = Counter()
+        self.png = make_png(args.image_size, args.image_size)
+        # 占位视频：内容无意义，只用于下载与存储路径
+        self.mp4 = b"\x00\x00\x00\x18ftypmp42" + b"\x00" * (args.video_kb * 1024)
+
+    async def delay(self):
+        latency = self.args.latency_ms + random.uniform(-self.args.jitter_ms, self.args.jitter_ms)
+        if latency > 0:
+            await asyncio.sleep(latency / 1000)
+
+    def maybe_fail(self, endpoint: str):
+        self.counters[endpoint] += 1
+        if random.random() < self.args.error_rate:
+            self.counters[f"{endpoint}:injected_error"] += 1
+            raise HTTPException(status_code=500, detail="injected failure")
+
+    def task_status(self, task: Dict[str, Any]) -> str:
+        elapsed = time.monotonic() - task["created_at"]
+        if elapsed < self.args.queue_seconds:
+            return "QUEUED"
+        if elapsed < self.args.queue_seconds + task["duration"]:
+            return "RUNNING"
+        return "FAILED" if task["fail"] else "SUCCESS"
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    fake = FakeRunninghub(args)
+    app = FastAPI(title="Fake RunningHub")
+
+    @app.post("/task/openapi/upload")
+    async def upload(request: Request):
+        await fake.delay()
+        fake.maybe_fail("upload")
+        form = await request.form()
+        upload_file = form.get("file")
+        suffix = "png"
+        if upload_file is not None and getattr(upload_file, "filename", None) and "." in upload_file.filename:
+            suffix = upload_file.filename.rsplit(".", 1)[-1]
+        file_name = f"api/{uuid.uuid4().hex}.{suffix}"
+        return {"code": 0, "msg": "success", "data": {"fileName": file_name, "fileType": form.get("fileType", "image")}}
+
+    @app.post("/task/openapi/ai-app/run")
+    async def run(request: Request):
+        await fake.delay()
+        fake.maybe_fail("run")
+        payload = await request.json()
+        webapp_id = str(payload.get("webappId", ""))
+        is_video = webapp_id in VIDEO_WEBAPP_IDS
+        base = args.video_task_seconds if is_video else args.task_seconds
+        task_id = str(random.randint(10 ** 18, 10 ** 19 - 1))
+        fake.tasks[task_id] = {
+            "created_at": time.monotonic(),
+            "duration": max(0.0, random.uniform(base * 0.8, base * 1.2)),
+            "fail": random.random() < args.task_failure_rate,
+            "video": is_video,
+        }
+        fake.counters["tasks_created"] += 1
+        return {"code": 0, "msg": "success", "data": {"taskId": task_id, "taskStatus": "QUEUED"}}
+
+    @app.post("/task/openapi/status")
+    async def status(request: Request):
+        await fake.delay()
+        fake.maybe_fail("status")
+        task = fake.tasks.get(str((await request.json()).get("taskId")))
+        if task is None:
+            return {"code": 807, "msg": "task not found", "data": None}
+        return {"code": 0, "msg": "success", "data": fake.task_status(task)}
+
+    @app.post("/task/openapi/outputs")
+    async def outputs(request: Request):
+        await fake.delay()
+        fake.maybe_fail("outputs")
+        task_id = str((await request.json()).get("taskId"))
+        task = fake.tasks.get(task_id)
+        if task is None or fake.task_status(task) != "SUCCESS":
+            return {"code": 804, "msg": "APIKEY_TASK_IS_RUNNING", "data": None}
+        base_url = str(request.base_url).rstrip("/")
+        if task["video"]:
+            files = [{"fileUrl": f"{base_url}/files/{task_id}.mp4", "fileType": "mp4"}]
+        else:
+            files = [
+                {"fileUrl": f"{base_url}/files/{task_id}_{index}.png", "fileType": "png"}
+                for index in range(args.outputs_per_task)
+            ]
+        for entry in files:
+            entry["taskCostTime"] = str(round(task["duration"]))
+        return {"code": 0, "msg": "success", "data": files}
+
+    @app.get("/files/{name}")
+    async def files(name: str):
+        await fake.delay()
+        fake.counters["files"] += 1
+        if name.endswith(".mp4"):
+            return Response(content=fake.mp4, media_type="video/mp4")
+        return Response(content=fake.png, media_type="image/png")
+
+    @app.get("/stats")
+    async def stats():
+        return JSONResponse({"tasks": len(fake.tasks), "counters": dict(fake.counters)})
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="本地 RunningHub 替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="每个接口的平均延迟")
+    parser.add_argument("--jitter-ms", type=float, default=20.0, help="延迟的均匀抖动范围（±）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="接口返回 500 的概率")
+    parser.add_argument("--task-failure-rate", type=float, default=0.0, help="任务以 FAILED 结束的概率")
+    parser.add_argument("--queue-seconds", type=float, default=0.5, help="任务处于 QUEUED 的时长")
+    parser.add_argument("--task-seconds", type=float, default=3.0, help="图片类任务的运行时长（±20%%）")
+    parser.add_argument("--video-task-seconds", type=float, default=8.0, help="视频任务的运行时长（±20%%）")
+    parser.add_argument("--outputs-per-task", type=int, default=1, help="图片类任务的输出文件数")
+    parser.add_argument("--image-size", type=int, default=1024, help="输出 PNG 的边长（像素）")
+    parser.add_argument("--video-kb", type=int, default=512, help="输出视频的大小（KB）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
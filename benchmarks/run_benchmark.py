@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+端到端压测
+启动 本地 RunningHub 替身 → comfyui-runninghub → comfyui-tenant-service 整条链路（或压测已运行的 tenant 服务），
+按设定并发执行 redesign / extract / video 三类流程：
+    提交任务 → 轮询 /proxy/tasks/{id} 至终态 → POST /proxy/tasks/{id}/complete 读取收尾结果
+
+输出各流程与各步骤的 p50/p95/p99 延迟、吞吐量与各服务进程的 RSS，
+结果写入 benchmarks/results/<时间>-<提交>.json；--baseline 指定上一次的结果文件即可对比回归。
+
+用法：
+    python benchmarks/run_benchmark.py --flows redesign,extract --iterations 60 --concurrency 8
+    python benchmarks/run_benchmark.py --fake-latency-ms 150 --fake-error-rate 0.02 --baseline benchmarks/results/<上次>.json
+    python benchmarks/run_benchmark.py --no-spawn --tenant-url http://localhost:8081   # 压测已运行的服务
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+try:
+    import psutil
+except ImportError:  # pragma: no cover - optional dependency
+    psutil = None
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from fake_runninghub import make_png  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[1]
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+TERMINAL_STATUSES = {"SUCCESS", "FAILED"}
+
+# 流程名 -> (tenant 接口, 额外表单字段)
+FLOWS = {
+    "redesign": ("/proxy/complete_image_edit", {"prompt": "把外套换成深蓝色羊毛材质"}),
+    "extract": ("/proxy/complete_pattern_extract", {}),
+    "video": ("/proxy/complete_video_generation", {"prompt": "模特缓慢转身展示服装"}),
+}
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * pct / 100
+    lower = int(index)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (index - lower)
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "p50": _round(percentile(values, 50)),
+        "p95": _round(percentile(values, 95)),
+        "p99": _round(percentile(values, 99)),
+        "max": _round(max(values) if values else None),
+        "mean": _round(sum(values) / len(values) if values else None),
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 2) if value is not None else None
+
+
+def read_rss_bytes(pid: int) -> Optional[int]:
+    """进程常驻内存：优先 psutil，否则读取 /proc（Linux）"""
+    if psutil is not None:
+        try:
+            return psutil.Process(pid).memory_info().rss
+        except psutil.Error:
+            return None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+class RssSampler:
+    """定时采样各服务进程的 RSS，记录峰值与结束值"""
+
+    def __init__(self, pids: Dict[str, int], interval: float = 0.5):
+        self.pids = pids
+        self.interval = interval
+        self.samples: Dict[str, List[int]] = defaultdict(list)
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self):
+        for name, pid in self.pids.items():
+            rss = read_rss_bytes(pid)
+            if rss is not None:
+                self.samples[name].append(rss)
+
+    async def _run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.sample()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> Dict[str, Dict[str, Optional[float]]]:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self.sample()
+        mb = 1024 * 1024
+        return {
+            name: {
+                "startMb": round(values[0] / mb, 1),
+                "peakMb": round(max(values) / mb, 1),
+                "endMb": round(values[-1] / mb, 1),
+            }
+            for name, values in self.samples.items() if values
+        }
+
+
+class Stack:
+    """以子进程启动 替身 / runninghub 服务 / tenant 服务，数据与日志放在临时目录"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.workdir = Path(tempfile.mkdtemp(prefix="fashionai-bench-"))
+        self.processes: Dict[str, subprocess.Popen] = {}
+        self.fake_url = f"http://127.0.0.1:{args.fake_port}"
+        self.runninghub_url = f"http://127.0.0.1:{args.runninghub_port}"
+        self.tenant_url = f"http://127.0.0.1:{args.tenant_port}"
+
+    def _spawn(self, name: str, command: List[str], env: Dict[str, str]):
+        service_dir = self.workdir / name
+        service_dir.mkdir(parents=True, exist_ok=True)
+        log_file = open(service_dir / "stdout.log", "wb")
+        self.processes[name] = subprocess.Popen(
+            command, cwd=service_dir, env={**os.environ, **env},
+            stdout=log_file, stderr=subprocess.STDOUT,
+        )
+
+    def _uvicorn(self, app_dir: Path, port: int) -> List[str]:
+        return [
+            sys.executable, "-m", "uvicorn", "app.main:app",
+            "--app-dir", str(app_dir), "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+        ]
+
+    async def start(self):
+        args = self.args
+        fake_args = [
+            "--port", str(args.fake_port),
+            "--latency-ms", str(args.fake_latency_ms), "--jitter-ms", str(args.fake_jitter_ms),
+            "--error-rate", str(args.fake_error_rate), "--task-failure-rate", str(args.fake_task_failure_rate),
+            "--task-seconds", str(args.fake_task_seconds), "--video-task-seconds", str(args.fake_video_task_seconds),
+        ]
+        self._spawn("fake", [sys.executable, str(Path(__file__).resolve().parent / "fake_runninghub.py"), *fake_args], {})
+        extra = dict(item.split("=", 1) for item in args.env)
+        self._spawn("runninghub", self._uvicorn(ROOT / "comfyui-runninghub", args.runninghub_port), {
+            "RUNNINGHUB_HOST": self.fake_url,
+            "RUNNINGHUB_API_KEY": "bench-api-key",
+            "MAX_CONCURRENT_TASKS": str(args.upstream_slots),
+            "RESULT_CACHE_PATH": str(self.workdir / "runninghub" / "task_results.db"),
+            "LOG_DIR": str(self.workdir / "runninghub" / "logs"),
+            **extra,
+        })
+        self._spawn("tenant", self._uvicorn(ROOT / "comfyui-tenant-service", args.tenant_port), {
+            "RUNNINGHUB_SERVICE_URL": self.runninghub_url,
+            "STORAGE_TYPE": "json",
+            "JSON_STORAGE_PATH": str(self.workdir / "tenant" / "database"),
+            "RATE_LIMIT_PER_MINUTE": "0",
+            "FINALIZER_QUEUE_PATH": str(self.workdir / "tenant" / "finalizer_queue.db"),
+            "LOG_DIR": str(self.workdir / "tenant" / "logs"),
+            **extra,
+        })
+        await self._wait_ready({
+            "fake": f"{self.fake_url}/stats",
+            "runninghub": f"{self.runninghub_url}/health",
+            "tenant": f"{self.tenant_url}/health/ready",
+        })
+
+    async def _wait_ready(self, urls: Dict[str, str], timeout: float = 60.0):
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            for name, url in urls.items():
+                while True:
+                    if self.processes[name].poll() is not None:
+                        raise RuntimeError(f"{name} 启动失败，日志: {self.workdir / name / 'stdout.log'}")
+                    try:
+                        if (await client.get(url)).status_code == 200:
+                            break
+                    except httpx.HTTPError:
+                        pass
+                    if time.monotonic() > deadline:
+                        raise RuntimeError(f"{name} 在 {timeout:.0f}s 内未就绪")
+                    await asyncio.sleep(0.2)
+
+    def pids(self) -> Dict[str, int]:
+        return {name: process.pid for name, process in self.processes.items()}
+
+    def stop(self):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in self.processes.values():
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.args.keep_workdir:
+            print(f"服务数据与日志保留在: {self.workdir}")
+        else:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class Benchmark:
+    def __init__(self, args: argparse.Namespace, tenant_url: str):
+        self.args = args
+        self.tenant_url = tenant_url.rstrip("/")
+        self.image = make_png(args.image_size, args.image_size)
+        self.timings: Dict[str, List[float]] = defaultdict(list)
+        self.outcomes: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.headers: Dict[str, str] = {}
+
+    async def login(self, client: httpx.AsyncClient):
+        username = self.args.username or f"bench_{uuid.uuid4().hex[:8]}"
+        password = self.args.password
+        if not self.args.username:
+            response = await client.post(f"{self.tenant_url}/auth/register", json={"username": username, "password": password})
+            response.raise_for_status()
+        response = await client.post(f"{self.tenant_url}/auth/token", data={"username": username, "password": password})
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def _timed(self, name: str, request):
+        started = time.perf_counter()
+        try:
+            return await request
+        finally:
+            self.timings[name].append((time.perf_counter() - started) * 1000)
+
+    async def run_flow(self, client: httpx.AsyncClient, flow: str, record: bool = True) -> str:
+        path, fields = FLOWS[flow]
+        started = time.perf_counter()
+        response = await self._timed(f"{flow}.submit", client.post(
+            f"{self.tenant_url}{path}",
+            data={"fileType": "image", **fields},
+            files={"file": ("bench.png", self.image, "image/png")},
+            headers=self.headers,
+        ))
+        response.raise_for_status()
+        task_id = response.json().get("taskId")
+        if not task_id:
+            raise RuntimeError(f"提交未返回 taskId: {response.text[:200]}")
+
+        deadline = time.monotonic() + self.args.task_timeout
+        status = None
+        while time.monotonic() < deadline:
+            await asyncio.sleep(self.args.poll_interval)
+            response = await self._timed("status", client.get(f"{self.tenant_url}/proxy/tasks/{task_id}", headers=self.headers))
+            if response.status_code == 200:
+                status = response.json().get("status")
+                if status in TERMINAL_STATUSES:
+                    break
+        else:
+            raise TimeoutError(f"任务 {task_id} 在 {self.args.task_timeout}s 内未完成（最后状态 {status}）")
+
+        response = await self._timed("complete", client.post(
+            f"{self.tenant_url}/proxy/tasks/{task_id}/complete", headers=self.headers,
+        ))
+        response.raise_for_status()
+        if record:
+            self.timings[f"{flow}.e2e"].append((time.perf_counter() - started) * 1000)
+        return status
+
+    async def run(self) -> Dict[str, Any]:
+        flows = self.args.flows
+        limits = httpx.Limits(max_connections=self.args.concurrency * 2)
+        async with httpx.AsyncClient(timeout=self.args.request_timeout, limits=limits) as client:
+            await self.login(client)
+            for index in range(self.args.warmup):
+                await self.run_flow(client, flows[index % len(flows)], record=False)
+            self.timings.clear()
+
+            queue: asyncio.Queue = asyncio.Queue()
+            for index in range(self.args.iterations):
+                queue.put_nowait(flows[index % len(flows)])
+
+            async def worker():
+                while True:
+                    try:
+                        flow = queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        return
+                    try:
+                        status = await self.run_flow(client, flow)
+                        self.outcomes[flow][status.lower()] += 1
+                    except Exception as e:
+                        self.outcomes[flow]["error"] += 1
+                        self.errors[f"{type(e).__name__}: {str(e)[:120]}"] += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+            wall_seconds = time.perf_counter() - started
+
+        completed = sum(counts.get("success", 0) + counts.get("failed", 0) for counts in self.outcomes.values())
+        requests = sum(len(values) for name, values in self.timings.items() if not name.endswith(".e2e"))
+        return {
+            "wallSeconds": round(wall_seconds, 2),
+            "throughput": {
+                "flowsPerSecond": round(completed / wall_seconds, 3),
+                "requestsPerSecond": round(requests / wall_seconds, 2),
+            },
+            "outcomes": {flow: dict(counts) for flow, counts in self.outcomes.items()},
+            "latencyMs": {name: summarize(values) for name, values in sorted(self.timings.items())},
+            "errors": dict(self.errors),
+        }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """与基线对比 p95 延迟与吞吐量，返回可读的对比行"""
+    def change(new, old) -> str:
+        if new is None or not old:
+            return "n/a"
+        return f"{(new - old) / old * 100:+.1f}%"
+
+    lines = []
+    new_tp = result["results"]["throughput"]["flowsPerSecond"]
+    old_tp = baseline["results"]["throughput"]["flowsPerSecond"]
+    lines.append(f"{'throughput (flows/s)':<28} {old_tp:>10} -> {new_tp:<10} {change(new_tp, old_tp)}")
+    old_latency = baseline["results"]["latencyMs"]
+    for name, stats in result["results"]["latencyMs"].items():
+        if name in old_latency:
+            old_p95 = old_latency[name]["p95"]
+            lines.append(f"{name + ' p95 (ms)':<28} {old_p95:>10} -> {stats['p95']:<10} {change(stats['p95'], old_p95)}")
+    return lines
+
+
+def print_report(result: Dict[str, Any]):
+    results = result["results"]
+    print(f"\n耗时 {results['wallSeconds']}s, 吞吐量 {results['throughput']['flowsPerSecond']} 流程/s, "
+          f"{results['throughput']['requestsPerSecond']} 请求/s")
+    print(f"结果: {json.dumps(results['outcomes'], ensure_ascii=False)}")
+    print(f"\n{'步骤':<22}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, stats in results["latencyMs"].items():
+        print(f"{name:<24}{stats['count']:>7}{stats['p50']:>10}{stats['p95']:>10}{stats['p99']:>10}{stats['max']:>10}")
+    for name, rss in result.get("rss", {}).items():
+        print(f"RSS {name:<12} 起始 {rss['startMb']} MB, 峰值 {rss['peakMb']} MB, 结束 {rss['endMb']} MB")
+    for error, count in results["errors"].items():
+        print(f"错误 x{count}: {error}")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="FashionAI 端到端压测")
+    parser.add_argument("--flows", default="redesign,extract,video", help="逗号分隔: " + ",".join(FLOWS))
+    parser.add_argument("--iterations", type=int, default=30, help="流程总次数（按 flows 轮流分配）")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="不计入统计的预热次数")
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--task-timeout", type=float, default=300.0)
+    parser.add_argument("--request-timeout", type=float, default=120.0)
+    parser.add_argument("--image-size", type=int, default=768, help="上传图片的边长（像素）")
+    parser.add_argument("--output", help="结果文件路径，默认 benchmarks/results/<时间>-<提交>.json")
+    parser.add_argument("--baseline", help="用于对比的上一次结果文件")
+    parser.add_argument("--label", default="", help="写入结果文件的备注")
+    # 已运行的服务
+    parser.add_argument("--no-spawn", action="store_true", help="不启动服务，直接压测 --tenant-url")
+    parser.add_argument("--tenant-url", default="http://127.0.0.1:18081")
+    parser.add_argument("--username", help="使用已有账号（默认注册一个临时账号）")
+    parser.add_argument("--password", default="bench-password")
+    # 启动的服务
+    parser.add_argument("--fake-port", type=int, default=19090)
+    parser.add_argument("--runninghub-port", type=int, default=18080)
+    parser.add_argument("--tenant-port", type=int, default=18081)
+    parser.add_argument("--upstream-slots", type=int, default=20, help="runninghub 服务的 MAX_CONCURRENT_TASKS")
+    parser.add_argument("--fake-latency-ms", type=float, default=50.0)
+    parser.add_argument("--fake-jitter-ms", type=float, default=20.0)
+    parser.add_argument("--fake-error-rate", type=float, default=0.0)
+    parser.add_argument("--fake-task-failure-rate", type=float, default=0.0)
+    parser.add_argument("--fake-task-seconds", type=float, default=3.0)
+    parser.add_argument("--fake-video-task-seconds", type=float, default=8.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给两个服务的额外环境变量")
+    parser.add_argument("--keep-workdir", action="store_true", help="保留服务的临时数据与日志目录")
+    args = parser.parse_args(argv)
+    args.flows = [flow.strip() for flow in args.flows.split(",") if flow.strip()]
+    unknown = [flow for flow in args.flows if flow not in FLOWS]
+    if unknown:
+        parser.error(f"未知流程: {', '.join(unknown)}")
+    return args
+
+
+async def main_async(args: argparse.Namespace) -> Dict[str, Any]:
+    stack = None if args.no_spawn else Stack(args)
+    try:
+        if stack is not None:
+            await stack.start()
+            tenant_url = stack.tenant_url
+        else:
+            tenant_url = args.tenant_url
+
+        sampler = RssSampler(stack.pids() if stack is not None else {})
+        sampler.start()
+        results = await Benchmark(args, tenant_url).run()
+        rss = await sampler.stop()
+    finally:
+        if stack is not None:
+            stack.stop()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("password", "output", "baseline")}
+    return {
+        "schemaVersion": 1,
+        "label": args.label,
+        "startedAt": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": config,
+        "results": results,
+        "rss": rss,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = asyncio.run(main_async(args))
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}-{result['commit'] or 'nogit'}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+    print_report(result)
+    print(f"\n结果已写入: {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        print(f"\n对比基线 {args.baseline}（{baseline.get('commit')}）:")
+        for line in compare(result, baseline):
+            print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+存储仓库一致性检查 + 基准测试
+对每种存储（json / sqlite / mysql）用同一组用例检查 StorageRepository 的行为，再跑同一组负载：
+    种子数据（批量创建任务记录）→ 认证读用户 / 读租户 / 历史首页与深分页 / 批量状态鉴权 /
+    PENDING 扫描 / 任务更新 / 用量批量写入与范围查询
+每个操作都打开一个新的仓库会话（与一次请求相同），按设定并发执行，输出 ops/s 与 p50/p95/p99（毫秒）。
+
+每种存储在独立子进程中运行（存储类型在导入时确定），json / sqlite 使用临时目录；
+mysql 需要一个可随意写入的库（用例数据带随机前缀，不会与已有数据冲突，但不会清理）。
+
+用法：
+    python benchmarks/storage_suite.py                          # json + sqlite，一致性检查 + 基准
+    python benchmarks/storage_suite.py --backends sqlite --users 50 --tasks-per-user 400 --concurrency 16
+    python benchmarks/storage_suite.py --backends mysql --mysql-host 127.0.0.1 --mysql-database tenant_bench
+    python benchmarks/storage_suite.py --conformance-only
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+ROOT = Path(__file__).resolve().parents[1]
+SERVICE_DIR = ROOT / "comfyui-tenant-service"
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+BACKENDS = ("json", "sqlite", "mysql")
+RESULT_MARKER = "STORAGE_SUITE_RESULT "
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+def _summarize(values: List[float]) -> Dict[str, Any]:
+    from run_benchmark import summarize
+
+    return summarize(values)
+
+
+# ---------------------------------------------------------------------------
+# 一致性检查（在子进程中运行）
+# ---------------------------------------------------------------------------
+
+class ConformanceError(AssertionError):
+    pass
+
+
+def check(condition: bool, message: str):
+    if not condition:
+        raise ConformanceError(message)
+
+
+def _decoded(value):
+    """result_data / storage_paths：数据库存储为 JSON 文本，JSON 存储为原值"""
+    return json.loads(value) if isinstance(value, str) else value
+
+
+async def check_users(session, prefix: str):
+    async with session() as repo:
+        user = await repo.create_user(f"{prefix}u1", "hash-1", 7, f"{prefix}u1@example.com")
+        for field in ("id", "username", "email", "hashed_password", "tenant_id", "is_active", "created_at"):
+            check(field in user, f"create_user 结果缺少字段 {field}")
+        check(user["username"] == f"{prefix}u1" and user["tenant_id"] == 7, "create_user 返回的字段值不对")
+        check(bool(user["is_active"]), "新用户应为启用状态")
+        await repo.create_user(f"{prefix}u2", "hash-2", 7)
+
+    async with session() as repo:
+        found = await repo.get_user_by_username(f"{prefix}u1")
+        check(found is not None and found["id"] == user["id"], "get_user_by_username 未找到刚创建的用户")
+        check(found["hashed_password"] == "hash-1", "get_user_by_username 返回的密码哈希不对")
+        by_email = await repo.get_user_by_email(f"{prefix}u1@example.com")
+        check(by_email is not None and by_email["username"] == f"{prefix}u1", "get_user_by_email 未找到用户")
+        check(await repo.get_user_by_username(f"{prefix}missing") is None, "不存在的用户应返回 None")
+        check(await repo.get_user_by_email(f"{prefix}missing@example.com") is None, "不存在的邮箱应返回 None")
+
+    for args, what in (
+        ((f"{prefix}u1", "hash", 7, None), "重复用户名"),
+        ((f"{prefix}u3", "hash", 7, f"{prefix}u1@example.com"), "重复邮箱"),
+    ):
+        async with session() as repo:
+            try:
+                await repo.create_user(*args)
+            except ValueError:
+                pass
+            else:
+                raise ConformanceError(f"{what}应抛出 ValueError")
+
+
+async def check_tenants(session, prefix: str):
+    async with session() as repo:
+        tenant = await repo.create_tenant(f"{prefix}tenant", '{"llm": {"model": "x"}}')
+        for field in ("id", "name", "api_key", "is_active", "settings", "created_at"):
+            check(field in tenant, f"create_tenant 结果缺少字段 {field}")
+    async with session() as repo:
+        found = await repo.get_tenant_by_id(tenant["id"])
+        check(found is not None and found["name"] == f"{prefix}tenant", "get_tenant_by_id 未找到刚创建的租户")
+        check(json.loads(found["settings"]) == {"llm": {"model": "x"}}, "租户 settings 未原样保存")
+        found["name"] = "mutated"
+        again = await repo.get_tenant_by_id(tenant["id"])
+        check(again["name"] == f"{prefix}tenant", "修改返回的租户字典不应影响后续读取（缓存必须返回副本）")
+        by_key = await repo.get_tenant_by_api_key(tenant["api_key"])
+        check(by_key is not None and by_key["id"] == tenant["id"], "get_tenant_by_api_key 未找到租户")
+        check(await repo.get_tenant_by_api_key("no-such-key") is None, "未知 API key 应返回 None")
+        check(await repo.get_tenant_by_id(10 ** 9) is None, "不存在的租户应返回 None")
+    async with session() as repo:
+        try:
+            await repo.create_tenant(f"{prefix}tenant")
+        except ValueError:
+            pass
+        else:
+            raise ConformanceError("重复租户名应抛出 ValueError")
+
+
+async def check_tasks(session, prefix: str):
+    owner, other = f"{prefix}owner", f"{prefix}other"
+    async with session() as repo:
+        first = await repo.create_task_records(owner, [f"{prefix}rh1", f"{prefix}rh2", f"{prefix}rh3"], "redesign")
+        check(len(first) == 3 and len(set(first)) == 3, "create_task_records 应返回 3 个不同的 tenant_task_id")
+        check(all(t.startswith("tenant_") for t in first), "tenant_task_id 应以 tenant_ 开头")
+        single = await repo.create_task_record(owner, f"{prefix}rh4", "video")
+        others = await repo.create_task_records(other, [f"{prefix}rh5"], "redesign")
+        check(await repo.create_task_records(owner, [], "redesign") == [], "空列表应返回空列表")
+
+    async with session() as repo:
+        record = await repo.get_task_record(first[0])
+        check(record is not None, "get_task_record 未找到刚创建的记录")
+        for field in ("id", "tenant_task_id", "user_id", "runninghub_task_id", "task_type", "status", "created_at",
+                      "completed_at", "result_data", "storage_paths", "error_message"):
+            check(field in record, f"任务记录缺少字段 {field}")
+        check(record["status"] == "PENDING" and record["runninghub_task_id"] == f"{prefix}rh1", "新记录应为 PENDING")
+        check(isinstance(record["created_at"], str), "任务记录的 created_at 应为 ISO 字符串")
+        check(await repo.get_task_record("tenant_missing") is None, "不存在的记录应返回 None")
+
+        owned = await repo.get_tasks_by_runninghub_ids(owner, [f"{prefix}rh1", f"{prefix}rh4", f"{prefix}rh5", "nope"])
+        check(set(owned) == {f"{prefix}rh1", f"{prefix}rh4"}, "get_tasks_by_runninghub_ids 应只返回该用户的任务")
+        check(owned[f"{prefix}rh4"]["tenant_task_id"] == single, "按 RunningHub ID 取回的记录不对")
+        check(await repo.get_tasks_by_runninghub_ids(owner, []) == {}, "空 ID 列表应返回空字典")
+
+        history = await repo.get_user_tasks(owner, 10, 0)
+        check([t["runninghub_task_id"] for t in history] == [f"{prefix}rh{i}" for i in (4, 3, 2, 1)],
+              "get_user_tasks 应按创建时间倒序（同一时间按 id 倒序）")
+        page = await repo.get_user_tasks(owner, 2, 1)
+        check([t["runninghub_task_id"] for t in page] == [f"{prefix}rh3", f"{prefix}rh2"], "get_user_tasks 分页不对")
+        typed = await repo.get_user_tasks(owner, 1, 1, "redesign")
+        check([t["runninghub_task_id"] for t in typed] == [f"{prefix}rh2"], "task_type 应在分页之前筛选")
+
+    async with session() as repo:
+        check(await repo.update_task_success(first[0], {"outputs": [1, 2]}, [{"path": "a.png"}]), "update_task_success 应返回 True")
+        check(await repo.update_task_failed(first[1], "boom"), "update_task_failed 应返回 True")
+        check(not await repo.update_task_success("tenant_missing", {}, []), "更新不存在的记录应返回 False")
+        check(not await repo.update_task_failed("tenant_missing", "x"), "更新不存在的记录应返回 False")
+        check(await repo.update_task_runninghub_id(others[0], f"{prefix}rh5up"), "update_task_runninghub_id 应返回 True")
+        check(not await repo.update_task_runninghub_id("tenant_missing", "x"), "更新不存在的记录应返回 False")
+
+    async with session() as repo:
+        done = await repo.get_task_record(first[0])
+        check(done["status"] == "SUCCESS" and done["completed_at"], "成功记录应有状态与完成时间")
+        check(_decoded(done["result_data"]) == {"outputs": [1, 2]}, "result_data 未原样保存")
+        check(_decoded(done["storage_paths"]) == [{"path": "a.png"}], "storage_paths 未原样保存")
+        failed = await repo.get_task_record(first[1])
+        check(failed["status"] == "FAILED" and failed["error_message"] == "boom", "失败记录应有状态与错误信息")
+        pending = [t for t in await repo.get_pending_tasks(100000) if t["user_id"] in (owner, other)]
+        check([t["runninghub_task_id"] for t in pending] == [f"{prefix}rh3", f"{prefix}rh4", f"{prefix}rh5up"],
+              "get_pending_tasks 应只返回 PENDING 记录，最早创建的优先")
+        renamed = await repo.get_tasks_by_runninghub_ids(other, [f"{prefix}rh5", f"{prefix}rh5up"])
+        check(set(renamed) == {f"{prefix}rh5up"} and renamed[f"{prefix}rh5up"]["tenant_task_id"] == others[0],
+              "update_task_runninghub_id 后应只能按新的 RunningHub ID 取回记录")
+        outputs = [t for t in await repo.get_task_outputs(done["id"] - 1, 100000) if t["user_id"] in (owner, other)]
+        check([t["id"] for t in outputs] == [done["id"]], "get_task_outputs 应只返回有输出文件的记录")
+        check(_decoded(outputs[0]["storage_paths"]) == [{"path": "a.png"}] and outputs[0]["task_type"] == "redesign",
+              "get_task_outputs 返回的字段不对")
+        check(all(t["id"] > done["id"] for t in await repo.get_task_outputs(done["id"], 100000)),
+              "get_task_outputs 应只返回 id 大于 after_id 的记录")
+
+
+async def check_usage(session, prefix: str):
+    tenant_id = 900000 + uuid.uuid4().int % 90000
+    base = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(hours=1)
+    rows = [
+        {"tenant_id": tenant_id, "user_id": 1, "endpoint": "GET /a", "request_count": 3, "created_at": base},
+        {"tenant_id": tenant_id, "user_id": 2, "endpoint": "GET /b", "request_count": 2, "created_at": base + timedelta(minutes=1)},
+        {"tenant_id": tenant_id, "user_id": 1, "endpoint": "GET /a", "request_count": 5, "created_at": base + timedelta(minutes=2)},
+        {"tenant_id": tenant_id + 1, "user_id": 1, "endpoint": "GET /a", "request_count": 7, "created_at": base},
+    ]
+    async with session() as repo:
+        await repo.append_api_usage(rows)
+        await repo.append_api_usage([])
+    async with session() as repo:
+        found = await repo.get_api_usage(tenant_id, base, base + timedelta(minutes=2))
+        check(sorted(r["request_count"] for r in found) == [2, 3], "get_api_usage 应只返回 [start, end) 内该租户的行")
+        check(all(isinstance(r["created_at"], datetime) for r in found), "用量行的 created_at 应为 datetime")
+        check({r["endpoint"] for r in found} == {"GET /a", "GET /b"}, "用量行的 endpoint 不对")
+        check(await repo.get_api_usage(tenant_id, base - timedelta(days=1), base) == [], "范围外应返回空列表")
+
+
+CHECKS = (
+    ("users", check_users),
+    ("tenants", check_tenants),
+    ("tasks", check_tasks),
+    ("usage", check_usage),
+)
+
+
+async def run_conformance(session) -> Dict[str, Any]:
+    results = {}
+    for name, func in CHECKS:
+        prefix = f"c{uuid.uuid4().hex[:8]}_"
+        try:
+            await func(session, prefix)
+            results[name] = {"ok": True}
+        except ConformanceError as e:
+            results[name] = {"ok": False, "error": str(e)}
+        except Exception as e:
+            results[name] = {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 基准负载（在子进程中运行）
+# ---------------------------------------------------------------------------
+
+async def measure(ops: int, concurrency: int, op: Callable[[int], Awaitable[Any]]) -> Dict[str, Any]:
+    """并发执行 ops 次 op(i)，返回延迟分布（毫秒）与吞吐"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(i: int):
+        async with semaphore:
+            started = time.perf_counter()
+            await op(i)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(ops)))
+    elapsed = time.perf_counter() - started
+    return {**_summarize(latencies), "ops_per_second": round(ops / elapsed, 1) if elapsed else None}
+
+
+async def run_benchmark(session, args) -> Dict[str, Any]:
+    prefix = f"b{uuid.uuid4().hex[:8]}_"
+    users = [f"{prefix}user{i}" for i in range(args.users)]
+    batch = 20
+    results: Dict[str, Any] = {}
+
+    async with session() as repo:
+        tenant = await repo.create_tenant(f"{prefix}tenant")
+
+    async def create_user(i: int):
+        async with session() as repo:
+            await repo.create_user(users[i], "hash", tenant["id"], f"{users[i]}@example.com")
+
+    results["create_user"] = await measure(args.users, args.concurrency, create_user)
+
+    # 每个用户 tasks_per_user 条记录，按 batch 条一批创建
+    batches = [(user, start) for user in users for start in range(0, args.tasks_per_user, batch)]
+    task_ids: Dict[str, List[str]] = {user: [] for user in users}
+
+    async def create_tasks(i: int):
+        user, start = batches[i]
+        ids = [f"{user}_rh{n}" for n in range(start, min(start + batch, args.tasks_per_user))]
+        async with session() as repo:
+            created = await repo.create_task_records(user, ids, "redesign" if start % (2 * batch) == 0 else "video")
+        task_ids[user].extend(created)
+
+    results[f"create_task_records[{batch}]"] = await measure(len(batches), args.concurrency, create_tasks)
+
+    async def get_user(i: int):
+        async with session() as repo:
+            await repo.get_user_by_username(users[i % len(users)])
+
+    async def get_tenant(i: int):
+        async with session() as repo:
+            await repo.get_tenant_by_id(tenant["id"])
+
+    async def history_first_page(i: int):
+        async with session() as repo:
+            await repo.get_user_tasks(users[i % len(users)], 20, 0)
+
+    deep_offset = max(0, args.tasks_per_user - 40)
+
+    async def history_deep_page(i: int):
+        async with session() as repo:
+            await repo.get_user_tasks(users[i % len(users)], 20, deep_offset)
+
+    async def history_by_type(i: int):
+        async with session() as repo:
+            await repo.get_user_tasks(users[i % len(users)], 20, 20, "video")
+
+    async def status_batch(i: int):
+        user = users[i % len(users)]
+        ids = [f"{user}_rh{n}" for n in range(0, min(20, args.tasks_per_user))]
+        async with session() as repo:
+            await repo.get_tasks_by_runninghub_ids(user, ids)
+
+    async def pending_scan(i: int):
+        async with session() as repo:
+            await repo.get_pending_tasks(500)
+
+    read_ops = args.ops
+    for name, op in (
+        ("get_user_by_username", get_user),
+        ("get_tenant_by_id", get_tenant),
+        ("get_user_tasks[first page]", history_first_page),
+        (f"get_user_tasks[offset {deep_offset}]", history_deep_page),
+        ("get_user_tasks[task_type]", history_by_type),
+        ("get_tasks_by_runninghub_ids[20]", status_batch),
+        ("get_pending_tasks[500]", pending_scan),
+    ):
+        results[name] = await measure(read_ops, args.concurrency, op)
+
+    updates = [tid for ids in task_ids.values() for tid in ids][: args.ops]
+
+    async def update_task(i: int):
+        async with session() as repo:
+            if i % 2:
+                await repo.update_task_failed(updates[i], "bench")
+            else:
+                await repo.update_task_success(updates[i], {"outputs": [i]}, [{"path": f"{i}.png"}])
+
+    results["update_task"] = await measure(len(updates), args.concurrency, update_task)
+
+    base = datetime.utcnow().replace(second=0, microsecond=0) - timedelta(days=1)
+    usage_batch = 500
+
+    async def append_usage(i: int):
+        rows = [
+            {
+                "tenant_id": tenant["id"], "user_id": n % 50, "endpoint": f"GET /e{n % 20}",
+                "request_count": 1 + n % 5, "created_at": base + timedelta(minutes=(i * usage_batch + n) % 1440),
+            }
+            for n in range(usage_batch)
+        ]
+        async with session() as repo:
+            await repo.append_api_usage(rows)
+
+    usage_flushes = max(1, args.ops // 50)
+    results[f"append_api_usage[{usage_batch}]"] = await measure(usage_flushes, 1, append_usage)
+
+    async def usage_query(i: int):
+        async with session() as repo:
+            await repo.get_api_usage(tenant["id"], base, base + timedelta(days=1))
+
+    results["get_api_usage[1 day]"] = await measure(max(1, args.ops // 20), args.concurrency, usage_query)
+    return results
+
+
+async def worker_main(args) -> Dict[str, Any]:
+    sys.path.insert(0, str(SERVICE_DIR))
+    from app.services.repository import repository_session
+
+    output: Dict[str, Any] = {"backend": args.worker}
+    output["conformance"] = await run_conformance(repository_session)
+    if not args.conformance_only:
+        output["benchmark"] = await run_benchmark(repository_session, args)
+
+    from app.models.database import close_storage
+
+    await close_storage()
+    return output
+
+
+# ---------------------------------------------------------------------------
+# 调度与报告
+# ---------------------------------------------------------------------------
+
+def backend_env(backend: str, workdir: Path, args) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "STORAGE_TYPE": backend,
+        "JSON_STORAGE_PATH": str(workdir / "database"),
+        "SQLITE_PATH": str(workdir / "tenant_service.db"),
+        "LOG_DIR": str(workdir / "logs"),
+        "LOG_LEVEL": "WARNING",
+        "TENANT_CACHE_SECONDS": str(args.tenant_cache_seconds),
+    })
+    if backend == "mysql":
+        env.update({
+            "MYSQL_HOST": args.mysql_host,
+            "MYSQL_PORT": str(args.mysql_port),
+            "MYSQL_USER": args.mysql_user,
+            "MYSQL_PASSWORD": args.mysql_password,
+            "MYSQL_DATABASE": args.mysql_database,
+        })
+    return env
+
+
+def run_backend(backend: str, args) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix=f"storage-suite-{backend}-") as tmp:
+        workdir = Path(tmp)
+        command = [sys.executable, str(Path(__file__).resolve()), "--worker", backend,
+                   "--users", str(args.users), "--tasks-per-user", str(args.tasks_per_user),
+                   "--ops", str(args.ops), "--concurrency", str(args.concurrency)]
+        if args.conformance_only:
+            command.append("--conformance-only")
+        completed = subprocess.run(
+            command, cwd=workdir, env=backend_env(backend, workdir, args),
+            capture_output=True, text=True, timeout=args.timeout,
+        )
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_MARKER):
+            return json.loads(line[len(RESULT_MARKER):])
+    return {"backend": backend, "error": (completed.stderr or completed.stdout)[-4000:]}
+
+
+def print_report(results: List[Dict[str, Any]]):
+    print("\n== 一致性检查 ==")
+    for result in results:
+        if "error" in result:
+            print(f"{result['backend']:<8} 运行失败:\n{result['error']}")
+            continue
+        for name, outcome in result["conformance"].items():
+            status = "通过" if outcome["ok"] else f"失败: {outcome['error']}"
+            print(f"{result['backend']:<8} {name:<10} {status}")
+
+    benchmarked = [r for r in results if r.get("benchmark")]
+    if not benchmarked:
+        return
+    print("\n== 基准（每格: ops/s  p50/p95 ms） ==")
+    names = list(benchmarked[0]["benchmark"])
+    header = f"{'workload':<34}" + "".join(f"{r['backend']:>26}" for r in benchmarked)
+    print(header)
+    for name in names:
+        cells = []
+        for result in benchmarked:
+            stats = result["benchmark"].get(name)
+            cells.append(f"{stats['ops_per_second']:>8}  {stats['p50']}/{stats['p95']}" if stats else "-")
+        print(f"{name:<34}" + "".join(f"{cell:>26}" for cell in cells))
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="存储仓库一致性检查 + 基准测试")
+    parser.add_argument("--backends", default="json,sqlite", help="逗号分隔: " + ",".join(BACKENDS))
+    parser.add_argument("--conformance-only", action="store_true", help="只做一致性检查")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--tasks-per-user", type=int, default=200)
+    parser.add_argument("--ops", type=int, default=500, help="每个读/更新负载的操作次数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--tenant-cache-seconds", type=float, default=30.0, help="0 时测量不带缓存的租户读取")
+    parser.add_argument("--timeout", type=float, default=1800.0, help="每种存储的最长运行时间（秒）")
+    parser.add_argument("--output", help="结果文件路径，默认 benchmarks/results/storage-<时间>.json")
+    parser.add_argument("--mysql-host", default="127.0.0.1")
+    parser.add_argument("--mysql-port", type=int, default=3306)
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-password", default="")
+    parser.add_argument("--mysql-database", default="comfyui_tenant_bench")
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if args.worker:
+        result = asyncio.run(worker_main(args))
+        print(RESULT_MARKER + json.dumps(result, ensure_ascii=False, default=str))
+        return 0
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = [b for b in backends if b not in BACKENDS]
+    if unknown:
+        print(f"未知的存储类型: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    results = []
+    for backend in backends:
+        print(f"运行 {backend} ...", flush=True)
+        results.append(run_backend(backend, args))
+    print_report(results)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"storage-{datetime.now():%Y%m%d-%H%M%S}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps({
+        "created_at": datetime.now().isoformat(),
+        "args": {k: v for k, v in vars(args).items() if k not in ("worker", "mysql_password")},
+        "results": results,
+    }, ensure_ascii=False, indent=2))
+    print(f"\n结果已写入 {output}")
+
+    failed = any("error" in r or not all(o["ok"] for o in r["conformance"].values()) for r in results)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,5 @@
 import { NextRequest, NextResponse } from "next/server";
+import { forwardedFor } from "@/lib/forwarded-for";
 
 const TENANT_API_BASE =
   process.env.NEXT_PUBLIC_TENANT_API_URL || "http://localhost:8081";
@@ -12,6 +13,7 @@ export async function POST(request: NextRequest) {
       method: "POST",
       headers: {
         "Content-Type": "application/json",
+        ...forwardedFor(request),
       },
       body: JSON.stringify(body),
     });
@@ -30,11 +30,8 @@ export async function POST(
 
     const data = await response.json();
 
-    if (!response.ok) {
-      return NextResponse.json(data, { status: response.status });
-    }
-
-    return NextResponse.json(data);
+    // 透传状态码：输出仍在处理中时为 202，客户端据此重试
+    return NextResponse.json(data, { status: response.status });
   } catch (error) {
     console.error("Complete task proxy error:", error);
     return NextResponse.json(
@@ -469,7 +469,7 @@ export default function ExtractStripePage() {
     }
   }, [hydrateStripeUnits, payloadMeta?.sourceImage])
 
-  const fetchAiVariations = useCallback(async () => {
+  const fetchAiVariations = useCallback(async (forceRefresh = false) => {
     if (normalizedUnitsForAi.length === 0) return
     const signature = JSON.stringify(normalizedUnitsForAi)
     aiRequestSignatureRef.current = signature
@@ -479,6 +479,7 @@ export default function ExtractStripePage() {
       const response = await extractApiClient.requestStripeVariations({
         stripeUnits: normalizedUnitsForAi,
         paletteGroups,
+        forceRefresh,
       })
       const cleanedVariations: StripeLLMVariation[] = Array.isArray(response?.variations)
         ? response.variations
@@ -570,7 +571,7 @@ export default function ExtractStripePage() {
 
   const handleRegenerateAiVariations = useCallback(() => {
     aiRequestSignatureRef.current = ""
-    void fetchAiVariations()
+    void fetchAiVariations(true)
   }, [fetchAiVariations])
 
   const applyAiVariation = useCallback(
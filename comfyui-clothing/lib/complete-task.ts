@@ -0,0 +1,27 @@
+const COMPLETE_POLL_INTERVAL_MS = 3000;
+const COMPLETE_MAX_WAIT_MS = 15 * 60 * 1000;
+
+/**
+ * 调用 /proxy/tasks/{id}/complete 直到收尾结束
+ * 输出仍在下载时服务端返回 202（status: "pending"），这里间隔重试；
+ * 返回 completed 的响应体，任务失败或等待超时时抛出错误
+ */
+export async function requestTaskCompletion(
+  request: () => Promise<Response>
+): Promise<any> {
+  const deadline = Date.now() + COMPLETE_MAX_WAIT_MS;
+  for (;;) {
+    const response = await request();
+    const data = await response.json();
+    if (response.status !== 202 && data?.status !== "pending") {
+      if (data?.status === "failed") {
+        throw new Error(data.message || "任务失败");
+      }
+      return data;
+    }
+    if (Date.now() >= deadline) {
+      throw new Error("任务结果仍在处理中，请稍后在历史记录中查看");
+    }
+    await new Promise((resolve) => setTimeout(resolve, COMPLETE_POLL_INTERVAL_MS));
+  }
+}
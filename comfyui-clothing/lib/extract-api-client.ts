@@ -3,6 +3,8 @@
  * Handles pattern extract workflow via Next.js API proxy
  */
 
+import { requestTaskCompletion } from "./complete-task";
+
 const API_BASE_URL = "/api"; // Next.js API routes
 
 export interface ExtractResponse {
@@ -127,6 +129,7 @@ export class ExtractApiClient {
     stripeUnits: Array<{ color: { r: number; g: number; b: number }; widthPx: number }>;
     paletteGroups?: PaletteGroup[];
     targetCount?: number;
+    forceRefresh?: boolean;
   }): Promise<StripeLLMResponse> {
     const res = await this.makeRequest(
       `${this.baseUrl}/proxy/llm/stripe_variations`,
@@ -190,11 +193,12 @@ export class ExtractApiClient {
   }
 
   async completeTask(taskId: string): Promise<{ outputs: string[] }> {
-    const res = await this.makeRequest(
-      `${this.baseUrl}/proxy/tasks/${taskId}/complete`,
-      { method: "POST", headers: this.getHeaders() }
+    const data = await requestTaskCompletion(() =>
+      this.makeRequest(`${this.baseUrl}/proxy/tasks/${taskId}/complete`, {
+        method: "POST",
+        headers: this.getHeaders(),
+      })
     );
-    const data = await res.json();
     const outputs: string[] = [];
 
     const storagePaths =
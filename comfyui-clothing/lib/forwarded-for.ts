@@ -0,0 +1,11 @@
+import { NextRequest } from "next/server";
+
+/**
+ * 转发给 tenant service 的客户端地址
+ * 未登录请求（登录、注册）在 tenant service 按客户端 IP 限流，
+ * 不透传时所有用户都会以本服务器的地址共用同一个令牌桶
+ */
+export function forwardedFor(request: NextRequest): Record<string, string> {
+  const forwarded = request.headers.get("x-forwarded-for") || request.ip;
+  return forwarded ? { "X-Forwarded-For": forwarded } : {};
+}
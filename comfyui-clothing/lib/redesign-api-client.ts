@@ -3,6 +3,8 @@
  * Handles image upload and redesign requests through Next.js API routes
  */
 
+import { requestTaskCompletion } from "./complete-task";
+
 const API_BASE_URL = "/api"; // 使用 Next.js API 路由
 
 export interface RedesignRequest {
@@ -202,16 +204,13 @@ export class RedesignApiClient {
    * Complete task and automatically download/store images
    */
   async completeTask(taskId: string): Promise<{ outputs: string[] }> {
-    const response = await this.makeRequest(
-      `${this.baseUrl}/proxy/tasks/${taskId}/complete`,
-      {
+    const data = await requestTaskCompletion(() =>
+      this.makeRequest(`${this.baseUrl}/proxy/tasks/${taskId}/complete`, {
         method: "POST",
         headers: this.getHeaders(),
-      }
+      })
     );
 
-    const data = await response.json();
-
     // 将存储路径转换为可访问的URL
     if (data.storagePaths && Array.isArray(data.storagePaths)) {
       const localUrls = data.storagePaths
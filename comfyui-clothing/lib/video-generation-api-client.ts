@@ -1,3 +1,5 @@
+import { requestTaskCompletion } from "./complete-task";
+
 const API_BASE_URL = "/api";
 
 export interface VideoGenerationResponse {
@@ -85,11 +87,12 @@ export class VideoGenerationApiClient {
   }
 
   async completeTask(taskId: string): Promise<CompleteTaskResponse> {
-    const res = await this.makeRequest(
-      `${this.baseUrl}/proxy/tasks/${taskId}/complete`,
-      { method: "POST", headers: this.getHeaders() }
+    const data = await requestTaskCompletion(() =>
+      this.makeRequest(`${this.baseUrl}/proxy/tasks/${taskId}/complete`, {
+        method: "POST",
+        headers: this.getHeaders(),
+      })
     );
-    const data = await res.json();
     const outputs: string[] = [];
 
     const storagePaths =
@@ -1,11 +1,23 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from .routers.v1 import router as v1_router
 from .routers.workflow_endpoints import router as workflow_router
-from .services.logger import get_main_logger
+from .routers.pipelines import router as pipelines_router
+from .services.config import get_settings
+from .services.logger import get_main_logger, setup_logging, shutdown_logging
+from .services.log_policy import loggable
+from .services.runninghub_client import get_runninghub_client
+from .services.task_scheduler import TenantContextMiddleware, get_task_scheduler
+from .services.resilience import CircuitOpenError
+from .services.metrics import CONTENT_TYPE, MetricsMiddleware, get_metrics_registry
+from .services.tracing import TracingMiddleware, get_span_exporter
+from .services.upload_retention import get_upload_retention
+from workflows.workflow_manager import workflow_manager
 
 
 def create_app() -> FastAPI:
+    setup_logging()
     logger = get_main_logger()
     logger.info("启动 ComfyUI Runninghub API 服务器")
     
@@ -20,13 +32,56 @@ def create_app() -> FastAPI:
         allow_headers=["*"],
         expose_headers=["*"],
     )
+    app.add_middleware(TenantContextMiddleware)
+    app.add_middleware(TracingMiddleware)
+    # 最外层：延迟包含其它中间件的耗时
+    app.add_middleware(MetricsMiddleware)
     app.include_router(v1_router, prefix="/v1")
     app.include_router(workflow_router, prefix="/v1")
+    app.include_router(pipelines_router, prefix="/v1")
     
+    @app.exception_handler(CircuitOpenError)
+    async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+        # 上游熔断期间快速失败，提示客户端稍后重试
+        return JSONResponse(
+            status_code=503,
+            content={"detail": str(exc)},
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+
     # 添加健康检查端点
     @app.get("/health")
     async def health_check():
         return {"status": "healthy", "service": "comfyui-runninghub"}
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=get_metrics_registry().render(), media_type=CONTENT_TYPE)
+
+    @app.on_event("startup")
+    async def report_workflow_registry():
+        preload = get_settings().workflow_preload
+        if preload:
+            workflow_manager.preload(None if "*" in preload else preload)
+        logger.info("工作流注册表加载报告: %s", loggable(workflow_manager.load_report(), max_total_length=0))
+
+    @app.on_event("startup")
+    async def restore_scheduler_tickets():
+        get_task_scheduler().restore(get_runninghub_client())
+
+    @app.on_event("startup")
+    async def start_upload_retention():
+        get_upload_retention().start()
+
+    @app.on_event("shutdown")
+    async def stop_upload_retention():
+        await get_upload_retention().stop()
+
+    @app.on_event("shutdown")
+    async def flush_logs_on_shutdown():
+        logger.info("服务器关闭")
+        get_span_exporter().flush()
+        shutdown_logging()
     
     logger.info("服务器配置完成")
     return app
@@ -0,0 +1,97 @@
+import copy
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, File, Form, Header, HTTPException, UploadFile
+from ..services.runninghub_client import get_runninghub_client
+from ..services.logger import get_router_logger
+from ..services.resilience import CircuitOpenError
+from ..services.pipeline_engine import PIPELINE_DEFINITIONS, PipelineError, get_pipeline_engine, validate_stages
+
+router = APIRouter()
+
+
+def _parse_json_field(raw: Optional[str], field_name: str):
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=400, detail=f"{field_name} 不是合法的 JSON")
+
+
+@router.get("/pipelines")
+async def list_pipelines():
+    """预置流水线列表"""
+    return {"pipelines": PIPELINE_DEFINITIONS}
+
+
+@router.post("/pipelines")
+async def create_pipeline(
+    file: Optional[UploadFile] = File(None),
+    imageName: str = Form(default=""),
+    fileType: str = Form(default="image"),
+    pipeline: str = Form(default=""),
+    stages: str = Form(default=""),
+    params: str = Form(default=""),
+    client = Depends(get_runninghub_client),
+):
+    """
+    启动流水线
+    - pipeline：预置流水线名称；或 stages：自定义阶段定义（JSON 数组）
+    - file / imageName：源图（上传文件或已上传的 RunningHub 文件名），只上传一次
+    - params：按阶段 id 覆盖参数（JSON 对象），如 {"video": {"prompt": "..."}}
+    """
+    logger = get_router_logger()
+
+    if pipeline:
+        definition = PIPELINE_DEFINITIONS.get(pipeline)
+        if definition is None:
+            raise HTTPException(status_code=404, detail=f"流水线 '{pipeline}' 不存在")
+        stage_list = copy.deepcopy(definition["stages"])
+        name = pipeline
+    else:
+        stage_list = _parse_json_field(stages, "stages")
+        name = "custom"
+    if not stage_list:
+        raise HTTPException(status_code=400, detail="必须提供 pipeline 或 stages")
+
+    overrides = _parse_json_field(params, "params") or {}
+    if not isinstance(overrides, dict):
+        raise HTTPException(status_code=400, detail="params 必须是 JSON 对象")
+    for stage in stage_list:
+        if isinstance(stage, dict) and isinstance(overrides.get(stage.get("id")), dict):
+            stage["params"] = {**(stage.get("params") or {}), **overrides[stage["id"]]}
+
+    if not file and not imageName:
+        raise HTTPException(status_code=400, detail="必须提供图片文件或已上传图片名称")
+
+    # 先校验阶段定义与各阶段参数，不合法时不上传源图
+    try:
+        validate_stages(stage_list)
+    except PipelineError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    engine = get_pipeline_engine()
+    try:
+        if file:
+            uploaded = await client.upload_file(file=file, file_type=fileType)
+            imageName = uploaded.get("fileName", "") if isinstance(uploaded, dict) else str(uploaded or "")
+            if not imageName:
+                raise HTTPException(status_code=502, detail="上传失败，未获取到图片名称")
+        return engine.start(stage_list, source_image=imageName, name=name)
+    except PipelineError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except (HTTPException, CircuitOpenError):
+        raise
+    except Exception as e:
+        logger.error("启动流水线失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"启动流水线失败: {str(e)}")
+
+
+@router.get("/pipelines/{pipeline_id}")
+async def get_pipeline(pipeline_id: str, x_tenant_id: Optional[str] = Header(default=None)):
+    """流水线状态（含各阶段状态、taskId 与输出）"""
+    snapshot = get_pipeline_engine().snapshot(pipeline_id, tenant_id=x_tenant_id)
+    if snapshot is None:
+        raise HTTPException(status_code=404, detail="Pipeline not found")
+    return snapshot
@@ -1,9 +1,15 @@
+import asyncio
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
+from ..services.config import get_settings
 from ..services.runninghub_client import get_runninghub_client
 from ..services.task_manager import get_task_manager
 from ..services.logger import get_router_logger
+from ..services.task_scheduler import get_task_scheduler
+from ..services.resilience import CircuitOpenError, get_resilience_registry
+from ..services.result_cache import get_result_cache
+from ..services.tracing import SpanExporter, get_span_exporter
 
 router = APIRouter()
 
@@ -17,17 +23,98 @@ async def upload_file(
     try:
         result = await client.upload_file(file=file, file_type=fileType)
         return {"fileName": result}
+    except CircuitOpenError:
+        raise
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@router.get("/scheduler")
+async def get_scheduler_stats():
+    return get_task_scheduler().stats()
+
+
+@router.get("/upstream")
+async def get_upstream_resilience():
+    """RunningHub 各操作的重试、重试预算与熔断器状态，以及终态结果缓存命中情况"""
+    cache = get_result_cache()
+    return {
+        "operations": get_resilience_registry().metrics(),
+        "resultCache": cache.stats() if cache is not None else None,
+    }
+
+
+@router.get("/traces")
+async def get_recent_traces(traceId: Optional[str] = None, limit: int = 200, format: str = "json"):
+    """最近记录的 span（内存环形缓冲区），可按 traceId 过滤；format=otlp 返回 OTLP/JSON"""
+    if format not in ("json", "otlp"):
+        raise HTTPException(status_code=400, detail="format 只支持 json 或 otlp")
+    spans = get_span_exporter().recent(trace_id=traceId, limit=max(1, min(limit, 2000)))
+    return SpanExporter.render(spans, format)
+
+
+class BatchStatusRequest(BaseModel):
+    taskIds: List[str]
+
+
+@router.post("/tasks/status:batch")
+async def get_task_status_batch(
+    payload: BatchStatusRequest,
+    client = Depends(get_runninghub_client),
+):
+    """批量查询任务状态：排队中的票据本地作答，其余以有限并发向 RunningHub 查询"""
+    settings = get_settings()
+    task_ids = list(dict.fromkeys(payload.taskIds))
+    if len(task_ids) > settings.status_batch_max_ids:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {settings.status_batch_max_ids} 个任务")
+
+    scheduler = get_task_scheduler()
+    semaphore = asyncio.Semaphore(settings.status_batch_concurrency)
+    statuses = {}
+
+    async def fetch(task_id: str, upstream_task_id: str):
+        async with semaphore:
+            try:
+                status = await client.get_status(upstream_task_id)
+            except Exception as exc:
+                statuses[task_id] = {"status": "UNKNOWN", "error": str(exc)}
+                return
+        scheduler.observe_status(upstream_task_id, status)
+        entry = {"status": status}
+        if upstream_task_id != task_id:
+            entry["upstreamTaskId"] = upstream_task_id
+        statuses[task_id] = entry
+
+    pending = []
+    for task_id in task_ids:
+        queue_info = scheduler.queue_info(task_id)
+        if queue_info is not None:
+            statuses[task_id] = queue_info
+        else:
+            pending.append(fetch(task_id, scheduler.resolve(task_id)))
+    await asyncio.gather(*pending)
+
+    return {"statuses": {task_id: statuses[task_id] for task_id in task_ids}}
+
+
 @router.get("/tasks/{task_id}")
 async def get_task_status(
     task_id: str,
     task_manager = Depends(get_task_manager),
 ):
-    status = await task_manager.get_status(task_id)
-    return {"taskId": task_id, "status": status}
+    scheduler = get_task_scheduler()
+    queue_info = scheduler.queue_info(task_id)
+    if queue_info is not None:
+        # 仍在本地排队（或派发失败），尚未提交到 RunningHub
+        return {"taskId": task_id, **queue_info}
+
+    upstream_task_id = scheduler.resolve(task_id)
+    status = await task_manager.get_status(upstream_task_id)
+    scheduler.observe_status(upstream_task_id, status)
+    result = {"taskId": task_id, "status": status}
+    if upstream_task_id != task_id:
+        result["upstreamTaskId"] = upstream_task_id
+    return result
 
 
 @router.get("/tasks/{task_id}/outputs")
@@ -35,7 +122,10 @@ async def get_task_outputs(
     task_id: str,
     client = Depends(get_runninghub_client),
 ):
-    outputs = await client.get_outputs(task_id)
+    upstream_task_id = get_task_scheduler().resolve(task_id)
+    if upstream_task_id is None:
+        return {"taskId": task_id, "outputs": []}
+    outputs = await client.get_outputs(upstream_task_id)
     return {"taskId": task_id, "outputs": outputs}
 
 
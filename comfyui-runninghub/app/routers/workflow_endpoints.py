@@ -2,35 +2,24 @@
 动态工作流端点生成器
 根据工作流定义自动创建端点
 """
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form
-from typing import Any, Dict, Optional
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Form, Request
+from typing import Any, Dict, List, Optional
+import json
 from pydantic import BaseModel
 from ..services.runninghub_client import get_runninghub_client
 from ..services.task_manager import get_task_manager
 from ..services.logger import get_router_logger
+from ..services.log_policy import loggable
+from ..services.task_scheduler import SchedulerQueueFull, get_task_scheduler
+from ..services.resilience import CircuitOpenError
+from ..services.idempotency import idempotent_endpoint
 from workflows.workflow_manager import workflow_manager
 
 router = APIRouter()
 
-# 尝试在导入时显式注册新工作流（防止动态扫描失败时缺失）
-try:
-    from workflows.complete_pattern_extract_workflow import (
-        CompletePatternExtractWorkflow,
-    )
-    if "complete_pattern_extract" not in workflow_manager.workflows:
-        workflow_manager.workflows["complete_pattern_extract"] = (
-            CompletePatternExtractWorkflow()
-        )
-    from workflows.complete_video_generation_workflow import (
-        CompleteVideoGenerationWorkflow,
-    )
-    if "complete_video_generation" not in workflow_manager.workflows:
-        workflow_manager.workflows["complete_video_generation"] = (
-            CompleteVideoGenerationWorkflow()
-        )
-except Exception:
-    # 静默忽略，端点内还有一次兜底注册
-    pass
+def _retry_later_error(e) -> HTTPException:
+    """排队已满或上游熔断：503 + Retry-After"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
 def create_workflow_endpoint(workflow_name: str):
     """为指定工作流创建端点"""
@@ -45,7 +34,7 @@ def create_workflow_endpoint(workflow_name: str):
     ):
         logger = get_router_logger()
         try:
-            logger.info(f"收到工作流请求: {workflow_name}, 参数: {payload.dict()}")
+            logger.info("收到工作流请求: %s, 参数: %s", workflow_name, loggable(payload.dict()))
             
             # 通过工作流管理器获取工作流配置
             workflow_config = workflow_manager.execute_workflow(
@@ -53,14 +42,17 @@ def create_workflow_endpoint(workflow_name: str):
                 **payload.dict()
             )
             
-            logger.info(f"工作流配置: webappId={workflow_config['webapp_id']}, 节点数量={len(workflow_config['node_info_list'])}")
+            logger.info("工作流配置: webappId=%s, 节点数量=%d", workflow_config['webapp_id'], len(workflow_config['node_info_list']))
             
             # 创建任务
-            task_id = await client.create_task(
+            task_id = await get_task_scheduler().submit(
+                client,
                 webapp_id=workflow_config['webapp_id'],
                 node_info_list=workflow_config['node_info_list'],
+                priority=workflow_config['priority'],
+                workflow=workflow_config['workflow_name'],
             )
-            logger.info(f"创建任务成功，任务ID: {task_id}")
+            logger.info("创建任务成功，任务ID: %s", task_id)
 
             if not task_id:
                 raise HTTPException(status_code=500, detail="创建任务失败，未获取到任务ID")
@@ -70,11 +62,14 @@ def create_workflow_endpoint(workflow_name: str):
                 "taskId": task_id,
                 "status": "PENDING",
                 "workflow": workflow_config['workflow_name'],
-                "message": "任务已创建，请使用 taskId 查询任务状态"
+                "message": "任务已创建，请使用 taskId 查询任务状态",
+                "queue": get_task_scheduler().queue_info(task_id),
             }
             
         except HTTPException:
             raise
+        except (SchedulerQueueFull, CircuitOpenError) as e:
+            raise _retry_later_error(e)
         except Exception as e:
             logger.error(f"工作流 {workflow_name} 执行过程中出错: {str(e)}")
             raise HTTPException(status_code=500, detail=f"工作流执行失败: {str(e)}")
@@ -83,9 +78,8 @@ def create_workflow_endpoint(workflow_name: str):
 
 def register_workflow_endpoints():
     """注册所有工作流的端点"""
-    for workflow_name in workflow_manager.workflows.keys():
-        workflow = workflow_manager.get_workflow(workflow_name)
-        input_model = workflow.input_model
+    for workflow_name in workflow_manager.names():
+        workflow = workflow_manager.get_definition(workflow_name).definition
         
         # 创建端点函数
         endpoint_func = create_workflow_endpoint(workflow_name)
@@ -109,23 +103,23 @@ async def list_workflows():
     """获取可用的工作流列表"""
     return {"workflows": workflow_manager.list_workflows()}
 
+@router.get("/workflows:registry")
+async def workflow_registry_report():
+    """工作流注册表加载耗时（定义编译与实现模块的延迟导入）"""
+    return workflow_manager.load_report()
+
 @router.get("/workflows/{workflow_name}")
 async def get_workflow_info(workflow_name: str):
     """获取指定工作流的详细信息"""
     try:
-        workflow = workflow_manager.get_workflow(workflow_name)
-        return {
-            "name": workflow.name,
-            "display_name": workflow.display_name,
-            "description": workflow.description,
-            "input_model": workflow.input_model.model_fields,
-            "webapp_id": workflow.webapp_id
-        }
+        return workflow_manager.describe_workflow(workflow_name)
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
 
 @router.post("/complete_image_edit")
+@idempotent_endpoint
 async def complete_image_edit(
+    request: Request,
     file: UploadFile = File(...),
     fileType: str = Form(default="image"),
     prompt: str = Form(...),
@@ -141,7 +135,7 @@ async def complete_image_edit(
     """
     logger = get_router_logger()
     try:
-        logger.info(f"收到完整图片编辑请求: 文件={file.filename}, 类型={fileType}, 提示词={prompt}")
+        logger.info("收到完整图片编辑请求: 文件=%s, 类型=%s, 提示词=%s", file.filename, fileType, loggable(prompt))
         
         # 获取完整图片编辑工作流
         workflow = workflow_manager.get_workflow("complete_image_edit")
@@ -156,15 +150,64 @@ async def complete_image_edit(
             file_4=file_4
         )
         
-        logger.info(f"完整图片编辑工作流执行成功: {result}")
+        logger.info("完整图片编辑工作流执行成功: %s", loggable(result))
         return result
         
+    except (SchedulerQueueFull, CircuitOpenError) as e:
+        raise _retry_later_error(e)
     except Exception as e:
         logger.error(f"完整图片编辑工作流执行失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"图片编辑失败: {str(e)}")
 
+@router.post("/complete_image_edit:batch")
+@idempotent_endpoint
+async def complete_image_edit_batch(
+    request: Request,
+    file: UploadFile = File(...),
+    prompts: str = Form(...),
+    fileType: str = Form(default="image"),
+    variantFiles: Optional[List[UploadFile]] = File(None),
+    file_2: Optional[UploadFile] = File(None),
+    file_3: Optional[UploadFile] = File(None),
+    file_4: Optional[UploadFile] = File(None),
+):
+    """
+    批量图片编辑
+    prompts 为 JSON 字符串数组；可选 variantFiles（多个）与 file 一起组成主图列表，
+    生成 主图 × 提示词 的网格任务。file_2~file_4 作为参考图所有任务共用。
+    """
+    logger = get_router_logger()
+    try:
+        prompt_list = json.loads(prompts)
+    except json.JSONDecodeError:
+        prompt_list = None
+    if not isinstance(prompt_list, list) or not prompt_list:
+        raise HTTPException(status_code=400, detail="prompts 必须是非空的 JSON 字符串数组")
+
+    files = [file] + [f for f in (variantFiles or []) if getattr(f, "filename", None)]
+    try:
+        workflow = workflow_manager.get_workflow("complete_image_edit")
+        result = await workflow.execute_batch(
+            files=files,
+            prompts=prompt_list,
+            fileType=fileType,
+            file_2=file_2,
+            file_3=file_3,
+            file_4=file_4,
+        )
+        return result
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CircuitOpenError as e:
+        raise _retry_later_error(e)
+    except Exception as e:
+        logger.error("批量图片编辑失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"批量图片编辑失败: {str(e)}")
+
 @router.post("/complete_pattern_extract")
+@idempotent_endpoint
 async def complete_pattern_extract(
+    request: Request,
     file: UploadFile = File(...),
     fileType: str = Form(default="image"),
     client = Depends(get_runninghub_client),
@@ -175,38 +218,28 @@ async def complete_pattern_extract(
     """
     logger = get_router_logger()
     try:
-        logger.info(f"收到完整印花提取请求: 文件={file.filename}, 类型={fileType}")
+        logger.info("收到完整印花提取请求: 文件=%s, 类型=%s", file.filename, fileType)
 
-        # 确保工作流已注册（容错：动态加载失败时，尝试显式注册）
-        try:
-            workflow = workflow_manager.get_workflow("complete_pattern_extract")
-        except Exception:
-            try:
-                from workflows.complete_pattern_extract_workflow import (
-                    CompletePatternExtractWorkflow,
-                )
-                wf = CompletePatternExtractWorkflow()
-                workflow_manager.workflows[wf.name] = wf
-                logger.info("已显式注册工作流 complete_pattern_extract")
-                workflow = wf
-            except Exception as reg_e:
-                logger.error(f"显式注册工作流失败: {reg_e}")
-                raise
+        workflow = workflow_manager.get_workflow("complete_pattern_extract")
 
         result = await workflow.execute_workflow(
             file=file,
             fileType=fileType,
         )
 
-        logger.info(f"完整印花提取工作流执行成功: {result}")
+        logger.info("完整印花提取工作流执行成功: %s", loggable(result))
         return result
 
+    except (SchedulerQueueFull, CircuitOpenError) as e:
+        raise _retry_later_error(e)
     except Exception as e:
         logger.error(f"完整印花提取工作流执行失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"印花提取失败: {str(e)}")
 
 @router.post("/complete_video_generation")
+@idempotent_endpoint
 async def complete_video_generation(
+    request: Request,
     file: UploadFile = File(...),
     prompt: str = Form(...),
     fileType: str = Form(default="image"),
@@ -218,23 +251,9 @@ async def complete_video_generation(
     """
     logger = get_router_logger()
     try:
-        logger.info(f"收到完整视频生成请求: 文件={file.filename}, 类型={fileType}, 提示词={prompt}")
+        logger.info("收到完整视频生成请求: 文件=%s, 类型=%s, 提示词=%s", file.filename, fileType, loggable(prompt))
 
-        # 确保工作流已注册（容错：动态加载失败时，尝试显式注册）
-        try:
-            workflow = workflow_manager.get_workflow("complete_video_generation")
-        except Exception:
-            try:
-                from workflows.complete_video_generation_workflow import (
-                    CompleteVideoGenerationWorkflow,
-                )
-                wf = CompleteVideoGenerationWorkflow()
-                workflow_manager.workflows[wf.name] = wf
-                logger.info("已显式注册工作流 complete_video_generation")
-                workflow = wf
-            except Exception as reg_e:
-                logger.error(f"显式注册工作流失败: {reg_e}")
-                raise
+        workflow = workflow_manager.get_workflow("complete_video_generation")
 
         result = await workflow.execute_workflow(
             file=file,
@@ -242,15 +261,19 @@ async def complete_video_generation(
             fileType=fileType,
         )
 
-        logger.info(f"完整视频生成工作流执行成功: {result}")
+        logger.info("完整视频生成工作流执行成功: %s", loggable(result))
         return result
 
+    except (SchedulerQueueFull, CircuitOpenError) as e:
+        raise _retry_later_error(e)
     except Exception as e:
         logger.error(f"完整视频生成工作流执行失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"视频生成失败: {str(e)}")
 
 @router.post("/variant_overlay")
+@idempotent_endpoint
 async def variant_overlay(
+    request: Request,
     file: Optional[UploadFile] = File(None),
     imageName: str = Form(default=""),
     fileType: str = Form(default="image"),
@@ -261,36 +284,25 @@ async def variant_overlay(
     """
     logger = get_router_logger()
     try:
-        logger.info(f"收到 variant overlay 请求: file={getattr(file, 'filename', None)}, imageName={imageName}")
-
-        # Ensure workflow registered
-        try:
-            workflow = workflow_manager.get_workflow("variant_overlay")
-        except Exception:
-            try:
-                from workflows.variant_overlay_workflow import VariantOverlayWorkflow
-                wf = VariantOverlayWorkflow()
-                workflow_manager.workflows[wf.name] = wf
-                logger.info("已显式注册工作流 variant_overlay")
-                workflow = wf
-            except Exception as reg_e:
-                logger.error(f"显式注册 variant_overlay 工作流失败: {reg_e}")
-                raise
+        logger.info("收到 variant overlay 请求: file=%s, imageName=%s", getattr(file, 'filename', None), imageName)
 
         if not file and not imageName:
             raise HTTPException(status_code=400, detail="必须提供图片文件或已上传图片名称")
 
+        workflow = workflow_manager.get_workflow("variant_overlay")
         result = await workflow.execute_workflow(
             file=file,
             fileType=fileType,
             image_name=imageName,
         )
 
-        logger.info(f"Variant overlay 工作流执行成功: {result}")
+        logger.info("Variant overlay 工作流执行成功: %s", loggable(result))
         return result
 
     except HTTPException:
         raise
+    except (SchedulerQueueFull, CircuitOpenError) as e:
+        raise _retry_later_error(e)
     except Exception as e:
         logger.error(f"Variant overlay 工作流执行失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Variant overlay 失败: {str(e)}")
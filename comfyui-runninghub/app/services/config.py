@@ -1,3 +1,5 @@
+from typing import Dict, List, Literal
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -7,6 +9,52 @@ class Settings(BaseSettings):
     request_timeout_seconds: int = 60
     poll_interval_seconds: int = 5
     max_poll_seconds: int = 300
+    # 提交调度：同时在 RunningHub 运行的任务上限（<=0 表示不限制），超出部分排队
+    max_concurrent_tasks: int = 3
+    max_queued_tasks: int = 500
+    scheduler_tenant_weights: Dict[str, float] = {}  # 租户 ID -> 公平排队权重，默认 1
+    scheduler_default_task_seconds: float = 90.0  # ETA 估算的初始任务耗时
+    scheduler_slot_lease_seconds: int = 900  # 在途任务长时间未到终态时强制释放预算
+    # 调度票据库（SQLite，重启后票据仍可查询、排队中的票据重新入队），为空只保存在内存中
+    scheduler_ticket_path: str = "cache/scheduler_tickets.db"
+    scheduler_ticket_retention_days: float = 30.0
+    batch_max_items: int = 50  # 批量生成单次最多任务数（主图数 × 提示词数）
+    pipeline_stage_timeout_seconds: int = 1800  # 流水线单个阶段（含排队）的最长等待时间
+    status_batch_max_ids: int = 100  # 批量状态查询单次最多任务数
+    # 终态任务的状态与输出缓存（SQLite），条目数 <=0 关闭
+    result_cache_path: str = "cache/task_results.db"
+    result_cache_max_entries: int = 100000
+    idempotency_ttl_seconds: int = 86400  # Idempotency-Key 对应响应的保存时长
+    status_batch_concurrency: int = 8  # 批量状态查询时对 RunningHub 的并发上限
+    # 启动时预加载的工作流实现（默认首次使用时才导入），["*"] 表示全部
+    workflow_preload: List[str] = []
+    # RunningHub 调用重试：操作名 -> 最大尝试次数（含首次）；create_task 非幂等，只在请求未发出时重试
+    retry_max_attempts: Dict[str, int] = {"upload_file": 3, "create_task": 3, "get_status": 4, "get_outputs": 4}
+    retry_base_delay_seconds: float = 0.2
+    retry_max_delay_seconds: float = 5.0
+    retry_budget_ratio: float = 0.2  # 每次调用存入的重试令牌，持续故障时重试量不超过调用量的 20%
+    retry_budget_reserve: float = 10.0  # 重试令牌上限（也是初始值）
+    # 熔断：连续失败次数阈值（<=0 关闭熔断）、打开后的冷却时间、半开状态的探测请求数
+    circuit_failure_threshold: int = 5
+    circuit_reset_seconds: float = 30.0
+    circuit_half_open_max_calls: int = 1
+    # 请求追踪：span 环形缓冲区大小；导出路径为空时只保留在内存中（GET /v1/traces 查看）
+    trace_buffer_size: int = 2048
+    trace_export_path: str = ""
+    trace_export_format: Literal["otlp", "json"] = "otlp"
+    trace_export_batch: int = 256  # 每累计多少个 span 追加写一次文件，关闭服务时写出剩余部分
+    # input/upload 中上传文件的保留时长（小时），<=0 不清理；删除限速（文件/秒）
+    upload_retention_hours: float = 72.0
+    upload_cleanup_interval_seconds: float = 3600.0
+    upload_delete_per_second: float = 20.0
+    upload_max_deletes_per_run: int = 5000
+    log_level: str = "INFO"
+    log_dir: str = "logs"
+    log_backup_count: int = 168  # 按小时轮转，默认保留 7 天
+    log_max_field_length: int = 256  # 单个字段写入日志的最大长度
+    log_max_total_length: int = 2048  # 单条载荷日志的最大长度
+    # 高频事件采样率（事件名 -> 0~1），例如 LOG_SAMPLE_RATES='{"status_poll": 0.1}'
+    log_sample_rates: Dict[str, float] = {"status_poll": 0.1, "outputs_poll": 0.1}
 
     model_config = SettingsConfigDict(env_file=[".env", "../.env", "../../.env"], env_prefix="", case_sensitive=False)
 
@@ -0,0 +1,170 @@
+"""
+幂等键（Idempotency-Key）
+创建任务类接口携带 Idempotency-Key 时，同一 (租户, 接口, 键) 在 TTL 内只会真正执行一次：
+- 已完成：直接重放保存的响应（响应头 Idempotent-Replayed: true）
+- 执行中：等待正在执行的请求并共享其结果，不会重复上传与创建任务
+- 同一个键配合不同的请求内容：返回 422
+
+5xx 与 409/429/503 响应不保存，客户端可以用同一个键重试。
+记录保存在进程内（提交调度器本身也是进程内状态，服务按单 worker 部署）。
+"""
+import functools
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from .config import get_settings
+from .logger import get_router_logger
+from .single_flight import SingleFlight
+from .task_scheduler import current_tenant
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+UNSTORED_STATUS_CODES = {409, 429, 503}
+
+
+class IdempotencyError(Exception):
+    """幂等键无法处理：status_code 为应返回的 HTTP 状态码"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: Any
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def storable(self) -> bool:
+        return self.status_code < 500 and self.status_code not in UNSTORED_STATUS_CODES
+
+
+async def fields_fingerprint(fields: Dict[str, Any]) -> str:
+    """
+    请求内容指纹：按字段名、字段值与上传文件内容摘要计算
+    读取上传文件后会复位文件指针，不影响后续处理
+    """
+    digest = hashlib.sha256()
+    for name in sorted(fields):
+        values = fields[name] if isinstance(fields[name], list) else [fields[name]]
+        for value in values:
+            digest.update(name.encode("utf-8") + b"\0")
+            if hasattr(value, "filename") and hasattr(value, "read"):
+                await value.seek(0)
+                digest.update(hashlib.sha256(await value.read()).digest())
+                await value.seek(0)
+            elif value is not None:
+                digest.update(str(value).encode("utf-8"))
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class IdempotencyStore:
+    """进程内幂等记录：已完成的响应按 TTL 保存，执行中的重复请求共享同一次执行（见 services/single_flight.py）"""
+
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._records: "OrderedDict[str, Tuple[float, str, StoredResponse]]" = OrderedDict()
+        self._flights = SingleFlight()
+        self.logger = get_router_logger()
+
+    @staticmethod
+    def _check_fingerprint(expected: str, actual: str):
+        if expected != actual:
+            raise IdempotencyError(422, "Idempotency-Key 已用于内容不同的请求")
+
+    def _get(self, key: str) -> Optional[Tuple[float, str, StoredResponse]]:
+        record = self._records.get(key)
+        if record is not None and record[0] <= time.monotonic():
+            del self._records[key]
+            return None
+        return record
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        factory: Callable[[], Awaitable[StoredResponse]],
+    ) -> Tuple[StoredResponse, bool]:
+        """
+        按幂等键执行 factory
+
+        Returns:
+            (响应, 是否为重放/共享的结果)
+        """
+        record = self._get(key)
+        if record is not None:
+            self._check_fingerprint(record[1], fingerprint)
+            return record[2], True
+
+        if key in self._flights:
+            self._check_fingerprint(self._flights.context(key), fingerprint)
+            self.logger.info("幂等键请求执行中，等待原请求结果: %s", key)
+            response, _ = await self._flights.do(key, factory)
+            return response, True
+
+        # 在独立任务中执行并保存结果：发起请求的客户端断开不会让等待中的重复请求失败
+        async def execute() -> StoredResponse:
+            response = await factory()
+            if response.storable():
+                self._records[key] = (time.monotonic() + self.ttl_seconds, fingerprint, response)
+                while len(self._records) > self.max_entries:
+                    self._records.popitem(last=False)
+            return response
+
+        return await self._flights.do(key, execute, context=fingerprint)
+
+_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        _store = IdempotencyStore(ttl_seconds=get_settings().idempotency_ttl_seconds)
+    return _store
+
+
+def _is_form_value(value: Any) -> bool:
+    return value is None or isinstance(value, (str, int, float, list)) or hasattr(value, "filename")
+
+
+def idempotent_endpoint(endpoint):
+    """
+    端点装饰器：按 Idempotency-Key 执行，键按租户（X-Tenant-ID）与接口路径隔离
+    被装饰的端点需要声明 request: Request 参数；指纹只取表单字段与上传文件
+    """
+    @functools.wraps(endpoint)
+    async def wrapper(**kwargs):
+        request = kwargs["request"]
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return await endpoint(**kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度不能超过 {MAX_KEY_LENGTH}")
+
+        fields = {name: value for name, value in kwargs.items() if name != "request" and _is_form_value(value)}
+
+        async def run() -> StoredResponse:
+            return StoredResponse(status_code=200, body=await endpoint(**kwargs))
+
+        try:
+            stored, replayed = await get_idempotency_store().run(
+                f"{current_tenant.get()}:{request.url.path}:{key}", await fields_fingerprint(fields), run
+            )
+        except IdempotencyError as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        if replayed:
+            return JSONResponse(content=stored.body, status_code=stored.status_code, headers={REPLAYED_HEADER: "true"})
+        return stored.body
+
+    return wrapper
@@ -0,0 +1,147 @@
+"""
+日志策略
+控制热点路径的日志量：字段截断、二进制/base64 脱敏、敏感字段掩码，
+以及高频事件（如状态轮询）的按事件采样。
+
+用法（配合 %-风格惰性格式化，级别关闭时不会做任何序列化）：
+    logger.debug("请求数据: %s", loggable(payload))
+    if log_sampled("status_poll"):
+        logger.info("查询任务状态: %s", task_id)
+"""
+import json
+import re
+import threading
+from typing import Any, Dict, Optional
+
+DEFAULT_MAX_FIELD_LENGTH = 256
+DEFAULT_MAX_TOTAL_LENGTH = 2048
+# 短于该长度的 base64 串不做脱敏（避免误伤普通 ID）
+BASE64_MIN_LENGTH = 128
+
+SENSITIVE_KEYS = {"apikey", "api_key", "authorization", "password", "token", "access_token", "secret"}
+
+_BASE64_RE = re.compile(r"^[A-Za-z0-9+/=\r\n_-]+$")
+_DATA_URI_RE = re.compile(r"data:([\w/+.-]+);base64,[A-Za-z0-9+/=\r\n]+")
+
+
+def _looks_like_base64(text: str) -> bool:
+    return len(text) >= BASE64_MIN_LENGTH and _BASE64_RE.match(text) is not None
+
+
+def _truncate(text: str, limit: int) -> str:
+    if limit <= 0 or len(text) <= limit:
+        return text
+    return f"{text[:limit]}...<截断, 共{len(text)}字符>"
+
+
+def redact(value: Any, max_field_length: int = DEFAULT_MAX_FIELD_LENGTH, _depth: int = 0) -> Any:
+    """
+    返回适合写入日志的副本：
+    - bytes / bytearray 替换为 <binary N bytes>
+    - base64 串与 data URI 替换为长度摘要
+    - 敏感字段（apiKey、token 等）掩码
+    - 超长字符串按 max_field_length 截断
+    """
+    if _depth > 6:
+        return "<...>"
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<binary {len(value)} bytes>"
+    if isinstance(value, str):
+        if _looks_like_base64(value):
+            return f"<base64 {len(value)} chars>"
+        if "base64," in value:
+            value = _DATA_URI_RE.sub(lambda m: f"<data:{m.group(1)} base64 {len(m.group(0))} chars>", value)
+        return _truncate(value, max_field_length)
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if isinstance(key, str) and key.lower() in SENSITIVE_KEYS:
+                result[key] = "***"
+            else:
+                result[key] = redact(item, max_field_length, _depth + 1)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [redact(item, max_field_length, _depth + 1) for item in value]
+    return value
+
+
+class Loggable:
+    """延迟到真正格式化日志时才执行脱敏、序列化与截断"""
+
+    __slots__ = ("value", "max_field_length", "max_total_length")
+
+    def __init__(self, value: Any, max_field_length: int, max_total_length: int):
+        self.value = value
+        self.max_field_length = max_field_length
+        self.max_total_length = max_total_length
+
+    def __str__(self) -> str:
+        safe = redact(self.value, self.max_field_length)
+        if isinstance(safe, str):
+            text = safe
+        else:
+            try:
+                text = json.dumps(safe, ensure_ascii=False, default=str)
+            except (TypeError, ValueError):
+                text = str(safe)
+        return _truncate(text, self.max_total_length)
+
+    __repr__ = __str__
+
+
+class LogSampler:
+    """
+    按事件名采样：rate=0.1 表示每 10 次记录 1 次（确定性计数，首次总会记录）；
+    未配置的事件默认全部记录
+    """
+
+    def __init__(self, rates: Optional[Dict[str, float]] = None):
+        self.rates: Dict[str, float] = dict(rates or {})
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def should_log(self, event: str) -> bool:
+        rate = self.rates.get(event, 1.0)
+        if rate >= 1.0:
+            return True
+        if rate <= 0.0:
+            return False
+        with self._lock:
+            count = self._counters.get(event, 0)
+            self._counters[event] = count + 1
+        # 计数跨过 1/rate 的整数倍时记录一次
+        return count == 0 or int(count * rate) != int((count - 1) * rate)
+
+
+_sampler: Optional[LogSampler] = None
+_limits: Optional[tuple] = None
+
+
+def _load_policy():
+    global _sampler, _limits
+    try:
+        from .config import get_settings
+        s = get_settings()
+        _sampler = LogSampler(s.log_sample_rates)
+        _limits = (s.log_max_field_length, s.log_max_total_length)
+    except Exception:
+        _sampler = LogSampler()
+        _limits = (DEFAULT_MAX_FIELD_LENGTH, DEFAULT_MAX_TOTAL_LENGTH)
+
+
+def loggable(value: Any, max_field_length: Optional[int] = None, max_total_length: Optional[int] = None) -> Loggable:
+    """包装任意对象，供 %s 惰性格式化使用"""
+    if _limits is None:
+        _load_policy()
+    return Loggable(
+        value,
+        _limits[0] if max_field_length is None else max_field_length,
+        _limits[1] if max_total_length is None else max_total_length,
+    )
+
+
+def log_sampled(event: str) -> bool:
+    """高频事件是否需要记录本次日志"""
+    if _sampler is None:
+        _load_policy()
+    return _sampler.should_log(event)
@@ -0,0 +1,290 @@
+"""
+工作流流水线（DAG）
+在 WorkflowManager 之上把多个 RunningHub 工作流串成有向无环图，整条链路在服务端后台执行：
+上游阶段输出的 RunningHub 文件直接作为下游阶段的 image_name，
+客户端不再需要轮询、下载、重新上传和再次提交。
+
+阶段定义：
+    {"id": "overlay", "workflow": "variant_overlay", "input": "extract", "dependsOn": [], "params": {}}
+- input：输出作为本阶段 image_name 的上游阶段；省略时使用流水线的源图
+- dependsOn：额外的依赖（只等待，不取输出）
+- params：组装节点时的其它参数（如视频提示词）
+"""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from workflows.workflow_manager import workflow_manager
+from .config import get_settings
+from .logger import get_task_manager_logger
+from .runninghub_client import get_runninghub_client
+from .task_manager import TaskManager
+from .task_scheduler import current_tenant, get_task_scheduler
+
+# 预置流水线
+PIPELINE_DEFINITIONS: Dict[str, Dict[str, Any]] = {
+    "pattern_overlay_video": {
+        "display_name": "印花提取 → 变体叠加 → 视频生成",
+        "stages": [
+            {"id": "extract", "workflow": "complete_pattern_extract"},
+            {"id": "overlay", "workflow": "variant_overlay", "input": "extract"},
+            {"id": "video", "workflow": "complete_video_generation", "input": "overlay"},
+        ],
+    },
+    "pattern_overlay": {
+        "display_name": "印花提取 → 变体叠加",
+        "stages": [
+            {"id": "extract", "workflow": "complete_pattern_extract"},
+            {"id": "overlay", "workflow": "variant_overlay", "input": "extract"},
+        ],
+    },
+}
+
+MAX_STAGES = 10
+# 校验阶段参数时代替运行时才确定的输入图片（源图或上游输出）
+DRY_RUN_IMAGE_NAME = "pipeline-dry-run.png"
+MAX_RETAINED_RUNS = 1000
+IMAGE_FILE_TYPES = {"png", "jpg", "jpeg", "webp", "bmp", "gif"}
+
+
+class PipelineError(ValueError):
+    """流水线定义或参数不合法"""
+
+
+def validate_stages(stages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """校验阶段定义（含各阶段工作流的必填参数）并按拓扑序返回规范化后的阶段列表"""
+    if not isinstance(stages, list) or not stages:
+        raise PipelineError("流水线至少需要一个阶段")
+    if len(stages) > MAX_STAGES:
+        raise PipelineError(f"流水线阶段数不能超过 {MAX_STAGES}")
+
+    normalized: Dict[str, Dict[str, Any]] = {}
+    for raw in stages:
+        if not isinstance(raw, dict) or not raw.get("id") or not raw.get("workflow"):
+            raise PipelineError("每个阶段都需要 id 和 workflow")
+        stage_id = str(raw["id"])
+        if stage_id in normalized:
+            raise PipelineError(f"阶段 id 重复: {stage_id}")
+        if not workflow_manager.has_workflow(raw["workflow"]):
+            raise PipelineError(f"工作流 '{raw['workflow']}' 不存在")
+        params = raw.get("params") or {}
+        if not isinstance(params, dict):
+            raise PipelineError(f"阶段 {stage_id} 的 params 必须是对象")
+        # 按工作流定义试组装节点：必填参数缺失时在启动前报错，而不是在前面的付费阶段跑完之后
+        try:
+            workflow_manager.execute_workflow(raw["workflow"], **{**params, "image_name": DRY_RUN_IMAGE_NAME})
+        except ValueError as e:
+            raise PipelineError(f"阶段 {stage_id} 参数不合法: {e}")
+        depends_on = [str(d) for d in (raw.get("dependsOn") or [])]
+        input_stage = raw.get("input")
+        if input_stage and str(input_stage) not in depends_on:
+            depends_on.append(str(input_stage))
+        normalized[stage_id] = {
+            "id": stage_id,
+            "workflow": raw["workflow"],
+            "input": str(input_stage) if input_stage else None,
+            "dependsOn": depends_on,
+            "params": params,
+        }
+
+    for stage in normalized.values():
+        for dep in stage["dependsOn"]:
+            if dep not in normalized:
+                raise PipelineError(f"阶段 {stage['id']} 依赖的阶段 {dep} 不存在")
+
+    # Kahn 拓扑排序，顺带检测环
+    indegree = {sid: len(stage["dependsOn"]) for sid, stage in normalized.items()}
+    ready = [sid for sid, degree in indegree.items() if degree == 0]
+    ordered = []
+    while ready:
+        sid = ready.pop(0)
+        ordered.append(normalized[sid])
+        for other in normalized.values():
+            if sid in other["dependsOn"]:
+                indegree[other["id"]] -= 1
+                if indegree[other["id"]] == 0:
+                    ready.append(other["id"])
+    if len(ordered) != len(normalized):
+        raise PipelineError("流水线存在循环依赖")
+    return ordered
+
+
+def output_image_name(outputs: List[Any]) -> Optional[str]:
+    """
+    从任务输出中取可直接喂给下游 image 节点的文件标识：
+    优先 fileName，其次 RunningHub 返回的 fileUrl；优先选择图片类型的输出
+    """
+    candidates = []
+    for item in outputs or []:
+        if isinstance(item, str):
+            candidates.append((True, item))
+        elif isinstance(item, dict):
+            name = item.get("fileName") or item.get("fileUrl")
+            if name:
+                file_type = str(item.get("fileType") or str(name).rsplit(".", 1)[-1]).lower()
+                candidates.append((file_type in IMAGE_FILE_TYPES, name))
+    for is_image, name in candidates:
+        if is_image:
+            return name
+    return candidates[0][1] if candidates else None
+
+
+class PipelineEngine:
+    """在后台执行流水线并维护各阶段状态"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.logger = get_task_manager_logger()
+        self._client = None
+        self._runs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._tasks: set = set()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_runninghub_client()
+        return self._client
+
+    def start(self, stages: List[Dict[str, Any]], source_image: str, name: str = "custom") -> Dict[str, Any]:
+        """校验并启动一条流水线，立即返回其状态快照"""
+        ordered = validate_stages(stages)
+        pipeline_id = f"pipe_{uuid.uuid4().hex[:16]}"
+        run = {
+            "pipelineId": pipeline_id,
+            "name": name,
+            "tenantId": current_tenant.get(),
+            "status": "RUNNING",
+            "sourceImage": source_image,
+            "createdAt": time.time(),
+            "finishedAt": None,
+            "stages": OrderedDict(
+                (stage["id"], {
+                    "id": stage["id"],
+                    "workflow": stage["workflow"],
+                    "input": stage["input"],
+                    "dependsOn": stage["dependsOn"],
+                    "status": "PENDING",
+                    "taskId": None,
+                    "inputImage": None,
+                    "outputImage": None,
+                    "outputs": None,
+                    "error": None,
+                    "startedAt": None,
+                    "finishedAt": None,
+                })
+                for stage in ordered
+            ),
+        }
+        self._runs[pipeline_id] = run
+        self._prune()
+
+        task = asyncio.create_task(self._execute(run, ordered))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        self.logger.info("流水线已启动: %s (%s), 阶段数=%d", pipeline_id, name, len(ordered))
+        return self.snapshot(pipeline_id)
+
+    def snapshot(self, pipeline_id: str, tenant_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        run = self._runs.get(pipeline_id)
+        if run is None or (tenant_id is not None and run["tenantId"] != tenant_id):
+            return None
+        result = {k: v for k, v in run.items() if k != "stages"}
+        result["stages"] = [dict(stage) for stage in run["stages"].values()]
+        return result
+
+    def _prune(self):
+        while len(self._runs) > MAX_RETAINED_RUNS:
+            oldest_id = next(
+                (pid for pid, run in self._runs.items() if run["status"] != "RUNNING"), None
+            )
+            if oldest_id is None:
+                break
+            self._runs.pop(oldest_id)
+
+    async def _execute(self, run: Dict[str, Any], ordered: List[Dict[str, Any]]):
+        done: Dict[str, asyncio.Future] = {
+            stage["id"]: asyncio.get_running_loop().create_future() for stage in ordered
+        }
+
+        async def run_stage(stage: Dict[str, Any]):
+            state = run["stages"][stage["id"]]
+            try:
+                dep_ok = [await done[dep] for dep in stage["dependsOn"]]
+                if not all(dep_ok):
+                    state["status"] = "SKIPPED"
+                    state["error"] = "上游阶段失败"
+                    return False
+                image_name = (
+                    run["stages"][stage["input"]]["outputImage"] if stage["input"] else run["sourceImage"]
+                )
+                state["inputImage"] = image_name
+                return await self._run_stage(stage, state, image_name)
+            except Exception as e:
+                state["status"] = "FAILED"
+                state["error"] = str(e)
+                self.logger.error("流水线 %s 阶段 %s 失败: %s", run["pipelineId"], stage["id"], e)
+                return False
+            finally:
+                state["finishedAt"] = state["finishedAt"] or time.time()
+
+        async def run_and_signal(stage: Dict[str, Any]):
+            ok = await run_stage(stage)
+            done[stage["id"]].set_result(bool(ok))
+            return ok
+
+        results = await asyncio.gather(*(run_and_signal(stage) for stage in ordered))
+        run["status"] = "SUCCESS" if all(results) else "FAILED"
+        run["finishedAt"] = time.time()
+        self.logger.info(
+            "流水线结束: %s, 状态=%s, 耗时 %.1fs",
+            run["pipelineId"], run["status"], run["finishedAt"] - run["createdAt"],
+        )
+
+    async def _run_stage(self, stage: Dict[str, Any], state: Dict[str, Any], image_name: str) -> bool:
+        # 阶段只需要组装节点，直接使用编译后的定义，不加载工作流实现模块
+        config = workflow_manager.execute_workflow(stage["workflow"], **{**stage["params"], "image_name": image_name})
+
+        state["status"] = "RUNNING"
+        state["startedAt"] = time.time()
+        scheduler = get_task_scheduler()
+        task_id = await scheduler.submit(
+            self.client,
+            webapp_id=config["webapp_id"],
+            node_info_list=config["node_info_list"],
+            priority=config["priority"],
+            workflow=config["workflow_name"],
+        )
+        if not task_id:
+            raise ValueError("创建任务失败，未获取到任务ID")
+        state["taskId"] = task_id
+
+        status = await TaskManager(self.client).poll_task_until_complete(
+            task_id, max_seconds=self.settings.pipeline_stage_timeout_seconds
+        )
+        if status != "SUCCESS":
+            state["status"] = "FAILED"
+            state["error"] = f"任务状态: {status}"
+            return False
+
+        outputs = await self.client.get_outputs(scheduler.resolve(task_id))
+        state["outputs"] = outputs
+        state["outputImage"] = output_image_name(outputs)
+        if not state["outputImage"]:
+            state["status"] = "FAILED"
+            state["error"] = "任务没有可用的输出文件"
+            return False
+        state["status"] = "SUCCESS"
+        state["finishedAt"] = time.time()
+        return True
+
+
+_engine: Optional[PipelineEngine] = None
+
+
+def get_pipeline_engine() -> PipelineEngine:
+    global _engine
+    if _engine is None:
+        _engine = PipelineEngine()
+    return _engine
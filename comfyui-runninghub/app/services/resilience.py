@@ -0,0 +1,310 @@
+"""
+RunningHub 调用的容错层
+- 重试：tenacity + 去相关抖动退避（decorrelated jitter），只对可安全重放的失败重试
+- 重试预算：按操作维护令牌，每次调用存入 ratio 个，每次重试取出 1 个，
+  上游持续故障时重试量被限制在正常调用量的 ratio 倍以内，避免重试风暴
+- 熔断：按操作统计连续失败，达到阈值后打开，期间直接失败（CircuitOpenError）；
+  冷却结束后进入半开状态放行少量探测请求，成功则关闭，失败则重新打开
+
+熔断器与重试预算在进程内共享（RunninghubClient 每个请求都会新建，状态不能挂在实例上）。
+"""
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from tenacity import AsyncRetrying, RetryCallState, retry_if_exception
+
+from .config import get_settings
+from .logger import get_runninghub_logger
+from .metrics import get_metrics_registry
+
+# 请求一定没有发出的错误：任何操作都可以安全重试
+PRE_SEND_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# 请求可能已被上游处理的瞬时错误：只对幂等操作重试
+TRANSIENT_ERRORS = (httpx.TimeoutException, httpx.NetworkError, httpx.RemoteProtocolError)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+# 熔断状态的数值表示（runninghub_circuit_state 指标）
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被直接拒绝"""
+
+    def __init__(self, operation: str, retry_after: int):
+        super().__init__(f"RunningHub {operation} 暂不可用（熔断中），请 {retry_after} 秒后重试")
+        self.operation = operation
+        self.retry_after = retry_after
+
+
+def is_failure(exc: BaseException) -> bool:
+    """是否计入熔断失败：网络错误、超时与 5xx（4xx 属于调用方问题，不计入）"""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+def is_retryable(exc: BaseException, idempotent: bool) -> bool:
+    if isinstance(exc, PRE_SEND_ERRORS):
+        return True
+    if not idempotent:
+        return False
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exc, TRANSIENT_ERRORS)
+
+
+class RetryBudget:
+    """重试预算（令牌桶）：reserve 为初始与最大令牌数"""
+
+    def __init__(self, ratio: float, reserve: float):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self.reserve, self._tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class CircuitBreaker:
+    """连续失败熔断器"""
+
+    def __init__(self, operation: str, failure_threshold: int, reset_seconds: float, half_open_max_calls: int):
+        self.operation = operation
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.transitions: Dict[str, int] = {OPEN: 0, HALF_OPEN: 0, CLOSED: 0}
+        self._half_open_calls = 0
+        self._lock = threading.Lock()
+        self.logger = get_runninghub_logger()
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        self.logger.warning("熔断器状态变更: %s %s -> %s", self.operation, self.state, state)
+        self.state = state
+        self.transitions[state] += 1
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        self._half_open_calls = 0
+
+    def before_call(self):
+        """调用前检查；熔断中抛出 CircuitOpenError"""
+        if self.failure_threshold <= 0:
+            return
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.reset_seconds - (time.monotonic() - self.opened_at)
+                if remaining > 0:
+                    raise CircuitOpenError(self.operation, int(remaining) + 1)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    raise CircuitOpenError(self.operation, 1)
+                self._half_open_calls += 1
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+            if self.state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED and 0 < self.failure_threshold <= self.consecutive_failures
+            ):
+                self._transition(OPEN)
+
+
+class wait_decorrelated_jitter:
+    """去相关抖动：sleep = min(cap, uniform(base, 上一次 sleep × 3))"""
+
+    def __init__(self, base: float, cap: float):
+        self.base = base
+        self.cap = cap
+
+    def __call__(self, retry_state: RetryCallState) -> float:
+        previous = retry_state.upcoming_sleep or self.base
+        return min(self.cap, random.uniform(self.base, previous * 3))
+
+
+class OperationPolicy:
+    """单个操作的重试预算、熔断器与计数"""
+
+    def __init__(self, operation: str, max_attempts: int, settings):
+        self.operation = operation
+        self.max_attempts = max(1, max_attempts)
+        self.budget = RetryBudget(settings.retry_budget_ratio, settings.retry_budget_reserve)
+        self.breaker = CircuitBreaker(
+            operation,
+            settings.circuit_failure_threshold,
+            settings.circuit_reset_seconds,
+            settings.circuit_half_open_max_calls,
+        )
+        self.counters: Dict[str, int] = {
+            "calls": 0,
+            "attempts": 0,
+            "successes": 0,
+            "failures": 0,
+            "retries": 0,
+            "retriesBudgetDenied": 0,
+            "shortCircuited": 0,
+        }
+
+    def _stop(self, retry_state: RetryCallState) -> bool:
+        # 只在确定要重试时才会调用：次数用尽或预算不足则停止
+        if retry_state.attempt_number >= self.max_attempts:
+            return True
+        if not self.budget.try_withdraw():
+            self.counters["retriesBudgetDenied"] += 1
+            return True
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "state": self.breaker.state,
+            "consecutiveFailures": self.breaker.consecutive_failures,
+            "transitions": dict(self.breaker.transitions),
+            "retryBudgetTokens": round(self.budget.tokens, 2),
+            "maxAttempts": self.max_attempts,
+            **self.counters,
+        }
+
+
+class ResilienceRegistry:
+    """按操作名管理容错策略"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self.logger = get_runninghub_logger()
+        self._policies: Dict[str, OperationPolicy] = {}
+        self._lock = threading.Lock()
+        metrics = get_metrics_registry()
+        self.attempt_duration = metrics.histogram(
+            "runninghub_upstream_request_duration_seconds",
+            "单次 RunningHub 请求耗时（每次重试单独计）",
+            ("operation", "outcome"),
+        )
+        metrics.register_collector(self.collect)
+
+    def policy(self, operation: str) -> OperationPolicy:
+        policy = self._policies.get(operation)
+        if policy is None:
+            with self._lock:
+                policy = self._policies.get(operation)
+                if policy is None:
+                    attempts = self.settings.retry_max_attempts.get(operation, 1)
+                    policy = self._policies[operation] = OperationPolicy(operation, attempts, self.settings)
+        return policy
+
+    async def call(self, operation: str, fn: Callable[[], Awaitable[Any]], idempotent: bool) -> Any:
+        """
+        在重试与熔断保护下执行 fn
+
+        Args:
+            operation: 操作名（决定重试次数、预算与熔断器）
+            fn: 每次尝试都会重新调用的协程工厂
+            idempotent: 请求可能已送达上游时是否仍可重放
+        """
+        policy = self.policy(operation)
+        policy.counters["calls"] += 1
+        policy.budget.deposit()
+
+        def before_sleep(retry_state: RetryCallState):
+            policy.counters["retries"] += 1
+            self.logger.warning(
+                "RunningHub %s 第 %d 次尝试失败，%.2fs 后重试: %s",
+                operation, retry_state.attempt_number, retry_state.upcoming_sleep,
+                retry_state.outcome.exception(),
+            )
+
+        retrying = AsyncRetrying(
+            stop=policy._stop,
+            wait=wait_decorrelated_jitter(self.settings.retry_base_delay_seconds, self.settings.retry_max_delay_seconds),
+            retry=retry_if_exception(lambda e: is_retryable(e, idempotent)),
+            before_sleep=before_sleep,
+            reraise=True,
+        )
+        async for attempt in retrying:
+            with attempt:
+                try:
+                    policy.breaker.before_call()
+                except CircuitOpenError:
+                    policy.counters["shortCircuited"] += 1
+                    raise
+                policy.counters["attempts"] += 1
+                started = time.perf_counter()
+                try:
+                    result = await fn()
+                except Exception as e:
+                    self.attempt_duration.observe(time.perf_counter() - started, operation=operation, outcome="error")
+                    if is_failure(e):
+                        policy.breaker.record_failure()
+                    else:
+                        policy.breaker.record_success()
+                    policy.counters["failures"] += 1
+                    raise
+                self.attempt_duration.observe(time.perf_counter() - started, operation=operation, outcome="success")
+                policy.breaker.record_success()
+                policy.counters["successes"] += 1
+                return result
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        return {operation: policy.snapshot() for operation, policy in self._policies.items()}
+
+    def collect(self):
+        """/metrics：重试、预算与熔断器状态"""
+        policies = list(self._policies.items())
+        counters = (
+            ("calls", "runninghub_upstream_calls_total", "RunningHub 操作调用次数"),
+            ("attempts", "runninghub_upstream_attempts_total", "RunningHub 请求次数（含重试）"),
+            ("successes", "runninghub_upstream_successes_total", "RunningHub 请求成功次数"),
+            ("failures", "runninghub_upstream_failures_total", "RunningHub 请求失败次数"),
+            ("retries", "runninghub_upstream_retries_total", "重试次数"),
+            ("retriesBudgetDenied", "runninghub_upstream_retries_budget_denied_total", "因重试预算不足放弃的重试次数"),
+            ("shortCircuited", "runninghub_upstream_short_circuited_total", "熔断期间被直接拒绝的调用次数"),
+        )
+        for key, name, documentation in counters:
+            yield name, "counter", documentation, [
+                ({"operation": operation}, policy.counters[key]) for operation, policy in policies
+            ]
+        yield "runninghub_circuit_state", "gauge", "熔断器状态（0 关闭，1 半开，2 打开）", [
+            ({"operation": operation}, STATE_VALUES[policy.breaker.state]) for operation, policy in policies
+        ]
+        yield "runninghub_retry_budget_tokens", "gauge", "剩余重试预算令牌", [
+            ({"operation": operation}, round(policy.budget.tokens, 2)) for operation, policy in policies
+        ]
+
+
+_registry: Optional[ResilienceRegistry] = None
+
+
+def get_resilience_registry() -> ResilienceRegistry:
+    global _registry
+    if _registry is None:
+        _registry = ResilienceRegistry()
+    return _registry
@@ -0,0 +1,181 @@
+"""
+任务结果缓存
+RunningHub 任务进入终态（SUCCESS / FAILED）后状态与输出不再变化，
+按任务 ID 永久缓存在本地 SQLite 中，已完成任务的重复状态/输出查询不再访问上游。
+
+- 只缓存终态状态，以及非空的输出列表（有输出即说明任务已完成）
+- 条目数超过上限时按最近访问时间淘汰最旧的一批
+- 进程内再加一层小的 LRU，热点任务不读磁盘
+"""
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, List, Optional, Tuple
+
+from .config import get_settings
+from .logger import get_runninghub_logger
+from .metrics import get_metrics_registry
+
+TERMINAL_STATUSES = {"SUCCESS", "FAILED"}
+# 访问时间的刷新粒度，避免每次命中都写盘
+ACCESS_TOUCH_SECONDS = 3600
+
+
+class TaskResultCache:
+    """终态任务的状态与输出缓存"""
+
+    def __init__(self, path: str, max_entries: int = 100000, memory_entries: int = 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory: "OrderedDict[str, Tuple[Optional[str], Optional[List[Any]], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.logger = get_runninghub_logger()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS task_results ("
+            " task_id TEXT PRIMARY KEY, status TEXT, outputs TEXT, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS idx_task_results_accessed_at ON task_results (accessed_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, task_id: str, status: Optional[str], outputs: Optional[List[Any]], accessed_at: float):
+        with self._lock:
+            self._memory[task_id] = (status, outputs, accessed_at)
+            self._memory.move_to_end(task_id)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, task_id: str) -> Optional[Tuple[Optional[str], Optional[List[Any]]]]:
+        with self._lock:
+            entry = self._memory.get(task_id)
+            if entry is not None:
+                self._memory.move_to_end(task_id)
+                return entry[0], entry[1]
+
+        row = self._connection().execute(
+            "SELECT status, outputs, accessed_at FROM task_results WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        status, outputs = row[0], json.loads(row[1]) if row[1] else None
+        now = time.time()
+        if now - row[2] > ACCESS_TOUCH_SECONDS:
+            self._connection().execute("UPDATE task_results SET accessed_at = ? WHERE task_id = ?", (now, task_id))
+        self._remember(task_id, status, outputs, now)
+        return status, outputs
+
+    def get_status(self, task_id: str) -> Optional[str]:
+        """已缓存的终态状态，未缓存返回 None"""
+        entry = self._lookup(task_id)
+        if entry is None or entry[0] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def get_outputs(self, task_id: str) -> Optional[List[Any]]:
+        """已缓存的输出，未缓存返回 None"""
+        entry = self._lookup(task_id)
+        if entry is None or entry[1] is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, task_id: str, status: Optional[str] = None, outputs: Optional[List[Any]] = None):
+        """写入终态状态和/或输出；非终态状态与空输出直接忽略"""
+        if status not in TERMINAL_STATUSES:
+            status = None
+        if not outputs:
+            outputs = None
+        elif status is None:
+            # 有输出说明任务已成功完成
+            status = "SUCCESS"
+        if status is None:
+            return
+
+        now = time.time()
+        try:
+            self._connection().execute(
+                "INSERT INTO task_results (task_id, status, outputs, created_at, accessed_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(task_id) DO UPDATE SET status = excluded.status,"
+                " outputs = COALESCE(excluded.outputs, task_results.outputs), accessed_at = excluded.accessed_at",
+                (task_id, status, json.dumps(outputs, ensure_ascii=False) if outputs else None, now, now),
+            )
+        except sqlite3.Error as e:
+            self.logger.warning("写入任务结果缓存失败: %s, %s", task_id, e)
+            return
+
+        cached = self._memory.get(task_id)
+        self._remember(task_id, status, outputs if outputs is not None else (cached[1] if cached else None), now)
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._evict()
+
+    def _evict(self):
+        conn = self._connection()
+        count = conn.execute("SELECT COUNT(*) FROM task_results").fetchone()[0]
+        overflow = count - self.max_entries
+        if overflow <= 0:
+            return
+        # 多淘汰 10%，避免每次写入都触发
+        conn.execute(
+            "DELETE FROM task_results WHERE task_id IN ("
+            " SELECT task_id FROM task_results ORDER BY accessed_at LIMIT ?)",
+            (overflow + self.max_entries // 10,),
+        )
+        self.logger.info("任务结果缓存淘汰: %d 条", overflow + self.max_entries // 10)
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "memoryEntries": len(self._memory),
+            "entries": self._connection().execute("SELECT COUNT(*) FROM task_results").fetchone()[0],
+            "maxEntries": self.max_entries,
+        }
+
+
+_cache: Optional[TaskResultCache] = None
+_initialized = False
+_cache_lock = threading.Lock()
+
+
+def _collect():
+    """/metrics：结果缓存命中情况（条目数需要查询 SQLite，不在抓取时统计）"""
+    yield "runninghub_result_cache_lookups_total", "counter", "终态结果缓存查询次数", [
+        ({"result": "hit"}, _cache.hits),
+        ({"result": "miss"}, _cache.misses),
+    ]
+
+
+def get_result_cache() -> Optional[TaskResultCache]:
+    """进程内共享的结果缓存；result_cache_max_entries <= 0 时不启用（返回 None）"""
+    global _cache, _initialized
+    if not _initialized:
+        with _cache_lock:
+            if not _initialized:
+                settings = get_settings()
+                if settings.result_cache_max_entries > 0:
+                    _cache = TaskResultCache(settings.result_cache_path, settings.result_cache_max_entries)
+                    get_metrics_registry().register_collector(_collect)
+                _initialized = True
+    return _cache
@@ -1,9 +1,12 @@
 from typing import Any, Optional
-import json
 import httpx
 from fastapi import UploadFile
 from .config import get_settings
 from .logger import get_runninghub_logger
+from .log_policy import loggable, log_sampled
+from .resilience import get_resilience_registry
+from .result_cache import get_result_cache
+from .tracing import KIND_CLIENT, span
 
 
 class RunninghubClient:
@@ -13,6 +16,19 @@ class RunninghubClient:
         self.timeout = httpx.Timeout(timeout_seconds)
         self._client = httpx.AsyncClient(timeout=self.timeout)
         self.logger = get_runninghub_logger()
+        self.resilience = get_resilience_registry()
+        self.result_cache = get_result_cache()
+
+    async def _post(self, operation: str, url: str, idempotent: bool, **kwargs) -> httpx.Response:
+        """带重试与熔断的 POST，非 2xx 响应抛出 httpx.HTTPStatusError"""
+        async def attempt() -> httpx.Response:
+            resp = await self._client.post(url, **kwargs)
+            resp.raise_for_status()
+            return resp
+
+        # 一个 span 覆盖全部重试，阶段名即操作名（Server-Timing 中按操作汇总）
+        with span(operation, kind=KIND_CLIENT, **{"http.url": url}):
+            return await self.resilience.call(operation, attempt, idempotent=idempotent)
 
     async def upload_file(self, file: UploadFile, file_type: str, file_bytes: Optional[bytes] = None) -> str:
         url = f"{self.base_url}/task/openapi/upload"
@@ -23,8 +39,8 @@ class RunninghubClient:
             "fileType": (None, file_type),
             "file": (file.filename, file_bytes, file.content_type or "application/octet-stream"),
         }
-        resp = await self._client.post(url, files=form)
-        resp.raise_for_status()
+        # 重复上传只会在 RunningHub 多生成一个文件，按幂等处理
+        resp = await self._post("upload_file", url, idempotent=True, files=form)
         data = resp.json()
         
         # 处理不同的响应格式
@@ -51,21 +67,16 @@ class RunninghubClient:
             "nodeInfoList": node_info_list,
         }
         
-        self.logger.debug(f"发送请求到: {url}")
-        self.logger.debug(f"请求数据: {payload}")
-        try:
-            request_body = json.dumps(payload, ensure_ascii=False)
-        except (TypeError, ValueError):
-            request_body = str(payload)
-        self.logger.info(f"RunningHub create_task 请求体: {request_body}")
+        self.logger.info("RunningHub create_task: webappId=%s, 节点数量=%d", webapp_id, len(node_info_list))
+        # apiKey 会被掩码，长字段截断
+        self.logger.debug("create_task 请求体: %s", loggable(payload))
         
-        resp = await self._client.post(url, json=payload)
-        self.logger.debug(f"响应状态: {resp.status_code}")
-        self.logger.debug(f"响应头: {dict(resp.headers)}")
+        # 重放可能重复创建任务，只在请求确定未发出时重试
+        resp = await self._post("create_task", url, idempotent=False, json=payload)
+        self.logger.debug("响应状态: %s", resp.status_code)
         
-        resp.raise_for_status()
         data = resp.json()
-        self.logger.debug(f"响应数据: {data}")
+        self.logger.debug("响应数据: %s", loggable(data))
         
         # 处理不同的响应格式
         task_id = ""
@@ -77,39 +88,56 @@ class RunninghubClient:
                 task_id = task_id_obj.get("taskId", "")
             elif isinstance(task_id_obj, str):
                 task_id = task_id_obj
+            elif isinstance(data.get("data"), dict):
+                # OpenAPI 标准格式：{"code": 0, "data": {"taskId": ..., "taskStatus": ...}}
+                task_id = data["data"].get("taskId", "")
             else:
                 task_id = data.get("data", "")
         elif isinstance(data, str):
             task_id = data
         
         if not task_id:
-            self.logger.warning(f"未获取到任务ID，响应数据: {data}")
+            self.logger.warning("未获取到任务ID，响应数据: %s", loggable(data))
         
-        self.logger.debug(f"提取的任务ID: {task_id}")
+        self.logger.debug("提取的任务ID: %s", task_id)
         return task_id
 
     async def get_status(self, task_id: str) -> str:
+        # 终态不会再变化，命中缓存时不访问上游
+        if self.result_cache is not None:
+            cached = self.result_cache.get_status(task_id)
+            if cached is not None:
+                return cached
+
         url = f"{self.base_url}/task/openapi/status"
         payload = {"apiKey": self.api_key, "taskId": task_id}
-        self.logger.debug(f"查询任务状态: {task_id}")
         
-        resp = await self._client.post(url, json=payload)
-        resp.raise_for_status()
+        resp = await self._post("get_status", url, idempotent=True, json=payload)
         data = resp.json()
         status = data.get("status") or data.get("data") or ""
-        self.logger.debug(f"任务状态: {status}")
+        # 状态轮询是最高频的调用，按 status_poll 采样
+        if log_sampled("status_poll"):
+            self.logger.debug("任务 %s 状态: %s", task_id, status)
+        if self.result_cache is not None:
+            self.result_cache.put(task_id, status=status)
         return status
 
     async def get_outputs(self, task_id: str) -> list[str]:
+        if self.result_cache is not None:
+            cached = self.result_cache.get_outputs(task_id)
+            if cached is not None:
+                return cached
+
         url = f"{self.base_url}/task/openapi/outputs"
         payload = {"apiKey": self.api_key, "taskId": task_id}
-        self.logger.debug(f"获取任务结果: {task_id}")
         
-        resp = await self._client.post(url, json=payload)
-        resp.raise_for_status()
+        resp = await self._post("get_outputs", url, idempotent=True, json=payload)
         data = resp.json()
         outputs = data.get("outputs") or data.get("data") or []
-        self.logger.debug(f"任务结果: {outputs}")
+        if log_sampled("outputs_poll"):
+            self.logger.debug("任务 %s 结果: %s", task_id, loggable(outputs))
+        if self.result_cache is not None and isinstance(outputs, list):
+            self.result_cache.put(task_id, outputs=outputs)
         return outputs
 
 
@@ -0,0 +1,60 @@
+"""
+单飞（single-flight）执行
+相同键的并发调用只执行一次 factory，其余调用共享结果。
+factory 在独立的任务中运行，调用方通过 asyncio.shield 等待：
+任一调用方被取消（例如客户端断开）只影响它自己，计算继续完成，其他调用方照常拿到结果；
+只有 factory 自身失败时，所有等待方才收到同一个异常。
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class SingleFlight:
+    """按键合并并发调用"""
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._tasks
+
+    def context(self, key: str) -> Optional[Any]:
+        """执行中任务附带的数据（见 do 的 context 参数），没有执行中的任务时返回 None"""
+        task = self._tasks.get(key)
+        return getattr(task, "single_flight_context", None) if task is not None else None
+
+    async def do(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        context: Any = None,
+    ) -> Tuple[Any, bool]:
+        """
+        执行或加入 key 对应的计算
+
+        Args:
+            key: 合并键
+            factory: 无参异步函数（只在没有执行中的任务时调用）
+            context: 附加在任务上的数据，加入方可通过 context(key) 读取（例如请求指纹）
+
+        Returns:
+            (结果, 是否加入了已有的计算)
+        """
+        task = self._tasks.get(key)
+        shared = task is not None
+        if task is None:
+            task = asyncio.get_running_loop().create_task(factory())
+            task.single_flight_context = context
+            self._tasks[key] = task
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # 所有调用方都已取消时避免 "Task exception was never retrieved" 警告
+            task.exception()
@@ -1,7 +1,11 @@
 import asyncio
+from typing import Optional
 from .config import get_settings
 from .runninghub_client import get_runninghub_client
 from .logger import get_task_manager_logger
+from .log_policy import log_sampled
+from .resilience import CircuitOpenError
+from .task_scheduler import get_task_scheduler
 
 
 class TaskManager:
@@ -10,24 +14,49 @@ class TaskManager:
         self.settings = get_settings()
         self.logger = get_task_manager_logger()
 
-    async def poll_task_until_complete(self, task_id: str) -> str:
+    async def poll_task_until_complete(self, task_id: str, max_seconds: Optional[int] = None) -> str:
+        """
+        轮询任务直到终态；task_id 可以是调度票据，排队期间只等待不请求上游
+
+        Returns:
+            SUCCESS / FAILED / TIMEOUT
+        """
+        scheduler = get_task_scheduler()
         interval = self.settings.poll_interval_seconds
-        max_seconds = self.settings.max_poll_seconds
+        max_seconds = self.settings.max_poll_seconds if max_seconds is None else max_seconds
         elapsed = 0
         
-        self.logger.info(f"开始轮询任务: {task_id}")
+        self.logger.info("开始轮询任务: %s", task_id)
 
         while elapsed <= max_seconds:
-            status = await self.client.get_status(task_id)
-            self.logger.debug(f"任务 {task_id} 状态: {status}")
+            queue_info = scheduler.queue_info(task_id)
+            if queue_info is not None:
+                if queue_info["status"] == "FAILED":
+                    return "FAILED"
+                await asyncio.sleep(interval)
+                elapsed += interval
+                continue
+
+            upstream_task_id = scheduler.resolve(task_id)
+            try:
+                status = await self.client.get_status(upstream_task_id)
+            except CircuitOpenError as e:
+                # 上游熔断期间暂停轮询，等熔断器进入半开后再查
+                wait = max(interval, e.retry_after)
+                await asyncio.sleep(wait)
+                elapsed += wait
+                continue
+            scheduler.observe_status(upstream_task_id, status)
+            if log_sampled("status_poll"):
+                self.logger.debug("任务 %s 状态: %s", task_id, status)
             
             if status in {"SUCCESS", "FAILED"}:
-                self.logger.info(f"任务 {task_id} 完成，最终状态: {status}")
+                self.logger.info("任务 %s 完成，最终状态: %s", task_id, status)
                 return status
             await asyncio.sleep(interval)
             elapsed += interval
             
-        self.logger.warning(f"任务 {task_id} 轮询超时")
+        self.logger.warning("任务 %s 轮询超时", task_id)
         return "TIMEOUT"
 
     async def get_status(self, task_id: str) -> str:
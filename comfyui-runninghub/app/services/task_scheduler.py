@@ -0,0 +1,521 @@
+"""
+任务提交调度器
+RunningHub 账号有并发上限，这里维护一个全局并发预算：
+- 预算未满时直接创建任务并返回 RunningHub 的 taskId（与原行为一致）
+- 预算已满时进入队列，返回调度票据 ID（q 开头），由后台按加权公平队列派发
+
+排队顺序采用自计时公平队列（SCFQ）：每个租户是一条流，流的权重 = 租户权重，
+派发机会按权重在租户之间分享；租户轮到派发时先派发自己优先级最高的任务
+（同优先级按入队顺序），因此同一租户的高优先级任务（如印花提取）不会被自己
+排在前面的视频任务挡住，而优先级不会增加租户占用的份额。
+在途任务在到达终态（或租约过期）时释放预算。
+
+票据与 票据 -> RunningHub taskId 的映射持久化在 SQLite 中（见 ticket_store.py），
+服务重启后票据仍可查询，仍在排队的票据由 restore 重新入队。
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .config import get_settings
+from .logger import get_task_manager_logger
+from .metrics import TASK_BUCKETS, get_metrics_registry
+from .ticket_store import TicketStore
+from .tracing import current_span
+
+TERMINAL_STATUSES = {"SUCCESS", "FAILED"}
+TICKET_PREFIX = "q"
+# 已派发/失败的票据在内存中的保留时长，之后从票据库（ticket_store.py）查询
+TICKET_RETENTION_SECONDS = 24 * 3600
+
+# 由 TenantContextMiddleware 按请求头 X-Tenant-ID 设置
+current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar("current_tenant", default="default")
+
+
+class SchedulerQueueFull(Exception):
+    """排队任务数已达上限（准入控制）"""
+
+    def __init__(self, retry_after: int):
+        super().__init__("任务队列已满，请稍后重试")
+        self.retry_after = retry_after
+
+
+@dataclass
+class Ticket:
+    ticket_id: str
+    tenant_id: str
+    webapp_id: str
+    node_info_list: List[Dict[str, Any]]
+    priority: int
+    client: Any
+    workflow: str = ""
+    enqueued_at: float = field(default_factory=time.time)
+    finish_tag: float = 0.0
+    status: str = "QUEUED"  # QUEUED -> SUBMITTING -> SUBMITTED | FAILED
+    upstream_task_id: Optional[str] = None
+    error: Optional[str] = None
+    dispatched_at: Optional[float] = None
+
+
+@dataclass
+class TenantFlow:
+    """一个租户的排队任务：完成标签按到达顺序分配，派发时取最小标签、派发优先级最高的票据"""
+    tags: List[float] = field(default_factory=list)
+    tickets: List[tuple] = field(default_factory=list)  # (-priority, seq, ticket_id)
+
+
+class SubmissionScheduler:
+    """全局并发预算 + 跨租户加权公平排队"""
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        max_queue: int = 500,
+        tenant_weights: Optional[Dict[str, float]] = None,
+        default_task_seconds: float = 90.0,
+        slot_lease_seconds: float = 900.0,
+        poll_interval_seconds: float = 5.0,
+        ticket_store: Optional[TicketStore] = None,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.tenant_weights = dict(tenant_weights or {})
+        self.slot_lease_seconds = slot_lease_seconds
+        self.poll_interval_seconds = poll_interval_seconds
+        self.ticket_store = ticket_store
+        self.logger = get_task_manager_logger()
+
+        # 在途任务：RunningHub taskId -> (派发时间, 创建任务所用的 client, 工作流名)
+        self._inflight: Dict[str, tuple] = {}
+        # 正在调用 create_task、尚未拿到 taskId 的预留名额
+        self._reserved = 0
+        # 有排队任务的租户：(该租户最小的完成标签, seq, tenant_id)，每个租户一项
+        self._queue: List[tuple] = []
+        self._flows: Dict[str, TenantFlow] = {}
+        self._queued = 0
+        self._tickets: Dict[str, Ticket] = {}
+        self._upstream_to_ticket: Dict[str, str] = {}
+        self._flow_finish: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        # 任务平均耗时（派发 -> 终态）的指数滑动平均，用于估算 ETA
+        self._avg_task_seconds = default_task_seconds
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._dispatch_tasks: set = set()
+
+        metrics = get_metrics_registry()
+        self.task_duration = metrics.histogram(
+            "runninghub_task_duration_seconds", "任务从派发到终态的耗时", ("workflow", "status"), buckets=TASK_BUCKETS
+        )
+        self.queue_wait = metrics.histogram(
+            "runninghub_task_queue_wait_seconds", "任务在本地排队等待派发的耗时", ("workflow",), buckets=TASK_BUCKETS
+        )
+        self.tasks_submitted = metrics.counter(
+            "runninghub_tasks_submitted_total", "提交的任务数", ("workflow", "path")
+        )
+        self.leases_expired = metrics.counter(
+            "runninghub_task_leases_expired_total", "长时间未到终态、被强制释放名额的任务数"
+        )
+        metrics.register_collector(self.collect)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrency > 0
+
+    def _in_use(self) -> int:
+        return len(self._inflight) + self._reserved
+
+    def _has_capacity(self) -> bool:
+        return self._in_use() < self.max_concurrency
+
+    # ------------------------------------------------------------------ 提交
+
+    async def submit(
+        self,
+        client,
+        webapp_id: str,
+        node_info_list: List[Dict[str, Any]],
+        priority: int = 2,
+        workflow: str = "",
+    ) -> str:
+        """
+        提交 RunningHub 任务
+
+        Args:
+            workflow: 工作流名，只用于指标标签（缺省时使用 webapp_id）
+
+        Returns:
+            预算充足时为 RunningHub taskId，否则为排队票据 ID
+        """
+        workflow = workflow or webapp_id
+        if not self.enabled:
+            self.tasks_submitted.inc(workflow=workflow, path="direct")
+            return await client.create_task(webapp_id=webapp_id, node_info_list=node_info_list)
+
+        self._reap_expired()
+        if self._has_capacity() and not self._queued:
+            self._reserved += 1
+            try:
+                task_id = await client.create_task(webapp_id=webapp_id, node_info_list=node_info_list)
+            finally:
+                self._reserved -= 1
+            if task_id:
+                self._inflight[task_id] = (time.time(), client, workflow)
+                self.tasks_submitted.inc(workflow=workflow, path="direct")
+            self._notify()
+            return task_id
+
+        if self._queued >= self.max_queue:
+            raise SchedulerQueueFull(retry_after=int(math.ceil(self._avg_task_seconds)))
+
+        tenant_id = current_tenant.get()
+        weight = max(self.tenant_weights.get(tenant_id, 1.0), 0.01)
+        start_tag = max(self._virtual_time, self._flow_finish.get(tenant_id, 0.0))
+        finish_tag = start_tag + 1.0 / weight
+        self._flow_finish[tenant_id] = finish_tag
+
+        ticket = Ticket(
+            ticket_id=f"{TICKET_PREFIX}{uuid.uuid4().hex}",
+            tenant_id=tenant_id,
+            webapp_id=webapp_id,
+            node_info_list=node_info_list,
+            priority=priority,
+            client=client,
+            workflow=workflow,
+            finish_tag=finish_tag,
+        )
+        self._tickets[ticket.ticket_id] = ticket
+        self._persist(ticket)
+        self._enqueue(ticket)
+        active = current_span()
+        if active is not None:
+            # 排队后的 create_task 由调度循环发出，不属于本次请求的 trace，这里记下票据便于关联
+            active.set_attribute("scheduler.ticket", ticket.ticket_id)
+        self.logger.info(
+            "任务进入排队: %s, 租户=%s, webappId=%s, 排队数=%d, 在途=%d",
+            ticket.ticket_id, tenant_id, webapp_id, self._queued, len(self._inflight),
+        )
+        self._ensure_dispatcher()
+        self._notify()
+        return ticket.ticket_id
+
+    # ------------------------------------------------------------------ 查询
+
+    def _ticket(self, task_id: str) -> Optional[Ticket]:
+        """内存中的票据；不在内存中（重启前创建或已过内存保留期）时从票据库读取"""
+        ticket = self._tickets.get(task_id)
+        if ticket is not None or self.ticket_store is None or not task_id.startswith(TICKET_PREFIX):
+            return ticket
+        record = self.ticket_store.get(task_id)
+        if record is None:
+            return None
+        return Ticket(
+            ticket_id=record["ticket_id"],
+            tenant_id=record["tenant_id"],
+            webapp_id=record["webapp_id"],
+            node_info_list=[],
+            priority=record["priority"],
+            client=None,
+            workflow=record["workflow"] or "",
+            enqueued_at=record["enqueued_at"],
+            finish_tag=record["finish_tag"],
+            status=record["status"],
+            upstream_task_id=record["upstream_task_id"],
+            error=record["error"],
+            dispatched_at=record["dispatched_at"],
+        )
+
+    def _persist(self, ticket: Ticket):
+        if self.ticket_store is not None:
+            self.ticket_store.save(ticket)
+
+    def resolve(self, task_id: str) -> Optional[str]:
+        """票据 ID -> RunningHub taskId；尚未派发返回 None，非票据原样返回"""
+        ticket = self._ticket(task_id)
+        if ticket is None:
+            return task_id
+        return ticket.upstream_task_id
+
+    def queue_info(self, task_id: str) -> Optional[Dict[str, Any]]:
+        """排队中的票据返回排队位置与 ETA；已派发或非票据返回 None"""
+        ticket = self._ticket(task_id)
+        if ticket is None:
+            return None
+        if ticket.status == "FAILED":
+            return {"status": "FAILED", "error": ticket.error}
+        if ticket.status == "SUBMITTING":
+            # 已出队、正在向 RunningHub 创建任务
+            return {"status": "QUEUED", "queuePosition": 0, "etaSeconds": 0, "enqueuedAt": ticket.enqueued_at}
+        if ticket.status != "QUEUED":
+            return None
+        if ticket.ticket_id not in self._tickets:
+            # 其它进程中排队的票据，位置未知
+            return {"status": "QUEUED", "queuePosition": 0, "etaSeconds": 0, "enqueuedAt": ticket.enqueued_at}
+        ordered = self._dispatch_order()
+        position = ordered.index(task_id) if task_id in ordered else len(ordered)
+        return {
+            "status": "QUEUED",
+            "queuePosition": position + 1,
+            "etaSeconds": self._estimate_eta(position),
+            "enqueuedAt": ticket.enqueued_at,
+        }
+
+    def restore(self, client) -> int:
+        """
+        服务启动时恢复票据库中尚未派发的票据，返回重新入队的数量
+        排队中的票据按原有的完成标签重新入队；提交途中中断的票据无法确认是否已创建任务，标记为失败
+        """
+        if self.ticket_store is None or not self.enabled:
+            return 0
+        restored = 0
+        for record in self.ticket_store.load_unfinished():
+            ticket = Ticket(
+                ticket_id=record["ticket_id"],
+                tenant_id=record["tenant_id"],
+                webapp_id=record["webapp_id"],
+                node_info_list=record["node_info_list"],
+                priority=record["priority"],
+                client=client,
+                workflow=record["workflow"] or "",
+                enqueued_at=record["enqueued_at"],
+                finish_tag=record["finish_tag"],
+            )
+            if record["status"] == "SUBMITTING":
+                ticket.status = "FAILED"
+                ticket.error = "服务重启时任务正在提交，无法确认是否已创建，请重新提交"
+                ticket.node_info_list = []
+                self._tickets[ticket.ticket_id] = ticket
+                self._persist(ticket)
+                self.logger.warning("调度票据提交中断，标记为失败: %s", ticket.ticket_id)
+                continue
+            self._flow_finish[ticket.tenant_id] = max(self._flow_finish.get(ticket.tenant_id, 0.0), ticket.finish_tag)
+            self._tickets[ticket.ticket_id] = ticket
+            self._enqueue(ticket)
+            restored += 1
+        if restored:
+            # 虚拟时间接上恢复的票据，新提交的任务不会整体插到它们前面
+            self._virtual_time = max(self._virtual_time, min(tag for tag, _, _ in self._queue))
+            self.logger.info("恢复排队票据: %d 个", restored)
+            self._ensure_dispatcher()
+            self._notify()
+        return restored
+
+    def _enqueue(self, ticket: Ticket):
+        flow = self._flows.setdefault(ticket.tenant_id, TenantFlow())
+        head = flow.tags[0] if flow.tags else None
+        heapq.heappush(flow.tags, ticket.finish_tag)
+        heapq.heappush(flow.tickets, (-ticket.priority, next(self._seq), ticket.ticket_id))
+        self._queued += 1
+        if head is None:
+            heapq.heappush(self._queue, (ticket.finish_tag, next(self._seq), ticket.tenant_id))
+        elif ticket.finish_tag < head:
+            # 恢复的票据可能比已入队的标签更早，重建该租户在全局堆中的位置
+            self._queue = [item for item in self._queue if item[2] != ticket.tenant_id]
+            self._queue.append((ticket.finish_tag, next(self._seq), ticket.tenant_id))
+            heapq.heapify(self._queue)
+
+    def _dequeue(self) -> tuple:
+        """按 SCFQ 取出下一个派发的票据，返回 (完成标签, 票据)"""
+        _, _, tenant_id = heapq.heappop(self._queue)
+        flow = self._flows[tenant_id]
+        tag = heapq.heappop(flow.tags)
+        _, _, ticket_id = heapq.heappop(flow.tickets)
+        self._queued -= 1
+        if flow.tags:
+            heapq.heappush(self._queue, (flow.tags[0], next(self._seq), tenant_id))
+        else:
+            del self._flows[tenant_id]
+        return tag, self._tickets[ticket_id]
+
+    def _dispatch_order(self) -> List[str]:
+        """排队票据按派发顺序排列（模拟调度循环的出队，不修改队列）"""
+        flows = {tenant_id: (sorted(flow.tags), sorted(flow.tickets)) for tenant_id, flow in self._flows.items()}
+        served = dict.fromkeys(flows, 0)
+        heap = list(self._queue)
+        order = []
+        while heap:
+            _, seq, tenant_id = heapq.heappop(heap)
+            tags, tickets = flows[tenant_id]
+            index = served[tenant_id]
+            order.append(tickets[index][2])
+            served[tenant_id] = index + 1
+            if index + 1 < len(tickets):
+                heapq.heappush(heap, (tags[index + 1], seq, tenant_id))
+        return order
+
+    def _estimate_eta(self, position: int) -> int:
+        # 前面还有 position 个任务，每一"轮"可同时派发 max_concurrency 个
+        rounds = position // self.max_concurrency + 1
+        if self._has_capacity():
+            rounds -= 1
+        return int(math.ceil(rounds * self._avg_task_seconds))
+
+    def observe_status(self, task_id: str, status: str):
+        """状态查询结果回流：任务到达终态时释放并发预算"""
+        upstream_id = self.resolve(task_id) or task_id
+        if status in TERMINAL_STATUSES and upstream_id in self._inflight:
+            self._release(upstream_id, status=status)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "maxConcurrency": self.max_concurrency,
+            "inflight": len(self._inflight),
+            "queued": self._queued,
+            "avgTaskSeconds": round(self._avg_task_seconds, 1),
+        }
+
+    # ------------------------------------------------------------------ 内部
+
+    def collect(self):
+        """/metrics：并发名额与排队情况"""
+        yield "runninghub_scheduler_slots", "gauge", "RunningHub 并发名额", [
+            ({"state": "inflight"}, len(self._inflight)),
+            ({"state": "reserved"}, self._reserved),
+            ({"state": "max"}, self.max_concurrency),
+        ]
+        yield "runninghub_scheduler_queued", "gauge", "本地排队等待派发的任务数", [({}, self._queued)]
+        yield "runninghub_scheduler_avg_task_seconds", "gauge", "任务平均耗时（ETA 估算用）", [
+            ({}, round(self._avg_task_seconds, 3))
+        ]
+
+    def _release(self, upstream_id: str, observed: bool = True, status: str = ""):
+        dispatched_at, _, workflow = self._inflight.pop(upstream_id)
+        if observed:
+            duration = time.time() - dispatched_at
+            self._avg_task_seconds = 0.8 * self._avg_task_seconds + 0.2 * duration
+            self.task_duration.observe(duration, workflow=workflow, status=status or "UNKNOWN")
+        else:
+            self.leases_expired.inc()
+        self._notify()
+
+    def _reap_expired(self):
+        now = time.time()
+        for upstream_id, (dispatched_at, _, _) in list(self._inflight.items()):
+            if now - dispatched_at > self.slot_lease_seconds:
+                self.logger.warning("在途任务租约过期，释放并发预算: %s", upstream_id)
+                self._release(upstream_id, observed=False)
+        for ticket_id, ticket in list(self._tickets.items()):
+            if ticket.status in ("SUBMITTED", "FAILED") and now - ticket.enqueued_at > TICKET_RETENTION_SECONDS:
+                self._tickets.pop(ticket_id, None)
+                if ticket.upstream_task_id:
+                    self._upstream_to_ticket.pop(ticket.upstream_task_id, None)
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is None or self._dispatcher.done():
+            self._wakeup = asyncio.Event()
+            self._dispatcher = asyncio.create_task(self._dispatch_loop())
+
+    async def _dispatch_loop(self):
+        while self._queue:
+            self._reap_expired()
+            while self._queue and self._has_capacity():
+                tag, ticket = self._dequeue()
+                self._virtual_time = max(self._virtual_time, tag)
+                self._reserved += 1
+                task = asyncio.create_task(self._dispatch(ticket))
+                self._dispatch_tasks.add(task)
+                task.add_done_callback(self._dispatch_tasks.discard)
+            if not self._queue:
+                break
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval_seconds)
+            except asyncio.TimeoutError:
+                # 没有客户端轮询时，由调度器自己刷新在途任务状态
+                await self._refresh_inflight()
+
+    async def _dispatch(self, ticket: Ticket):
+        ticket.status = "SUBMITTING"
+        # 先落盘：提交途中进程退出时，重启后不会再次创建同一个任务
+        self._persist(ticket)
+        try:
+            task_id = await ticket.client.create_task(
+                webapp_id=ticket.webapp_id, node_info_list=ticket.node_info_list
+            )
+            if not task_id:
+                raise ValueError("创建任务失败，未获取到任务ID")
+        except Exception as e:
+            ticket.status = "FAILED"
+            ticket.error = str(e)
+            self.logger.error("排队任务派发失败: %s, %s", ticket.ticket_id, e)
+        else:
+            ticket.status = "SUBMITTED"
+            ticket.upstream_task_id = task_id
+            ticket.dispatched_at = time.time()
+            self._inflight[task_id] = (ticket.dispatched_at, ticket.client, ticket.workflow)
+            self.tasks_submitted.inc(workflow=ticket.workflow, path="queued")
+            self.queue_wait.observe(ticket.dispatched_at - ticket.enqueued_at, workflow=ticket.workflow)
+            self._upstream_to_ticket[task_id] = ticket.ticket_id
+            self.logger.info(
+                "排队任务已派发: %s -> %s, 等待 %.1fs",
+                ticket.ticket_id, task_id, ticket.dispatched_at - ticket.enqueued_at,
+            )
+        finally:
+            # 派发完成后不再需要保留请求参数
+            ticket.node_info_list = []
+            self._persist(ticket)
+            self._reserved -= 1
+            self._notify()
+
+    async def _refresh_inflight(self):
+        for upstream_id, (_, client, _) in list(self._inflight.items()):
+            try:
+                status = await client.get_status(upstream_id)
+            except Exception as e:
+                self.logger.warning("刷新在途任务状态失败: %s, %s", upstream_id, e)
+                continue
+            if status in TERMINAL_STATUSES and upstream_id in self._inflight:
+                self._release(upstream_id, status=status)
+
+
+_scheduler: Optional[SubmissionScheduler] = None
+
+
+def get_task_scheduler() -> SubmissionScheduler:
+    global _scheduler
+    if _scheduler is None:
+        s = get_settings()
+        _scheduler = SubmissionScheduler(
+            max_concurrency=s.max_concurrent_tasks,
+            max_queue=s.max_queued_tasks,
+            tenant_weights=s.scheduler_tenant_weights,
+            default_task_seconds=s.scheduler_default_task_seconds,
+            slot_lease_seconds=s.scheduler_slot_lease_seconds,
+            poll_interval_seconds=s.poll_interval_seconds,
+            ticket_store=TicketStore(s.scheduler_ticket_path, s.scheduler_ticket_retention_days)
+            if s.scheduler_ticket_path else None,
+        )
+    return _scheduler
+
+
+class TenantContextMiddleware:
+    """从租户服务转发的 X-Tenant-ID 请求头设置当前租户，供调度器做公平排队"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        tenant_id = "default"
+        for name, value in scope.get("headers", ()):
+            if name == b"x-tenant-id":
+                tenant_id = value.decode("latin-1") or "default"
+                break
+        token = current_tenant.set(tenant_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_tenant.reset(token)
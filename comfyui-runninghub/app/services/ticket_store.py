@@ -0,0 +1,108 @@
+"""
+调度票据持久化
+排队票据（q 开头，见 task_scheduler.py）及其派发后的 RunningHub taskId 保存在本地 SQLite 中：
+- 服务重启、内存中的票据过期后，客户端仍可用票据 ID 查询状态与输出
+- 重启时仍在排队的票据重新入队；正在提交（SUBMITTING）的票据无法确认 RunningHub 是否已创建任务，
+  为避免重复创建（重复计费）标记为失败
+- 已派发/失败的票据保留 SCHEDULER_TICKET_RETENTION_DAYS 天
+"""
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .logger import get_task_manager_logger
+
+FIELDS = (
+    "ticket_id", "tenant_id", "webapp_id", "workflow", "priority", "node_info_list", "status",
+    "upstream_task_id", "error", "finish_tag", "enqueued_at", "dispatched_at", "updated_at",
+)
+
+
+class TicketStore:
+    """票据与 票据 -> RunningHub taskId 映射"""
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, path: str, retention_days: float = 30.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.retention_seconds = retention_days * 86400
+        self._local = threading.local()
+        self._writes = 0
+        self.logger = get_task_manager_logger()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS scheduler_tickets ("
+            " ticket_id TEXT PRIMARY KEY, tenant_id TEXT NOT NULL, webapp_id TEXT NOT NULL, workflow TEXT,"
+            " priority INTEGER NOT NULL, node_info_list TEXT, status TEXT NOT NULL, upstream_task_id TEXT,"
+            " error TEXT, finish_tag REAL NOT NULL, enqueued_at REAL NOT NULL, dispatched_at REAL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS idx_scheduler_tickets_status ON scheduler_tickets (status, updated_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(self, ticket) -> bool:
+        """写入票据的当前状态；失败只记录日志（票据仍在内存中可用）"""
+        now = time.time()
+        try:
+            self._connection().execute(
+                f"INSERT OR REPLACE INTO scheduler_tickets ({', '.join(FIELDS)})"
+                f" VALUES ({', '.join('?' for _ in FIELDS)})",
+                (
+                    ticket.ticket_id, ticket.tenant_id, ticket.webapp_id, ticket.workflow, ticket.priority,
+                    json.dumps(ticket.node_info_list, ensure_ascii=False) if ticket.node_info_list else None,
+                    ticket.status, ticket.upstream_task_id, ticket.error, ticket.finish_tag,
+                    ticket.enqueued_at, ticket.dispatched_at, now,
+                ),
+            )
+        except sqlite3.Error as e:
+            self.logger.warning("保存调度票据失败: %s, %s", ticket.ticket_id, e)
+            return False
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self._prune(now)
+        return True
+
+    def get(self, ticket_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            row = self._connection().execute(
+                f"SELECT {', '.join(FIELDS)} FROM scheduler_tickets WHERE ticket_id = ?", (ticket_id,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            self.logger.warning("读取调度票据失败: %s, %s", ticket_id, e)
+            return None
+        return self._decode(row) if row is not None else None
+
+    def load_unfinished(self) -> List[Dict[str, Any]]:
+        """尚未派发完成的票据（QUEUED / SUBMITTING），最早入队的在前"""
+        rows = self._connection().execute(
+            f"SELECT {', '.join(FIELDS)} FROM scheduler_tickets"
+            " WHERE status IN ('QUEUED', 'SUBMITTING') ORDER BY enqueued_at"
+        ).fetchall()
+        return [self._decode(row) for row in rows]
+
+    @staticmethod
+    def _decode(row) -> Dict[str, Any]:
+        record = dict(zip(FIELDS, row))
+        record["node_info_list"] = json.loads(record["node_info_list"]) if record["node_info_list"] else []
+        return record
+
+    def _prune(self, now: float):
+        deleted = self._connection().execute(
+            "DELETE FROM scheduler_tickets WHERE status IN ('SUBMITTED', 'FAILED') AND updated_at < ?",
+            (now - self.retention_seconds,),
+        ).rowcount
+        if deleted:
+            self.logger.info("清理过期调度票据: %d 条", deleted)
@@ -0,0 +1,336 @@
+"""
+请求追踪
+- W3C Trace Context：读取请求头 traceparent 继续上游的 trace，调用其它服务时注入 traceparent
+- 每个阶段记录一个 span（with span("upload_file"): ...），写入进程内环形缓冲区，
+  可通过 GET /v1/traces 查看，也可按批追加到文件（JSON 或 OTLP/JSON，每批一行，兼容 OpenTelemetry Collector 的文件格式）
+- 响应头 Server-Timing 汇总本次请求各阶段耗时，浏览器开发者工具的 Timing 面板可直接查看
+"""
+import contextvars
+import functools
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .logger import get_main_logger
+
+SERVICE_NAME = "comfyui-runninghub"
+TRACEPARENT_HEADER = "traceparent"
+SERVER_TIMING_HEADER = "Server-Timing"
+_TRACEPARENT_RE = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_TIMING_NAME_RE = re.compile(r"[^A-Za-z0-9_-]")
+
+# OTLP SpanKind
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    flags: str = "01"
+    kind: int = KIND_INTERNAL
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{self.flags}"
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "service": SERVICE_NAME,
+            "start": self.start_ns / 1e9,
+            "durationMs": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, str]]:
+    """解析 traceparent，返回 (trace_id, parent_span_id, flags)；格式不合法返回 None"""
+    if not value:
+        return None
+    match = _TRACEPARENT_RE.match(value.strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags = match.groups()
+    if version == "ff" or trace_id == "0" * 32 or span_id == "0" * 16:
+        return None
+    return trace_id, span_id, flags
+
+
+def _new_id(nbytes: int) -> str:
+    return os.urandom(nbytes).hex()
+
+
+class SpanExporter:
+    """环形缓冲区 + 可选的文件导出"""
+
+    def __init__(self, buffer_size: int, export_path: str = "", export_format: str = "otlp", batch_size: int = 256):
+        self.spans: Deque[Span] = deque(maxlen=max(1, buffer_size))
+        self.export_path = Path(export_path) if export_path else None
+        self.export_format = export_format
+        self.batch_size = max(1, batch_size)
+        self._pending: List[Span] = []
+        self._lock = threading.Lock()
+        self.logger = get_main_logger()
+
+    def record(self, span: Span):
+        batch = None
+        with self._lock:
+            self.spans.append(span)
+            if self.export_path is not None:
+                self._pending.append(span)
+                if len(self._pending) >= self.batch_size:
+                    batch, self._pending = self._pending, []
+        if batch:
+            self._write(batch)
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: List[Span]):
+        try:
+            self.export_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.export_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.render(batch, self.export_format), ensure_ascii=False) + "\n")
+        except OSError as e:
+            self.logger.warning("写入追踪文件失败: %s, %s", self.export_path, e)
+
+    @staticmethod
+    def render(spans: List[Span], export_format: str) -> Dict[str, Any]:
+        if export_format == "json":
+            return {"service": SERVICE_NAME, "spans": [span.to_dict() for span in spans]}
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{
+                    "scope": {"name": "app.services.tracing"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+
+    def recent(self, trace_id: Optional[str] = None, limit: int = 200) -> List[Span]:
+        with self._lock:
+            spans = list(self.spans)
+        if trace_id:
+            spans = [span for span in spans if span.trace_id == trace_id]
+        return spans[-limit:]
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+# 当前请求已结束的阶段 span，用于生成 Server-Timing
+_request_spans: contextvars.ContextVar[Optional[List[Span]]] = contextvars.ContextVar("request_spans", default=None)
+
+_exporter: Optional[SpanExporter] = None
+_exporter_lock = threading.Lock()
+
+
+def get_span_exporter() -> SpanExporter:
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                settings = get_settings()
+                _exporter = SpanExporter(
+                    settings.trace_buffer_size,
+                    settings.trace_export_path,
+                    settings.trace_export_format,
+                    settings.trace_export_batch,
+                )
+    return _exporter
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+class span:
+    """
+    记录一个阶段：with span("upload_file", fileType="image"): ...
+    没有父 span 时开启新的 trace（例如后台任务）
+    """
+
+    def __init__(self, name: str, kind: int = KIND_INTERNAL, **attributes):
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+
+    def __enter__(self) -> Span:
+        parent = _current_span.get()
+        self.span = Span(
+            name=self.name,
+            trace_id=parent.trace_id if parent else _new_id(16),
+            span_id=_new_id(8),
+            parent_id=parent.span_id if parent else None,
+            flags=parent.flags if parent else "01",
+            kind=self.kind,
+            attributes=dict(self.attributes),
+        )
+        self._token = _current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        self.span.end_ns = time.time_ns()
+        if exc is not None:
+            self.span.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        request_spans = _request_spans.get()
+        if request_spans is not None:
+            request_spans.append(self.span)
+        get_span_exporter().record(self.span)
+        return False
+
+
+def traced(name: Optional[str] = None):
+    """函数装饰器：整个调用记录为一个 span（支持协程函数）"""
+    def decorator(func):
+        span_name = name or func.__name__
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def inject_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    """调用下游服务前注入当前 span 的 traceparent"""
+    active = _current_span.get()
+    if active is not None:
+        headers[TRACEPARENT_HEADER] = active.traceparent()
+    return headers
+
+
+def server_timing(spans: List[Span], total_ms: float) -> str:
+    """按阶段名汇总耗时：upload_file;dur=812.4;desc="x3", ..., total;dur=..."""
+    totals: Dict[str, List[float]] = {}
+    for item in spans:
+        entry = totals.setdefault(_TIMING_NAME_RE.sub("_", item.name), [0.0, 0])
+        entry[0] += item.duration_ms
+        entry[1] += 1
+    parts = []
+    for name, (duration, count) in totals.items():
+        part = f"{name};dur={duration:.1f}"
+        if count > 1:
+            part += f';desc="x{count}"'
+        parts.append(part)
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+
+class TracingMiddleware:
+    """为每个请求建立服务端 span，继续上游 traceparent，并在响应中加入 Server-Timing 与 traceparent"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                incoming = parse_traceparent(value.decode("latin-1"))
+                break
+        method = scope.get("method", "")
+        server_span = Span(
+            name=f"{method} {scope.get('path', '')}",
+            trace_id=incoming[0] if incoming else _new_id(16),
+            span_id=_new_id(8),
+            parent_id=incoming[1] if incoming else None,
+            flags=incoming[2] if incoming else "01",
+            kind=KIND_SERVER,
+            attributes={"http.method": method, "http.target": scope.get("path", "")},
+        )
+        stages: List[Span] = []
+        span_token = _current_span.set(server_span)
+        stages_token = _request_spans.set(stages)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                server_span.set_attribute("http.status_code", message["status"])
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", server_timing(stages, server_span.duration_ms).encode("latin-1")))
+                headers.append((b"timing-allow-origin", b"*"))
+                headers.append((b"traceparent", server_span.traceparent().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            server_span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _request_spans.reset(stages_token)
+            _current_span.reset(span_token)
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                server_span.name = f"{method} {route.path}"
+                server_span.set_attribute("http.route", route.path)
+            server_span.end_ns = time.time_ns()
+            get_span_exporter().record(server_span)
@@ -0,0 +1,146 @@
+"""
+上传文件保留期限
+完整图片编辑工作流把每个上传文件另存到 input/upload/（见 workflows/complete_image_edit_workflow.py），
+文件只在提交任务时使用，之后没有任何引用。后台定时删除修改时间超过 UPLOAD_RETENTION_HOURS 的文件，
+删除按 UPLOAD_DELETE_PER_SECOND 限速，避免 I/O 峰值。
+
+试运行：python -m app.services.upload_retention 只输出报告，加 --apply 才删除。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .logger import get_main_logger
+from .metrics import get_metrics_registry
+
+UPLOAD_DIR = Path(__file__).resolve().parents[2] / "input" / "upload"
+REPORT_EXAMPLES = 5
+
+
+def expired_uploads(directory: Path, retention_hours: float, now: Optional[float] = None) -> Tuple[List[Tuple[Path, int]], int, int]:
+    """返回 (过期文件及大小，最旧的在前, 文件总数, 总字节数)；retention_hours <= 0 时没有过期文件"""
+    now = now if now is not None else time.time()
+    cutoff = now - retention_hours * 3600 if retention_hours > 0 else float("-inf")
+    expired, files, total = [], 0, 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                files += 1
+                total += stat.st_size
+                if stat.st_mtime < cutoff:
+                    expired.append((stat.st_mtime, Path(entry.path), stat.st_size))
+    except FileNotFoundError:
+        pass
+    expired.sort(key=lambda item: item[0])
+    return [(path, size) for _, path, size in expired], files, total
+
+
+class UploadRetention:
+    """定时删除过期的上传文件"""
+
+    def __init__(self, settings=None, directory: Path = UPLOAD_DIR):
+        self.settings = settings or get_settings()
+        self.directory = directory
+        self.logger = get_main_logger()
+        self._task: Optional[asyncio.Task] = None
+        metrics = get_metrics_registry()
+        self.deleted_files = metrics.counter("runninghub_upload_deleted_files_total", "删除的过期上传文件数")
+        self.deleted_bytes = metrics.counter("runninghub_upload_deleted_bytes_total", "删除过期上传文件释放的字节数")
+        self.stored_bytes = metrics.gauge("runninghub_upload_bytes", "input/upload 目录的文件总量（最近一次清理后）")
+
+    async def run_once(self, dry_run: bool = False) -> Dict[str, Any]:
+        started = time.perf_counter()
+        expired, files, total = await asyncio.to_thread(
+            expired_uploads, self.directory, self.settings.upload_retention_hours
+        )
+        expired = expired[:max(self.settings.upload_max_deletes_per_run, 0)]
+        report: Dict[str, Any] = {
+            "dry_run": dry_run,
+            "directory": str(self.directory),
+            "scanned": {"files": files, "bytes": total},
+            "expired": {
+                "files": len(expired),
+                "bytes": sum(size for _, size in expired),
+                "examples": [str(path) for path, _ in expired[:REPORT_EXAMPLES]],
+            },
+        }
+        deleted_files = deleted_bytes = 0
+        if not dry_run:
+            rate = self.settings.upload_delete_per_second
+            for path, size in expired:
+                try:
+                    await asyncio.to_thread(path.unlink, True)
+                except OSError as e:
+                    self.logger.warning("删除上传文件失败 %s: %s", path, e)
+                    continue
+                deleted_files += 1
+                deleted_bytes += size
+                if rate > 0:
+                    await asyncio.sleep(1.0 / rate)
+            self.deleted_files.inc(deleted_files)
+            self.deleted_bytes.inc(deleted_bytes)
+        self.stored_bytes.set(total - deleted_bytes)
+        report["deleted"] = {"files": deleted_files, "bytes": deleted_bytes}
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.logger.info(
+            "上传文件清理%s: 共 %d 个 %d 字节，过期 %d 个，已删除 %d 个 %d 字节",
+            "（试运行）" if dry_run else "", files, total, len(expired), deleted_files, deleted_bytes,
+        )
+        return report
+
+    def start(self):
+        if self._task is None and self.settings.upload_retention_hours > 0:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self.logger.info("上传文件清理已启动，保留 %.0f 小时", self.settings.upload_retention_hours)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.settings.upload_cleanup_interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.logger.exception("上传文件清理出错: %s", e)
+
+
+_upload_retention: Optional[UploadRetention] = None
+
+
+def get_upload_retention() -> UploadRetention:
+    global _upload_retention
+    if _upload_retention is None:
+        _upload_retention = UploadRetention()
+    return _upload_retention
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="input/upload 过期文件清理（默认试运行，只输出报告）")
+    parser.add_argument("--apply", action="store_true", help="删除过期文件")
+    args = parser.parse_args(argv)
+    settings = get_settings()
+    if settings.upload_retention_hours <= 0:
+        print("UPLOAD_RETENTION_HOURS <= 0，未启用上传文件清理", file=sys.stderr)
+        return 2
+    report = asyncio.run(UploadRetention(settings).run_once(dry_run=not args.apply))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,31 +4,25 @@
 """
 from pathlib import Path
 from typing import Dict, Any, List, Optional
+import asyncio
+import hashlib
 import uuid
-from pydantic import BaseModel
 from fastapi import UploadFile
-from .workflow_manager import Workflow
+from .workflow_manager import DeclarativeWorkflow
 from app.services.runninghub_client import RunninghubClient
 from app.services.config import get_settings
 from app.services.logger import get_runninghub_logger
+from app.services.task_scheduler import get_task_scheduler
+from app.services.log_policy import loggable
+from app.services.tracing import span
+from app.services.upload_retention import UPLOAD_DIR
 
-DEFAULT_IMAGE_PLACEHOLDER = "f23d534950c05bb974fbf23485108c17fa8446b66dd19b6b2f482d68441335b2.png"
 
-
-class CompleteImageEditInput(BaseModel):
-    """完整图片编辑工作流输入参数"""
-    file: UploadFile
-    fileType: str = "image"
-    prompt: str = ""
-    file_2: Optional[UploadFile] = None
-    file_3: Optional[UploadFile] = None
-    file_4: Optional[UploadFile] = None
-
-
-class CompleteImageEditWorkflow(Workflow):
-    """完整的图片编辑工作流 - 包含上传和编辑"""
+class CompleteImageEditWorkflow(DeclarativeWorkflow):
+    """完整的图片编辑工作流 - 包含上传和编辑（节点绑定见 definitions.py）"""
     
-    def __init__(self):
+    def __init__(self, compiled):
+        super().__init__(compiled)
         # 延迟初始化，避免在导入时出错
         self._settings = None
         self._client = None
@@ -56,43 +50,24 @@ class CompleteImageEditWorkflow(Workflow):
             self._logger = get_runninghub_logger()
         return self._logger
     
-    @property
-    def webapp_id(self) -> str:
-        return "1970781747573125122"
-    
-    @property
-    def name(self) -> str:
-        return "complete_image_edit"
-    
-    @property
-    def display_name(self) -> str:
-        return "完整图片编辑"
-    
-    @property
-    def description(self) -> str:
-        return "上传图片并进行编辑，接受二进制图片文件和编辑提示词"
-    
-    @property
-    def input_model(self):
-        return CompleteImageEditInput
-
     async def _persist_upload_file(self, upload_file: UploadFile, description: str) -> bytes:
         """将上传的文件保存到本地 input/upload 目录并返回文件内容"""
-        upload_dir = Path(__file__).resolve().parents[1] / "input" / "upload"
+        upload_dir = UPLOAD_DIR
         upload_dir.mkdir(parents=True, exist_ok=True)
 
-        await upload_file.seek(0)
-        file_bytes = await upload_file.read()
+        with span("persist_upload"):
+            await upload_file.seek(0)
+            file_bytes = await upload_file.read()
 
-        original_name = upload_file.filename
-        safe_name = Path(original_name).name if original_name else f"{uuid.uuid4().hex}.bin"
-        destination = upload_dir / safe_name
+            original_name = upload_file.filename
+            safe_name = Path(original_name).name if original_name else f"{uuid.uuid4().hex}.bin"
+            destination = upload_dir / safe_name
 
-        with destination.open("wb") as f:
-            f.write(file_bytes)
+            with destination.open("wb") as f:
+                f.write(file_bytes)
 
-        await upload_file.seek(0)
-        self.logger.info(f"{description} 已保存到本地: {destination}")
+            await upload_file.seek(0)
+        self.logger.info("%s 已保存到本地: %s", description, destination)
         return file_bytes
     
     async def execute_workflow(self, file: UploadFile, fileType: str = "image", prompt: str = "", file_2: Optional[UploadFile] = None, file_3: Optional[UploadFile] = None, file_4: Optional[UploadFile] = None, **kwargs) -> Dict[str, Any]:
@@ -115,34 +90,34 @@ class CompleteImageEditWorkflow(Workflow):
             image_names = {}
             
             # 上传第一张图片
-            self.logger.info(f"开始上传第一张图片: {file.filename}")
+            self.logger.info("开始上传第一张图片: %s", file.filename)
             image_1_bytes = await self._persist_upload_file(file, "第一张图片")
             image_name = await self.client.upload_file(file=file, file_type=fileType, file_bytes=image_1_bytes)
             image_names['image_1'] = self._process_upload_result(image_name, "第一张图片")
             
             # 上传第二张图片（如果提供）
             if file_2:
-                self.logger.info(f"开始上传第二张图片: {file_2.filename}")
+                self.logger.info("开始上传第二张图片: %s", file_2.filename)
                 image_2_bytes = await self._persist_upload_file(file_2, "第二张图片")
                 image_2_name = await self.client.upload_file(file=file_2, file_type=fileType, file_bytes=image_2_bytes)
                 image_names['image_2'] = self._process_upload_result(image_2_name, "第二张图片")
             
             # 上传第三张图片（如果提供）
             if file_3:
-                self.logger.info(f"开始上传第三张图片: {file_3.filename}")
+                self.logger.info("开始上传第三张图片: %s", file_3.filename)
                 image_3_bytes = await self._persist_upload_file(file_3, "第三张图片")
                 image_3_name = await self.client.upload_file(file=file_3, file_type=fileType, file_bytes=image_3_bytes)
                 image_names['image_3'] = self._process_upload_result(image_3_name, "第三张图片")
             
             # 上传第四张图片（如果提供）
             if file_4:
-                self.logger.info(f"开始上传第四张图片: {file_4.filename}")
+                self.logger.info("开始上传第四张图片: %s", file_4.filename)
                 image_4_bytes = await self._persist_upload_file(file_4, "第四张图片")
                 image_4_name = await self.client.upload_file(file=file_4, file_type=fileType, file_bytes=image_4_bytes)
                 image_names['image_4'] = self._process_upload_result(image_4_name, "第四张图片")
             
             # 第二步：执行图片编辑
-            self.logger.info(f"开始执行图片编辑，提示词: {prompt}")
+            self.logger.info("开始执行图片编辑，提示词: %s", loggable(prompt))
             node_info_list = self.get_node_info_list(
                 prompt=prompt, 
                 image_name=image_names.get('image_1', ''),
@@ -151,13 +126,15 @@ class CompleteImageEditWorkflow(Workflow):
                 image_4=image_names.get('image_4', '')
             )
             
-            task_id = await self.client.create_task(
+            task_id = await get_task_scheduler().submit(
+                self.client,
                 webapp_id=self.webapp_id,
-                node_info_list=node_info_list
+                node_info_list=node_info_list,
+                priority=self.priority,
+                workflow=self.name,
             )
             
-            self.logger.info(f"create_task返回的原始数据: {task_id}")
-            self.logger.info(f"返回数据类型: {type(task_id)}")
+            self.logger.debug("create_task返回的原始数据: %s (%s)", loggable(task_id), type(task_id).__name__)
             
             if not task_id:
                 raise ValueError("任务创建失败，未获取到任务ID")
@@ -169,19 +146,123 @@ class CompleteImageEditWorkflow(Workflow):
             elif not isinstance(task_id, str):
                 task_id = str(task_id)
             
-            self.logger.info(f"处理后的任务ID: {task_id}")
+            self.logger.info("处理后的任务ID: %s", task_id)
             
             return {
                 "taskId": task_id,
                 "imageNames": image_names,
                 "status": "created",
-                "message": "图片编辑任务已创建"
+                "message": "图片编辑任务已创建",
+                "queue": get_task_scheduler().queue_info(task_id),
             }
             
         except Exception as e:
-            self.logger.error(f"工作流执行失败: {str(e)}")
+            self.logger.error("工作流执行失败: %s", e)
             raise e
     
+    async def execute_batch(
+        self,
+        files: List[UploadFile],
+        prompts: List[str],
+        fileType: str = "image",
+        file_2: Optional[UploadFile] = None,
+        file_3: Optional[UploadFile] = None,
+        file_4: Optional[UploadFile] = None,
+    ) -> Dict[str, Any]:
+        """
+        批量图片编辑：主图列表 × 提示词列表（网格），参考图 file_2~file_4 所有任务共用
+
+        内容相同的图片只上传一次；各任务经提交调度器并发创建，超出并发预算的任务排队。
+        单个任务创建失败不影响其它任务，失败项带 error 字段返回。
+
+        Returns:
+            {"batchId", "imageNames", "items": [{"index", "imageIndex", "promptIndex", "prompt", "taskId", "queue"} | {..., "error"}]}
+        """
+        prompts = [str(p) for p in prompts if str(p).strip()]
+        if not files:
+            raise ValueError("至少需要一张主图")
+        if not prompts:
+            raise ValueError("编辑提示词不能为空")
+        total = len(files) * len(prompts)
+        if total > self.settings.batch_max_items:
+            raise ValueError(f"批量任务数 {total} 超过上限 {self.settings.batch_max_items}")
+
+        batch_id = f"batch_{uuid.uuid4().hex[:16]}"
+        self.logger.info("开始批量图片编辑: %s, 主图=%d, 提示词=%d", batch_id, len(files), len(prompts))
+
+        # 第一步：按内容去重后并发上传
+        uploads: Dict[str, asyncio.Task] = {}
+
+        async def upload(upload_file: UploadFile, description: str) -> str:
+            file_bytes = await self._persist_upload_file(upload_file, description)
+            result = await self.client.upload_file(file=upload_file, file_type=fileType, file_bytes=file_bytes)
+            return self._process_upload_result(result, description)
+
+        async def upload_once(upload_file: UploadFile, description: str) -> asyncio.Task:
+            await upload_file.seek(0)
+            digest = hashlib.sha1(await upload_file.read()).hexdigest()
+            await upload_file.seek(0)
+            if digest not in uploads:
+                uploads[digest] = asyncio.ensure_future(upload(upload_file, description))
+            return uploads[digest]
+
+        primary_tasks = [await upload_once(f, f"主图{idx + 1}") for idx, f in enumerate(files)]
+        reference_tasks = {
+            key: await upload_once(f, description)
+            for key, f, description in (
+                ("image_2", file_2, "第二张图片"),
+                ("image_3", file_3, "第三张图片"),
+                ("image_4", file_4, "第四张图片"),
+            )
+            if f
+        }
+        await asyncio.gather(*uploads.values())
+        primary_names = [t.result() for t in primary_tasks]
+        reference_names = {key: t.result() for key, t in reference_tasks.items()}
+        self.logger.info("%s 图片上传完成: %d 张（去重后）", batch_id, len(uploads))
+
+        # 第二步：并发提交（由调度器做准入控制）
+        grid = [(i, j) for i in range(len(primary_names)) for j in range(len(prompts))]
+        scheduler = get_task_scheduler()
+
+        async def submit(image_index: int, prompt_index: int) -> str:
+            node_info_list = self.get_node_info_list(
+                prompt=prompts[prompt_index],
+                image_name=primary_names[image_index],
+                **reference_names,
+            )
+            return await scheduler.submit(
+                self.client,
+                webapp_id=self.webapp_id,
+                node_info_list=node_info_list,
+                priority=self.priority,
+                workflow=self.name,
+            )
+
+        results = await asyncio.gather(*(submit(i, j) for i, j in grid), return_exceptions=True)
+
+        items = []
+        for index, ((i, j), result) in enumerate(zip(grid, results)):
+            item = {"index": index, "imageIndex": i, "promptIndex": j, "prompt": prompts[j]}
+            if isinstance(result, BaseException):
+                item["error"] = str(result)
+            elif not result:
+                item["error"] = "任务创建失败，未获取到任务ID"
+            else:
+                item["taskId"] = str(result)
+                item["queue"] = scheduler.queue_info(item["taskId"])
+            items.append(item)
+
+        created = sum(1 for item in items if "taskId" in item)
+        self.logger.info("批量图片编辑已提交: %s, 成功 %d/%d", batch_id, created, len(items))
+        return {
+            "batchId": batch_id,
+            "imageNames": {"primary": primary_names, **reference_names},
+            "items": items,
+            "status": "created" if created else "failed",
+            "message": f"已创建 {created}/{len(items)} 个图片编辑任务",
+        }
+    
     def _process_upload_result(self, upload_result: Any, image_description: str) -> str:
         """
         处理上传结果，确保返回字符串格式的图片名称
@@ -193,8 +274,7 @@ class CompleteImageEditWorkflow(Workflow):
         Returns:
             处理后的图片名称字符串
         """
-        self.logger.info(f"{image_description}上传接口返回的原始数据: {upload_result}")
-        self.logger.info(f"返回数据类型: {type(upload_result)}")
+        self.logger.debug("%s上传接口返回的原始数据: %s (%s)", image_description, loggable(upload_result), type(upload_result).__name__)
         
         if not upload_result:
             raise ValueError(f"{image_description}上传失败，未获取到图片名称")
@@ -208,149 +288,5 @@ class CompleteImageEditWorkflow(Workflow):
         else:
             image_name = upload_result
         
-        self.logger.info(f"处理后的{image_description}名称: {image_name}")
+        self.logger.info("处理后的%s名称: %s", image_description, image_name)
         return image_name
-    
-    def get_node_info_list(self, prompt: str = "", image_name: str = "", image_2: str = "", image_3: str = "", image_4: str = "", **kwargs) -> List[Dict[str, Any]]:
-        """
-        生成图片编辑的节点信息列表
-        
-        Args:
-            prompt: 编辑提示词
-            image_name: 第一张图片名称
-            image_2: 第二张图片名称
-            image_3: 第三张图片名称
-            image_4: 第四张图片名称
-        """
-        # 确保 prompt 是字符串
-        if isinstance(prompt, dict):
-            prompt = str(prompt)
-        elif not isinstance(prompt, str):
-            prompt = str(prompt)
-        
-        if not prompt.strip():
-            raise ValueError("编辑提示词不能为空")
-        
-        def normalize_image_value(value: Any, allow_empty: bool = False) -> str:
-            if isinstance(value, dict):
-                value = str(value)
-            elif not isinstance(value, str):
-                value = str(value)
-            normalized = value.strip()
-            if not normalized:
-                if allow_empty:
-                    return DEFAULT_IMAGE_PLACEHOLDER
-                raise ValueError("第一张图片名称不能为空")
-            return normalized
-        
-        image_name = normalize_image_value(image_name, allow_empty=False)
-        image_2 = normalize_image_value(image_2, allow_empty=True)
-        image_3 = normalize_image_value(image_3, allow_empty=True)
-        image_4 = normalize_image_value(image_4, allow_empty=True)
-        
-        node_info_list = [
-            {
-                "nodeId": "35",
-                "fieldName": "image",
-                "fieldValue": image_name,
-                "description": "image"
-            },
-            {
-                "nodeId": "53",
-                "fieldName": "image",
-                "fieldValue": image_2,
-                "description": "image"
-            },
-            {
-                "nodeId": "51",
-                "fieldName": "image",
-                "fieldValue": image_3,
-                "description": "image"
-            },
-            {
-                "nodeId": "52",
-                "fieldName": "image",
-                "fieldValue": image_4,
-                "description": "image"
-            },
-            {
-                "nodeId": "46",
-                "fieldName": "text",
-                "fieldValue": prompt,
-                "description": "text"
-            }
-        ]
-        
-        return node_info_list
-
-
-# 为了向后兼容，保留原有的ImageEditWorkflow
-class ImageEditInput(BaseModel):
-    """图片编辑工作流输入参数（仅编辑，需要预先上传的图片名称）"""
-    prompt: str = ""
-    image_name: str = ""
-
-
-class ImageEditWorkflow(Workflow):
-    """图片编辑工作流（仅编辑功能）"""
-    
-    @property
-    def webapp_id(self) -> str:
-        return "1970781747573125122"
-    
-    @property
-    def name(self) -> str:
-        return "image_edit"
-    
-    @property
-    def display_name(self) -> str:
-        return "图片编辑"
-    
-    @property
-    def description(self) -> str:
-        return "基于图片和提示词进行编辑，需要提供图片名称和编辑提示词"
-    
-    @property
-    def input_model(self):
-        return ImageEditInput
-    
-    def get_node_info_list(self, prompt: str = "", image_name: str = "", **kwargs) -> List[Dict[str, Any]]:
-        """
-        生成图片编辑的节点信息列表
-        
-        Args:
-            prompt: 编辑提示词
-            image_name: 图片名称
-        """
-        # 确保 prompt 是字符串
-        if isinstance(prompt, dict):
-            prompt = str(prompt)
-        elif not isinstance(prompt, str):
-            prompt = str(prompt)
-        
-        if not prompt.strip():
-            raise ValueError("编辑提示词不能为空")
-        
-        # 确保 image_name 是字符串
-        if isinstance(image_name, dict):
-            image_name = str(image_name)
-        elif not isinstance(image_name, str):
-            image_name = str(image_name)
-        
-        if not image_name.strip():
-            raise ValueError("图片名称不能为空")
-        
-        return [
-            {
-                "nodeId": "35",
-                "fieldName": "image",
-                "fieldValue": image_name,
-                "description": "image"
-            },
-            {
-                "nodeId": "46",
-                "fieldName": "text",
-                "fieldValue": prompt,
-                "description": "text"
-            }
-        ]
@@ -2,26 +2,20 @@
 完整的视频生成工作流
 接收图片和提示词，上传后触发视频生成任务
 """
-from typing import Dict, Any, List, Optional
-from pydantic import BaseModel
+from typing import Dict, Any, Optional
 from fastapi import UploadFile
-from .workflow_manager import Workflow
+from .workflow_manager import DeclarativeWorkflow
 from app.services.runninghub_client import RunninghubClient
 from app.services.config import get_settings
 from app.services.logger import get_runninghub_logger
+from app.services.task_scheduler import get_task_scheduler
 
 
-class CompleteVideoGenerationInput(BaseModel):
-    """完整视频生成工作流输入参数"""
-    file: UploadFile
-    prompt: str
-    fileType: str = "image"
+class CompleteVideoGenerationWorkflow(DeclarativeWorkflow):
+    """完整视频生成：上传图片并触发视频生成任务（节点绑定见 definitions.py）"""
 
-
-class CompleteVideoGenerationWorkflow(Workflow):
-    """完整视频生成：上传图片并触发视频生成任务"""
-
-    def __init__(self):
+    def __init__(self, compiled):
+        super().__init__(compiled)
         self._settings = None
         self._client: Optional[RunninghubClient] = None
         self._logger = None
@@ -48,62 +42,6 @@ class CompleteVideoGenerationWorkflow(Workflow):
             self._logger = get_runninghub_logger()
         return self._logger
 
-    @property
-    def webapp_id(self) -> str:
-        # 对应 curl 示例中的 webappId
-        return "1980833864815919105"
-
-    @property
-    def name(self) -> str:
-        return "complete_video_generation"
-
-    @property
-    def display_name(self) -> str:
-        return "完整视频生成"
-
-    @property
-    def description(self) -> str:
-        return "上传图片并结合提示词生成视频，返回任务ID用于轮询与获取输出"
-
-    @property
-    def input_model(self):
-        return CompleteVideoGenerationInput
-
-    def get_node_info_list(self, image_name: str = "", prompt: str = "", **kwargs) -> List[Dict[str, Any]]:
-        """
-        生成视频生成任务所需的节点信息列表
-
-        Args:
-            image_name: 已上传到运行服务后的图片文件名
-            prompt: 视频生成提示词
-        """
-        if not isinstance(image_name, str):
-            image_name = str(image_name)
-        image_name = image_name.strip()
-        if not image_name:
-            raise ValueError("图片名称不能为空")
-
-        if not isinstance(prompt, str):
-            prompt = str(prompt)
-        prompt = prompt.strip()
-        if not prompt:
-            raise ValueError("提示词不能为空")
-
-        return [
-            {
-                "nodeId": "87",
-                "fieldName": "image",
-                "fieldValue": image_name,
-                "description": "image",
-            },
-            {
-                "nodeId": "86",
-                "fieldName": "prompt",
-                "fieldValue": prompt,
-                "description": "prompt",
-            },
-        ]
-
     async def execute_workflow(
         self,
         file: UploadFile,
@@ -114,7 +52,7 @@ class CompleteVideoGenerationWorkflow(Workflow):
         """
         上传图片 -> 组装节点 -> 创建视频生成任务
         """
-        self.logger.info(f"开始上传视频生成图片: {file.filename}")
+        self.logger.info("开始上传视频生成图片: %s", file.filename)
         image_name = await self.client.upload_file(file=file, file_type=fileType)
 
         if isinstance(image_name, dict):
@@ -127,9 +65,12 @@ class CompleteVideoGenerationWorkflow(Workflow):
 
         node_info_list = self.get_node_info_list(image_name=image_name, prompt=prompt)
 
-        task_id = await self.client.create_task(
+        task_id = await get_task_scheduler().submit(
+            self.client,
             webapp_id=self.webapp_id,
             node_info_list=node_info_list,
+            priority=self.priority,
+            workflow=self.name,
         )
 
         if isinstance(task_id, dict):
@@ -140,9 +81,10 @@ class CompleteVideoGenerationWorkflow(Workflow):
         if not task_id:
             raise ValueError("任务创建失败，未获取到任务ID")
 
-        self.logger.info(f"视频生成任务已创建，taskId={task_id}")
+        self.logger.info("视频生成任务已创建，taskId=%s", task_id)
         return {
             "taskId": task_id,
             "status": "created",
             "message": "视频生成任务已创建",
+            "queue": get_task_scheduler().queue_info(task_id),
         }
@@ -0,0 +1,76 @@
+"""
+工作流定义
+新增只需拼装节点的工作流时，在此追加一条 WorkflowDefinition 即可自动生成 /v1/generate/{name} 端点；
+需要上传文件等自定义流程时，再在 workflows/ 下实现 DeclarativeWorkflow 子类并通过 implementation 引用。
+"""
+from .registry import NodeBinding, WorkflowDefinition
+
+# 图片编辑：参考图未提供时使用的占位图（RunningHub 上已存在的文件）
+DEFAULT_IMAGE_PLACEHOLDER = "f23d534950c05bb974fbf23485108c17fa8446b66dd19b6b2f482d68441335b2.png"
+
+IMAGE_EDIT_WEBAPP_ID = "1970781747573125122"
+
+WORKFLOW_DEFINITIONS = (
+    WorkflowDefinition(
+        name="image_edit",
+        webapp_id=IMAGE_EDIT_WEBAPP_ID,
+        display_name="图片编辑",
+        description="基于图片和提示词进行编辑，需要提供图片名称和编辑提示词",
+        bindings=(
+            NodeBinding("image_name", "35", "image", required=True, error="第一张图片名称不能为空"),
+            NodeBinding("prompt", "46", "text", required=True, error="编辑提示词不能为空"),
+            NodeBinding("image_2", "53", "image"),
+            NodeBinding("image_3", "51", "image"),
+            NodeBinding("image_4", "52", "image"),
+        ),
+    ),
+    WorkflowDefinition(
+        name="complete_image_edit",
+        webapp_id=IMAGE_EDIT_WEBAPP_ID,
+        display_name="完整图片编辑",
+        description="上传图片并进行编辑，接受二进制图片文件和编辑提示词",
+        bindings=(
+            NodeBinding("image_name", "35", "image", required=True, error="第一张图片名称不能为空"),
+            NodeBinding("image_2", "53", "image", default=DEFAULT_IMAGE_PLACEHOLDER),
+            NodeBinding("image_3", "51", "image", default=DEFAULT_IMAGE_PLACEHOLDER),
+            NodeBinding("image_4", "52", "image", default=DEFAULT_IMAGE_PLACEHOLDER),
+            NodeBinding("prompt", "46", "text", required=True, error="编辑提示词不能为空"),
+        ),
+        implementation="workflows.complete_image_edit_workflow:CompleteImageEditWorkflow",
+    ),
+    WorkflowDefinition(
+        name="complete_pattern_extract",
+        webapp_id="1972483134858129410",
+        display_name="完整印花提取",
+        description="上传图片并进行印花提取，返回任务ID用于轮询与获取输出",
+        bindings=(
+            NodeBinding("image_name", "224", "image", required=True, error="图片名称不能为空"),
+        ),
+        # 耗时短、用户在页面上等待结果，排队时优先派发
+        priority=4,
+        implementation="workflows.complete_pattern_extract_workflow:CompletePatternExtractWorkflow",
+    ),
+    WorkflowDefinition(
+        name="complete_video_generation",
+        webapp_id="1980833864815919105",
+        display_name="完整视频生成",
+        description="上传图片并结合提示词生成视频，返回任务ID用于轮询与获取输出",
+        bindings=(
+            NodeBinding("image_name", "87", "image", required=True, error="图片名称不能为空"),
+            NodeBinding("prompt", "86", "prompt", required=True, error="提示词不能为空"),
+        ),
+        # 视频任务占用并发时间最长，排队时让位于图片类任务
+        priority=1,
+        implementation="workflows.complete_video_generation_workflow:CompleteVideoGenerationWorkflow",
+    ),
+    WorkflowDefinition(
+        name="variant_overlay",
+        webapp_id="1976162186252959746",
+        display_name="Variant Overlay",
+        description="Upload an image and trigger the variant overlay AI-App on RunningHub.",
+        bindings=(
+            NodeBinding("image_name", "388", "image", required=True, error="image_name is required"),
+        ),
+        implementation="workflows.variant_overlay_workflow:VariantOverlayWorkflow",
+    ),
+)
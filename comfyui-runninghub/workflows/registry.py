@@ -0,0 +1,125 @@
+"""
+声明式工作流注册表
+工作流以数据形式定义（webappId、节点绑定、字段校验），启动时编译一次为节点列表构建函数与输入模型；
+需要自定义执行逻辑（上传、批量等）的工作流通过 implementation 指向 Python 类，首次使用时才导入。
+
+节点绑定：
+    NodeBinding("prompt", "46", "text", required=True, error="编辑提示词不能为空")
+- param：调用方传入的参数名
+- required：为空时抛出 ValueError(error)
+- default：可选参数为空时写入的占位值；为 None 时省略该节点
+"""
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+from pydantic import BaseModel, Field, create_model
+
+
+@dataclass(frozen=True)
+class NodeBinding:
+    """工作流参数到 RunningHub 节点字段的绑定"""
+
+    param: str
+    node_id: str
+    field_name: str
+    required: bool = False
+    default: Optional[str] = None
+    error: str = ""
+    description: str = ""
+
+
+@dataclass(frozen=True)
+class WorkflowDefinition:
+    """工作流定义（纯数据）"""
+
+    name: str
+    webapp_id: str
+    display_name: str
+    description: str
+    bindings: Tuple[NodeBinding, ...]
+    # 提交调度优先级，数值越大排队时越早派发
+    priority: int = 2
+    # "模块路径:类名"，为空时使用通用的 DeclarativeWorkflow
+    implementation: Optional[str] = None
+
+
+NodeListBuilder = Callable[..., List[Dict[str, Any]]]
+
+
+def _normalize(value: Any) -> str:
+    if value is None:
+        return ""
+    if type(value) is not str:
+        value = str(value)
+    return value.strip()
+
+
+def compile_node_builder(bindings: Tuple[NodeBinding, ...]) -> NodeListBuilder:
+    """把节点绑定编译为节点列表构建函数：绑定在编译时展开成元组，构建时只做取值、校验与拼装"""
+    plan = tuple(
+        (
+            b.param,
+            b.node_id,
+            b.field_name,
+            b.description or b.field_name,
+            b.required,
+            b.default,
+            b.error or f"{b.param} 不能为空",
+        )
+        for b in bindings
+    )
+
+    def build_node_info_list(**kwargs) -> List[Dict[str, Any]]:
+        node_info_list = []
+        for param, node_id, field_name, description, required, default, error in plan:
+            value = _normalize(kwargs.get(param))
+            if not value:
+                if required:
+                    raise ValueError(error)
+                if default is None:
+                    continue
+                value = default
+            node_info_list.append({
+                "nodeId": node_id,
+                "fieldName": field_name,
+                "fieldValue": value,
+                "description": description,
+            })
+        return node_info_list
+
+    return build_node_info_list
+
+
+def compile_input_model(definition: WorkflowDefinition) -> Type[BaseModel]:
+    """根据节点绑定生成 /generate/{name} 端点的请求体模型"""
+    fields: Dict[str, Any] = {}
+    for b in definition.bindings:
+        if b.param in fields:
+            continue
+        note = f"节点 {b.node_id}.{b.field_name}" + ("（必填）" if b.required else "")
+        fields[b.param] = (str, Field(default="", description=note))
+    model_name = "".join(part.capitalize() for part in definition.name.split("_")) + "Input"
+    return create_model(model_name, **fields)
+
+
+@dataclass(frozen=True)
+class CompiledWorkflow:
+    """编译后的工作流定义"""
+
+    definition: WorkflowDefinition
+    build_node_info_list: NodeListBuilder
+    input_model: Type[BaseModel]
+    compile_ms: float
+
+
+def compile_definition(definition: WorkflowDefinition) -> CompiledWorkflow:
+    started = time.perf_counter()
+    builder = compile_node_builder(definition.bindings)
+    input_model = compile_input_model(definition)
+    return CompiledWorkflow(
+        definition=definition,
+        build_node_info_list=builder,
+        input_model=input_model,
+        compile_ms=(time.perf_counter() - started) * 1000,
+    )
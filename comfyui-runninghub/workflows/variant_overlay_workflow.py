@@ -4,26 +4,24 @@ Variant overlay workflow
 Automatically uploads the provided image file to RunningHub and then triggers
 the AI-App with webappId 1976162186252959746 (nodeId 388).
 """
-from typing import Dict, Any, List, Optional
-from pydantic import BaseModel
+from typing import Dict, Any, Optional
 from fastapi import UploadFile
 
-from .workflow_manager import Workflow
+from .workflow_manager import DeclarativeWorkflow
 from app.services.runninghub_client import RunninghubClient
 from app.services.config import get_settings
 from app.services.logger import get_runninghub_logger
+from app.services.task_scheduler import get_task_scheduler
 
 
-class VariantOverlayInput(BaseModel):
-    """Variant overlay workflow input parameters (for already uploaded images)."""
+class VariantOverlayWorkflow(DeclarativeWorkflow):
+    """Workflow that uploads an image (if necessary) and triggers variant overlay.
 
-    image_name: str
+    Node bindings live in workflows/definitions.py.
+    """
 
-
-class VariantOverlayWorkflow(Workflow):
-    """Workflow that uploads an image (if necessary) and triggers variant overlay."""
-
-    def __init__(self):
+    def __init__(self, compiled):
+        super().__init__(compiled)
         self._settings = None
         self._client = None
         self._logger = None
@@ -50,40 +48,6 @@ class VariantOverlayWorkflow(Workflow):
             self._logger = get_runninghub_logger()
         return self._logger
 
-    @property
-    def webapp_id(self) -> str:
-        # Matches the provided curl example
-        return "1976162186252959746"
-
-    @property
-    def name(self) -> str:
-        return "variant_overlay"
-
-    @property
-    def display_name(self) -> str:
-        return "Variant Overlay"
-
-    @property
-    def description(self) -> str:
-        return "Upload an image and trigger the variant overlay AI-App on RunningHub."
-
-    @property
-    def input_model(self):
-        return VariantOverlayInput
-
-    def get_node_info_list(self, image_name: str, **kwargs) -> List[Dict[str, Any]]:
-        if not image_name or not image_name.strip():
-            raise ValueError("image_name is required")
-
-        return [
-            {
-                "nodeId": "388",
-                "fieldName": "image",
-                "fieldValue": image_name,
-                "description": "image",
-            }
-        ]
-
     async def execute_workflow(
         self,
         file: Optional[UploadFile] = None,
@@ -100,7 +64,7 @@ class VariantOverlayWorkflow(Workflow):
             image_name: Existing image name on RunningHub (optional).
         """
         if file:
-            self.logger.info(f"Uploading image for variant overlay: {file.filename}")
+            self.logger.info("Uploading image for variant overlay: %s", file.filename)
             uploaded = await self.client.upload_file(file=file, file_type=fileType)
             if isinstance(uploaded, dict):
                 image_name = uploaded.get("fileName", str(uploaded))
@@ -111,11 +75,14 @@ class VariantOverlayWorkflow(Workflow):
             raise ValueError("image_name is required (either upload a file or provide image_name)")
 
         node_info_list = self.get_node_info_list(image_name=image_name)
-        self.logger.info(f"Triggering variant overlay workflow with image: {image_name}")
+        self.logger.info("Triggering variant overlay workflow with image: %s", image_name)
 
-        task_id = await self.client.create_task(
+        task_id = await get_task_scheduler().submit(
+            self.client,
             webapp_id=self.webapp_id,
             node_info_list=node_info_list,
+            priority=self.priority,
+            workflow=self.name,
         )
 
         if isinstance(task_id, dict):
@@ -130,6 +97,7 @@ class VariantOverlayWorkflow(Workflow):
             "taskId": task_id,
             "status": "created",
             "message": "Variant overlay task has been created",
+            "queue": get_task_scheduler().queue_info(task_id),
         }
 
         if file and hasattr(file, "filename"):
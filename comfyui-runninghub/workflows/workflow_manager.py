@@ -1,18 +1,27 @@
 """
 工作流管理器
 负责管理和执行不同的工作流
+
+工作流定义来自 workflows/definitions.py，启动时编译一次；
+带 implementation 的工作流在首次 get_workflow 时才导入对应模块
 """
-from typing import Dict, Any, List, Type
+from typing import Dict, Any, List, Optional, Type
 from abc import ABC, abstractmethod
 import importlib
-import os
+import threading
+import time
 from pydantic import BaseModel
 from app.services.logger import get_main_logger
+from .definitions import WORKFLOW_DEFINITIONS
+from .registry import CompiledWorkflow, WorkflowDefinition, compile_definition
 
 logger = get_main_logger()
 
 class Workflow(ABC):
     """工作流基类"""
+
+    # 提交调度优先级，数值越大排队时越早派发
+    priority: int = 2
     
     @property
     @abstractmethod
@@ -54,93 +63,181 @@ class Workflow(ABC):
         # 默认实现，子类可以重写
         return {"message": "工作流执行完成"}
 
+class DeclarativeWorkflow(Workflow):
+    """由 WorkflowDefinition 驱动的工作流：元数据与节点列表都来自编译后的定义"""
+
+    def __init__(self, compiled: CompiledWorkflow):
+        self._compiled = compiled
+
+    @property
+    def definition(self) -> WorkflowDefinition:
+        return self._compiled.definition
+
+    @property
+    def priority(self) -> int:
+        return self.definition.priority
+
+    @property
+    def webapp_id(self) -> str:
+        return self.definition.webapp_id
+
+    @property
+    def name(self) -> str:
+        return self.definition.name
+
+    @property
+    def display_name(self) -> str:
+        return self.definition.display_name
+
+    @property
+    def description(self) -> str:
+        return self.definition.description
+
+    @property
+    def input_model(self) -> Type[BaseModel]:
+        return self._compiled.input_model
+
+    def get_node_info_list(self, **kwargs) -> List[Dict[str, Any]]:
+        return self._compiled.build_node_info_list(**kwargs)
+
 class WorkflowManager:
     """工作流管理器"""
     
-    def __init__(self):
-        self.workflows: Dict[str, Workflow] = {}
-        self._load_workflows()
+    def __init__(self, definitions=WORKFLOW_DEFINITIONS):
+        self._compiled: Dict[str, CompiledWorkflow] = {}
+        self._instances: Dict[str, Workflow] = {}
+        self._load_ms: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._compile_workflows(definitions)
     
-    def _load_workflows(self):
-        """动态加载所有工作流"""
-        workflows_dir = os.path.dirname(__file__)
-        
-        for filename in os.listdir(workflows_dir):
-            if filename.endswith('.py') and filename != '__init__.py' and filename != 'workflow_manager.py':
-                module_name = filename[:-3]  # 移除 .py 扩展名
-                try:
-                    module = importlib.import_module(f'workflows.{module_name}')
-                    
-                    # 查找工作流类
-                    for attr_name in dir(module):
-                        attr = getattr(module, attr_name)
-                        if (isinstance(attr, type) and 
-                            issubclass(attr, Workflow) and 
-                            attr != Workflow):
-                            
-                            workflow_instance = attr()
-                            self.workflows[workflow_instance.name] = workflow_instance
-                            logger.info(f"加载工作流: {workflow_instance.name} - {workflow_instance.display_name}")
-                            
-                except Exception as e:
-                    logger.error(f"加载工作流 {module_name} 失败: {str(e)}")
+    def _compile_workflows(self, definitions):
+        """编译所有工作流定义（不导入任何实现模块）"""
+        started = time.perf_counter()
+        for definition in definitions:
+            if definition.name in self._compiled:
+                logger.warning("工作流定义重复，已忽略: %s", definition.name)
+                continue
+            self._compiled[definition.name] = compile_definition(definition)
+        self.compile_ms = (time.perf_counter() - started) * 1000
+        logger.info(
+            "工作流注册表已编译: %d 个工作流, 耗时 %.2fms (%s)",
+            len(self._compiled), self.compile_ms, ", ".join(self._compiled),
+        )
     
-    def get_workflow(self, name: str) -> Workflow:
-        """获取指定名称的工作流"""
-        if name not in self.workflows:
+    def _instantiate(self, compiled: CompiledWorkflow) -> Workflow:
+        implementation = compiled.definition.implementation
+        if not implementation:
+            return DeclarativeWorkflow(compiled)
+        module_path, _, class_name = implementation.partition(":")
+        started = time.perf_counter()
+        workflow_class = getattr(importlib.import_module(module_path), class_name)
+        workflow = workflow_class(compiled)
+        self._load_ms[compiled.definition.name] = (time.perf_counter() - started) * 1000
+        logger.info(
+            "加载工作流实现: %s -> %s, 耗时 %.1fms",
+            compiled.definition.name, implementation, self._load_ms[compiled.definition.name],
+        )
+        return workflow
+    
+    def names(self) -> List[str]:
+        """已注册的工作流名称"""
+        return list(self._compiled)
+    
+    def has_workflow(self, name: str) -> bool:
+        return name in self._compiled
+    
+    def get_definition(self, name: str) -> CompiledWorkflow:
+        """获取编译后的工作流定义（不会触发实现模块导入）"""
+        compiled = self._compiled.get(name)
+        if compiled is None:
             raise ValueError(f"工作流 '{name}' 不存在")
-        return self.workflows[name]
+        return compiled
+    
+    def get_workflow(self, name: str) -> Workflow:
+        """获取指定名称的工作流，首次调用时加载其实现"""
+        workflow = self._instances.get(name)
+        if workflow is not None:
+            return workflow
+        compiled = self.get_definition(name)
+        with self._lock:
+            workflow = self._instances.get(name)
+            if workflow is None:
+                workflow = self._instantiate(compiled)
+                self._instances[name] = workflow
+        return workflow
+    
+    def preload(self, names: Optional[List[str]] = None):
+        """预先加载工作流实现（默认全部），避免首个请求承担导入耗时"""
+        for name in names if names is not None else self.names():
+            try:
+                self.get_workflow(name)
+            except Exception as e:
+                logger.error("预加载工作流 %s 失败: %s", name, e)
+    
+    def load_report(self) -> Dict[str, Any]:
+        """注册表加载耗时报告：定义编译耗时与各实现模块的导入耗时"""
+        return {
+            "workflowCount": len(self._compiled),
+            "compileMs": round(self.compile_ms, 3),
+            "workflows": [
+                {
+                    "name": name,
+                    "implementation": compiled.definition.implementation,
+                    "compileMs": round(compiled.compile_ms, 3),
+                    "loaded": name in self._instances,
+                    "loadMs": round(self._load_ms[name], 3) if name in self._load_ms else None,
+                }
+                for name, compiled in self._compiled.items()
+            ],
+        }
+    
+    def describe_workflow(self, name: str) -> Dict[str, Any]:
+        """工作流元数据、输入参数与节点绑定"""
+        compiled = self.get_definition(name)
+        definition = compiled.definition
+        return {
+            "name": definition.name,
+            "display_name": definition.display_name,
+            "description": definition.description,
+            "webapp_id": definition.webapp_id,
+            "input_model": {
+                field_name: {
+                    "type": str(field_info.annotation),
+                    "default": field_info.default if field_info.default is not None else None,
+                    "description": field_info.description if hasattr(field_info, 'description') else None
+                }
+                for field_name, field_info in compiled.input_model.model_fields.items()
+            },
+            "nodes": [
+                {"param": b.param, "nodeId": b.node_id, "fieldName": b.field_name, "required": b.required}
+                for b in definition.bindings
+            ],
+        }
     
     def list_workflows(self) -> List[Dict[str, Any]]:
         """列出所有可用的工作流及其信息"""
-        return [
-            {
-                "name": workflow.name,
-                "display_name": workflow.display_name,
-                "description": workflow.description,
-                "input_model": {
-                    field_name: {
-                        "type": str(field_info.annotation),
-                        "default": field_info.default if field_info.default is not None else None,
-                        "description": field_info.description if hasattr(field_info, 'description') else None
-                    }
-                    for field_name, field_info in workflow.input_model.model_fields.items()
-                }
-            }
-            for workflow in self.workflows.values()
-        ]
+        return [self.describe_workflow(name) for name in self._compiled]
     
     def execute_workflow(self, name: str, **kwargs) -> Dict[str, Any]:
-        """执行指定的工作流"""
-        workflow = self.get_workflow(name)
-        node_info_list = workflow.get_node_info_list(**kwargs)
+        """组装指定工作流的提交参数（只使用编译后的定义）"""
+        compiled = self.get_definition(name)
+        node_info_list = compiled.build_node_info_list(**kwargs)
         
         return {
-            "webapp_id": workflow.webapp_id,
+            "webapp_id": compiled.definition.webapp_id,
             "node_info_list": node_info_list,
-            "workflow_name": workflow.name
+            "workflow_name": compiled.definition.name,
+            "priority": compiled.definition.priority,
         }
     
     async def execute_workflow_async(self, name: str, **kwargs) -> Dict[str, Any]:
         """异步执行指定的工作流"""
         workflow = self.get_workflow(name)
-        
-        # 检查工作流是否有自定义的异步执行方法
-        if hasattr(workflow, 'execute_workflow'):
-            return await workflow.execute_workflow(**kwargs)
-        else:
-            # 使用默认的同步执行方法
-            node_info_list = workflow.get_node_info_list(**kwargs)
-            return {
-                "webapp_id": workflow.webapp_id,
-                "node_info_list": node_info_list,
-                "workflow_name": workflow.name
-            }
+        return await workflow.execute_workflow(**kwargs)
     
     def get_workflow_input_model(self, name: str) -> Type[BaseModel]:
         """获取工作流的输入参数模型"""
-        workflow = self.get_workflow(name)
-        return workflow.input_model
+        return self.get_definition(name).input_model
 
 # 全局工作流管理器实例
 workflow_manager = WorkflowManager()
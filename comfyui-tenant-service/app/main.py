@@ -1,14 +1,28 @@
+import asyncio
+import contextlib
+import time
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from .routers import auth, tenants, proxy
-from .services.logger import get_main_logger
-from .services.database_init import init_database
+from .services.logger import get_main_logger, setup_logging, shutdown_logging
 from .services.config import get_settings
+from .services.lifecycle import get_storage_bootstrap, startup_phase
 from .services.image_storage import image_storage_service
+from .services.rate_limiter import RateLimitMiddleware, RATE_LIMIT_HEADERS, build_rate_limiter
+from .services.idempotency import REPLAYED_HEADER
+from .services.task_finalizer import get_task_finalizer
+from .services.usage_accounting import get_usage_accounting
+from .services.output_gc import get_output_gc
+from .services.metrics import CONTENT_TYPE, MetricsMiddleware, get_metrics_registry
+from .services.tracing import SERVER_TIMING_HEADER, TRACEPARENT_HEADER, TracingMiddleware, get_span_exporter
+from .models.database import close_storage, collect_pool_metrics
 
 def create_app() -> FastAPI:
-    logger = get_main_logger()
+    started = time.perf_counter()
     settings = get_settings()
+    setup_logging(settings.log_level)
+    logger = get_main_logger()
     
     logger.info("启动多租户微服务")
     
@@ -22,19 +36,57 @@ def create_app() -> FastAPI:
     elif storage_info['type'] == 'SQLite':
         logger.info(f"SQLite 文件: {storage_info['path']}")
     
-    # Initialize database
-    logger.info("初始化数据库...")
-    if init_database():
-        logger.info("数据库初始化成功")
-    else:
-        logger.warning("数据库初始化失败，使用 JSON 存储")
-    
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # 启动：不等待数据库与缩略图同步，worker 立即开始响应健康检查
+        lifespan_started = time.perf_counter()
+        bootstrap = get_storage_bootstrap()
+        bootstrap.start()
+        # 缩略图同步遍历整个输出目录，在线程中进行，不影响就绪
+        thumbnails = asyncio.create_task(sync_thumbnails())
+        if settings.finalizer_enabled:
+            get_task_finalizer().start()
+        if settings.usage_accounting_enabled:
+            get_usage_accounting().start()
+        if settings.gc_enabled:
+            get_output_gc().start()
+        logger.info("启动完成: %.1fms（存储在后台初始化）", (time.perf_counter() - lifespan_started) * 1000)
+
+        yield
+
+        thumbnails.cancel()
+        if settings.gc_enabled:
+            await get_output_gc().stop()
+        if settings.finalizer_enabled:
+            await get_task_finalizer().stop()
+        if settings.usage_accounting_enabled:
+            await get_usage_accounting().stop()
+        await bootstrap.stop()
+        # aiosqlite 每个连接占用一个工作线程，不关闭连接池进程无法退出
+        from .services.dual_write import close_dual_write_engine
+        await close_storage()
+        await close_dual_write_engine()
+        logger.info("多租户微服务关闭")
+        get_span_exporter().flush()
+        shutdown_logging()
+
+    async def sync_thumbnails():
+        with startup_phase("thumbnails"):
+            await asyncio.to_thread(image_storage_service.sync_all_thumbnails)
+
     app = FastAPI(
         title="ComfyUI Tenant Service",
         version="0.1.0",
-        description="Multi-tenant microservice for ComfyUI Runninghub"
+        description="Multi-tenant microservice for ComfyUI Runninghub",
+        lifespan=lifespan,
     )
 
+    # Rate limiting (added before CORS so 429 responses still carry CORS headers)
+    rate_limiter = build_rate_limiter(settings)
+    if rate_limiter:
+        app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+        logger.info("请求限流已启用: %d 令牌/分钟, 后端: %s", settings.rate_limit_per_minute, settings.rate_limit_backend)
+
     # CORS middleware
     app.add_middleware(
         CORSMiddleware,
@@ -42,19 +94,35 @@ def create_app() -> FastAPI:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=RATE_LIMIT_HEADERS + [REPLAYED_HEADER, SERVER_TIMING_HEADER, TRACEPARENT_HEADER],
     )
 
+    # Tracing (continues incoming traceparent, adds Server-Timing to every response)
+    app.add_middleware(TracingMiddleware)
+
+    # Metrics (outermost, so latency includes rate limiting and CORS)
+    app.add_middleware(MetricsMiddleware)
+    get_metrics_registry().register_collector(collect_pool_metrics)
+
     # Include routers
     app.include_router(auth.router, prefix="/auth", tags=["authentication"])
     app.include_router(tenants.router, prefix="/tenants", tags=["tenants"])
     app.include_router(proxy.router, prefix="/proxy", tags=["proxy"])
 
-    @app.on_event("startup")
-    async def sync_thumbnails_on_startup():
-        logger.info("同步缩略图目录状态")
-        image_storage_service.sync_all_thumbnails()
-    
-    logger.info("多租户微服务配置完成")
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(content=get_metrics_registry().render(), media_type=CONTENT_TYPE)
+
+    @app.get("/health/live", include_in_schema=False)
+    async def liveness():
+        return {"status": "ok"}
+
+    @app.get("/health/ready", include_in_schema=False)
+    async def readiness():
+        status = get_storage_bootstrap().status()
+        return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
+    logger.info("多租户微服务配置完成: %.1fms", (time.perf_counter() - started) * 1000)
     return app
 
 app = create_app()
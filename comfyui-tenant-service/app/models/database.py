@@ -1,116 +1,164 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+import asyncio
+from typing import Optional
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text, Index
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.sql import func
 from datetime import datetime
 from ..services.config import get_settings
-from ..services.database_init import init_database
+from ..services.database_init import create_async_database_engine, create_schema, init_database
 from ..services.logger import get_main_logger
 
-# Initialize database
-settings = get_settings()
-logger = get_main_logger()
+# 表结构与存储类型无关（JSON 存储时不建表），数据库仓库按这些模型读写
+Base = declarative_base()
+
+class Tenant(Base):
+    __tablename__ = "tenants"
+
+    id = Column(Integer, primary_key=True, index=True)
+    name = Column(String(100), unique=True, index=True)
+    api_key = Column(String(255), unique=True, index=True)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    settings = Column(Text)  # JSON string for tenant-specific settings
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True, index=True)
+    username = Column(String(50), unique=True, index=True)
+    email = Column(String(100), unique=True, index=True, nullable=True)
+    hashed_password = Column(String(255))
+    tenant_id = Column(Integer, index=True)
+    is_active = Column(Boolean, default=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_login = Column(DateTime)
+
+class APIUsage(Base):
+    __tablename__ = "api_usage"
 
-# Initialize database based on configuration
-if not init_database():
-    logger.warning("Database initialization failed, using JSON storage")
-
-# Database configuration based on storage type
-if settings.is_json_storage():
-    # Use JSON storage, no SQLAlchemy needed
-    engine = None
-    SessionLocal = None
-    Base = None
-    logger.info(f"使用 JSON 存储: {settings.json_storage_path}")
-else:
-    # Use SQLAlchemy for database storage
-    database_url = settings.get_database_url()
-    engine = create_engine(
-        database_url, 
-        connect_args={"check_same_thread": False} if "sqlite" in database_url else {}
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_id = Column(Integer, index=True)
+    user_id = Column(Integer, index=True)
+    endpoint = Column(String(100))
+    request_count = Column(Integer, default=1)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # 按租户查询时间范围内的用量
+        Index("ix_api_usage_tenant_created", "tenant_id", "created_at"),
+    )
+
+class TenantTaskRecord(Base):
+    __tablename__ = "tenant_task_records"
+
+    id = Column(Integer, primary_key=True, index=True)
+    tenant_task_id = Column(String(100), unique=True, index=True, nullable=False)
+    user_id = Column(String(100), nullable=False, index=True)
+    runninghub_task_id = Column(String(100), nullable=False, index=True)
+    task_type = Column(String(50), nullable=True, index=True)  # 任务类型：如 "targeted_redesign", "image_edit" 等
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    completed_at = Column(DateTime(timezone=True), nullable=True)
+    status = Column(String(50), nullable=False, default="PENDING")
+    result_data = Column(Text, nullable=True)
+    storage_paths = Column(Text, nullable=True)
+    error_message = Column(Text, nullable=True)
+
+    __table_args__ = (
+        # 任务历史：按用户倒序分页，可选按任务类型筛选
+        Index("ix_task_records_user_created", "user_id", created_at.desc()),
+        Index("ix_task_records_user_type_created", "user_id", "task_type", "created_at"),
+        # 完成处理器扫描 PENDING 记录
+        Index("ix_task_records_status_created", "status", "created_at"),
     )
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    Base = declarative_base()
-    
-    storage_info = settings.get_storage_info()
-    logger.info(f"使用 {storage_info['type']} 数据库存储")
-
-# Define models only if using SQLAlchemy
-if Base is not None:
-    class Tenant(Base):
-        __tablename__ = "tenants"
-        
-        id = Column(Integer, primary_key=True, index=True)
-        name = Column(String(100), unique=True, index=True)
-        api_key = Column(String(255), unique=True, index=True)
-        is_active = Column(Boolean, default=True)
-        created_at = Column(DateTime, default=datetime.utcnow)
-        updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-        settings = Column(Text)  # JSON string for tenant-specific settings
-
-    class User(Base):
-        __tablename__ = "users"
-        
-        id = Column(Integer, primary_key=True, index=True)
-        username = Column(String(50), unique=True, index=True)
-        email = Column(String(100), unique=True, index=True, nullable=True)
-        hashed_password = Column(String(255))
-        tenant_id = Column(Integer, index=True)
-        is_active = Column(Boolean, default=True)
-        created_at = Column(DateTime, default=datetime.utcnow)
-        last_login = Column(DateTime)
-
-    class APIUsage(Base):
-        __tablename__ = "api_usage"
-        
-        id = Column(Integer, primary_key=True, index=True)
-        tenant_id = Column(Integer, index=True)
-        user_id = Column(Integer, index=True)
-        endpoint = Column(String(100))
-        request_count = Column(Integer, default=1)
-        created_at = Column(DateTime, default=datetime.utcnow)
-    
-    class TenantTaskRecord(Base):
-        __tablename__ = "tenant_task_records"
-        
-        id = Column(Integer, primary_key=True, index=True)
-        tenant_task_id = Column(String(100), unique=True, index=True, nullable=False)
-        user_id = Column(String(100), nullable=False, index=True)
-        runninghub_task_id = Column(String(100), nullable=False, index=True)
-        task_type = Column(String(50), nullable=True, index=True)  # 任务类型：如 "targeted_redesign", "image_edit" 等
-        created_at = Column(DateTime(timezone=True), server_default=func.now())
-        completed_at = Column(DateTime(timezone=True), nullable=True)
-        status = Column(String(50), nullable=False, default="PENDING")
-        result_data = Column(Text, nullable=True)
-        storage_paths = Column(Text, nullable=True)
-        error_message = Column(Text, nullable=True)
-    
-
-    # Create tables
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "tenant_task_id": self.tenant_task_id,
+            "user_id": self.user_id,
+            "runninghub_task_id": self.runninghub_task_id,
+            "task_type": self.task_type,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+            "status": self.status,
+            "result_data": self.result_data,
+            "storage_paths": self.storage_paths,
+            "error_message": self.error_message,
+        }
+
+
+# 导入本模块不连接数据库：存储在第一次使用时初始化（服务启动时由 services/lifecycle.py 在后台提前触发）
+logger = get_main_logger()
+
+async_engine = None
+AsyncSessionLocal = None
+_storage_ready = False
+_storage_lock: Optional[asyncio.Lock] = None
+
+
+def storage_ready() -> bool:
+    return _storage_ready
+
+
+async def init_storage():
+    """
+    幂等的存储初始化，只有第一次调用真正执行，并发调用等待同一次初始化：
+    JSON 存储创建目录与文件；数据库存储创建数据库（MySQL）、建表补索引并创建异步引擎。
+    失败时抛出异常，下一次调用重新尝试
+    """
+    global async_engine, AsyncSessionLocal, _storage_ready, _storage_lock
+    if _storage_ready:
+        return
+    if _storage_lock is None:
+        _storage_lock = asyncio.Lock()
+    async with _storage_lock:
+        if _storage_ready:
+            return
+        from ..services.lifecycle import startup_phase
+
+        settings = get_settings()
+        if settings.is_json_storage():
+            with startup_phase("json_storage"):
+                await asyncio.to_thread(init_database)
+            logger.info("使用 JSON 存储: %s", settings.json_storage_path)
+        else:
+            if settings.storage_type == "mysql":
+                with startup_phase("create_database"):
+                    if not await asyncio.to_thread(init_database):
+                        raise RuntimeError("MySQL 数据库创建失败")
+            # 请求处理与后台任务走异步引擎（见 services/repository.py）
+            engine = create_async_database_engine(settings)
+            try:
+                with startup_phase("schema"):
+                    await create_schema(engine, Base.metadata)
+            except Exception:
+                await engine.dispose()
+                raise
+            async_engine = engine
+            AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+            logger.info("使用 %s 数据库存储", settings.get_storage_info()["type"])
+        _storage_ready = True
+
+
+async def close_storage():
+    """关闭异步引擎（aiosqlite 每个连接占用一个工作线程，不关闭进程无法退出）；之后再次使用会重新初始化"""
+    global async_engine, AsyncSessionLocal, _storage_ready, _storage_lock
+    engine = async_engine
+    async_engine = AsyncSessionLocal = None
+    _storage_ready = False
+    _storage_lock = None
     if engine is not None:
-        Base.metadata.create_all(bind=engine)
-else:
-    # For JSON storage, create dummy classes to avoid import errors
-    class Tenant:
-        pass
-    
-    class User:
-        pass
-    
-    class APIUsage:
-        pass
-    
-    class TenantTaskRecord:
-        pass
-
-def get_db():
-    if SessionLocal is not None:
-        db = SessionLocal()
-        try:
-            yield db
-        finally:
-            db.close()
-    else:
-        # Return JSON storage for JSON mode
-        from ..services.json_storage import JSONStorage
-        yield JSONStorage()
+        await engine.dispose()
+
+def collect_pool_metrics():
+    """/metrics：请求处理所用（异步）引擎的连接池状态（JSON 存储时没有）"""
+    if async_engine is None:
+        return
+    samples = []
+    for state, attr in (("size", "size"), ("checked_in", "checkedin"), ("checked_out", "checkedout"), ("overflow", "overflow")):
+        method = getattr(async_engine.sync_engine.pool, attr, None)
+        if callable(method):
+            samples.append(({"state": state}, method()))
+    yield "tenant_db_pool_connections", "gauge", "数据库连接池连接数", samples
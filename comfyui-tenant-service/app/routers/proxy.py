@@ -1,45 +1,70 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, Response
 import httpx
-from sqlalchemy.orm import Session
 from pathlib import Path
 from datetime import datetime
 import json
+import time
+import hashlib
+import uuid
+import asyncio
+import re
 from io import BytesIO
+from typing import Any, Dict, Optional
 try:
     from PIL import Image
 except ImportError:  # pragma: no cover - optional dependency
     Image = None
-from ..models.database import get_db, Tenant
 from ..routers.auth import get_current_user
+from ..services.repository import get_repository
 from ..services.logger import get_proxy_logger
+from ..services.log_policy import loggable, log_sampled
 from ..services.config import get_settings
+from ..services.memo_cache import AsyncMemoCache
+from ..services.metrics import get_metrics_registry
+from ..services.tracing import KIND_CLIENT, SpanExporter, get_span_exporter, inject_headers, span
+from ..services.idempotency import (
+    IDEMPOTENCY_HEADER,
+    MAX_KEY_LENGTH,
+    REPLAYED_HEADER,
+    IdempotencyError,
+    StoredResponse,
+    get_idempotency_store,
+    request_fingerprint,
+)
+from ..services.task_finalizer import TICKET_PREFIX, get_task_finalizer
 
 router = APIRouter()
 settings = get_settings()
 
+upstream_seconds = get_metrics_registry().histogram(
+    "tenant_upstream_request_duration_seconds", "代理到 RunningHub 服务的请求耗时", ("endpoint", "status")
+)
+_ID_SEGMENT = re.compile(r"^(tasks|pipelines)/[^/:]+")
+
+def _endpoint_label(endpoint: str) -> str:
+    """指标标签：把任务/流水线 ID 换成占位符"""
+    return _ID_SEGMENT.sub(lambda m: f"{m.group(1)}/{{id}}", endpoint)
+
 async def proxy_to_runninghub(
     request: Request,
     endpoint: str,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    repo = Depends(get_repository),
+    timeout: float = 30.0,
 ):
     logger = get_proxy_logger()
-    # 获取用户名，支持两种存储模式
-    if settings.is_database_storage():
-        username = current_user.username
-        tenant_id = current_user.tenant_id
-    else:
-        username = current_user["username"]
-        tenant_id = current_user["tenant_id"]
+    # 获取用户名
+    username = current_user["username"]
+    tenant_id = current_user["tenant_id"]
     
-    logger.info(f"代理请求: {endpoint}, 用户: {username}")
+    # 任务状态/输出查询是前端轮询的高频请求，按 status_poll 采样记录
+    verbose = not endpoint.startswith("tasks/") or log_sampled("status_poll")
+    if verbose:
+        logger.info("代理请求: %s, 用户: %s", endpoint, username)
     
     # Get tenant info
-    if settings.is_json_storage():
-        tenant = db.get_tenant_by_id(tenant_id)
-    else:
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    tenant = await repo.get_tenant_by_id(tenant_id)
     
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
@@ -51,172 +76,207 @@ async def proxy_to_runninghub(
     body = await request.body()
     content_type = request.headers.get("content-type", "application/json")
     
-    # Prepare headers
+    # Prepare headers（X-Tenant-ID 供 RunningHub 服务做跨租户公平排队）
     headers = {
-        "Content-Type": content_type
+        "Content-Type": content_type,
+        "X-Tenant-ID": str(tenant_id),
     }
+    # 幂等键按用户隔离后透传：代理超时后的重试会在 RunningHub 服务侧接上仍在执行的原请求
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    if idempotency_key:
+        headers[IDEMPOTENCY_HEADER] = hashlib.sha256(f"{username}:{idempotency_key}".encode("utf-8")).hexdigest()
     
     try:
-        logger.info(f"准备请求后端服务: {backend_url}")
-        logger.info(f"请求方法: {request.method}")
-        logger.info(f"内容类型: {content_type}")
+        logger.debug("准备请求后端服务: %s %s (%s)", request.method, backend_url, content_type)
         
         # 测试连接
-        try:
-            async with httpx.AsyncClient(timeout=5.0) as test_client:
-                # 测试基本连接
-                test_response = await test_client.get(f"{settings.runninghub_service_url}/docs")
-                logger.info(f"连接测试成功: {test_response.status_code}")
+        with span("connection_test"):
+            try:
+                async with httpx.AsyncClient(timeout=5.0) as test_client:
+                    # 测试基本连接
+                    test_response = await test_client.get(f"{settings.runninghub_service_url}/docs")
+                    logger.debug("连接测试成功: %s", test_response.status_code)
                 
-                # 测试健康检查端点
-                try:
-                    health_response = await test_client.get(f"{settings.runninghub_service_url}/health")
-                    logger.info(f"健康检查: {health_response.status_code}")
-                except Exception as health_e:
-                    logger.warning(f"健康检查失败: {str(health_e)}")
+                    # 测试健康检查端点
+                    try:
+                        health_response = await test_client.get(f"{settings.runninghub_service_url}/health")
+                        logger.debug("健康检查: %s", health_response.status_code)
+                    except Exception as health_e:
+                        logger.warning("健康检查失败: %s", health_e)
                     
-        except httpx.ConnectError as connect_e:
-            logger.error(f"无法连接到RunningHub服务器: {str(connect_e)}")
-            logger.error(f"请检查RunningHub服务器是否在 {settings.runninghub_service_url} 运行")
-        except httpx.TimeoutException as timeout_e:
-            logger.error(f"连接RunningHub服务器超时: {str(timeout_e)}")
-        except Exception as test_e:
-            logger.error(f"连接测试失败: {str(test_e)}")
-            logger.error(f"错误类型: {type(test_e).__name__}")
+            except httpx.ConnectError as connect_e:
+                logger.error("无法连接到RunningHub服务器: %s", connect_e)
+                logger.error("请检查RunningHub服务器是否在 %s 运行", settings.runninghub_service_url)
+            except httpx.TimeoutException as timeout_e:
+                logger.error("连接RunningHub服务器超时: %s", timeout_e)
+            except Exception as test_e:
+                logger.error("连接测试失败: %s (%s)", test_e, type(test_e).__name__)
         
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        async with httpx.AsyncClient(timeout=timeout) as client:
             # For file uploads, we need to handle multipart/form-data differently
             if "multipart/form-data" in content_type:
-                logger.info("处理文件上传请求")
+                logger.debug("处理文件上传请求")
                 # Parse the multipart data and forward it
-                form_data = await request.form()
+                with span("read_form"):
+                    form_data = await request.form()
                 files = {}
                 data = {}
                 
-                # 准备 httpx 的文件上传格式
-                httpx_files = {}
+                # 准备 httpx 的文件上传格式（列表形式，保留同名的多个文件/字段）
+                httpx_files = []
                 httpx_data = {}
                 
-                for key, value in form_data.items():
+                for key, value in form_data.multi_items():
                     if hasattr(value, 'filename'):  # It's a file
                         file_content = await value.read()
                         # httpx 文件格式: (filename, content, content_type)
-                        httpx_files[key] = (value.filename, file_content, value.content_type)
-                        logger.info(f"文件: {key} = {value.filename} ({len(file_content)} bytes)")
+                        httpx_files.append((key, (value.filename, file_content, value.content_type)))
+                        logger.debug("文件: %s = %s (%d bytes)", key, value.filename, len(file_content))
+                    elif key in httpx_data:
+                        existing = httpx_data[key]
+                        httpx_data[key] = (existing if isinstance(existing, list) else [existing]) + [value]
                     else:
                         httpx_data[key] = value
-                        logger.info(f"数据: {key} = {value}")
                 
-                logger.info(f"发送文件上传请求到: {backend_url}")
-                logger.info(f"httpx_files: {list(httpx_files.keys())}")
-                logger.info(f"httpx_data: {httpx_data}")
+                if verbose:
+                    logger.info(
+                        "发送文件上传请求到: %s, files=%s, data=%s",
+                        backend_url, [key for key, _ in httpx_files], loggable(httpx_data),
+                    )
                 
-                response = await client.post(
-                    backend_url,
-                    files=httpx_files,
-                    data=httpx_data,
-                    timeout=30.0
-                )
+                with span("runninghub_service", kind=KIND_CLIENT, endpoint=_endpoint_label(endpoint)):
+                    response = await client.post(
+                        backend_url,
+                        files=httpx_files,
+                        data=httpx_data,
+                        headers=inject_headers({k: v for k, v in headers.items() if k != "Content-Type"}),
+                        timeout=timeout
+                    )
             else:
-                logger.info("处理JSON请求")
+                logger.debug("处理JSON请求: %s", loggable(body))
                 # For JSON requests
-                response = await client.request(
-                    method=request.method,
-                    url=backend_url,
-                    headers=headers,
-                    content=body,
-                    timeout=30.0
-                )
+                with span("runninghub_service", kind=KIND_CLIENT, endpoint=_endpoint_label(endpoint)):
+                    response = await client.request(
+                        method=request.method,
+                        url=backend_url,
+                        headers=inject_headers(dict(headers)),
+                        content=body,
+                        timeout=timeout
+                    )
             
-            logger.info(f"后端响应: {response.status_code}")
-            logger.info(f"后端响应头: {dict(response.headers)}")
+            upstream_seconds.observe(
+                response.elapsed.total_seconds(), endpoint=_endpoint_label(endpoint), status=str(response.status_code)
+            )
+            if verbose:
+                logger.info("后端响应: %s %s", endpoint, response.status_code)
             
             # 检查响应状态码
             if response.status_code >= 400:
-                logger.error(f"后端服务返回错误状态码: {response.status_code}")
+                logger.error("后端服务返回错误状态码: %s", response.status_code)
                 try:
-                    error_text = response.text
-                    logger.error(f"后端错误响应内容: {error_text}")
+                    logger.error("后端错误响应内容: %s", loggable(response.text))
                 except Exception as e:
-                    logger.error(f"无法读取错误响应内容: {str(e)}")
+                    logger.error("无法读取错误响应内容: %s", e)
             
             # Return response
             if response.headers.get("content-type", "").startswith("application/json"):
                 try:
                     response_data = response.json()
-                    logger.info(f"后端响应数据: {response_data}")
+                    logger.debug("后端响应数据: %s", loggable(response_data))
+                    # 任务队列已满时透传 Retry-After
+                    retry_after = response.headers.get("retry-after")
                     return JSONResponse(
                         content=response_data,
-                        status_code=response.status_code
+                        status_code=response.status_code,
+                        headers={"Retry-After": retry_after} if retry_after else None,
                     )
                 except Exception as e:
-                    logger.error(f"解析JSON响应失败: {str(e)}")
+                    logger.error("解析JSON响应失败: %s", e)
                     return JSONResponse(
                         content={"error": "Failed to parse JSON response", "raw_response": response.text},
                         status_code=response.status_code
                     )
             else:
                 response_text = response.text
-                logger.info(f"后端响应文本: {response_text}")
+                logger.debug("后端响应文本: %s", loggable(response_text))
                 return JSONResponse(
                     content={"data": response_text},
                     status_code=response.status_code
                 )
             
     except httpx.TimeoutException as e:
-        logger.error(f"请求超时: {str(e)}")
-        logger.error(f"超时详情: 请求URL={backend_url}, 超时时间=30秒")
+        logger.error("请求超时: %s, 请求URL=%s, 超时时间=%s秒", e, backend_url, timeout)
         raise HTTPException(status_code=504, detail=f"Backend service timeout: {str(e)}")
     except httpx.ConnectError as e:
-        logger.error(f"连接错误: {str(e)}")
-        logger.error(f"连接详情: 目标URL={backend_url}, 错误类型={type(e).__name__}")
-        logger.error(f"可能原因: RunningHub服务器未启动或网络不可达")
+        logger.error("连接错误: %s, 目标URL=%s, 错误类型=%s", e, backend_url, type(e).__name__)
+        logger.error("可能原因: RunningHub服务器未启动或网络不可达")
         raise HTTPException(status_code=503, detail=f"Cannot connect to backend service: {str(e)}")
     except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP状态错误: {e.response.status_code}")
-        logger.error(f"响应头: {dict(e.response.headers)}")
+        logger.error("HTTP状态错误: %s", e.response.status_code)
         try:
-            error_content = e.response.text
-            logger.error(f"错误响应内容: {error_content}")
+            logger.error("错误响应内容: %s", loggable(e.response.text))
         except Exception as content_e:
-            logger.error(f"无法读取错误响应内容: {str(content_e)}")
+            logger.error("无法读取错误响应内容: %s", content_e)
         raise HTTPException(status_code=e.response.status_code, detail=f"Backend service returned {e.response.status_code}")
     except httpx.RequestError as e:
-        logger.error(f"请求错误: {str(e)}")
-        logger.error(f"请求详情: URL={backend_url}, 方法={request.method}")
+        logger.error("请求错误: %s, URL=%s, 方法=%s", e, backend_url, request.method)
         raise HTTPException(status_code=502, detail=f"Backend service error: {str(e)}")
     except Exception as e:
-        logger.error(f"未知错误: {str(e)}")
-        logger.error(f"错误类型: {type(e).__name__}")
-        logger.error(f"错误详情: {str(e)}")
+        logger.error("未知错误: %s (%s)", e, type(e).__name__)
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
+async def with_idempotency(request: Request, current_user, handler):
+    """
+    按 Idempotency-Key 执行创建任务类请求；未携带该请求头时直接执行
+    键按 租户 + 用户 + 接口 隔离，handler 必须返回 JSONResponse
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return await handler()
+    if len(key) > MAX_KEY_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key 长度不能超过 {MAX_KEY_LENGTH}")
+
+    scope = f"{current_user['tenant_id']}:{current_user['username']}"
+
+    async def run() -> StoredResponse:
+        result = await handler()
+        retry_after = result.headers.get("retry-after")
+        return StoredResponse(
+            status_code=result.status_code,
+            body=json.loads(result.body.decode("utf-8")),
+            headers={"Retry-After": retry_after} if retry_after else {},
+        )
+
+    try:
+        stored, replayed = await get_idempotency_store().run(
+            f"{scope}:{request.url.path}:{key}", await request_fingerprint(request), run
+        )
+    except IdempotencyError as e:
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.detail,
+            headers={"Retry-After": str(e.retry_after)} if e.retry_after else None,
+        )
+    headers = dict(stored.headers)
+    if replayed:
+        headers[REPLAYED_HEADER] = "true"
+    return JSONResponse(content=stored.body, status_code=stored.status_code, headers=headers or None)
+
 @router.post("/llm/chat")
-async def proxy_llm_chat(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def proxy_llm_chat(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
     logger = get_proxy_logger()
 
-    if settings.is_database_storage():
-        username = current_user.username
-        tenant_id = current_user.tenant_id
-    else:
-        username = current_user["username"]
-        tenant_id = current_user["tenant_id"]
+    username = current_user["username"]
+    tenant_id = current_user["tenant_id"]
 
-    logger.info(f"LLM对话代理请求, 用户: {username}")
+    logger.info("LLM对话代理请求, 用户: %s", username)
 
-    if settings.is_json_storage():
-        tenant = db.get_tenant_by_id(tenant_id)
-    else:
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    tenant = await repo.get_tenant_by_id(tenant_id)
 
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    raw_settings = None
-    if settings.is_database_storage():
-        raw_settings = getattr(tenant, "settings", None)
-    else:
-        raw_settings = tenant.get("settings")
+    raw_settings = tenant.get("settings")
 
     tenant_settings = {}
     if raw_settings:
@@ -260,33 +320,206 @@ async def proxy_llm_chat(request: Request, current_user = Depends(get_current_us
     try:
         payload = await request.json()
     except Exception as exc:
-        logger.error(f"解析请求JSON失败: {exc}")
+        logger.error("解析请求JSON失败: %s", exc)
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
+PALETTE_MODES = {"local", "llm", "hybrid"}
+PALETTE_UPGRADE_TTL_SECONDS = 600
+
+# hybrid 模式下后台 LLM 升级结果：upgrade_id -> {"username", "status", "result", "created_at"}
+_palette_upgrades: dict = {}
+# 持有后台任务引用，避免任务在完成前被垃圾回收
+_palette_upgrade_tasks: set = set()
+
+
+def _compress_image_for_llm(file_bytes: bytes, logger):
+    """
+    如果图片过大（>1MB），尝试压缩到 512KB 以下再发送给 LLM
+    返回 (图片字节, 压缩后的MIME或None)
+    """
+    original_size = len(file_bytes)
+    if original_size <= 1024 * 1024:
+        return file_bytes, None
+    if Image is None:
+        logger.warning("palette_from_image: Pillow not installed, cannot compress large image (size=%d bytes)", original_size)
+        return file_bytes, None
+
+    try:
+        image = Image.open(BytesIO(file_bytes))
+        image = image.convert("RGB")
+
+        target_size = 512 * 1024
+        quality = 95
+        buffer = BytesIO()
+
+        def save_image(img, q):
+            buffer.seek(0)
+            buffer.truncate(0)
+            img.save(buffer, format="JPEG", quality=q, optimize=True)
+
+        working_image = image
+        save_image(working_image, quality)
+
+        while buffer.tell() > target_size and quality > 10:
+            quality -= 5
+            save_image(working_image, quality)
+
+        if buffer.tell() > target_size:
+            # 继续压缩：逐步缩小尺寸
+            min_side = 128
+            while buffer.tell() > target_size and (working_image.width > min_side or working_image.height > min_side):
+                new_width = max(min_side, int(working_image.width * 0.9))
+                new_height = max(min_side, int(working_image.height * 0.9))
+                if new_width == working_image.width and new_height == working_image.height:
+                    break
+                resample = Image.LANCZOS if hasattr(Image, "LANCZOS") else Image.BICUBIC
+                working_image = working_image.resize((new_width, new_height), resample)
+                save_image(working_image, max(quality, 40))
+
+        compressed_bytes = buffer.getvalue()
+        if len(compressed_bytes) < original_size and len(compressed_bytes) <= target_size:
+            logger.info(
+                "palette_from_image: compressed image from %d bytes to %d bytes (quality=%d)",
+                original_size,
+                len(compressed_bytes),
+                quality,
+            )
+            return compressed_bytes, "image/jpeg"
+        logger.info("palette_from_image: compression did not reach target size (original=%d, result=%d)", original_size, len(compressed_bytes))
+    except Exception as comp_err:
+        logger.warning("palette_from_image: image compression failed: %s", comp_err)
+    return file_bytes, None
+
+
+async def _request_llm_palette(
+    file_bytes: bytes,
+    filename: str,
+    prompt: str,
+    model: str,
+    llm_service_url: str,
+    llm_api_key: str,
+    llm_vision_path: str,
+    logger,
+) -> dict:
+    """调用租户配置的LLM视觉端点，返回解析后的配色JSON"""
+    import base64
+    import mimetypes
+
+    # 压缩属于CPU密集操作，放到线程池中避免阻塞事件循环
+    file_bytes, compressed_mime = await asyncio.to_thread(_compress_image_for_llm, file_bytes, logger)
+
+    # 参考 llm-request-example.html：使用 data URL 的 image_url 方式
+    mime, _ = mimetypes.guess_type(filename or "")
+    if compressed_mime:
+        mime = compressed_mime
+    else:
+        mime = mime or "image/png"
+    b64 = base64.b64encode(file_bytes).decode("ascii")
+    data_url = f"data:{mime};base64,{b64}"
+
+    payload = {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "你是服装配色顾问，只输出JSON，无多余文字。"},
+            {"role": "user", "content": [
+                {"type": "text", "text": str(prompt)},
+                {"type": "image_url", "image_url": {"url": data_url}}
+            ]}
+        ],
+        "response_format": {"type": "json_object"},
+        "stream": False
+    }
+
+    target_url = f"{llm_service_url.rstrip('/')}{llm_vision_path}"
+
+    async with httpx.AsyncClient(timeout=60.0) as client:
+        resp = await client.post(
+            target_url,
+            headers={
+                "Authorization": f"Bearer {llm_api_key}",
+                "Content-Type": "application/json"
+            },
+            json=payload
+        )
+        text = resp.text
+        # 兼容不同LLM响应结构，尽力提取JSON
+        data = None
+        try:
+            data = resp.json()
+        except Exception:
+            pass
+        # 常见OpenAI样式
+        if isinstance(data, dict):
+            content = None
+            try:
+                content = data.get("choices", [{}])[0].get("message", {}).get("content")
+            except Exception:
+                content = None
+            if isinstance(content, str):
+                try:
+                    return json.loads(content)
+                except Exception:
+                    return {"groups": []}
+        # 回退：直接尝试将文本解析为JSON
+        try:
+            return json.loads(text)
+        except Exception:
+            return {"groups": []}
+
+
+def _prune_palette_upgrades():
+    """清理过期的 hybrid 升级结果"""
+    now = time.monotonic()
+    expired = [
+        upgrade_id
+        for upgrade_id, entry in _palette_upgrades.items()
+        if now - entry["created_at"] > PALETTE_UPGRADE_TTL_SECONDS
+    ]
+    for upgrade_id in expired:
+        _palette_upgrades.pop(upgrade_id, None)
+
+
+async def _run_palette_upgrade(upgrade_id: str, llm_kwargs: dict, logger):
+    """hybrid 模式后台任务：请求LLM配色并写入升级结果"""
+    entry = _palette_upgrades.get(upgrade_id)
+    if entry is None:
+        return
+    try:
+        entry["result"] = await _request_llm_palette(logger=logger, **llm_kwargs)
+        entry["status"] = "ready"
+        logger.info("palette_from_image: hybrid 升级完成 %s", upgrade_id)
+    except Exception as e:
+        entry["status"] = "failed"
+        entry["error"] = str(e)
+        logger.error("palette_from_image: hybrid 升级失败 %s: %s", upgrade_id, e)
+
+
 @router.post("/llm/palette_from_image")
-async def palette_from_image(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def palette_from_image(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
     """
-    接收前端上传的图片与提示词，转发至租户配置的LLM视觉端点，要求返回RGB配色组。
+    接收前端上传的图片与提示词，返回RGB配色组。
     返回格式：{ "groups": [ { "colors": [ {r,g,b}, ... ] }, ... ] }
+
+    mode（查询参数或表单字段）：
+    - llm（默认）：转发至租户配置的LLM视觉端点
+    - local：使用本地 NumPy 配色引擎，毫秒级返回，不依赖LLM
+    - hybrid：立即返回本地配色，同时在后台请求LLM；
+      结果通过 GET /llm/palette_from_image/upgrades/{upgradeId} 获取
+    可选表单字段 mask：服装蒙版图片，用于本地引擎的像素加权
     """
+    from ..services.palette_engine import palette_engine
+
     logger = get_proxy_logger()
 
     # 读取租户LLM配置
-    if settings.is_database_storage():
-        username = current_user.username
-        tenant_id = current_user.tenant_id
-    else:
-        username = current_user["username"]
-        tenant_id = current_user["tenant_id"]
+    username = current_user["username"]
+    tenant_id = current_user["tenant_id"]
 
-    if settings.is_json_storage():
-        tenant = db.get_tenant_by_id(tenant_id)
-    else:
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    tenant = await repo.get_tenant_by_id(tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    raw_settings = getattr(tenant, "settings", None) if settings.is_database_storage() else tenant.get("settings")
+    raw_settings = tenant.get("settings")
     tenant_settings = {}
     if raw_settings:
         if isinstance(raw_settings, dict):
@@ -312,134 +545,82 @@ async def palette_from_image(request: Request, current_user = Depends(get_curren
     )
     llm_vision_path = llm_nested.get("vision_path") or "/chat/completions"
 
-    if not llm_service_url or not llm_api_key:
-        raise HTTPException(status_code=500, detail="LLM service is not configured")
-
-    # 读取表单：文件+提示词
+    # 读取表单：文件+提示词（+可选蒙版）
     form = await request.form()
+    mode = str(request.query_params.get("mode") or form.get("mode") or "llm").lower()
+    if mode not in PALETTE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of: {', '.join(sorted(PALETTE_MODES))}")
+
     file = form.get("file")
     prompt = form.get("prompt") or "请返回RGB配色组的JSON。"
     if not hasattr(file, 'filename'):
         raise HTTPException(status_code=400, detail="file is required")
 
     file_bytes = await file.read()
-    original_size = len(file_bytes)
-    compressed_mime = None
+    mask = form.get("mask")
+    mask_bytes = await mask.read() if hasattr(mask, "filename") else None
 
-    # 如果图片过大（>1MB），尝试压缩到 512KB 以下再发送给 LLM
-    if original_size > 1024 * 1024:
-        if Image is None:
-            logger.warning("palette_from_image: Pillow not installed, cannot compress large image (size=%d bytes)", original_size)
-        else:
-            try:
-                image = Image.open(BytesIO(file_bytes))
-                image = image.convert("RGB")
-
-                target_size = 512 * 1024
-                quality = 95
-                buffer = BytesIO()
-
-                def save_image(img, q):
-                    buffer.seek(0)
-                    buffer.truncate(0)
-                    img.save(buffer, format="JPEG", quality=q, optimize=True)
-
-                working_image = image
-                save_image(working_image, quality)
-
-                while buffer.tell() > target_size and quality > 10:
-                    quality -= 5
-                    save_image(working_image, quality)
-
-                if buffer.tell() > target_size:
-                    # 继续压缩：逐步缩小尺寸
-                    min_side = 128
-                    while buffer.tell() > target_size and (working_image.width > min_side or working_image.height > min_side):
-                        new_width = max(min_side, int(working_image.width * 0.9))
-                        new_height = max(min_side, int(working_image.height * 0.9))
-                        if new_width == working_image.width and new_height == working_image.height:
-                            break
-                        resample = Image.LANCZOS if hasattr(Image, "LANCZOS") else Image.BICUBIC
-                        working_image = working_image.resize((new_width, new_height), resample)
-                        save_image(working_image, max(quality, 40))
-
-                compressed_bytes = buffer.getvalue()
-                if len(compressed_bytes) < original_size and len(compressed_bytes) <= target_size:
-                    logger.info(
-                        "palette_from_image: compressed image from %d bytes to %d bytes (quality=%d)",
-                        original_size,
-                        len(compressed_bytes),
-                        quality,
-                    )
-                    file_bytes = compressed_bytes
-                    compressed_mime = "image/jpeg"
-                else:
-                    logger.info("palette_from_image: compression did not reach target size (original=%d, result=%d)", original_size, len(compressed_bytes))
-            except Exception as comp_err:
-                logger.warning(f"palette_from_image: image compression failed: {comp_err}")
+    if mode != "llm" and not palette_engine.is_available():
+        if mode == "local":
+            raise HTTPException(status_code=503, detail="Local palette engine is not available")
+        logger.warning("palette_from_image: 本地配色引擎不可用，hybrid 模式回退为 llm")
+        mode = "llm"
 
-    # 参考 llm-request-example.html：使用 data URL 的 image_url 方式
-    import base64
-    import mimetypes
-    mime, _ = mimetypes.guess_type(file.filename)
-    if compressed_mime:
-        mime = compressed_mime
-    else:
-        mime = mime or "image/png"
-    b64 = base64.b64encode(file_bytes).decode("ascii")
-    data_url = f"data:{mime};base64,{b64}"
+    if mode == "hybrid" and (not llm_service_url or not llm_api_key):
+        # 未配置LLM时 hybrid 退化为纯本地结果
+        logger.warning("palette_from_image: LLM服务未配置，hybrid 模式仅返回本地配色")
+        mode = "local"
 
-    payload = {
+    if mode == "local":
+        try:
+            result = await asyncio.to_thread(palette_engine.extract_palette, file_bytes, mask_bytes)
+        except Exception as e:
+            logger.error("palette_from_image 本地提取失败: %s", e)
+            raise HTTPException(status_code=400, detail="Local palette extraction failed")
+        return JSONResponse(content=result)
+
+    if not llm_service_url or not llm_api_key:
+        raise HTTPException(status_code=500, detail="LLM service is not configured")
+
+    llm_kwargs = {
+        "file_bytes": file_bytes,
+        "filename": file.filename,
+        "prompt": prompt,
         "model": (llm_nested.get("default_model") or llm_nested.get("model") or tenant_settings.get("llm_default_model") or settings.llm_default_model or "gpt-4.1"),
-        "messages": [
-            {"role": "system", "content": "你是服装配色顾问，只输出JSON，无多余文字。"},
-            {"role": "user", "content": [
-                {"type": "text", "text": str(prompt)},
-                {"type": "image_url", "image_url": {"url": data_url}}
-            ]}
-        ],
-        "response_format": {"type": "json_object"},
-        "stream": False
+        "llm_service_url": llm_service_url,
+        "llm_api_key": llm_api_key,
+        "llm_vision_path": llm_vision_path,
     }
 
-    target_url = f"{llm_service_url.rstrip('/')}{llm_vision_path}"
+    if mode == "hybrid":
+        try:
+            result = await asyncio.to_thread(palette_engine.extract_palette, file_bytes, mask_bytes)
+        except Exception as e:
+            logger.error("palette_from_image 本地提取失败: %s", e)
+            raise HTTPException(status_code=400, detail="Local palette extraction failed")
+
+        _prune_palette_upgrades()
+        upgrade_id = uuid.uuid4().hex
+        _palette_upgrades[upgrade_id] = {
+            "username": username,
+            "status": "pending",
+            "result": None,
+            "created_at": time.monotonic(),
+        }
+        task = asyncio.create_task(_run_palette_upgrade(upgrade_id, llm_kwargs, logger))
+        _palette_upgrade_tasks.add(task)
+        task.add_done_callback(_palette_upgrade_tasks.discard)
+        result["upgrade"] = {
+            "upgradeId": upgrade_id,
+            "status": "pending",
+            "url": f"/proxy/llm/palette_from_image/upgrades/{upgrade_id}",
+        }
+        return JSONResponse(content=result)
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                target_url,
-                headers={
-                    "Authorization": f"Bearer {llm_api_key}",
-                    "Content-Type": "application/json"
-                },
-                json=payload
-            )
-            text = resp.text
-            # 兼容不同LLM响应结构，尽力提取JSON
-            data = None
-            try:
-                data = resp.json()
-            except Exception:
-                pass
-            # 常见OpenAI样式
-            if isinstance(data, dict):
-                content = None
-                try:
-                    content = data.get("choices", [{}])[0].get("message", {}).get("content")
-                except Exception:
-                    content = None
-                if isinstance(content, str):
-                    try:
-                        return JSONResponse(content=json.loads(content))
-                    except Exception:
-                        return JSONResponse(content={"groups": []})
-            # 回退：直接尝试将文本解析为JSON
-            try:
-                return JSONResponse(content=json.loads(text))
-            except Exception:
-                return JSONResponse(content={"groups": []})
+        return JSONResponse(content=await _request_llm_palette(logger=logger, **llm_kwargs))
     except Exception as e:
-        logger.error(f"palette_from_image 调用失败: {e}")
+        logger.error("palette_from_image 调用失败: %s", e)
         raise HTTPException(status_code=500, detail="Palette generation failed")
 
     if not payload.get("model"):
@@ -450,26 +631,26 @@ async def palette_from_image(request: Request, current_user = Depends(get_curren
         "Content-Type": "application/json"
     }
 
-    logger.info(f"转发LLM请求到: {target_url}")
+    logger.info("转发LLM请求到: %s", target_url)
 
     try:
         async with httpx.AsyncClient(timeout=60.0) as client:
             response = await client.post(target_url, json=payload, headers=headers)
     except httpx.TimeoutException as exc:
-        logger.error(f"LLM服务请求超时: {exc}")
+        logger.error("LLM服务请求超时: %s", exc)
         raise HTTPException(status_code=504, detail="LLM service timeout")
     except httpx.HTTPError as exc:
-        logger.error(f"LLM服务请求错误: {exc}")
+        logger.error("LLM服务请求错误: %s", exc)
         raise HTTPException(status_code=502, detail="LLM service request failed")
 
-    logger.info(f"LLM响应状态码: {response.status_code}")
+    logger.info("LLM响应状态码: %s", response.status_code)
 
     if response.status_code >= 400:
         try:
             error_payload = response.json()
         except Exception:
             error_payload = {"detail": response.text}
-        logger.error(f"LLM服务返回错误: {error_payload}")
+        logger.error("LLM服务返回错误: %s", error_payload)
         return JSONResponse(content=error_payload, status_code=response.status_code)
 
     try:
@@ -484,31 +665,191 @@ async def palette_from_image(request: Request, current_user = Depends(get_curren
     return JSONResponse(content=data, status_code=response.status_code)
 
 
+@router.get("/llm/palette_from_image/upgrades/{upgrade_id}")
+async def get_palette_upgrade(upgrade_id: str, current_user = Depends(get_current_user)):
+    """
+    获取 hybrid 模式的 LLM 配色升级结果
+    返回：{ "upgradeId", "status": "pending"|"ready"|"failed", "result": {...}|null }
+    """
+    username = current_user["username"]
+
+    _prune_palette_upgrades()
+    entry = _palette_upgrades.get(upgrade_id)
+    if entry is None or entry["username"] != username:
+        raise HTTPException(status_code=404, detail="Palette upgrade not found")
+
+    return {
+        "upgradeId": upgrade_id,
+        "status": entry["status"],
+        "result": entry.get("result"),
+        "error": entry.get("error"),
+    }
+
+
+STRIPE_VARIATION_COLOR_STEP = 4
+
+stripe_variations_cache = AsyncMemoCache(
+    max_entries=settings.llm_cache_max_entries,
+    ttl_seconds=settings.llm_cache_ttl_seconds,
+)
+
+
+def _stripe_variations_signature(tenant_id, model: str, normalized_units: list, palette_groups, target_count) -> str:
+    """
+    条纹衍生请求的规范化签名：颜色量化、宽度归一化为相对值，
+    并包含 targetCount、模型与租户，保证语义相同的请求命中同一缓存
+    """
+    step = STRIPE_VARIATION_COLOR_STEP
+
+    def quantize(value) -> int:
+        try:
+            return int(round(float(value) / step)) * step
+        except Exception:
+            return 0
+
+    total_width = sum(unit["widthPx"] for unit in normalized_units) or 1.0
+    units = [
+        [quantize(unit["color"]["r"]), quantize(unit["color"]["g"]), quantize(unit["color"]["b"]), round(unit["widthPx"] / total_width, 3)]
+        for unit in normalized_units
+    ]
+
+    palette = []
+    if isinstance(palette_groups, list):
+        for group in palette_groups:
+            colors = group.get("colors") if isinstance(group, dict) else None
+            if not isinstance(colors, list):
+                continue
+            palette.append([
+                [quantize(color.get("r")), quantize(color.get("g")), quantize(color.get("b"))]
+                for color in colors
+                if isinstance(color, dict)
+            ])
+
+    canonical = json.dumps(
+        {
+            "tenant": tenant_id,
+            "model": model,
+            "targetCount": target_count,
+            "units": units,
+            "palette": palette,
+        },
+        separators=(",", ":"),
+        sort_keys=True,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+async def _request_stripe_variations(
+    normalized_units: list,
+    palette_groups,
+    target_count,
+    llm_default_model: str,
+    llm_service_url: str,
+    llm_api_key: str,
+    logger,
+) -> dict:
+    """构造条纹衍生提示词并请求LLM，返回解析后的JSON"""
+    units_json = json.dumps(normalized_units, ensure_ascii=False)
+    palette_json = json.dumps(palette_groups, ensure_ascii=False) if palette_groups else "[]"
+
+    prompt = (
+        "我们已经提取了一组条纹印花的最小循环单元，包含RGB颜色与相对宽度数据。"
+        "请作为资深纺织图案设计师，基于这些信息构思新的艺术化条纹方案。你可以增减色带数量、调整颜色或宽度，"
+        "但需要保持色彩协调、适合服装印花的风格，并确保每个方案的相对宽度可归一化。"
+        "\n\n原始条纹单元（widthPx 为相对像素宽度）：\n"
+        f"{units_json}\n"
+        "\n如果有帮助，可参考这些协调配色组（可选）：\n"
+        f"{palette_json}\n"
+        "\n请输出一个JSON对象，格式如下：\n"
+        '{ "variations": [ { "title": "方案名称", "styleNote": "风格说明", "stripeUnits": [ { "color": {"r":0-255,"g":0-255,"b":0-255}, "relativeWidth": 0.00 }, ... ] }, ... ], "guidance": "整体建议" }\n'
+        "要求：\n"
+        f"1. 给出 {target_count} 个左右的方案（如果灵感有限可少于此数，但至少2个）。\n"
+        "2. 每个方案的 stripeUnits 至少包含 3 条色带，relativeWidth 为 0-1 的小数，并保证总和≈1（允许两位小数误差）。\n"
+        "3. 可以引入新的颜色或调换顺序，但要与原始风格有联系。\n"
+        "4. 仅返回JSON，不要加入额外解释或Markdown。\n"
+    )
+
+    payload = {
+        "model": llm_default_model,
+        "messages": [
+            {"role": "system", "content": "你是资深纺织与印花设计师，只能输出JSON对象，不得添加多余文字。"},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.8,
+        "response_format": {"type": "json_object"},
+        "stream": False,
+    }
+
+    target_url = f"{llm_service_url.rstrip('/')}/chat/completions"
+
+    try:
+        async with httpx.AsyncClient(timeout=60.0) as client:
+            resp = await client.post(
+                target_url,
+                headers={
+                    "Authorization": f"Bearer {llm_api_key}",
+                    "Content-Type": "application/json",
+                },
+                json=payload,
+            )
+    except httpx.TimeoutException as exc:
+        logger.error("LLM条纹衍生请求超时: %s", exc)
+        raise HTTPException(status_code=504, detail="LLM service timeout")
+    except httpx.HTTPError as exc:
+        logger.error("LLM条纹衍生请求失败: %s", exc)
+        raise HTTPException(status_code=502, detail="LLM service request failed")
+
+    text = resp.text
+    data = None
+    try:
+        data = resp.json()
+    except Exception:
+        data = None
+
+    if resp.status_code >= 400:
+        logger.error("LLM条纹衍生服务错误: %s", text)
+        if isinstance(data, dict):
+            raise HTTPException(status_code=resp.status_code, detail=data)
+        raise HTTPException(status_code=resp.status_code, detail=text or "LLM service error")
+
+    if isinstance(data, dict):
+        content = None
+        try:
+            content = data.get("choices", [{}])[0].get("message", {}).get("content")
+        except Exception:
+            content = None
+        if isinstance(content, str):
+            try:
+                return json.loads(content)
+            except Exception as parse_err:
+                logger.warning("解析LLM条纹内容失败，返回原始 choices: %s", parse_err)
+                return {"variations": []}
+
+    try:
+        return json.loads(text)
+    except Exception:
+        logger.warning("LLM条纹衍生响应非JSON，返回空结果")
+        return {"variations": []}
+
+
 @router.post("/llm/stripe_variations")
-async def stripe_variations(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def stripe_variations(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
     """
     根据前端传来的条纹RGB与宽度信息，向租户配置的LLM请求风格衍生方案。
     预期返回：{ "variations": [ { "title": "", "styleNote": "", "stripeUnits": [ { "color": {...}, "relativeWidth": 0.0 } ] }, ... ], "guidance": "" }
     """
     logger = get_proxy_logger()
 
-    if settings.is_database_storage():
-        username = current_user.username
-        tenant_id = current_user.tenant_id
-    else:
-        username = current_user["username"]
-        tenant_id = current_user["tenant_id"]
+    username = current_user["username"]
+    tenant_id = current_user["tenant_id"]
 
-    logger.info(f"LLM条纹衍生请求, 用户: {username}")
+    logger.info("LLM条纹衍生请求, 用户: %s", username)
 
-    if settings.is_json_storage():
-        tenant = db.get_tenant_by_id(tenant_id)
-    else:
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
+    tenant = await repo.get_tenant_by_id(tenant_id)
     if not tenant:
         raise HTTPException(status_code=404, detail="Tenant not found")
 
-    raw_settings = getattr(tenant, "settings", None) if settings.is_database_storage() else tenant.get("settings")
+    raw_settings = tenant.get("settings")
     tenant_settings = {}
     if raw_settings:
         if isinstance(raw_settings, dict):
@@ -546,7 +887,7 @@ async def stripe_variations(request: Request, current_user = Depends(get_current
     try:
         body = await request.json()
     except Exception as exc:
-        logger.error(f"解析条纹衍生请求JSON失败: {exc}")
+        logger.error("解析条纹衍生请求JSON失败: %s", exc)
         raise HTTPException(status_code=400, detail="Invalid JSON payload")
 
     stripe_units = body.get("stripeUnits") or []
@@ -586,101 +927,137 @@ async def stripe_variations(request: Request, current_user = Depends(get_current
     if not normalized_units:
         raise HTTPException(status_code=400, detail="No valid stripe units provided")
 
-    units_json = json.dumps(normalized_units, ensure_ascii=False)
-    palette_json = json.dumps(palette_groups, ensure_ascii=False) if palette_groups else "[]"
+    force_refresh = bool(body.get("forceRefresh"))
+    signature = _stripe_variations_signature(tenant_id, llm_default_model, normalized_units, palette_groups, target_count)
+
+    async def request_variations():
+        return await _request_stripe_variations(
+            normalized_units,
+            palette_groups,
+            target_count,
+            llm_default_model,
+            llm_service_url,
+            llm_api_key,
+            logger,
+        )
 
-    prompt = (
-        "我们已经提取了一组条纹印花的最小循环单元，包含RGB颜色与相对宽度数据。"
-        "请作为资深纺织图案设计师，基于这些信息构思新的艺术化条纹方案。你可以增减色带数量、调整颜色或宽度，"
-        "但需要保持色彩协调、适合服装印花的风格，并确保每个方案的相对宽度可归一化。"
-        "\n\n原始条纹单元（widthPx 为相对像素宽度）：\n"
-        f"{units_json}\n"
-        "\n如果有帮助，可参考这些协调配色组（可选）：\n"
-        f"{palette_json}\n"
-        "\n请输出一个JSON对象，格式如下：\n"
-        '{ "variations": [ { "title": "方案名称", "styleNote": "风格说明", "stripeUnits": [ { "color": {"r":0-255,"g":0-255,"b":0-255}, "relativeWidth": 0.00 }, ... ] }, ... ], "guidance": "整体建议" }\n'
-        "要求：\n"
-        f"1. 给出 {target_count} 个左右的方案（如果灵感有限可少于此数，但至少2个）。\n"
-        "2. 每个方案的 stripeUnits 至少包含 3 条色带，relativeWidth 为 0-1 的小数，并保证总和≈1（允许两位小数误差）。\n"
-        "3. 可以引入新的颜色或调换顺序，但要与原始风格有联系。\n"
-        "4. 仅返回JSON，不要加入额外解释或Markdown。\n"
+    result, cache_state = await stripe_variations_cache.get_or_compute(
+        signature, request_variations, refresh=force_refresh
     )
+    if not (isinstance(result, dict) and result.get("variations")):
+        # 空结果不缓存，下次请求重新调用LLM
+        stripe_variations_cache.invalidate(signature)
+    logger.info("LLM条纹衍生缓存: %s, 签名: %s", cache_state, signature[:12])
+    return JSONResponse(content=result, headers={"X-Cache": cache_state})
+
+@router.post("/stripes/extract")
+async def extract_stripe_units(request: Request, current_user = Depends(get_current_user)):
+    """
+    服务端条纹循环检测：对图片做一维投影 + 自相关，返回最小循环的条纹单元
+    返回格式：{ "isStripePattern": bool, "stripePatternUnit": [ { "color": {...}, "widthPx": 0 } ], ... }
+    """
+    from ..services.stripe_engine import stripe_engine
 
-    payload = {
-        "model": llm_default_model,
-        "messages": [
-            {"role": "system", "content": "你是资深纺织与印花设计师，只能输出JSON对象，不得添加多余文字。"},
-            {"role": "user", "content": prompt},
-        ],
-        "temperature": 0.8,
-        "response_format": {"type": "json_object"},
-        "stream": False,
-    }
+    logger = get_proxy_logger()
+    if not stripe_engine.is_available():
+        raise HTTPException(status_code=503, detail="Stripe engine is not available")
 
-    target_url = f"{llm_service_url.rstrip('/')}/chat/completions"
+    form = await request.form()
+    file = form.get("file")
+    if not hasattr(file, "filename"):
+        raise HTTPException(status_code=400, detail="file is required")
+    file_bytes = await file.read()
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                target_url,
-                headers={
-                    "Authorization": f"Bearer {llm_api_key}",
-                    "Content-Type": "application/json",
-                },
-                json=payload,
-            )
-    except httpx.TimeoutException as exc:
-        logger.error(f"LLM条纹衍生请求超时: {exc}")
-        raise HTTPException(status_code=504, detail="LLM service timeout")
-    except httpx.HTTPError as exc:
-        logger.error(f"LLM条纹衍生请求失败: {exc}")
-        raise HTTPException(status_code=502, detail="LLM service request failed")
+        result = await asyncio.to_thread(stripe_engine.extract_stripe_units, file_bytes)
+    except Exception as e:
+        logger.error("条纹检测失败: %s", e)
+        raise HTTPException(status_code=400, detail="Stripe extraction failed")
+    return JSONResponse(content=result)
 
-    text = resp.text
-    data = None
-    try:
-        data = resp.json()
-    except Exception:
-        data = None
 
-    if resp.status_code >= 400:
-        logger.error(f"LLM条纹衍生服务错误: {text}")
-        if isinstance(data, dict):
-            raise HTTPException(status_code=resp.status_code, detail=data)
-        raise HTTPException(status_code=resp.status_code, detail=text or "LLM service error")
+def _tile_response(signature: str, data: bytes, request: Request) -> Response:
+    """构造平铺图响应：内容由签名唯一确定，可长期缓存"""
+    etag = f'"{signature}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "private, max-age=31536000, immutable",
+        "X-Tile-Signature": signature,
+    }
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=data, media_type="image/png", headers=headers)
 
-    if isinstance(data, dict):
-        content = None
-        try:
-            content = data.get("choices", [{}])[0].get("message", {}).get("content")
-        except Exception:
-            content = None
-        if isinstance(content, str):
-            try:
-                return JSONResponse(content=json.loads(content))
-            except Exception as parse_err:
-                logger.warning(f"解析LLM条纹内容失败，返回原始 choices: {parse_err}")
-                return JSONResponse(content={"variations": []})
+
+@router.post("/stripes/render")
+async def render_stripe_tile(request: Request, current_user = Depends(get_current_user)):
+    """
+    渲染旋转后的条纹平铺图（PNG）
+    请求体：{ "stripeUnits": [...], "width": 512, "height": 512, "angle": 0, "unitWidth": 120 }
+    stripeUnits 支持 widthPx 或 relativeWidth；相同参数的渲染结果命中内存 LRU
+    """
+    from ..services.stripe_engine import stripe_engine
+
+    logger = get_proxy_logger()
+    if not stripe_engine.is_available():
+        raise HTTPException(status_code=503, detail="Stripe engine is not available")
 
     try:
-        parsed = json.loads(text)
-        return JSONResponse(content=parsed)
+        body = await request.json()
     except Exception:
-        logger.warning("LLM条纹衍生响应非JSON，返回空结果")
-        return JSONResponse(content={"variations": []})
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    try:
+        width = int(body.get("width") or 512)
+        height = int(body.get("height") or width)
+        angle = float(body.get("angle") or 0)
+        unit_width = body.get("unitWidth")
+        unit_width = float(unit_width) if unit_width is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid render parameters")
+
+    try:
+        signature, data, cached = await asyncio.to_thread(
+            stripe_engine.render_tile,
+            body.get("stripeUnits") or [],
+            width,
+            height,
+            angle,
+            unit_width,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error("条纹平铺渲染失败: %s", e)
+        raise HTTPException(status_code=500, detail="Stripe tile rendering failed")
+
+    if not cached:
+        logger.info("条纹平铺渲染完成: %s, %sx%s, angle=%s", signature, width, height, angle)
+    return _tile_response(signature, data, request)
+
+
+@router.get("/stripes/tiles/{signature}")
+async def get_stripe_tile(signature: str, request: Request, current_user = Depends(get_current_user)):
+    """按签名读取已渲染的平铺图；缓存淘汰后返回404，客户端需重新 POST /stripes/render"""
+    from ..services.stripe_engine import stripe_engine
+
+    data = stripe_engine.tile_cache.get(signature)
+    if data is None:
+        raise HTTPException(status_code=404, detail="Tile not found")
+    return _tile_response(signature, data, request)
 
 @router.post("/upload")
-async def upload_file(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await proxy_to_runninghub(request, "upload", current_user, db)
+async def upload_file(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, "upload", current_user, repo)
 
 @router.post("/generate")
-async def generate_image(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await proxy_to_runninghub(request, "generate", current_user, db)
+async def generate_image(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, "generate", current_user, repo)
 
 @router.get("/tasks/history")
 async def get_task_history(
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    repo = Depends(get_repository),
     page: int = 1,
     limit: int = 10,
     task_type: str | None = None,
@@ -688,31 +1065,19 @@ async def get_task_history(
     """
     获取用户的任务历史记录
     """
-    from ..services.task_record_service import task_record_service
-    
     logger = get_proxy_logger()
     
     try:
         # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
+        username = current_user["username"]
         
-        logger.info(f"获取用户任务历史: {username}, 页码: {page}, 限制: {limit}")
+        logger.info("获取用户任务历史: %s, 页码: %s, 限制: %s", username, page, limit)
         
         # 计算偏移量
         offset = (page - 1) * limit
         
-        # 获取用户任务记录
-        task_records = task_record_service.get_user_tasks(username, limit, db, offset)
-
-        # 可选：按任务类型筛选
-        if task_type:
-            try:
-                task_records = [r for r in task_records if (r.get("task_type") == task_type)]
-            except Exception:
-                pass
+        # 获取用户任务记录（按任务类型筛选在分页之前完成，走 user_id + task_type 索引）
+        task_records = await repo.get_user_tasks(username, limit, offset, task_type)
         
         # 处理任务记录，添加图片URL
         history_items = []
@@ -778,45 +1143,175 @@ async def get_task_history(
             }
             history_items.append(history_item)
         
-        logger.info(f"返回 {len(history_items)} 条历史记录")
+        logger.info("返回 %s 条历史记录", len(history_items))
         return history_items
         
     except Exception as e:
-        logger.error(f"获取任务历史失败: {str(e)}")
+        logger.error("获取任务历史失败: %s", e)
         raise HTTPException(status_code=500, detail=f"获取任务历史失败: {str(e)}")
 
+TERMINAL_TASK_STATUSES = {"SUCCESS", "FAILED"}
+
+@router.post("/tasks/status:batch")
+async def get_task_status_batch(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """
+    批量查询任务状态
+    请求体：{ "taskIds": ["<runninghub taskId>", ...] }
+    一次存储查询完成归属校验；本地记录已是终态的直接返回，其余合并为一次上游批量查询。
+    返回：{ "statuses": { taskId: { "status": ..., ... } } }，不属于当前用户的任务为 NOT_FOUND
+    """
+    logger = get_proxy_logger()
+
+    try:
+        body = await request.json()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+
+    task_ids = body.get("taskIds") if isinstance(body, dict) else None
+    if not isinstance(task_ids, list) or not all(isinstance(t, str) and t for t in task_ids):
+        raise HTTPException(status_code=400, detail="taskIds must be a list of task IDs")
+    task_ids = list(dict.fromkeys(task_ids))
+    if len(task_ids) > settings.status_batch_max_ids:
+        raise HTTPException(status_code=400, detail=f"At most {settings.status_batch_max_ids} task IDs per request")
+
+    username = current_user["username"]
+    tenant_id = current_user["tenant_id"]
+
+    records = await repo.get_tasks_by_runninghub_ids(username, task_ids)
+
+    statuses = {}
+    unresolved = []
+    for task_id in task_ids:
+        record = records.get(task_id)
+        if record is None and task_id.startswith(TICKET_PREFIX):
+            # 可能是已派发、记录已改用 RunningHub taskId 的排队票据：按上游返回的 upstreamTaskId 再查
+            unresolved.append(task_id)
+        elif record is None:
+            statuses[task_id] = {"status": "NOT_FOUND"}
+        elif record.get("status") in TERMINAL_TASK_STATUSES:
+            statuses[task_id] = {"status": record["status"], "tenantTaskId": record.get("tenant_task_id")}
+        else:
+            unresolved.append(task_id)
+    local_terminal = sum(1 for status in statuses.values() if status["status"] in TERMINAL_TASK_STATUSES)
+
+    if unresolved:
+        try:
+            async with httpx.AsyncClient(timeout=30.0) as client:
+                with span("runninghub_service", kind=KIND_CLIENT, endpoint="tasks/status:batch"):
+                    response = await client.post(
+                        f"{settings.runninghub_service_url}/v1/tasks/status:batch",
+                        json={"taskIds": unresolved},
+                        headers=inject_headers({"X-Tenant-ID": str(tenant_id)}),
+                    )
+                response.raise_for_status()
+                upstream = response.json().get("statuses", {})
+        except Exception as e:
+            logger.error("批量查询上游任务状态失败: %s", e)
+            upstream = {}
+        adopted = {
+            task_id: upstream[task_id]["upstreamTaskId"]
+            for task_id in unresolved
+            if task_id not in records and (upstream.get(task_id) or {}).get("upstreamTaskId")
+        }
+        if adopted:
+            by_upstream = await repo.get_tasks_by_runninghub_ids(username, list(adopted.values()))
+            for task_id, upstream_task_id in adopted.items():
+                if upstream_task_id in by_upstream:
+                    records[task_id] = by_upstream[upstream_task_id]
+        for task_id in unresolved:
+            record = records.get(task_id)
+            if record is None:
+                statuses[task_id] = {"status": "NOT_FOUND" if task_id in upstream else "UNKNOWN"}
+                continue
+            entry = dict(upstream.get(task_id) or {"status": "UNKNOWN"})
+            entry["tenantTaskId"] = record.get("tenant_task_id")
+            if record.get("runninghub_task_id") == task_id:
+                await _adopt_ticket(repo, record, task_id, entry.get("upstreamTaskId"))
+            statuses[task_id] = entry
+
+    if log_sampled("status_poll"):
+        logger.info(
+            "批量任务状态: 用户=%s, 请求=%d, 本地终态=%d, 上游查询=%d",
+            username, len(task_ids), local_terminal, len(unresolved),
+        )
+    return {"statuses": {task_id: statuses[task_id] for task_id in task_ids}}
+
+async def _adopt_ticket(repo, record: Dict[str, Any], task_id: str, upstream_task_id: Optional[str]):
+    """状态响应带回 upstreamTaskId 时，把仍记着排队票据的任务记录改用 RunningHub taskId"""
+    if not upstream_task_id or upstream_task_id == task_id:
+        return
+    try:
+        await get_task_finalizer().adopt_upstream_id(repo, record["tenant_task_id"], task_id, upstream_task_id)
+    except Exception as e:
+        get_proxy_logger().warning("任务记录改用 RunningHub 任务失败: %s -> %s, %s", task_id, upstream_task_id, e)
+
+
+async def _ticket_upstream_id(task_id: str, tenant_id) -> Optional[str]:
+    """向 RunningHub 服务查询排队票据派发后的 RunningHub taskId；尚未派发或查询失败返回 None"""
+    try:
+        async with httpx.AsyncClient(timeout=10.0) as client:
+            with span("runninghub_service", kind=KIND_CLIENT, endpoint="tasks/{id}"):
+                response = await client.get(
+                    f"{settings.runninghub_service_url}/v1/tasks/{task_id}",
+                    headers=inject_headers({"X-Tenant-ID": str(tenant_id)}),
+                )
+            response.raise_for_status()
+            return response.json().get("upstreamTaskId")
+    except Exception as e:
+        get_proxy_logger().warning("查询排队票据失败: %s, %s", task_id, e)
+        return None
+
+
+async def _find_task_record(repo, current_user, task_id: str) -> Optional[Dict[str, Any]]:
+    """
+    按客户端持有的任务 ID 查找当前用户的任务记录；
+    排队票据派发后记录已改用 RunningHub taskId（见 TaskFinalizer.adopt_upstream_id），此时经票据再查一次
+    """
+    username = current_user["username"]
+    record = (await repo.get_tasks_by_runninghub_ids(username, [task_id])).get(task_id)
+    if record is None and task_id.startswith(TICKET_PREFIX):
+        upstream_task_id = await _ticket_upstream_id(task_id, current_user["tenant_id"])
+        if upstream_task_id:
+            record = (await repo.get_tasks_by_runninghub_ids(username, [upstream_task_id])).get(upstream_task_id)
+    return record
+
+
 @router.get("/tasks/{task_id}")
-async def get_task_status(task_id: str, request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await proxy_to_runninghub(request, f"tasks/{task_id}", current_user, db)
+async def get_task_status(task_id: str, request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    response = await proxy_to_runninghub(request, f"tasks/{task_id}", current_user, repo)
+    if task_id.startswith(TICKET_PREFIX) and response.status_code == 200:
+        upstream_task_id = json.loads(response.body).get("upstreamTaskId")
+        if upstream_task_id:
+            username = current_user["username"]
+            record = (await repo.get_tasks_by_runninghub_ids(username, [task_id])).get(task_id)
+            if record is not None:
+                await _adopt_ticket(repo, record, task_id, upstream_task_id)
+    return response
 
 @router.get("/tasks/{task_id}/outputs")
-async def get_task_outputs(task_id: str, request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await proxy_to_runninghub(request, f"tasks/{task_id}/outputs", current_user, db)
+async def get_task_outputs(task_id: str, request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, f"tasks/{task_id}/outputs", current_user, repo)
 
 @router.get("/tasks/{task_id}/outputs/stored")
 async def get_stored_task_outputs(
     task_id: str, 
     current_user = Depends(get_current_user), 
-    db: Session = Depends(get_db)
+    repo = Depends(get_repository)
 ):
     """
     获取已存储的任务输出
     下载并存储图片到本地，返回本地路径
     """
     from ..services.image_storage import image_storage_service
-    from ..services.task_record_service import task_record_service
     import httpx
     
     logger = get_proxy_logger()
     
     try:
         # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
+        username = current_user["username"]
         
-        logger.info(f"获取存储的任务输出: {task_id}, 用户: {username}")
+        logger.info("获取存储的任务输出: %s, 用户: %s", task_id, username)
         
         # 首先从RunningHub获取原始输出
         backend_url = f"{settings.runninghub_service_url}/v1/tasks/{task_id}/outputs"
@@ -826,7 +1321,7 @@ async def get_stored_task_outputs(
             response.raise_for_status()
             outputs_data = response.json()
         
-        logger.info(f"从RunningHub获取到输出: {outputs_data}")
+        logger.info("从RunningHub获取到输出: %s", outputs_data)
         
         # 下载并存储图片
         if "outputs" in outputs_data and outputs_data["outputs"]:
@@ -859,35 +1354,35 @@ async def get_stored_task_outputs(
             return outputs_data
             
     except Exception as e:
-        logger.error(f"获取存储的任务输出失败: {str(e)}")
+        logger.error("获取存储的任务输出失败: %s", e)
         raise HTTPException(status_code=500, detail=f"获取任务输出失败: {str(e)}")
 
 @router.post("/generate/image_edit")
-async def generate_image_edit(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
-    return await proxy_to_runninghub(request, "generate/image_edit", current_user, db)
+async def generate_image_edit(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, "generate/image_edit", current_user, repo)
 
 @router.post("/complete_image_edit")
-async def complete_image_edit(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def complete_image_edit(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """完整的图片编辑工作流（支持 Idempotency-Key）"""
+    return await with_idempotency(request, current_user, lambda: _complete_image_edit(request, current_user, repo))
+
+async def _complete_image_edit(request: Request, current_user, repo):
     """
     完整的图片编辑工作流
     创建任务记录并代理到RunningHub
     """
-    from ..services.task_record_service import task_record_service
     import httpx
     
     logger = get_proxy_logger()
     
     try:
         # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
+        username = current_user["username"]
         
-        logger.info(f"开始完整图片编辑工作流: 用户={username}")
+        logger.info("开始完整图片编辑工作流: 用户=%s", username)
         
         # 代理到RunningHub
-        result = await proxy_to_runninghub(request, "complete_image_edit", current_user, db)
+        result = await proxy_to_runninghub(request, "complete_image_edit", current_user, repo)
         
         # 检查返回结果类型
         if isinstance(result, JSONResponse):
@@ -900,16 +1395,15 @@ async def complete_image_edit(request: Request, current_user = Depends(get_curre
             # 如果任务创建成功，记录tenant任务
             if isinstance(response_data, dict) and "taskId" in response_data:
                 runninghub_task_id = response_data["taskId"]
-                tenant_task_id = task_record_service.create_task_record(
-                    username, 
-                    runninghub_task_id, 
-                    db,
+                tenant_task_id = await repo.create_task_record(
+                    username,
+                    runninghub_task_id,
                     task_type="targeted_redesign"  # 标记为Targeted Redesign任务
                 )
                 
                 # 在结果中添加tenant_task_id
                 response_data["tenantTaskId"] = tenant_task_id
-                logger.info(f"创建tenant任务记录: {tenant_task_id}")
+                logger.info("创建tenant任务记录: %s", tenant_task_id)
                 
                 # 返回更新后的响应
                 return JSONResponse(
@@ -920,30 +1414,88 @@ async def complete_image_edit(request: Request, current_user = Depends(get_curre
         return result
         
     except Exception as e:
-        logger.error(f"完整图片编辑工作流失败: {str(e)}")
+        logger.error("完整图片编辑工作流失败: %s", e)
         raise HTTPException(status_code=500, detail=f"图片编辑失败: {str(e)}")
 
+@router.post("/complete_image_edit:batch")
+async def complete_image_edit_batch(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """批量图片编辑（支持 Idempotency-Key）"""
+    return await with_idempotency(request, current_user, lambda: _complete_image_edit_batch(request, current_user, repo))
+
+async def _complete_image_edit_batch(request: Request, current_user, repo):
+    """
+    批量图片编辑：一组图片 + 多个提示词（或 主图 × 提示词 网格）
+    表单字段透传给 RunningHub 服务（file, prompts, variantFiles, file_2~file_4, fileType），
+    所有成功创建的任务记录在一次存储事务中写入。
+    """
+    logger = get_proxy_logger()
+
+    username = current_user["username"]
+
+    # 批量上传与提交耗时更长，放宽代理超时
+    result = await proxy_to_runninghub(request, "complete_image_edit:batch", current_user, repo, timeout=120.0)
+    if not isinstance(result, JSONResponse) or result.status_code >= 400:
+        return result
+
+    response_data = json.loads(result.body.decode("utf-8"))
+    items = response_data.get("items") if isinstance(response_data, dict) else None
+    if not isinstance(items, list):
+        return result
+
+    created_items = [item for item in items if item.get("taskId")]
+    try:
+        tenant_task_ids = await repo.create_task_records(
+            username,
+            [item["taskId"] for item in created_items],
+            task_type="targeted_redesign"
+        )
+    except Exception as e:
+        logger.error("批量创建任务记录失败: %s", e)
+        raise HTTPException(status_code=500, detail=f"批量创建任务记录失败: {str(e)}")
+
+    for item, tenant_task_id in zip(created_items, tenant_task_ids):
+        item["tenantTaskId"] = tenant_task_id
+
+    logger.info(
+        "批量图片编辑: 用户=%s, 批次=%s, 任务=%d/%d",
+        username, response_data.get("batchId"), len(created_items), len(items),
+    )
+    return JSONResponse(content=response_data, status_code=result.status_code)
+
+@router.get("/pipelines")
+async def list_pipelines(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, "pipelines", current_user, repo)
+
+@router.post("/pipelines")
+async def create_pipeline(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """启动服务端工作流流水线（如 印花提取 → 变体叠加 → 视频生成），返回 pipelineId 与各阶段状态"""
+    return await proxy_to_runninghub(request, "pipelines", current_user, repo, timeout=60.0)
+
+@router.get("/pipelines/{pipeline_id}")
+async def get_pipeline(pipeline_id: str, request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    return await proxy_to_runninghub(request, f"pipelines/{pipeline_id}", current_user, repo)
+
 @router.post("/complete_pattern_extract")
-async def complete_pattern_extract(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def complete_pattern_extract(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """完整印花提取工作流（支持 Idempotency-Key）"""
+    return await with_idempotency(request, current_user, lambda: _complete_pattern_extract(request, current_user, repo))
+
+async def _complete_pattern_extract(request: Request, current_user, repo):
     """
     完整印花提取工作流：创建任务记录并代理到RunningHub
     """
-    from ..services.task_record_service import task_record_service
     import httpx
 
     logger = get_proxy_logger()
 
     try:
         # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
+        username = current_user["username"]
 
-        logger.info(f"开始完整印花提取工作流: 用户={username}")
+        logger.info("开始完整印花提取工作流: 用户=%s", username)
 
         # 代理到RunningHub
-        result = await proxy_to_runninghub(request, "complete_pattern_extract", current_user, db)
+        result = await proxy_to_runninghub(request, "complete_pattern_extract", current_user, repo)
 
         # 处理返回
         if isinstance(result, JSONResponse):
@@ -954,45 +1506,44 @@ async def complete_pattern_extract(request: Request, current_user = Depends(get_
 
             if isinstance(response_data, dict) and "taskId" in response_data:
                 runninghub_task_id = response_data["taskId"]
-                tenant_task_id = task_record_service.create_task_record(
+                tenant_task_id = await repo.create_task_record(
                     username,
                     runninghub_task_id,
-                    db,
                     task_type="pattern_extract"
                 )
 
                 response_data["tenantTaskId"] = tenant_task_id
-                logger.info(f"创建tenant任务记录(印花提取): {tenant_task_id}")
+                logger.info("创建tenant任务记录(印花提取): %s", tenant_task_id)
 
                 return JSONResponse(content=response_data, status_code=result.status_code)
 
         return result
 
     except Exception as e:
-        logger.error(f"完整印花提取工作流失败: {str(e)}")
+        logger.error("完整印花提取工作流失败: %s", e)
         raise HTTPException(status_code=500, detail=f"印花提取失败: {str(e)}")
 
 @router.post("/complete_video_generation")
-async def complete_video_generation(request: Request, current_user = Depends(get_current_user), db: Session = Depends(get_db)):
+async def complete_video_generation(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """完整视频生成工作流（支持 Idempotency-Key）"""
+    return await with_idempotency(request, current_user, lambda: _complete_video_generation(request, current_user, repo))
+
+async def _complete_video_generation(request: Request, current_user, repo):
     """
     完整视频生成工作流：创建任务记录并代理到RunningHub
     """
-    from ..services.task_record_service import task_record_service
     import httpx
 
     logger = get_proxy_logger()
 
     try:
         # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
+        username = current_user["username"]
 
-        logger.info(f"开始完整视频生成工作流: 用户={username}")
+        logger.info("开始完整视频生成工作流: 用户=%s", username)
 
         # 代理到RunningHub
-        result = await proxy_to_runninghub(request, "complete_video_generation", current_user, db)
+        result = await proxy_to_runninghub(request, "complete_video_generation", current_user, repo)
 
         # 处理返回
         if isinstance(result, JSONResponse):
@@ -1003,146 +1554,104 @@ async def complete_video_generation(request: Request, current_user = Depends(get
 
             if isinstance(response_data, dict) and "taskId" in response_data:
                 runninghub_task_id = response_data["taskId"]
-                tenant_task_id = task_record_service.create_task_record(
+                tenant_task_id = await repo.create_task_record(
                     username,
                     runninghub_task_id,
-                    db,
                     task_type="video_generation"
                 )
 
                 response_data["tenantTaskId"] = tenant_task_id
-                logger.info(f"创建tenant任务记录(视频生成): {tenant_task_id}")
+                logger.info("创建tenant任务记录(视频生成): %s", tenant_task_id)
 
                 return JSONResponse(content=response_data, status_code=result.status_code)
 
         return result
 
     except Exception as e:
-        logger.error(f"完整视频生成工作流失败: {str(e)}")
+        logger.error("完整视频生成工作流失败: %s", e)
         raise HTTPException(status_code=500, detail=f"视频生成失败: {str(e)}")
 
 @router.post("/variant_overlay")
-async def variant_overlay(
-    request: Request,
-    current_user = Depends(get_current_user),
-    db: Session = Depends(get_db),
-):
+async def variant_overlay(request: Request, current_user = Depends(get_current_user), repo = Depends(get_repository)):
+    """Variant overlay 工作流（支持 Idempotency-Key）"""
+    return await with_idempotency(request, current_user, lambda: _variant_overlay(request, current_user, repo))
+
+async def _variant_overlay(request: Request, current_user, repo):
     """
     Variant overlay 工作流：代理到 RunningHub
     """
     logger = get_proxy_logger()
     try:
-        result = await proxy_to_runninghub(request, "variant_overlay", current_user, db)
+        result = await proxy_to_runninghub(request, "variant_overlay", current_user, repo)
         return result
     except Exception as e:
-        logger.error(f"Variant overlay 工作流失败: {str(e)}")
+        logger.error("Variant overlay 工作流失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Variant overlay 失败: {str(e)}")
 
+def _record_json_field(value):
+    """任务记录中的 JSON 字段：数据库存储为文本，JSON 存储为对象"""
+    if isinstance(value, str):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return None
+    return value
+
 @router.post("/tasks/{task_id}/complete")
 async def complete_task_with_storage(
     task_id: str,
     current_user = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    repo = Depends(get_repository)
 ):
     """
-    任务完成处理：自动下载图片并更新任务记录
+    读取任务的收尾结果（输出下载、缩略图与记录更新由后台任务完成处理器完成，每个任务只处理一次）
+    记录仍为 PENDING 时催促处理器立即处理，并最多等待 finalizer_complete_wait_seconds 秒；
+    仍未完成返回 202（status=pending），客户端稍后重试即可
     """
-    from ..services.task_record_service import task_record_service
-    from ..services.image_storage import image_storage_service
-    import httpx
-    
     logger = get_proxy_logger()
     
-    try:
-        # 获取用户名
-        if settings.is_database_storage():
-            username = current_user.username
-        else:
-            username = current_user["username"]
-        
-        logger.info(f"开始处理任务完成: {task_id}, 用户: {username}")
-        
-        # 1. 从RunningHub获取任务输出
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            outputs_response = await client.get(f"{settings.runninghub_service_url}/v1/tasks/{task_id}/outputs")
-            outputs_response.raise_for_status()
-            outputs_data = outputs_response.json()
-        
-        logger.info(f"获取到任务输出: {outputs_data}")
-        outputs = outputs_data.get("outputs")
-        if outputs:
-            logger.info(f"任务输出数量: {len(outputs)}")
-            for idx, item in enumerate(outputs):
-                logger.info(
-                    f"输出[{idx}]: 类型={type(item).__name__}, 内容={item}"
-                )
-        else:
-            logger.warning("任务输出为空或缺少 'outputs' 字段")
-        
-        # 2. 下载并存储图片
-        if "outputs" in outputs_data and outputs_data["outputs"]:
-            stored_outputs = await image_storage_service.download_and_store_images(
-                username, 
-                outputs_data["outputs"]
-            )
-            
-            # 提取存储路径
-            storage_entries = []
-            for output in stored_outputs:
-                if "localPath" in output:
-                    storage_entries.append({
-                        "original": output["localPath"],
-                        "thumbnail": output.get("thumbnailPath")
-                    })
-            
-            logger.info(f"文件存储完成，路径: {storage_entries}")
-            
-            # 3. 更新任务记录
-            # 首先找到对应的tenant任务记录
-            task_records = db.get_user_tasks(username, limit=100) if hasattr(db, 'get_user_tasks') else []
-            tenant_task_id = None
-            
-            for record in task_records:
-                if record.get("runninghub_task_id") == task_id:
-                    tenant_task_id = record.get("tenant_task_id")
-                    break
-            
-            if tenant_task_id:
-                # 更新任务为成功状态
-                success = task_record_service.update_task_success(
-                    tenant_task_id,
-                    outputs_data,
-                    storage_entries,
-                    db
-                )
-                
-                if success:
-                    logger.info(f"任务记录更新成功: {tenant_task_id}")
-                else:
-                    logger.error(f"任务记录更新失败: {tenant_task_id}")
-            
-            # 4. 返回处理结果（不包含fileUrl）
-            result = {
-                "taskId": task_id,
-                "status": "completed",
-                "message": "文件已下载并存储到本地",
-                "storagePaths": storage_entries,
-                "outputCount": len(stored_outputs)
-            }
-            
-            return result
-        else:
-            logger.warning(f"任务 {task_id} 没有输出")
-            return {
-                "taskId": task_id,
-                "status": "completed",
-                "message": "任务完成，但没有输出文件",
-                "outputCount": 0
-            }
-            
-    except Exception as e:
-        logger.error(f"处理任务完成失败: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"任务完成处理失败: {str(e)}")
+    username = current_user["username"]
+    
+    record = await _find_task_record(repo, current_user, task_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    
+    if record.get("status") == "PENDING":
+        job = await get_task_finalizer().finalize_now(record, settings.finalizer_complete_wait_seconds)
+        logger.info("等待任务收尾: %s, 用户: %s, 作业: %s", task_id, username, job)
+        record = await repo.get_task_record(record["tenant_task_id"]) or record
+    
+    status = record.get("status")
+    if status == "PENDING":
+        return JSONResponse(
+            status_code=202,
+            content={"taskId": task_id, "status": "pending", "message": "任务尚未完成，请稍后重试"},
+        )
+    if status == "FAILED":
+        return {
+            "taskId": task_id,
+            "status": "failed",
+            "message": record.get("error_message") or "任务失败",
+            "outputCount": 0
+        }
+    
+    storage_entries = _record_json_field(record.get("storage_paths")) or []
+    result_data = _record_json_field(record.get("result_data")) or {}
+    output_count = len(result_data.get("outputs") or []) if isinstance(result_data, dict) else len(storage_entries)
+    if not storage_entries:
+        return {
+            "taskId": task_id,
+            "status": "completed",
+            "message": "任务完成，但没有输出文件",
+            "outputCount": 0
+        }
+    return {
+        "taskId": task_id,
+        "status": "completed",
+        "message": "文件已下载并存储到本地",
+        "storagePaths": storage_entries,
+        "outputCount": output_count
+    }
 
 @router.get("/diagnostics/runninghub")
 async def diagnose_runninghub():
@@ -1166,7 +1675,7 @@ async def diagnose_runninghub():
                 diagnostics["tests"]["docs_endpoint"] = {
                     "status": "success",
                     "status_code": response.status_code,
-                    "response_time": "N/A"
+                    "response_time": f"{response.elapsed.total_seconds() * 1000:.1f}ms"
                 }
             except Exception as e:
                 diagnostics["tests"]["docs_endpoint"] = {
@@ -1181,7 +1690,7 @@ async def diagnose_runninghub():
                 diagnostics["tests"]["health_endpoint"] = {
                     "status": "success",
                     "status_code": response.status_code,
-                    "response_time": "N/A"
+                    "response_time": f"{response.elapsed.total_seconds() * 1000:.1f}ms"
                 }
             except Exception as e:
                 diagnostics["tests"]["health_endpoint"] = {
@@ -1196,7 +1705,7 @@ async def diagnose_runninghub():
                 diagnostics["tests"]["api_endpoint"] = {
                     "status": "success",
                     "status_code": response.status_code,
-                    "response_time": "N/A"
+                    "response_time": f"{response.elapsed.total_seconds() * 1000:.1f}ms"
                 }
             except Exception as e:
                 diagnostics["tests"]["api_endpoint"] = {
@@ -1207,10 +1716,27 @@ async def diagnose_runninghub():
     
     except Exception as e:
         diagnostics["error"] = str(e)
-        logger.error(f"诊断失败: {str(e)}")
+        logger.error("诊断失败: %s", e)
     
     return diagnostics
 
+@router.get("/diagnostics/traces")
+async def get_recent_traces(
+    traceId: str = None,
+    limit: int = 200,
+    format: str = "json",
+    current_user = Depends(get_current_user),
+):
+    """
+    当前用户最近请求的 span（内存环形缓冲区），可按 traceId 过滤；format=otlp 返回 OTLP/JSON
+    """
+    if format not in ("json", "otlp"):
+        raise HTTPException(status_code=400, detail="format 只支持 json 或 otlp")
+    spans = get_span_exporter().recent(
+        trace_id=traceId, limit=max(1, min(limit, 2000)), user_id=current_user["id"]
+    )
+    return SpanExporter.render(spans, format)
+
 @router.get("/static/images/{file_path:path}")
 async def serve_stored_image(file_path: str):
     """
@@ -1225,42 +1751,28 @@ async def serve_stored_image(file_path: str):
         output_dir = Path(project_root) / "output"
         full_path = output_dir / file_path
         
-        logger.info(f"请求图片文件: {file_path}")
-        logger.info(f"项目根目录: {project_root}")
-        logger.info(f"output目录: {output_dir}")
-        logger.info(f"完整路径: {full_path}")
-        logger.info(f"路径是否存在: {full_path.exists()}")
+        logger.debug("请求图片文件: %s -> %s", file_path, full_path)
         
         # 安全检查：确保文件在output目录内
         try:
             resolved_path = full_path.resolve()
             resolved_output = output_dir.resolve()
             if not str(resolved_path).startswith(str(resolved_output)):
-                logger.error(f"路径安全检查失败: {resolved_path} 不在 {resolved_output} 内")
+                logger.error("路径安全检查失败: %s 不在 %s 内", resolved_path, resolved_output)
                 raise HTTPException(status_code=403, detail="Access denied")
         except Exception as path_e:
-            logger.error(f"路径解析错误: {str(path_e)}")
+            logger.error("路径解析错误: %s", path_e)
             raise HTTPException(status_code=403, detail="Path resolution failed")
         
         if not full_path.exists():
-            logger.error(f"文件不存在: {full_path}")
-            # 列出output目录内容用于调试
-            try:
-                if output_dir.exists():
-                    files = list(output_dir.rglob("*"))
-                    logger.info(f"output目录内容: {[str(f) for f in files]}")
-                else:
-                    logger.error("output目录不存在")
-            except Exception as list_e:
-                logger.error(f"列出目录内容失败: {str(list_e)}")
+            logger.warning("文件不存在: %s", full_path)
             raise HTTPException(status_code=404, detail="File not found")
         
-        logger.info(f"成功提供文件: {full_path}")
         return FileResponse(full_path)
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"提供文件失败: {str(e)}")
+        logger.error("提供文件失败: %s", e)
         raise HTTPException(status_code=500, detail=f"Failed to serve file: {str(e)}")
 
@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from pydantic import BaseModel
-from ..models.database import get_db, Tenant, User
 from ..routers.auth import get_current_user
 from ..services.logger import get_tenant_logger
-from ..services.config import get_settings
+from ..services.repository import get_repository
+from ..services.usage_accounting import GRANULARITIES, GROUP_FIELDS, get_usage_accounting
 
 router = APIRouter()
 
@@ -20,105 +21,83 @@ class TenantResponse(BaseModel):
     created_at: str
 
 @router.post("/", response_model=TenantResponse)
-async def create_tenant(tenant_data: TenantCreate, db = Depends(get_db)):
+async def create_tenant(tenant_data: TenantCreate, repo = Depends(get_repository)):
     logger = get_tenant_logger()
     logger.info(f"创建租户请求: {tenant_data.name}")
     
-    settings = get_settings()
-    
-    if settings.is_json_storage():
-        # Use JSON storage
-        try:
-            tenant = db.create_tenant(
-                name=tenant_data.name,
-                settings=tenant_data.settings
-            )
-            return TenantResponse(
-                id=tenant["id"],
-                name=tenant["name"],
-                api_key=tenant["api_key"],
-                is_active=tenant["is_active"],
-                created_at=tenant["created_at"]
-            )
-        except ValueError as e:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=str(e)
-            )
-    else:
-        # Use SQLAlchemy
-        # Check if tenant exists
-        if db.query(Tenant).filter(Tenant.name == tenant_data.name).first():
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Tenant name already exists"
-            )
-        
-        # Generate API key (in production, use secure random generation)
-        import uuid
-        api_key = str(uuid.uuid4())
-        
-        # Create tenant
-        db_tenant = Tenant(
+    try:
+        tenant = await repo.create_tenant(
             name=tenant_data.name,
-            api_key=api_key,
             settings=tenant_data.settings
         )
-        db.add(db_tenant)
-        db.commit()
-        db.refresh(db_tenant)
-        
-        logger.info(f"租户创建成功: {tenant_data.name}, API Key: {api_key}")
-        return TenantResponse(
-            id=db_tenant.id,
-            name=db_tenant.name,
-            api_key=db_tenant.api_key,
-            is_active=db_tenant.is_active,
-            created_at=db_tenant.created_at.isoformat()
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Tenant name already exists"
         )
+    
+    logger.info(f"租户创建成功: {tenant_data.name}")
+    return TenantResponse(
+        id=tenant["id"],
+        name=tenant["name"],
+        api_key=tenant["api_key"],
+        is_active=tenant["is_active"],
+        created_at=tenant["created_at"]
+    )
 
 @router.get("/me")
-async def get_tenant_info(current_user = Depends(get_current_user), db = Depends(get_db)):
+async def get_tenant_info(current_user = Depends(get_current_user), repo = Depends(get_repository)):
     logger = get_tenant_logger()
-    settings = get_settings()
+    logger.info(f"获取租户信息: 用户 {current_user['username']}")
     
-    # 获取用户名，支持两种存储模式
-    if settings.is_database_storage():
-        username = current_user.username
-        tenant_id = current_user.tenant_id
-    else:
-        username = current_user["username"]
-        tenant_id = current_user["tenant_id"]
-    
-    logger.info(f"获取租户信息: 用户 {username}")
+    tenant = await repo.get_tenant_by_id(current_user["tenant_id"])
+    if not tenant:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Tenant not found"
+        )
     
-    if settings.is_database_storage():
-        # 数据库存储模式
-        tenant = db.query(Tenant).filter(Tenant.id == tenant_id).first()
-        if not tenant:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Tenant not found"
-            )
-        
-        return {
-            "tenant_id": tenant.id,
-            "tenant_name": tenant.name,
-            "is_active": tenant.is_active,
-            "created_at": tenant.created_at.isoformat()
-        }
-    else:
-        # JSON存储模式
-        tenant = db.get_tenant_by_id(tenant_id)
-        if not tenant:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Tenant not found"
-            )
-        
-        return {
-            "tenant_id": tenant["id"],
-            "tenant_name": tenant["name"],
-            "is_active": tenant["is_active"],
-            "created_at": tenant["created_at"]
-        }
+    return {
+        "tenant_id": tenant["id"],
+        "tenant_name": tenant["name"],
+        "is_active": tenant["is_active"],
+        "created_at": tenant["created_at"]
+    }
+
+def _parse_time(value: Optional[str], name: str) -> Optional[datetime]:
+    """ISO 8601 时间，带时区的换算为 UTC（用量按 UTC 存储）"""
+    if value is None:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"{name} 不是合法的 ISO 8601 时间")
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+@router.get("/me/usage")
+async def get_tenant_usage(
+    start: Optional[str] = Query(None, description="起始时间（ISO 8601，默认 end 前 24 小时）"),
+    end: Optional[str] = Query(None, description="结束时间（不含，默认当前时间）"),
+    granularity: str = Query("hour", description="minute / hour / day"),
+    group_by: Optional[str] = Query(None, description="endpoint / user_id"),
+    current_user = Depends(get_current_user),
+    repo = Depends(get_repository),
+):
+    """当前租户在时间范围内的 API 请求数"""
+    tenant_id = current_user["tenant_id"]
+
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"granularity 只支持 {', '.join(GRANULARITIES)}")
+    if group_by is not None and group_by not in GROUP_FIELDS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"group_by 只支持 {', '.join(GROUP_FIELDS)}")
+    end_time = _parse_time(end, "end") or datetime.utcnow()
+    start_time = _parse_time(start, "start") or end_time - timedelta(hours=24)
+    if start_time >= end_time:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="start 必须早于 end")
+    # 按分钟粒度查询时限制范围，避免一次返回过多数据点
+    if granularity == "minute" and end_time - start_time > timedelta(days=1):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="minute 粒度的查询范围不能超过 1 天")
+
+    return await get_usage_accounting().query(repo, tenant_id, start_time, end_time, granularity, group_by)
@@ -1,10 +1,9 @@
+import asyncio
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
-from ..models.database import User, Tenant
 from .config import get_settings
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -36,36 +35,15 @@ def verify_token(token: str) -> dict:
             detail="Invalid token"
         )
 
-def authenticate_user(db, username: str, password: str):
-    """认证用户，支持数据库和JSON存储模式"""
-    from .config import get_settings
-    settings = get_settings()
-    
-    if settings.is_database_storage():
-        # 数据库存储模式
-        user = db.query(User).filter(User.username == username).first()
-        if not user:
-            return None
-        if not verify_password(password, user.hashed_password):
-            return None
-        return user
-    else:
-        # JSON存储模式
-        user = db.get_user_by_username(username)
-        if not user:
-            return None
-        if not verify_password(password, user["hashed_password"]):
-            return None
-        return user
+async def authenticate_user(repo, username: str, password: str):
+    """认证用户，返回用户字典；bcrypt 校验耗时数百毫秒，放到线程池中执行"""
+    user = await repo.get_user_by_username(username)
+    if not user:
+        return None
+    if not await asyncio.to_thread(verify_password, password, user["hashed_password"]):
+        return None
+    return user
 
-def get_tenant_by_api_key(db, api_key: str):
-    """根据API密钥获取租户，支持数据库和JSON存储模式"""
-    from .config import get_settings
-    settings = get_settings()
-    
-    if settings.is_database_storage():
-        # 数据库存储模式
-        return db.query(Tenant).filter(Tenant.api_key == api_key, Tenant.is_active == True).first()
-    else:
-        # JSON存储模式
-        return db.get_tenant_by_api_key(api_key)
+async def get_tenant_by_api_key(repo, api_key: str):
+    """根据API密钥获取启用中的租户"""
+    return await repo.get_tenant_by_api_key(api_key)
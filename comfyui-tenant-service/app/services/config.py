@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Literal, Optional
+from typing import Dict, List, Literal, Optional
 
 StorageType = Literal["mysql", "sqlite", "json"]
 
@@ -17,6 +17,8 @@ class Settings(BaseSettings):
     llm_service_url: Optional[str] = None
     llm_api_key: Optional[str] = None
     llm_default_model: str = "gpt-4.1"
+    llm_cache_ttl_seconds: int = 1800
+    llm_cache_max_entries: int = 512
 
     # Storage configuration (json, mysql, sqlite)
     storage_type: StorageType = "json"
@@ -30,13 +32,75 @@ class Settings(BaseSettings):
 
     # SQLite configuration (used when storage_type == "sqlite")
     sqlite_path: str = "./tenant_service.db"
+    # SQLite 连接参数：WAL + synchronous=NORMAL，写锁等待 busy_timeout 而不是立即报 "database is locked"
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_mmap_size_mb: int = 256  # 0 关闭内存映射读
+    sqlite_cache_size_mb: int = 64  # 每个连接的页缓存
+    sqlite_statement_cache: int = 256  # 每个连接缓存的预编译语句数
+    sqlite_pool_size: int = 8  # 常驻连接数（线程池中的并发请求各取一个连接）
+    sqlite_max_overflow: int = 8
 
     # JSON storage configuration (used when storage_type == "json")
     json_storage_path: str = "./database"
+    # 数据库存储时租户记录的进程内缓存时长（每个代理请求都读取租户配置），0 关闭
+    tenant_cache_seconds: float = 30.0
+    # 迁移期间 JSON 存储的写入同步写入 sqlite / mysql（见 services/json_migration.py），空为关闭
+    storage_dual_write: Literal["", "sqlite", "mysql"] = ""
 
     # Misc configuration
-    rate_limit_per_minute: int = 60
+    rate_limit_per_minute: int = 60  # 每个 租户+用户 每分钟的令牌数，<=0 关闭限流
+    rate_limit_backend: Literal["memory", "sqlite"] = "memory"  # sqlite 可在多个 worker 间共享
+    rate_limit_sqlite_path: str = "./rate_limit.db"
+    # 端点令牌消耗覆盖，例如 RATE_LIMIT_ENDPOINT_COSTS='{"POST /proxy/complete_image_edit": 15}'
+    rate_limit_endpoint_costs: Dict[str, int] = {}
+    # 任务/流水线状态轮询的独立令牌桶（每个 租户+用户 每分钟），<=0 时轮询不限流
+    rate_limit_poll_per_minute: int = 600
+    # 受信任的反向代理（例如前端 Next.js 服务），来自这些地址的请求按 X-Forwarded-For 识别客户端 IP
+    rate_limit_trusted_proxies: List[str] = ["127.0.0.1", "::1"]
+    status_batch_max_ids: int = 100  # 批量状态查询单次最多任务数
+    # Idempotency-Key：响应保存时长、执行中标记的租约、跨 worker 等待原请求的最长时间
+    idempotency_backend: Literal["memory", "sqlite"] = "memory"
+    idempotency_sqlite_path: str = "./idempotency.db"
+    idempotency_ttl_seconds: int = 86400
+    idempotency_lease_seconds: int = 300
+    idempotency_wait_seconds: float = 25.0
+    # 任务完成处理器：后台扫描 PENDING 任务记录，任务完成后下载输出并更新记录
+    finalizer_enabled: bool = True
+    finalizer_queue_path: str = "./finalizer_queue.db"
+    finalizer_poll_seconds: float = 5.0  # 未完成任务的再次查询间隔
+    finalizer_scan_seconds: float = 30.0  # 扫描 PENDING 记录的间隔
+    finalizer_scan_limit: int = 500
+    finalizer_batch_size: int = 50  # 单次认领的作业数（不超过 RunningHub 服务批量状态查询上限）
+    finalizer_lease_seconds: int = 300
+    finalizer_max_attempts: int = 5  # 输出下载失败的最多尝试次数
+    finalizer_max_pending_hours: float = 24.0  # 超过该时长仍未完成的任务标记为失败
+    finalizer_complete_wait_seconds: float = 20.0  # /complete 等待收尾完成的最长时间
+    # 输出文件清理（output/<用户>/ 及其 thumbnail/、video/，见 services/output_gc.py）
+    gc_enabled: bool = False
+    gc_dry_run: bool = False  # 只输出报告，不删除
+    gc_interval_seconds: float = 3600.0
+    # 任务类型 -> 保留天数（按任务完成时间），"*" 为其他类型；未配置的类型不按时间清理
+    gc_retention_days: Dict[str, float] = {}
+    gc_default_quota_mb: float = 0  # 每个租户的输出文件配额，<=0 不限制
+    gc_tenant_quota_mb: Dict[str, float] = {}  # 租户 ID -> 配额（覆盖默认值）
+    gc_orphan_grace_hours: float = 24.0  # 不被任何任务记录引用的文件超过该时长后删除，<=0 不清理
+    gc_delete_per_second: float = 20.0  # 删除速率上限（原图与缩略图为一组），<=0 不限速
+    gc_max_deletes_per_run: int = 5000
+    # API 用量统计：内存中按分钟聚合，定时批量写入
+    usage_accounting_enabled: bool = True
+    usage_flush_seconds: float = 15.0
+    # 请求追踪：span 环形缓冲区大小；导出路径为空时只保留在内存中（GET /proxy/diagnostics/traces 查看）
+    trace_buffer_size: int = 2048
+    trace_export_path: str = ""
+    trace_export_format: Literal["otlp", "json"] = "otlp"
+    trace_export_batch: int = 256  # 每累计多少个 span 追加写一次文件，关闭服务时写出剩余部分
     log_level: str = "INFO"
+    log_dir: str = "logs"
+    log_backup_count: int = 168  # 按小时轮转，默认保留 7 天
+    log_max_field_length: int = 256  # 单个字段写入日志的最大长度
+    log_max_total_length: int = 2048  # 单条载荷日志的最大长度
+    # 高频事件采样率（事件名 -> 0~1），例如 LOG_SAMPLE_RATES='{"status_poll": 0.1}'
+    log_sample_rates: Dict[str, float] = {"status_poll": 0.1}
 
     model_config = SettingsConfigDict(
         env_file=[".env", "../.env", "../../.env"],
@@ -44,15 +108,15 @@ class Settings(BaseSettings):
         case_sensitive=False,
     )
 
-    def get_database_url(self) -> str:
-        """Return the database connection URL based on the storage type."""
+    def get_async_database_url(self) -> str:
+        """Return the SQLAlchemy asyncio URL (aiomysql / aiosqlite drivers)."""
         if self.storage_type == "mysql":
             return (
-                f"mysql+pymysql://{self.mysql_user}:{self.mysql_password}"
+                f"mysql+aiomysql://{self.mysql_user}:{self.mysql_password}"
                 f"@{self.mysql_host}:{self.mysql_port}/{self.mysql_database}"
             )
         if self.storage_type == "sqlite":
-            return f"sqlite:///{self.sqlite_path}"
+            return f"sqlite+aiosqlite:///{self.sqlite_path}"
         return ""
 
     def is_database_storage(self) -> bool:
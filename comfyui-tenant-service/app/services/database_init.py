@@ -1,8 +1,12 @@
 import os
 import json
 from pathlib import Path
-from sqlalchemy import create_engine, text
+from typing import List
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Connection
 from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from .config import get_settings
 from .logger import get_main_logger
 
@@ -37,7 +41,7 @@ def init_database():
             logger.info("MySQL database initialized successfully")
             return True
         else:
-            logger.warning("MySQL initialization failed, falling back to JSON storage")
+            logger.warning("MySQL initialization failed, will retry")
             return False
     
     elif settings.storage_type == "json":
@@ -54,6 +58,89 @@ def init_database():
         logger.info("Using SQLite database")
         return True
 
+def create_async_database_engine(settings=None):
+    """
+    异步引擎（MySQL: aiomysql，SQLite: aiosqlite），请求处理中的查询不再阻塞事件循环
+    SQLite：连接池 + 每个新连接设置 PRAGMA
+    - journal_mode=WAL：读写互不阻塞；synchronous=NORMAL：WAL 下只在检查点 fsync
+    - busy_timeout：并发写入时等待写锁，而不是立即返回 "database is locked"
+    - mmap_size / cache_size：热数据读取不经过系统调用
+    连接长期保留在池中，sqlite3 的语句缓存（cached_statements）使热点查询只预编译一次。
+    """
+    settings = settings or get_settings()
+    database_url = settings.get_async_database_url()
+    if settings.storage_type == "sqlite":
+        engine = create_async_engine(
+            database_url,
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=settings.sqlite_pool_size,
+            max_overflow=settings.sqlite_max_overflow,
+            connect_args=_sqlite_connect_args(settings),
+        )
+        _apply_sqlite_pragmas(engine.sync_engine, settings)
+        return engine
+    # MySQL 服务端会关闭空闲连接，取用前检测并定期回收；
+    # READ COMMITTED 让同一会话内的重复读取看到其他会话（如任务完成处理器）已提交的更新
+    return create_async_engine(
+        database_url, pool_pre_ping=True, pool_recycle=3600, isolation_level="READ COMMITTED"
+    )
+
+def _sqlite_connect_args(settings) -> dict:
+    return {
+        "check_same_thread": False,
+        "timeout": settings.sqlite_busy_timeout_ms / 1000,
+        "cached_statements": settings.sqlite_statement_cache,
+    }
+
+def _apply_sqlite_pragmas(engine, settings):
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("PRAGMA journal_mode=WAL")
+            cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+            cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb) * 1024 * 1024}")
+            # 负值表示以 KiB 为单位
+            cursor.execute(f"PRAGMA cache_size={-int(settings.sqlite_cache_size_mb) * 1024}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+def ensure_indexes(engine, metadata) -> List[str]:
+    """
+    创建模型中声明但数据库中缺失的索引（create_all 不会给已存在的表补索引），返回新建的索引名
+    engine 可以是 Engine 或 Connection
+    """
+    logger = get_main_logger()
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    created = []
+    for table in metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            logger.info("创建缺失的索引: %s.%s", table.name, index.name)
+            index.create(bind=engine, checkfirst=True)
+            created.append(index.name)
+    if created and engine.dialect.name == "sqlite":
+        # 让查询规划器拿到新索引的统计信息
+        if isinstance(engine, Connection):
+            engine.execute(text("PRAGMA optimize"))
+        else:
+            with engine.connect() as conn:
+                conn.execute(text("PRAGMA optimize"))
+    return created
+
+async def create_schema(async_engine, metadata):
+    """在异步引擎上建表并补齐缺失的索引（迁移工具与双写的目标库使用）"""
+    async with async_engine.begin() as conn:
+        await conn.run_sync(metadata.create_all)
+        await conn.run_sync(ensure_indexes, metadata)
+
 def init_json_storage():
     """Initialize JSON file storage"""
     settings = get_settings()
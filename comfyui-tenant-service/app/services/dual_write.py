@@ -0,0 +1,176 @@
+"""
+JSON 存储迁移期间的双写
+STORAGE_TYPE=json 且设置了 STORAGE_DUAL_WRITE=sqlite / mysql 时，repository_session() 返回 DualWriteRepository：
+读取与写入仍以 JSON 存储为准，每次写入成功后把结果记录（原 ID）同步写入目标库。
+目标库写入失败只记录日志与 tenant_dual_write_errors_total，不影响请求；遗漏的记录由
+python -m app.services.json_migration copy 补齐（导入是幂等的，见 services/json_migration.py）。
+"""
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .config import get_settings
+from .json_migration import MIRRORED, open_target, repository_class_for, to_row
+from .logger import get_migration_logger
+from .metrics import get_metrics_registry
+from .repository import StorageRepository
+
+logger = get_migration_logger()
+
+dual_write_errors = get_metrics_registry().counter(
+    "tenant_dual_write_errors_total", "双写目标库写入失败次数", ("operation",)
+)
+
+_engine = None
+_sessionmaker = None
+_engine_lock: Optional[asyncio.Lock] = None
+
+
+async def _get_sessionmaker():
+    """目标库引擎在第一次写入时创建（同时建表）"""
+    global _engine, _sessionmaker, _engine_lock
+    if _sessionmaker is not None:
+        return _sessionmaker
+    if _engine_lock is None:
+        _engine_lock = asyncio.Lock()
+    async with _engine_lock:
+        if _sessionmaker is None:
+            from sqlalchemy.ext.asyncio import async_sessionmaker
+
+            _engine = await open_target(get_settings().storage_dual_write)
+            _sessionmaker = async_sessionmaker(_engine, expire_on_commit=False)
+    return _sessionmaker
+
+
+@contextlib.asynccontextmanager
+async def secondary_session() -> AsyncIterator[StorageRepository]:
+    """打开一个目标库的仓库会话"""
+    sessions = await _get_sessionmaker()
+    repository_class = repository_class_for(get_settings().storage_dual_write)
+    async with sessions() as session:
+        yield repository_class(session)
+
+
+async def close_dual_write_engine():
+    global _engine, _sessionmaker, _engine_lock
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = _sessionmaker = _engine_lock = None
+
+
+class DualWriteRepository(StorageRepository):
+    """以 primary（JSON）为准，写入后同步到目标库"""
+
+    def __init__(self, primary: StorageRepository):
+        self.primary = primary
+        self.backend = primary.backend
+
+    async def _mirror(self, operation: str, collection: str, records: List[Dict[str, Any]]):
+        records = [record for record in records if record]
+        if not records:
+            return
+        try:
+            async with secondary_session() as secondary:
+                await secondary.import_records(collection, [to_row(collection, record) for record in records])
+        except Exception as e:
+            dual_write_errors.inc(operation=operation)
+            logger.warning("双写失败(%s): %s", operation, e)
+
+    # 用户
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_user_by_username(username)
+
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_user_by_email(email)
+
+    async def create_user(self, username: str, password_hash: str, tenant_id: int, email: str = None) -> Dict[str, Any]:
+        user = await self.primary.create_user(username, password_hash, tenant_id, email)
+        await self._mirror("create_user", "users", [user])
+        return user
+
+    # 租户
+    async def get_tenant_by_id(self, tenant_id: int) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_tenant_by_id(tenant_id)
+
+    async def get_tenant_by_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_tenant_by_api_key(api_key)
+
+    async def create_tenant(self, name: str, settings: str = "{}", tenant_id: int = None) -> Dict[str, Any]:
+        tenant = await self.primary.create_tenant(name, settings, tenant_id)
+        await self._mirror("create_tenant", "tenants", [tenant])
+        return tenant
+
+    # 任务记录
+    async def create_task_records(
+        self, user_id: str, runninghub_task_ids: List[str], task_type: str = None
+    ) -> List[str]:
+        tenant_task_ids = await self.primary.create_task_records(user_id, runninghub_task_ids, task_type)
+        if tenant_task_ids:
+            created = set(tenant_task_ids)
+            records = await self.primary.get_tasks_by_runninghub_ids(user_id, runninghub_task_ids)
+            await self._mirror("create_task_records", "task_records", [
+                record for record in records.values() if record["tenant_task_id"] in created
+            ])
+        return tenant_task_ids
+
+    async def get_task_record(self, tenant_task_id: str) -> Optional[Dict[str, Any]]:
+        return await self.primary.get_task_record(tenant_task_id)
+
+    async def get_tasks_by_runninghub_ids(
+        self, user_id: str, runninghub_task_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        return await self.primary.get_tasks_by_runninghub_ids(user_id, runninghub_task_ids)
+
+    async def get_user_tasks(
+        self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None
+    ) -> List[Dict[str, Any]]:
+        return await self.primary.get_user_tasks(user_id, limit, offset, task_type)
+
+    async def get_pending_tasks(self, limit: int = 500) -> List[Dict[str, Any]]:
+        return await self.primary.get_pending_tasks(limit)
+
+    async def get_task_outputs(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        return await self.primary.get_task_outputs(after_id, limit)
+
+    async def update_task_success(
+        self, tenant_task_id: str, result_data: Dict[str, Any], storage_paths: List[Any]
+    ) -> bool:
+        updated = await self.primary.update_task_success(tenant_task_id, result_data, storage_paths)
+        if updated:
+            await self._mirror("update_task_success", "task_records", [await self.primary.get_task_record(tenant_task_id)])
+        return updated
+
+    async def update_task_failed(self, tenant_task_id: str, error_message: str) -> bool:
+        updated = await self.primary.update_task_failed(tenant_task_id, error_message)
+        if updated:
+            await self._mirror("update_task_failed", "task_records", [await self.primary.get_task_record(tenant_task_id)])
+        return updated
+
+    async def update_task_runninghub_id(self, tenant_task_id: str, runninghub_task_id: str) -> bool:
+        updated = await self.primary.update_task_runninghub_id(tenant_task_id, runninghub_task_id)
+        if updated:
+            await self._mirror(
+                "update_task_runninghub_id", "task_records", [await self.primary.get_task_record(tenant_task_id)]
+            )
+        return updated
+
+    # 用量统计
+    async def append_api_usage(self, rows: List[Dict[str, Any]]):
+        """
+        先写目标库，成功后在 JSON 中标记为已同步（复制时跳过），失败则不标记（由复制补齐）。
+        写入目标库后、写入 JSON 前进程退出时，目标库会多出这一批（verify 显示不一致）；聚合行只影响统计，可接受
+        """
+        if not rows:
+            return
+        mirrored = False
+        try:
+            async with secondary_session() as secondary:
+                await secondary.append_api_usage(rows)
+            mirrored = True
+        except Exception as e:
+            dual_write_errors.inc(operation="append_api_usage")
+            logger.warning("双写失败(append_api_usage): %s", e)
+        await self.primary.append_api_usage([{**row, MIRRORED: True} for row in rows] if mirrored else rows)
+
+    async def get_api_usage(self, tenant_id: int, start, end) -> List[Dict[str, Any]]:
+        return await self.primary.get_api_usage(tenant_id, start, end)
@@ -0,0 +1,287 @@
+"""
+幂等键（Idempotency-Key）
+创建任务类接口携带 Idempotency-Key 时，同一 (租户, 用户, 接口, 键) 在 TTL 内只会真正执行一次：
+- 已完成：直接重放保存的响应（响应头 Idempotent-Replayed: true）
+- 本进程执行中：等待正在执行的请求并共享其结果，不会重复上传与创建任务
+- 其它 worker 执行中（sqlite 后端）：轮询等待结果，超时返回 409 + Retry-After
+- 同一个键配合不同的请求内容：返回 422
+
+5xx 与 409/429 响应不保存，客户端可以用同一个键重试。
+
+后端：
+- memory：进程内字典，单个 uvicorn worker 内生效
+- sqlite：多个 worker 共享记录（执行中标记带租约，持有者崩溃后自动失效）
+"""
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .config import get_settings
+from .logger import get_proxy_logger
+from .single_flight import SingleFlight
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+# 不保存的状态码：可重试的失败
+UNSTORED_STATUS_CODES = {409, 429}
+
+
+class IdempotencyError(Exception):
+    """幂等键无法处理：status_code 为应返回的 HTTP 状态码"""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[int] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+@dataclass
+class StoredResponse:
+    status_code: int
+    body: Any
+    headers: Dict[str, str] = field(default_factory=dict)
+
+    def storable(self) -> bool:
+        return self.status_code < 500 and self.status_code not in UNSTORED_STATUS_CODES
+
+
+async def request_fingerprint(request) -> str:
+    """
+    请求内容指纹：multipart 按字段名、字段值与文件内容摘要计算（与 boundary 无关），其它按原始请求体计算
+    读取上传文件后会复位文件指针，表单由 Starlette 缓存，后续处理可以再次读取
+    """
+    digest = hashlib.sha256()
+    content_type = request.headers.get("content-type", "")
+    if "multipart/form-data" in content_type or "application/x-www-form-urlencoded" in content_type:
+        form = await request.form()
+        for key, value in sorted(form.multi_items(), key=lambda item: item[0]):
+            digest.update(key.encode("utf-8") + b"\0")
+            if hasattr(value, "filename"):
+                await value.seek(0)
+                digest.update(hashlib.sha256(await value.read()).digest())
+                await value.seek(0)
+            else:
+                digest.update(str(value).encode("utf-8"))
+            digest.update(b"\0")
+    else:
+        digest.update(await request.body())
+    return digest.hexdigest()
+
+
+class MemoryIdempotencyBackend:
+    """进程内记录"""
+
+    def __init__(self):
+        self._records: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record["expires_at"] <= time.time():
+                del self._records[key]
+                return None
+            return record
+
+    def try_begin(self, key: str, fingerprint: str, lease_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record["expires_at"] > now:
+                return False
+            self._records[key] = {
+                "state": "in_progress", "fingerprint": fingerprint, "response": None,
+                "expires_at": now + lease_seconds,
+            }
+            if len(self._records) > 10000:
+                for k in [k for k, r in self._records.items() if r["expires_at"] <= now]:
+                    del self._records[k]
+            return True
+
+    def complete(self, key: str, fingerprint: str, response: StoredResponse, ttl_seconds: float):
+        with self._lock:
+            self._records[key] = {
+                "state": "done", "fingerprint": fingerprint,
+                "response": {"status_code": response.status_code, "body": response.body, "headers": response.headers},
+                "expires_at": time.time() + ttl_seconds,
+            }
+
+    def release(self, key: str):
+        with self._lock:
+            self._records.pop(key, None)
+
+
+class SQLiteIdempotencyBackend:
+    """基于 SQLite 的共享记录，占位使用 BEGIN IMMEDIATE 保证多进程间只有一个执行者"""
+
+    PRUNE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._calls = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            " idem_key TEXT PRIMARY KEY, state TEXT NOT NULL, fingerprint TEXT NOT NULL,"
+            " response TEXT, expires_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT state, fingerprint, response, expires_at FROM idempotency_keys WHERE idem_key = ?", (key,)
+        ).fetchone()
+        if row is None or row[3] <= time.time():
+            return None
+        return {
+            "state": row[0], "fingerprint": row[1],
+            "response": json.loads(row[2]) if row[2] else None, "expires_at": row[3],
+        }
+
+    def try_begin(self, key: str, fingerprint: str, lease_seconds: float) -> bool:
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT expires_at FROM idempotency_keys WHERE idem_key = ?", (key,)).fetchone()
+            if row is not None and row[0] > now:
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (idem_key, state, fingerprint, response, expires_at) "
+                "VALUES (?, 'in_progress', ?, NULL, ?)",
+                (key, fingerprint, now + lease_seconds),
+            )
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM idempotency_keys WHERE expires_at < ?", (now,))
+            conn.execute("COMMIT")
+            return True
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def complete(self, key: str, fingerprint: str, response: StoredResponse, ttl_seconds: float):
+        payload = json.dumps(
+            {"status_code": response.status_code, "body": response.body, "headers": response.headers},
+            ensure_ascii=False,
+        )
+        self._connection().execute(
+            "INSERT OR REPLACE INTO idempotency_keys (idem_key, state, fingerprint, response, expires_at) "
+            "VALUES (?, 'done', ?, ?, ?)",
+            (key, fingerprint, payload, time.time() + ttl_seconds),
+        )
+
+    def release(self, key: str):
+        self._connection().execute("DELETE FROM idempotency_keys WHERE idem_key = ?", (key,))
+
+
+class IdempotencyStore:
+    """幂等执行：本进程内的并发重复请求共享同一次执行（见 services/single_flight.py），跨进程通过后端记录协调"""
+
+    def __init__(self, backend, ttl_seconds: float, lease_seconds: float, wait_seconds: float):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.lease_seconds = lease_seconds
+        self.wait_seconds = wait_seconds
+        self._flights = SingleFlight()
+        self._offload = isinstance(backend, SQLiteIdempotencyBackend)
+        self.logger = get_proxy_logger()
+
+    async def _call(self, method, *args):
+        if self._offload:
+            # SQLite 事务可能等待文件锁，避免阻塞事件循环
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    @staticmethod
+    def _check_fingerprint(expected: str, actual: str):
+        if expected != actual:
+            raise IdempotencyError(422, "Idempotency-Key 已用于内容不同的请求")
+
+    async def run(
+        self,
+        key: str,
+        fingerprint: str,
+        factory: Callable[[], Awaitable[StoredResponse]],
+    ) -> Tuple[StoredResponse, bool]:
+        """
+        按幂等键执行 factory
+
+        Returns:
+            (响应, 是否为重放/共享的结果)
+        """
+        deadline = time.monotonic() + self.wait_seconds
+        while True:
+            if key in self._flights:
+                self._check_fingerprint(self._flights.context(key), fingerprint)
+                self.logger.info("幂等键请求执行中，等待原请求结果: %s", key)
+                response, _ = await self._flights.do(key, factory)
+                return response, True
+
+            record = await self._call(self.backend.get, key)
+            if record is not None:
+                self._check_fingerprint(record["fingerprint"], fingerprint)
+                if record["state"] == "done":
+                    response = record["response"]
+                    return StoredResponse(response["status_code"], response["body"], response["headers"]), True
+                # 其它 worker 正在执行
+                if time.monotonic() >= deadline:
+                    retry_after = max(1, int(record["expires_at"] - time.time()))
+                    raise IdempotencyError(409, "相同 Idempotency-Key 的请求仍在处理中", retry_after=min(retry_after, 30))
+                await asyncio.sleep(0.5)
+                continue
+
+            if await self._call(self.backend.try_begin, key, fingerprint, self.lease_seconds):
+                break
+
+        # 在独立任务中执行并保存结果：发起请求的客户端断开不会让等待中的重复请求失败，也不会丢失已创建的任务
+        async def execute() -> StoredResponse:
+            try:
+                response = await factory()
+            except BaseException:
+                await self._call(self.backend.release, key)
+                raise
+            if response.storable():
+                await self._call(self.backend.complete, key, fingerprint, response, self.ttl_seconds)
+            else:
+                await self._call(self.backend.release, key)
+            return response
+
+        return await self._flights.do(key, execute, context=fingerprint)
+
+_store: Optional[IdempotencyStore] = None
+
+
+def get_idempotency_store() -> IdempotencyStore:
+    global _store
+    if _store is None:
+        settings = get_settings()
+        if settings.idempotency_backend == "sqlite":
+            backend = SQLiteIdempotencyBackend(settings.idempotency_sqlite_path)
+        else:
+            backend = MemoryIdempotencyBackend()
+        _store = IdempotencyStore(
+            backend,
+            ttl_seconds=settings.idempotency_ttl_seconds,
+            lease_seconds=settings.idempotency_lease_seconds,
+            wait_seconds=settings.idempotency_wait_seconds,
+        )
+    return _store
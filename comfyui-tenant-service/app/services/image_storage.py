@@ -5,11 +5,13 @@
 import os
 import httpx
 import asyncio
+import time
 from datetime import datetime
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 from urllib.parse import urlparse
 from ..services.logger import get_image_storage_logger
+from ..services.metrics import get_metrics_registry
 
 try:
     from PIL import Image
@@ -18,10 +20,16 @@ except ImportError:  # pragma: no cover - optional dependency
 
 logger = get_image_storage_logger()
 
+_metrics = get_metrics_registry()
+download_seconds = _metrics.histogram("tenant_output_download_seconds", "输出文件下载耗时", ("kind", "outcome"))
+download_bytes = _metrics.counter("tenant_output_download_bytes_total", "下载的输出文件字节数", ("kind",))
+thumbnail_seconds = _metrics.histogram("tenant_thumbnail_seconds", "缩略图生成耗时", ("outcome",))
+
 class ImageStorageService:
     """图片存储服务"""
     
     THUMBNAIL_DIR_NAME = "thumbnail"
+    VIDEO_DIR_NAME = "video"
     THUMBNAIL_SIZE = (512, 512)
 
     def __init__(self, base_storage_path: str = "./output"):
@@ -48,7 +56,7 @@ class ImageStorageService:
         user_output_dir.mkdir(parents=True, exist_ok=True)
         thumbnail_dir = user_output_dir / self.THUMBNAIL_DIR_NAME
         thumbnail_dir.mkdir(parents=True, exist_ok=True)
-        video_dir = user_output_dir / "video"
+        video_dir = user_output_dir / self.VIDEO_DIR_NAME
         video_dir.mkdir(parents=True, exist_ok=True)
 
         image_types = {"png", "jpg", "jpeg", "gif", "webp"}
@@ -141,6 +149,7 @@ class ImageStorageService:
         Returns:
             本地文件路径，失败返回None
         """
+        started = time.perf_counter()
         try:
             # 生成文件名：精确到秒的时间戳
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -158,9 +167,12 @@ class ImageStorageService:
                     f.write(response.content)
                 
                 logger.info(f"图片下载完成: {local_path}")
+                download_seconds.observe(time.perf_counter() - started, kind="image", outcome="success")
+                download_bytes.inc(len(response.content), kind="image")
                 return local_path
                 
         except Exception as e:
+            download_seconds.observe(time.perf_counter() - started, kind="image", outcome="error")
             logger.error(f"下载图片失败 {image_url}: {str(e)}")
             return None
     
@@ -172,6 +184,7 @@ class ImageStorageService:
             logger.warning("Pillow 未安装，无法生成缩略图")
             return None
 
+        started = time.perf_counter()
         try:
             thumbnail_dir.mkdir(parents=True, exist_ok=True)
             target_path = thumbnail_dir / source_path.name
@@ -182,8 +195,10 @@ class ImageStorageService:
                 img.save(target_path, format=img_format)
 
             logger.info(f"缩略图生成完成: {target_path}")
+            thumbnail_seconds.observe(time.perf_counter() - started, outcome="success")
             return target_path
         except Exception as e:
+            thumbnail_seconds.observe(time.perf_counter() - started, outcome="error")
             logger.error(f"生成缩略图失败 {source_path}: {str(e)}")
             return None
 
@@ -259,6 +274,7 @@ class ImageStorageService:
         """
         下载任意二进制文件（如视频）
         """
+        started = time.perf_counter()
         try:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             filename = f"{timestamp}.{file_type}"
@@ -274,8 +290,11 @@ class ImageStorageService:
                     f.write(response.content)
 
             logger.info(f"文件下载完成: {local_path}")
+            download_seconds.observe(time.perf_counter() - started, kind="video", outcome="success")
+            download_bytes.inc(len(response.content), kind="video")
             return local_path
         except Exception as e:
+            download_seconds.observe(time.perf_counter() - started, kind="video", outcome="error")
             logger.error(f"下载文件失败 {file_url}: {str(e)}")
             return None
 
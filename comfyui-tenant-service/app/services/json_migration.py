@@ -0,0 +1,497 @@
+"""
+JSON 存储 → SQLite / MySQL 在线迁移
+流式读取 JSON 集合（逐条解析，不整体载入），按批写入目标库，并用行数与校验和核对结果。
+
+在线迁移步骤（服务全程可用）：
+1. 设置 STORAGE_DUAL_WRITE=sqlite（或 mysql）后重启服务：仍以 JSON 为准，新的写入同时写入目标库
+   （见 services/dual_write.py）
+2. python -m app.services.json_migration copy     复制已有数据（可重复执行）
+3. python -m app.services.json_migration verify   行数与校验和一致后即可切换
+4. 设置 STORAGE_TYPE=sqlite、清空 STORAGE_DUAL_WRITE 后重启服务
+
+重复执行是安全的：
+- 租户、用户按原 ID 导入，已存在的跳过；任务记录只覆盖目标库中仍为 PENDING 的记录（终态不会再变），
+  与双写并发时不会用旧状态覆盖新状态
+- 用量行没有自然键：已读到的位置与数据在同一事务中记录在目标库的 json_migration_state 表，
+  中断后从该位置继续；双写时已写入目标库的行在 api_usage.jsonl 中带 "mirrored" 标记，复制时跳过
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, MetaData, String, Table, Text, delete, func, insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .config import get_settings
+from .database_init import create_async_database_engine, create_schema
+from .logger import get_migration_logger
+
+COLLECTIONS = ("tenants", "users", "task_records", "api_usage")
+USAGE_LINES = "api_usage.jsonl"
+LEGACY_USAGE = "api_usage.json"
+MIRRORED = "mirrored"
+
+logger = get_migration_logger()
+
+# 迁移进度（只在目标库中使用，不属于服务的表结构）
+state_metadata = MetaData()
+migration_state = Table(
+    "json_migration_state",
+    state_metadata,
+    Column("name", String(100), primary_key=True),
+    Column("value", Text),
+)
+
+
+# ---------------------------------------------------------------------------
+# 流式读取
+# ---------------------------------------------------------------------------
+
+def iter_json_array(path: Path, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """逐个产出 JSON 数组中的元素，内存中只保留当前元素与一个读取块"""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, pos, eof = "", 0, False
+
+        def fill():
+            nonlocal buffer, pos, eof
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+        started = False
+        while True:
+            while pos < len(buffer) and (buffer[pos].isspace() or (started and buffer[pos] == ",")):
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    if started:
+                        raise ValueError(f"{path}: JSON 数组不完整")
+                    return  # 空文件
+                fill()
+                continue
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path}: 不是 JSON 数组")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()  # 元素跨越了读取块
+                continue
+            rest = buffer[end:].lstrip()
+            if not rest or rest[0] not in ",]":
+                # 数字等标量可能被读取块截断（"3." 会被解析为 3），读到后面的分隔符再解析
+                if eof:
+                    raise ValueError(f"{path}: JSON 数组格式错误")
+                fill()
+                continue
+            pos = end
+            yield item
+
+
+def iter_usage_lines(path: Path, offset: int = 0) -> Iterator[Tuple[Optional[Dict[str, Any]], int]]:
+    """从字节位置 offset 开始逐行读取 api_usage.jsonl，产出 (记录或 None, 该行结束位置)；不完整的最后一行留到下次"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                return
+            offset += len(line)
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None  # 进程被杀时可能留下半行
+            yield (record if isinstance(record, dict) else None), offset
+
+
+def collection_path(root: Path, collection: str) -> Path:
+    return root / f"{collection}.json"
+
+
+# ---------------------------------------------------------------------------
+# 记录转换与校验和
+# ---------------------------------------------------------------------------
+
+def _datetime(value) -> Optional[datetime]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _text(value) -> Optional[str]:
+    """对象按 JSON 文本保存（数据库中 settings / result_data / storage_paths 为 Text 列）"""
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+def to_row(collection: str, record: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON 存储的记录 → 目标表的行（保留原 ID；同一集合的行列名一致，可直接 executemany）"""
+    if collection == "tenants":
+        return {
+            "id": record.get("id"),
+            "name": record.get("name"),
+            "api_key": record.get("api_key"),
+            "is_active": bool(record.get("is_active", True)),
+            "created_at": _datetime(record.get("created_at")),
+            "updated_at": _datetime(record.get("updated_at")),
+            "settings": _text(record.get("settings")),
+        }
+    if collection == "users":
+        return {
+            "id": record.get("id"),
+            "username": record.get("username"),
+            "email": record.get("email"),
+            "hashed_password": record.get("hashed_password"),
+            "tenant_id": record.get("tenant_id"),
+            "is_active": bool(record.get("is_active", True)),
+            "created_at": _datetime(record.get("created_at")),
+            "last_login": _datetime(record.get("last_login")),
+        }
+    if collection == "task_records":
+        return {
+            "id": record.get("id"),
+            "tenant_task_id": record.get("tenant_task_id"),
+            "user_id": record.get("user_id"),
+            "runninghub_task_id": record.get("runninghub_task_id"),
+            "task_type": record.get("task_type"),
+            "created_at": _datetime(record.get("created_at")) or datetime.utcnow(),
+            "completed_at": _datetime(record.get("completed_at")),
+            "status": record.get("status") or "PENDING",
+            "result_data": _text(record.get("result_data")),
+            "storage_paths": _text(record.get("storage_paths")),
+            "error_message": record.get("error_message"),
+        }
+    if collection == "api_usage":
+        return {
+            "tenant_id": record.get("tenant_id"),
+            "user_id": record.get("user_id"),
+            "endpoint": record.get("endpoint"),
+            "request_count": record.get("request_count") or 1,
+            "created_at": _datetime(record.get("created_at")),
+        }
+    raise ValueError(f"Unknown collection: {collection}")
+
+
+def _canonical(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return value
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def fingerprint(collection: str, record: Dict[str, Any]) -> Tuple:
+    """两边共同比较的字段（时间戳的精度与时区因数据库而异，只在用量中按分钟比较）"""
+    if collection == "tenants":
+        return (record.get("id"), record.get("name"), record.get("api_key"),
+                bool(record.get("is_active")), _canonical(record.get("settings")))
+    if collection == "users":
+        return (record.get("id"), record.get("username"), record.get("email"), record.get("hashed_password"),
+                record.get("tenant_id"), bool(record.get("is_active")))
+    if collection == "task_records":
+        return (record.get("tenant_task_id"), record.get("user_id"), record.get("runninghub_task_id"),
+                record.get("task_type"), record.get("status"), _canonical(record.get("result_data")),
+                _canonical(record.get("storage_paths")), record.get("error_message"))
+    if collection == "api_usage":
+        created_at = _datetime(record.get("created_at"))
+        return (record.get("tenant_id"), record.get("user_id"), record.get("endpoint"),
+                record.get("request_count") or 1, created_at.strftime("%Y-%m-%dT%H:%M") if created_at else None)
+    raise ValueError(f"Unknown collection: {collection}")
+
+
+class Checksum:
+    """与顺序无关、允许重复的校验和：各行指纹哈希之和（mod 2^64）"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+
+    def add(self, collection: str, record: Dict[str, Any]):
+        digest = hashlib.sha1(json.dumps(fingerprint(collection, record), default=str).encode("utf-8")).digest()
+        self.total = (self.total + int.from_bytes(digest[:8], "big")) % (1 << 64)
+        self.count += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "checksum": f"{self.total:016x}"}
+
+
+# ---------------------------------------------------------------------------
+# 目标库
+# ---------------------------------------------------------------------------
+
+def target_settings(target: str, settings=None):
+    settings = settings or get_settings()
+    if target not in ("sqlite", "mysql"):
+        raise ValueError(f"迁移目标只能是 sqlite 或 mysql: {target!r}")
+    return settings.model_copy(update={"storage_type": target})
+
+
+def repository_class_for(target: str):
+    from .sql_repository import MySQLRepository, SQLiteRepository
+
+    return MySQLRepository if target == "mysql" else SQLiteRepository
+
+
+async def open_target(target: str, settings=None):
+    """目标库的异步引擎（建好服务的表与迁移进度表）"""
+    from ..models.database import Base
+
+    engine = create_async_database_engine(target_settings(target, settings))
+    await create_schema(engine, Base.metadata)
+    async with engine.begin() as conn:
+        await conn.run_sync(state_metadata.create_all)
+    return engine
+
+
+async def _load_position(session, name: str) -> int:
+    value = (await session.execute(select(migration_state.c.value).where(migration_state.c.name == name))).scalar()
+    return int(value) if value else 0
+
+
+async def _save_position(session, name: str, position: int):
+    await session.execute(delete(migration_state).where(migration_state.c.name == name))
+    await session.execute(insert(migration_state).values(name=name, value=str(position)))
+
+
+# ---------------------------------------------------------------------------
+# 复制
+# ---------------------------------------------------------------------------
+
+def _batches(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+async def copy_collection(sessions, repository_class, root: Path, collection: str, batch_size: int) -> Dict[str, Any]:
+    """租户 / 用户 / 任务记录：按批导入（可重复执行）"""
+    path = collection_path(root, collection)
+    if not path.exists():
+        return {"rows": 0, "batches": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    rows = batches = 0
+    for batch in _batches(iter_json_array(path), batch_size):
+        rows_batch = [to_row(collection, record) for record in batch if isinstance(record, dict)]
+        async with sessions() as session:
+            await repository_class(session).import_records(collection, rows_batch)
+        rows += len(rows_batch)
+        batches += 1
+        if batches % 20 == 0:
+            logger.info("迁移 %s: 已导入 %d 行", collection, rows)
+    seconds = time.perf_counter() - started
+    logger.info("迁移 %s 完成: %d 行, %d 批, %.1fs", collection, rows, batches, seconds)
+    return {"rows": rows, "batches": batches, "seconds": round(seconds, 2)}
+
+
+async def _copy_usage_batch(sessions, state_name: str, rows: List[Dict[str, Any]], position: int):
+    """用量行与读取位置在同一事务中提交：中断后不会重复也不会遗漏"""
+    from ..models.database import APIUsage
+
+    async with sessions() as session:
+        async with session.begin():
+            if rows:
+                await session.execute(insert(APIUsage.__table__), rows)
+            await _save_position(session, state_name, position)
+
+
+async def copy_usage(sessions, root: Path, batch_size: int) -> Dict[str, Any]:
+    """用量：旧版 api_usage.json（数组）与 api_usage.jsonl（逐行追加），从上次的位置继续"""
+    started = time.perf_counter()
+    copied = skipped = 0
+
+    legacy = root / LEGACY_USAGE
+    if legacy.exists():
+        async with sessions() as session:
+            done = await _load_position(session, LEGACY_USAGE)
+        index = 0
+        for batch in _batches(iter_json_array(legacy), batch_size):
+            first, index = index, index + len(batch)
+            pending = batch[max(0, done - first):] if index > done else []
+            if pending:
+                rows = [to_row("api_usage", record) for record in pending if isinstance(record, dict)]
+                await _copy_usage_batch(sessions, LEGACY_USAGE, rows, index)
+                copied += len(rows)
+
+    lines = root / USAGE_LINES
+    if lines.exists():
+        async with sessions() as session:
+            offset = await _load_position(session, USAGE_LINES)
+        rows: List[Dict[str, Any]] = []
+        position = offset
+        for record, position in iter_usage_lines(lines, offset):
+            if record is None or record.get(MIRRORED):
+                skipped += 1  # 半行，或双写时已写入目标库
+            else:
+                rows.append(to_row("api_usage", record))
+            if len(rows) >= batch_size:
+                await _copy_usage_batch(sessions, USAGE_LINES, rows, position)
+                copied += len(rows)
+                rows = []
+        if rows or position != offset:
+            await _copy_usage_batch(sessions, USAGE_LINES, rows, position)
+            copied += len(rows)
+
+    seconds = time.perf_counter() - started
+    logger.info("迁移 api_usage 完成: 新增 %d 行, 跳过 %d 行, %.1fs", copied, skipped, seconds)
+    return {"rows": copied, "skipped": skipped, "seconds": round(seconds, 2)}
+
+
+async def copy(target: str, collections: Sequence[str] = COLLECTIONS, batch_size: int = 1000,
+               source: Optional[str] = None) -> Dict[str, Any]:
+    """把 JSON 存储复制到目标库，返回各集合的统计"""
+    root = Path(source or get_settings().json_storage_path)
+    engine = await open_target(target)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    repository_class = repository_class_for(target)
+    results = {}
+    try:
+        for collection in collections:
+            if collection == "api_usage":
+                results[collection] = await copy_usage(sessions, root, batch_size)
+            else:
+                results[collection] = await copy_collection(sessions, repository_class, root, collection, batch_size)
+    finally:
+        await engine.dispose()
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 核对
+# ---------------------------------------------------------------------------
+
+def json_checksum(root: Path, collection: str) -> Checksum:
+    checksum = Checksum()
+    if collection == "api_usage":
+        legacy = root / LEGACY_USAGE
+        if legacy.exists():
+            for record in iter_json_array(legacy):
+                if isinstance(record, dict):
+                    checksum.add(collection, record)
+        lines = root / USAGE_LINES
+        if lines.exists():
+            for record, _ in iter_usage_lines(lines):
+                if record is not None:
+                    checksum.add(collection, record)
+        return checksum
+    path = collection_path(root, collection)
+    if path.exists():
+        for record in iter_json_array(path):
+            if isinstance(record, dict):
+                checksum.add(collection, record)
+    return checksum
+
+
+async def sql_checksum(sessions, collection: str) -> Checksum:
+    from ..models.database import APIUsage, Tenant, TenantTaskRecord, User
+
+    table = {"tenants": Tenant, "users": User, "task_records": TenantTaskRecord, "api_usage": APIUsage}[collection].__table__
+    checksum = Checksum()
+    async with sessions() as session:
+        result = await session.stream(select(table))
+        async for row in result.mappings():
+            checksum.add(collection, dict(row))
+    return checksum
+
+
+async def verify(target: str, collections: Sequence[str] = COLLECTIONS, source: Optional[str] = None) -> Dict[str, Any]:
+    """逐集合比较行数与校验和；双写期间有新写入时可能短暂不一致，重新执行即可"""
+    root = Path(source or get_settings().json_storage_path)
+    engine = await open_target(target)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    report = {}
+    try:
+        for collection in collections:
+            expected = await asyncio.to_thread(json_checksum, root, collection)
+            actual = await sql_checksum(sessions, collection)
+            report[collection] = {
+                "json": expected.to_dict(),
+                target: actual.to_dict(),
+                "match": expected.to_dict() == actual.to_dict(),
+            }
+    finally:
+        await engine.dispose()
+    return report
+
+
+async def status(target: str) -> Dict[str, Any]:
+    """目标库中各表的行数与用量读取位置"""
+    from ..models.database import APIUsage, Tenant, TenantTaskRecord, User
+
+    engine = await open_target(target)
+    sessions = async_sessionmaker(engine, expire_on_commit=False)
+    try:
+        async with sessions() as session:
+            counts = {
+                name: (await session.execute(select(func.count()).select_from(model.__table__))).scalar()
+                for name, model in (("tenants", Tenant), ("users", User), ("task_records", TenantTaskRecord), ("api_usage", APIUsage))
+            }
+            positions = {name: await _load_position(session, name) for name in (LEGACY_USAGE, USAGE_LINES)}
+    finally:
+        await engine.dispose()
+    return {"rows": counts, "usage_positions": positions}
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    settings = get_settings()
+    parser = argparse.ArgumentParser(description="JSON 存储迁移到 SQLite / MySQL")
+    parser.add_argument("command", choices=("copy", "verify", "status"))
+    parser.add_argument("--target", default=settings.storage_dual_write or None,
+                        help="sqlite / mysql，默认取 STORAGE_DUAL_WRITE；连接参数取 SQLITE_PATH / MYSQL_*")
+    parser.add_argument("--source", help="JSON 存储目录，默认取 JSON_STORAGE_PATH")
+    parser.add_argument("--collections", default=",".join(COLLECTIONS))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    if not args.target:
+        print("请用 --target 指定迁移目标（sqlite / mysql）", file=sys.stderr)
+        return 2
+    collections = [c.strip() for c in args.collections.split(",") if c.strip()]
+    unknown = [c for c in collections if c not in COLLECTIONS]
+    if unknown:
+        print(f"未知的集合: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    if args.command == "copy":
+        result = asyncio.run(copy(args.target, collections, args.batch_size, args.source))
+    elif args.command == "verify":
+        result = asyncio.run(verify(args.target, collections, args.source))
+    else:
+        result = asyncio.run(status(args.target))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.command == "verify" and not all(entry["match"] for entry in result.values()):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""
+JSON 文件存储仓库
+JSONStorage 的每次操作都是读改写整个文件：在线程池中执行并用一把锁串行化，避免并发写丢记录。
+JSONStorage 按文件签名缓存解析结果，返回给调用方的记录是副本，调用方修改不会污染缓存。
+"""
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .json_storage import JSONStorage
+from .repository import StorageRepository, _timed, new_tenant_task_id
+
+# JSONStorage 每次操作都读改写整个文件，线程之间必须串行
+_json_lock = threading.Lock()
+
+_json_storage: Optional[JSONStorage] = None
+
+
+def get_json_storage() -> JSONStorage:
+    global _json_storage
+    if _json_storage is None:
+        _json_storage = JSONStorage()
+    return _json_storage
+
+
+def _copy(record: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return dict(record) if record is not None else None
+
+
+class JSONRepository(StorageRepository):
+    """JSONStorage 的异步包装"""
+
+    backend = "json"
+
+    def __init__(self, storage: JSONStorage):
+        self.storage = storage
+
+    async def _run(self, method, *args):
+        def locked():
+            with _json_lock:
+                return method(*args)
+        return await asyncio.to_thread(locked)
+
+    # 用户
+    @_timed("get_user")
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return _copy(await self._run(self.storage.get_user_by_username, username))
+
+    @_timed("get_user")
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return _copy(await self._run(self.storage.get_user_by_email, email))
+
+    @_timed("create_user")
+    async def create_user(self, username: str, password_hash: str, tenant_id: int, email: str = None) -> Dict[str, Any]:
+        return _copy(await self._run(self.storage.create_user, username, password_hash, tenant_id, email))
+
+    # 租户
+    @_timed("get_tenant")
+    async def get_tenant_by_id(self, tenant_id: int) -> Optional[Dict[str, Any]]:
+        return _copy(await self._run(self.storage.get_tenant_by_id, tenant_id))
+
+    @_timed("get_tenant")
+    async def get_tenant_by_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        return _copy(await self._run(self.storage.get_tenant_by_api_key, api_key))
+
+    @_timed("create_tenant")
+    async def create_tenant(self, name: str, settings: str = "{}", tenant_id: int = None) -> Dict[str, Any]:
+        return _copy(await self._run(self.storage.create_tenant, name, settings))
+
+    # 任务记录
+    @_timed("create_task_records")
+    async def create_task_records(
+        self, user_id: str, runninghub_task_ids: List[str], task_type: str = None
+    ) -> List[str]:
+        tenant_task_ids = [new_tenant_task_id() for _ in runninghub_task_ids]
+        if not tenant_task_ids:
+            return []
+        await self._run(self.storage.create_task_records, [
+            {
+                "tenant_task_id": tenant_task_id,
+                "user_id": user_id,
+                "runninghub_task_id": runninghub_task_id,
+                "task_type": task_type,
+            }
+            for tenant_task_id, runninghub_task_id in zip(tenant_task_ids, runninghub_task_ids)
+        ])
+        return tenant_task_ids
+
+    @_timed("get_task_record")
+    async def get_task_record(self, tenant_task_id: str) -> Optional[Dict[str, Any]]:
+        return _copy(await self._run(self.storage.get_task_record_by_tenant_id, tenant_task_id))
+
+    @_timed("get_tasks_by_runninghub_ids")
+    async def get_tasks_by_runninghub_ids(
+        self, user_id: str, runninghub_task_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        if not runninghub_task_ids:
+            return {}
+        records = await self._run(self.storage.get_tasks_by_runninghub_ids, user_id, runninghub_task_ids)
+        return {record["runninghub_task_id"]: dict(record) for record in records}
+
+    @_timed("get_user_tasks")
+    async def get_user_tasks(
+        self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None
+    ) -> List[Dict[str, Any]]:
+        records = await self._run(self.storage.get_user_tasks, user_id, limit, offset, task_type)
+        return [dict(record) for record in records]
+
+    @_timed("get_pending_tasks")
+    async def get_pending_tasks(self, limit: int = 500) -> List[Dict[str, Any]]:
+        return [dict(record) for record in await self._run(self.storage.get_pending_tasks, limit)]
+
+    @_timed("get_task_outputs")
+    async def get_task_outputs(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        records = await self._run(self.storage.get_task_outputs, after_id, limit)
+        return [
+            {key: record.get(key) for key in ("id", "user_id", "task_type", "created_at", "completed_at", "storage_paths")}
+            for record in records
+        ]
+
+    @_timed("update_task_success")
+    async def update_task_success(
+        self, tenant_task_id: str, result_data: Dict[str, Any], storage_paths: List[Any]
+    ) -> bool:
+        return await self._run(self.storage.update_task_success, tenant_task_id, result_data, storage_paths)
+
+    @_timed("update_task_failed")
+    async def update_task_failed(self, tenant_task_id: str, error_message: str) -> bool:
+        return await self._run(self.storage.update_task_failed, tenant_task_id, error_message)
+
+    @_timed("update_task_runninghub_id")
+    async def update_task_runninghub_id(self, tenant_task_id: str, runninghub_task_id: str) -> bool:
+        return await self._run(self.storage.update_task_runninghub_id, tenant_task_id, runninghub_task_id)
+
+    # 用量统计（api_usage.jsonl 只追加，不参与整文件读改写，不需要持锁）
+    @_timed("append_api_usage")
+    async def append_api_usage(self, rows: List[Dict[str, Any]]):
+        if rows:
+            await asyncio.to_thread(self.storage.append_api_usage, rows)
+
+    @_timed("get_api_usage")
+    async def get_api_usage(self, tenant_id: int, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        return await asyncio.to_thread(self.storage.get_api_usage, tenant_id, start, end)
@@ -1,38 +1,62 @@
 import json
+import os
 import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from .config import get_settings
 from .logger import get_main_logger
 
 class JSONStorage:
+    # 解析结果按 (mtime_ns, size) 缓存：文件没变就不重新解析（其它进程写入会改变签名）。
+    # 缓存的列表会被读改写方法就地修改，调用方（JSONRepository）负责串行化并复制返回的记录。
+    _cache: Dict[Path, Tuple[Tuple[int, int], List[Dict]]] = {}
+
     def __init__(self):
         self.settings = get_settings()
         self.logger = get_main_logger()
         self.db_path = Path(self.settings.json_storage_path)
         self.db_path.mkdir(parents=True, exist_ok=True)
     
+    @staticmethod
+    def _signature(file_path: Path) -> Optional[Tuple[int, int]]:
+        try:
+            stat = file_path.stat()
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
     def _load_data(self, filename: str) -> List[Dict]:
-        """Load data from JSON file"""
+        """Load data from JSON file (cached until the file changes)"""
         file_path = self.db_path / f"{filename}.json"
-        if not file_path.exists():
+        signature = self._signature(file_path)
+        if signature is None:
             return []
+        cached = self._cache.get(file_path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
         
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+                data = json.load(f)
         except Exception as e:
             self.logger.error(f"Failed to load {filename}: {str(e)}")
             return []
+        self._cache[file_path] = (signature, data)
+        return data
     
     def _save_data(self, filename: str, data: List[Dict]):
-        """Save data to JSON file"""
+        """Save data to JSON file (write a temp file, then rename so readers never see a partial file)"""
         file_path = self.db_path / f"{filename}.json"
+        temp_path = file_path.with_suffix(".json.tmp")
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
+            with open(temp_path, 'w', encoding='utf-8') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2, default=str)
+            os.replace(temp_path, file_path)
+            self._cache[file_path] = (self._signature(file_path), data)
         except Exception as e:
+            # 缓存中的列表可能已被就地修改，丢弃后下次从文件重新读取
+            self._cache.pop(file_path, None)
             self.logger.error(f"Failed to save {filename}: {str(e)}")
     
     # Tenant operations
@@ -120,22 +144,47 @@ class JSONStorage:
                 break
         self._save_data("users", users)
     
-    # Usage tracking
+    # Usage tracking（按分钟聚合后追加写入 api_usage.jsonl，见 services/usage_accounting.py）
     def log_api_usage(self, tenant_id: int, user_id: int, endpoint: str):
-        """Log API usage"""
-        usage = self._load_data("api_usage")
-        
-        usage_record = {
-            "id": len(usage) + 1,
+        """Log a single API call"""
+        self.append_api_usage([{
             "tenant_id": tenant_id,
             "user_id": user_id,
             "endpoint": endpoint,
             "request_count": 1,
-            "created_at": datetime.utcnow().isoformat()
-        }
-        
-        usage.append(usage_record)
-        self._save_data("api_usage", usage)
+            "created_at": datetime.utcnow(),
+        }])
+
+    def append_api_usage(self, rows: List[Dict]):
+        """Append aggregated usage rows (one JSON object per line)"""
+        file_path = self.db_path / "api_usage.jsonl"
+        lines = []
+        for row in rows:
+            created_at = row["created_at"]
+            lines.append(json.dumps({
+                **row,
+                "created_at": created_at.isoformat() if isinstance(created_at, datetime) else created_at,
+            }, ensure_ascii=False))
+        with open(file_path, 'a', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+
+    def get_api_usage(self, tenant_id: int, start: datetime, end: datetime) -> List[Dict]:
+        """Aggregated usage rows of a tenant with start <= created_at < end"""
+        file_path = self.db_path / "api_usage.jsonl"
+        if not file_path.exists():
+            return []
+        rows = []
+        with open(file_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                    created_at = datetime.fromisoformat(row["created_at"])
+                except (ValueError, KeyError, TypeError):
+                    continue  # 进程被杀时可能留下半行
+                if row.get("tenant_id") == tenant_id and start <= created_at < end:
+                    row["created_at"] = created_at
+                    rows.append(row)
+        return rows
     
     # Task record operations
     def create_task_record(self, tenant_task_id: str, user_id: str, runninghub_task_id: str, task_type: str = None) -> Dict:
@@ -161,6 +210,31 @@ class JSONStorage:
         self.logger.info(f"Created task record: {tenant_task_id}")
         return task_record
     
+    def create_task_records(self, entries: List[Dict]) -> List[Dict]:
+        """Create several task records with a single load/save of the task file"""
+        task_records = self._load_data("task_records")
+        now = datetime.utcnow().isoformat()
+        created = []
+        for entry in entries:
+            task_record = {
+                "id": len(task_records) + 1,
+                "tenant_task_id": entry["tenant_task_id"],
+                "user_id": entry["user_id"],
+                "runninghub_task_id": entry["runninghub_task_id"],
+                "task_type": entry.get("task_type"),
+                "status": "PENDING",
+                "created_at": now,
+                "completed_at": None,
+                "result_data": None,
+                "storage_paths": None,
+                "error_message": None
+            }
+            task_records.append(task_record)
+            created.append(task_record)
+        self._save_data("task_records", task_records)
+        self.logger.info(f"Created {len(created)} task records")
+        return created
+
     def get_task_record_by_tenant_id(self, tenant_task_id: str) -> Optional[Dict]:
         """Get task record by tenant task ID"""
         task_records = self._load_data("task_records")
@@ -202,10 +276,50 @@ class JSONStorage:
         self._save_data("task_records", task_records)
         self.logger.info(f"Updated task record to failed: {tenant_task_id}")
         return True
+
+    def update_task_runninghub_id(self, tenant_task_id: str, runninghub_task_id: str) -> bool:
+        """Point a task record at the RunningHub task ID its queue ticket was dispatched as"""
+        task_records = self._load_data("task_records")
+
+        for task_record in task_records:
+            if task_record.get("tenant_task_id") == tenant_task_id:
+                task_record["runninghub_task_id"] = runninghub_task_id
+                break
+        else:
+            self.logger.error(f"Task record not found: {tenant_task_id}")
+            return False
+
+        self._save_data("task_records", task_records)
+        self.logger.info(f"Updated task record RunningHub ID: {tenant_task_id} -> {runninghub_task_id}")
+        return True
     
-    def get_user_tasks(self, user_id: str, limit: int = 50, offset: int = 0) -> List[Dict]:
+    def get_tasks_by_runninghub_ids(self, user_id: str, runninghub_task_ids: List[str]) -> List[Dict]:
+        """Get the user's task records matching the given RunningHub task IDs"""
+        wanted = set(runninghub_task_ids)
+        task_records = self._load_data("task_records")
+        return [
+            t for t in task_records
+            if t.get("user_id") == user_id and t.get("runninghub_task_id") in wanted
+        ]
+
+    def get_pending_tasks(self, limit: int = 500) -> List[Dict]:
+        """Get the oldest task records that are still PENDING (all users)"""
+        task_records = self._load_data("task_records")
+        pending = [t for t in task_records if t.get("status") == "PENDING"]
+        return sorted(pending, key=lambda x: (x.get("created_at", ""), x.get("id", 0)))[:limit]
+
+    def get_task_outputs(self, after_id: int = 0, limit: int = 1000) -> List[Dict]:
+        """Task records with stored outputs and id > after_id, ordered by id"""
+        task_records = self._load_data("task_records")
+        with_outputs = [t for t in task_records if t.get("storage_paths") and t.get("id", 0) > after_id]
+        return sorted(with_outputs, key=lambda x: x.get("id", 0))[:limit]
+
+    def get_user_tasks(self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None) -> List[Dict]:
         """Get user's task records"""
         task_records = self._load_data("task_records")
-        user_tasks = [t for t in task_records if t.get("user_id") == user_id]
-        sorted_tasks = sorted(user_tasks, key=lambda x: x.get("created_at", ""), reverse=True)
+        user_tasks = [
+            t for t in task_records
+            if t.get("user_id") == user_id and (not task_type or t.get("task_type") == task_type)
+        ]
+        sorted_tasks = sorted(user_tasks, key=lambda x: (x.get("created_at", ""), x.get("id", 0)), reverse=True)
         return sorted_tasks[offset:offset + limit]
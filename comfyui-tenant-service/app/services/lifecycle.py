@@ -0,0 +1,97 @@
+"""
+服务启动与健康检查
+- 启动按阶段计时：日志 "启动阶段 <phase>: <ms>" 与 /metrics 的 tenant_startup_phase_seconds
+- 存储初始化（建库、建表、连接池）在后台进行，失败按退避重试；worker 不等数据库即可响应健康检查：
+  GET /health/live   进程在运行即 200
+  GET /health/ready  存储初始化完成才 200，否则 503（负载均衡据此决定是否转发流量）
+- 就绪前到达的请求在第一次访问存储时等待同一次初始化（见 models/database.py 的 init_storage）
+"""
+import asyncio
+import contextlib
+import time
+from typing import Any, Dict, Optional
+
+from .config import get_settings
+from .logger import get_main_logger
+from .metrics import get_metrics_registry
+
+logger = get_main_logger()
+
+startup_phase_seconds = get_metrics_registry().gauge(
+    "tenant_startup_phase_seconds", "启动各阶段耗时", ("phase",)
+)
+
+RETRY_MAX_SECONDS = 30.0
+
+
+@contextlib.contextmanager
+def startup_phase(name: str):
+    """记录一个启动阶段的耗时（失败的阶段同样记录）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        startup_phase_seconds.set(seconds, phase=name)
+        logger.info("启动阶段 %s: %.1fms", name, seconds * 1000)
+
+
+class StorageBootstrap:
+    """后台初始化存储，失败时按 1s, 2s, 4s ... 最多 RETRY_MAX_SECONDS 的间隔重试"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        from ..models.database import init_storage
+
+        started = time.perf_counter()
+        delay = 1.0
+        while True:
+            self.attempts += 1
+            try:
+                await init_storage()
+            except Exception as e:
+                self.error = str(e)
+                logger.warning("存储初始化失败（第 %d 次，%.0fs 后重试）: %s", self.attempts, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RETRY_MAX_SECONDS)
+                continue
+            self.error = None
+            seconds = time.perf_counter() - started
+            startup_phase_seconds.set(seconds, phase="storage_ready")
+            logger.info("存储就绪: %.1fms（第 %d 次尝试）", seconds * 1000, self.attempts)
+            return
+
+    def status(self) -> Dict[str, Any]:
+        from ..models.database import storage_ready
+
+        return {
+            "ready": storage_ready(),
+            "storage": get_settings().storage_type,
+            "attempts": self.attempts,
+            "error": self.error,
+        }
+
+
+_storage_bootstrap: Optional[StorageBootstrap] = None
+
+
+def get_storage_bootstrap() -> StorageBootstrap:
+    global _storage_bootstrap
+    if _storage_bootstrap is None:
+        _storage_bootstrap = StorageBootstrap()
+    return _storage_bootstrap
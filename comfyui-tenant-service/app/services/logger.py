@@ -1,58 +1,189 @@
+"""
+日志子系统
+启动时配置一次：业务代码只把日志记录放入队列（QueueHandler），
+由后台线程（QueueListener）按服务名写入按小时轮转的日志文件
+"""
+import atexit
 import logging
-import os
-from datetime import datetime
+import logging.handlers
+import queue
+import threading
 from pathlib import Path
+from typing import Dict, Optional
+
+LOGGER_PREFIX = "tenant_service"
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_service_loggers: Dict[str, "ServiceLogger"] = {}
+
+
+class _ServiceFileRouter(logging.Handler):
+    """
+    在监听线程中运行：按日志记录所属服务分发到各自的轮转文件
+    logs/<service>/<service>.log，每小时轮转一次
+    """
+
+    def __init__(self, log_dir: Path, backup_count: int):
+        super().__init__()
+        self.log_dir = log_dir
+        self.backup_count = backup_count
+        self._handlers: Dict[str, logging.Handler] = {}
+        self._formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+
+    def _handler_for(self, service_name: str) -> logging.Handler:
+        handler = self._handlers.get(service_name)
+        if handler is None:
+            service_dir = self.log_dir / service_name
+            service_dir.mkdir(parents=True, exist_ok=True)
+            handler = logging.handlers.TimedRotatingFileHandler(
+                service_dir / f"{service_name}.log",
+                when="H",
+                backupCount=self.backup_count,
+                encoding="utf-8",
+                delay=True,
+            )
+            handler.setFormatter(self._formatter)
+            self._handlers[service_name] = handler
+        return handler
+
+    def emit(self, record: logging.LogRecord):
+        service_name = record.name.split(".", 1)[-1]
+        try:
+            self._handler_for(service_name).handle(record)
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        for handler in self._handlers.values():
+            handler.close()
+        self._handlers.clear()
+        super().close()
+
+
+def _resolve_level(level) -> int:
+    if isinstance(level, int):
+        return level
+    resolved = logging.getLevelName(str(level).upper())
+    return resolved if isinstance(resolved, int) else logging.INFO
+
+
+def setup_logging(level: Optional[str] = None, log_dir: Optional[str] = None, backup_count: Optional[int] = None):
+    """
+    配置日志子系统（幂等，多次调用只会调整日志级别）
+
+    Args:
+        level: 日志级别，默认取 Settings.log_level
+        log_dir: 日志根目录，默认取 Settings.log_dir
+        backup_count: 每个服务保留的轮转文件数量，默认取 Settings.log_backup_count
+    """
+    global _listener, _queue_handler
+
+    with _lock:
+        if level is None or log_dir is None or backup_count is None:
+            from .config import get_settings
+            settings = get_settings()
+            level = settings.log_level if level is None else level
+            log_dir = settings.log_dir if log_dir is None else log_dir
+            backup_count = settings.log_backup_count if backup_count is None else backup_count
+
+        root = logging.getLogger(LOGGER_PREFIX)
+        root.setLevel(_resolve_level(level))
+
+        if _listener is not None:
+            return
+
+        log_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        _queue_handler = logging.handlers.QueueHandler(log_queue)
+        root.addHandler(_queue_handler)
+        root.propagate = False
+
+        router = _ServiceFileRouter(Path(log_dir), backup_count)
+        _listener = logging.handlers.QueueListener(log_queue, router, respect_handler_level=False)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """停止后台写日志线程，并刷新队列中剩余的日志"""
+    global _listener, _queue_handler
+
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        logging.getLogger(LOGGER_PREFIX).removeHandler(_queue_handler)
+        _listener = None
+        _queue_handler = None
+
 
 class ServiceLogger:
+    """
+    服务日志器：对 logging.Logger 的轻量封装
+    支持 %-风格的惰性格式化：logger.info("任务 %s 完成", task_id)
+    """
+
     def __init__(self, service_name: str):
         self.service_name = service_name
-        self.log_dir = Path("logs") / service_name
-        self.log_dir.mkdir(parents=True, exist_ok=True)
-        
-        # Create hourly log file
-        now = datetime.now()
-        log_filename = f"{now.strftime('%Y%m%d%H')}.log"
-        log_path = self.log_dir / log_filename
-        
-        # Configure logger
-        self.logger = logging.getLogger(f"{service_name}_{now.strftime('%Y%m%d%H')}")
-        self.logger.setLevel(logging.DEBUG)
-        
-        if not self.logger.handlers:
-            handler = logging.FileHandler(log_path, encoding='utf-8')
-            formatter = logging.Formatter(
-                '%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S'
-            )
-            handler.setFormatter(formatter)
-            self.logger.addHandler(handler)
-    
-    def debug(self, message: str):
-        self.logger.debug(message)
-    
-    def info(self, message: str):
-        self.logger.info(message)
-    
-    def warning(self, message: str):
-        self.logger.warning(message)
-    
-    def error(self, message: str):
-        self.logger.error(message)
+        self.logger = logging.getLogger(f"{LOGGER_PREFIX}.{service_name}")
+
+    def isEnabledFor(self, level: int) -> bool:
+        return self.logger.isEnabledFor(level)
+
+    def debug(self, message, *args, **kwargs):
+        self.logger.debug(message, *args, **kwargs)
+
+    def info(self, message, *args, **kwargs):
+        self.logger.info(message, *args, **kwargs)
+
+    def warning(self, message, *args, **kwargs):
+        self.logger.warning(message, *args, **kwargs)
+
+    def error(self, message, *args, **kwargs):
+        self.logger.error(message, *args, **kwargs)
+
+    def exception(self, message, *args, **kwargs):
+        self.logger.exception(message, *args, **kwargs)
+
+
+def get_service_logger(service_name: str) -> ServiceLogger:
+    """获取（并缓存）指定服务的日志器；首次使用时自动完成日志子系统配置"""
+    service_logger = _service_loggers.get(service_name)
+    if service_logger is None:
+        if _listener is None:
+            setup_logging()
+        service_logger = _service_loggers.setdefault(service_name, ServiceLogger(service_name))
+    return service_logger
+
 
 def get_auth_logger():
-    return ServiceLogger("auth")
+    return get_service_logger("auth")
 
 def get_tenant_logger():
-    return ServiceLogger("tenant")
+    return get_service_logger("tenant")
 
 def get_proxy_logger():
-    return ServiceLogger("proxy")
+    return get_service_logger("proxy")
 
 def get_main_logger():
-    return ServiceLogger("main")
+    return get_service_logger("main")
 
 def get_task_record_logger():
-    return ServiceLogger("task_record")
+    return get_service_logger("task_record")
 
 def get_image_storage_logger():
-    return ServiceLogger("image_storage")
\ No newline at end of file
+    return get_service_logger("image_storage")
+
+def get_finalizer_logger():
+    return get_service_logger("finalizer")
+
+def get_migration_logger():
+    return get_service_logger("migration")
+
+def get_gc_logger():
+    return get_service_logger("gc")
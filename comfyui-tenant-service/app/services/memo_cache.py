@@ -0,0 +1,90 @@
+"""
+异步记忆化缓存
+带 TTL 与 LRU 上限，并对相同键的并发请求做单飞（single-flight）合并（见 services/single_flight.py）
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from .single_flight import SingleFlight
+
+
+class AsyncMemoCache:
+    """进程内异步记忆化缓存"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 1800):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        """读取未过期的缓存值，未命中返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl_seconds: Optional[float] = None):
+        """写入缓存并按 LRU 淘汰超出上限的条目"""
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: str):
+        self._entries.pop(key, None)
+
+    async def get_or_compute(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Any]],
+        refresh: bool = False,
+    ) -> Tuple[Any, str]:
+        """
+        获取缓存值，未命中时调用 factory 计算并写入缓存
+
+        Args:
+            key: 缓存键
+            factory: 无参异步函数，返回待缓存的值；抛出异常时不写入缓存
+            refresh: 为 True 时跳过已有缓存强制重新计算（仍会合并并发请求）
+
+        Returns:
+            (值, 来源)，来源为 "hit" / "coalesced" / "miss"
+        """
+        if not refresh:
+            value = self.get(key)
+            if value is not None:
+                self.hits += 1
+                return value, "hit"
+
+        # 计算在独立任务中完成并写入缓存：发起请求的客户端断开不会让合并进来的请求失败
+        async def compute():
+            value = await factory()
+            self.set(key, value)
+            return value
+
+        if key in self._flights:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        value, shared = await self._flights.do(key, compute)
+        return value, "coalesced" if shared else "miss"
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._entries),
+            "inflight": len(self._flights),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,381 @@
+"""
+输出文件清理：保留期限、租户配额与孤儿文件
+output/<用户>/ 的原图、thumbnail/ 下的同名缩略图与 video/ 下的视频只增不减，后台定时清理：
+- 保留期限：按任务类型配置保留天数（GC_RETENTION_DAYS，"*" 为其他类型），从任务完成时间起算
+- 租户配额：租户下所有用户的输出总量超过配额时，从最旧的文件开始删除，直到回到配额以内
+- 孤儿文件：不被任何任务记录引用、且修改时间超过 GC_ORPHAN_GRACE_HOURS 的文件
+  （宽限期内的文件可能刚下载、尚未写入任务记录）
+原图与同名缩略图作为一组删除；删除按 GC_DELETE_PER_SECOND 限速，避免 I/O 峰值，单次最多 GC_MAX_DELETES_PER_RUN 组。
+任务记录保持不变（result_data 中仍保留 RunningHub 的原始地址）。
+
+试运行：python -m app.services.output_gc 只输出报告，加 --apply 才删除；GC_DRY_RUN=true 时后台任务同样只输出报告。
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .config import get_settings
+from .image_storage import ImageStorageService, image_storage_service
+from .logger import get_gc_logger
+from .metrics import get_metrics_registry
+
+REASONS = ("orphan", "retention", "quota")
+REPORT_EXAMPLES = 5
+REFERENCE_PAGE = 1000
+
+
+@dataclass
+class OutputGroup:
+    """一个输出文件及其缩略图（单独残留的缩略图自成一组）"""
+
+    user: str
+    paths: List[Path]
+    size: int
+    mtime: float
+    task_type: Optional[str] = None
+    finished_at: Optional[datetime] = None  # 引用它的任务的完成时间，None 表示没有任务记录引用
+    reason: Optional[str] = None
+
+    @property
+    def referenced(self) -> bool:
+        return self.finished_at is not None
+
+    def age_key(self) -> float:
+        return self.finished_at.timestamp() if self.finished_at else self.mtime
+
+
+@dataclass
+class GCPlan:
+    groups: List[OutputGroup]
+    deletions: List[OutputGroup]
+    tenants: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    truncated: int = 0
+
+
+def path_key(path) -> str:
+    """任务记录中的路径与扫描得到的路径统一为绝对路径（记录可能是 Windows 风格的相对路径）"""
+    return os.path.normcase(os.path.abspath(str(path).replace("\\", "/")))
+
+
+# ---------------------------------------------------------------------------
+# 扫描与引用
+# ---------------------------------------------------------------------------
+
+def _files(directory: Path) -> Dict[str, os.DirEntry]:
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name: entry for entry in entries if entry.is_file(follow_symlinks=False)}
+    except FileNotFoundError:
+        return {}
+
+
+def scan_output_store(base: Path) -> List[OutputGroup]:
+    """遍历 output/<用户>/、thumbnail/、video/，按原图 + 同名缩略图分组"""
+    groups = []
+    try:
+        user_dirs = [entry for entry in os.scandir(base) if entry.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return groups
+    for user_dir in user_dirs:
+        if user_dir.name == ImageStorageService.THUMBNAIL_DIR_NAME:
+            continue
+        root = Path(user_dir.path)
+        thumbnails = _files(root / ImageStorageService.THUMBNAIL_DIR_NAME)
+        originals = list(_files(root).values()) + list(_files(root / ImageStorageService.VIDEO_DIR_NAME).values())
+        for entry in originals:
+            members = [entry]
+            thumbnail = thumbnails.pop(entry.name, None) if Path(entry.path).parent == root else None
+            if thumbnail is not None:
+                members.append(thumbnail)
+            stats = [member.stat(follow_symlinks=False) for member in members]
+            groups.append(OutputGroup(
+                user=user_dir.name,
+                paths=[Path(member.path) for member in members],
+                size=sum(stat.st_size for stat in stats),
+                mtime=max(stat.st_mtime for stat in stats),
+            ))
+        for entry in thumbnails.values():
+            stat = entry.stat(follow_symlinks=False)
+            groups.append(OutputGroup(user=user_dir.name, paths=[Path(entry.path)], size=stat.st_size, mtime=stat.st_mtime))
+    return groups
+
+
+def _parse_time(value) -> Optional[datetime]:
+    if not value:
+        return None
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def _storage_entries(value) -> Iterable[str]:
+    """storage_paths 中的原图与缩略图路径（与 /proxy/history 的解析一致）"""
+    if isinstance(value, str):
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = [value]
+    if not isinstance(value, list):
+        value = [value]
+    for entry in value:
+        if isinstance(entry, dict):
+            for key in ("original", "localPath", "thumbnail", "thumbnailPath"):
+                if entry.get(key):
+                    yield entry[key]
+        elif entry:
+            yield entry
+
+
+async def load_references(repo) -> Dict[str, Tuple[Optional[str], datetime]]:
+    """路径 -> (任务类型, 完成时间)，按 id 分页遍历全部有输出的任务记录"""
+    references: Dict[str, Tuple[Optional[str], datetime]] = {}
+    after_id = 0
+    while True:
+        records = await repo.get_task_outputs(after_id, REFERENCE_PAGE)
+        if not records:
+            return references
+        for record in records:
+            finished_at = _parse_time(record.get("completed_at")) or _parse_time(record.get("created_at")) or datetime.now()
+            for path in _storage_entries(record.get("storage_paths")):
+                key = path_key(path)
+                known = references.get(key)
+                if known is None or known[1] < finished_at:
+                    references[key] = (record.get("task_type"), finished_at)
+        after_id = records[-1]["id"]
+
+
+# ---------------------------------------------------------------------------
+# 清理计划
+# ---------------------------------------------------------------------------
+
+def _quota_bytes(settings, tenant_id) -> int:
+    quota_mb = settings.gc_tenant_quota_mb.get(str(tenant_id), settings.gc_default_quota_mb)
+    return int(quota_mb * 1024 * 1024) if quota_mb and quota_mb > 0 else 0
+
+
+def build_plan(
+    groups: List[OutputGroup],
+    references: Dict[str, Tuple[Optional[str], datetime]],
+    tenant_of_user: Dict[str, Any],
+    settings=None,
+    now: Optional[float] = None,
+) -> GCPlan:
+    """标记每组文件的删除原因：孤儿文件与超过保留期限的先删，其余按租户配额从最旧的删起"""
+    settings = settings or get_settings()
+    now = now if now is not None else time.time()
+    current = datetime.fromtimestamp(now)
+    orphan_grace = settings.gc_orphan_grace_hours * 3600
+
+    for group in groups:
+        for path in group.paths:
+            reference = references.get(path_key(path))
+            if reference and (group.finished_at is None or group.finished_at < reference[1]):
+                group.task_type, group.finished_at = reference
+        if not group.referenced:
+            if orphan_grace > 0 and now - group.mtime > orphan_grace:
+                group.reason = "orphan"
+            continue
+        retention_days = settings.gc_retention_days.get(group.task_type or "", settings.gc_retention_days.get("*"))
+        if retention_days and retention_days > 0 and current - group.finished_at > timedelta(days=retention_days):
+            group.reason = "retention"
+
+    tenants: Dict[str, Dict[str, Any]] = {}
+    by_tenant: Dict[str, List[OutputGroup]] = {}
+    for group in groups:
+        tenant_id = tenant_of_user.get(group.user)
+        by_tenant.setdefault(str(tenant_id) if tenant_id is not None else "unknown", []).append(group)
+    for tenant, tenant_groups in by_tenant.items():
+        total = sum(group.size for group in tenant_groups)
+        remaining = total - sum(group.size for group in tenant_groups if group.reason)
+        quota = _quota_bytes(settings, tenant) if tenant != "unknown" else 0
+        if quota and remaining > quota:
+            # 宽限期内未被引用的文件可能是正在完成的任务，不因配额删除
+            candidates = sorted(
+                (group for group in tenant_groups if not group.reason and group.referenced),
+                key=OutputGroup.age_key,
+            )
+            for group in candidates:
+                if remaining <= quota:
+                    break
+                group.reason = "quota"
+                remaining -= group.size
+        tenants[tenant] = {"bytes": total, "quota_bytes": quota, "bytes_after": remaining}
+
+    deletions = [group for reason in REASONS for group in groups if group.reason == reason]
+    limit = max(settings.gc_max_deletes_per_run, 0)
+    truncated = max(len(deletions) - limit, 0)
+    return GCPlan(groups=groups, deletions=deletions[:limit], tenants=tenants, truncated=truncated)
+
+
+def plan_report(plan: GCPlan) -> Dict[str, Any]:
+    planned = {}
+    for reason in REASONS:
+        selected = [group for group in plan.deletions if group.reason == reason]
+        planned[reason] = {
+            "groups": len(selected),
+            "files": sum(len(group.paths) for group in selected),
+            "bytes": sum(group.size for group in selected),
+            "examples": [str(group.paths[0]) for group in selected[:REPORT_EXAMPLES]],
+        }
+    return {
+        "scanned": {
+            "users": len({group.user for group in plan.groups}),
+            "groups": len(plan.groups),
+            "files": sum(len(group.paths) for group in plan.groups),
+            "bytes": sum(group.size for group in plan.groups),
+            "referenced_groups": sum(1 for group in plan.groups if group.referenced),
+        },
+        "tenants": plan.tenants,
+        "planned": planned,
+        "truncated": plan.truncated,
+    }
+
+
+# ---------------------------------------------------------------------------
+# 后台清理
+# ---------------------------------------------------------------------------
+
+def _unlink(paths: List[Path]) -> int:
+    removed = 0
+    for path in paths:
+        with contextlib.suppress(FileNotFoundError):
+            path.unlink()
+            removed += 1
+    return removed
+
+
+class OutputGarbageCollector:
+    """定时扫描输出目录并按计划限速删除"""
+
+    def __init__(self, settings=None, base_path: Optional[Path] = None):
+        self.settings = settings or get_settings()
+        self.base_path = Path(base_path or image_storage_service.base_storage_path)
+        self.logger = get_gc_logger()
+        self._task: Optional[asyncio.Task] = None
+        metrics = get_metrics_registry()
+        self.deleted_files = metrics.counter("tenant_gc_deleted_files_total", "输出清理删除的文件数", ("reason",))
+        self.deleted_bytes = metrics.counter("tenant_gc_deleted_bytes_total", "输出清理释放的字节数", ("reason",))
+        self.delete_errors = metrics.counter("tenant_gc_delete_errors_total", "输出清理删除失败次数")
+        self.tenant_bytes = metrics.gauge("tenant_output_bytes", "租户输出文件总量（最近一次清理后）", ("tenant",))
+        self.run_seconds = metrics.histogram("tenant_gc_run_seconds", "一次输出清理的耗时", ("dry_run",))
+
+    async def plan(self) -> GCPlan:
+        from .repository import repository_session
+
+        groups = await asyncio.to_thread(scan_output_store, self.base_path)
+        async with repository_session() as repo:
+            references = await load_references(repo)
+            tenant_of_user = {}
+            for user in {group.user for group in groups}:
+                record = await repo.get_user_by_username(user)
+                tenant_of_user[user] = record.get("tenant_id") if record else None
+        return build_plan(groups, references, tenant_of_user, self.settings)
+
+    async def run_once(self, dry_run: Optional[bool] = None) -> Dict[str, Any]:
+        """扫描一次并返回报告；dry_run 时只报告计划，不删除"""
+        dry_run = self.settings.gc_dry_run if dry_run is None else dry_run
+        started = time.perf_counter()
+        plan = await self.plan()
+        report = plan_report(plan)
+        report["dry_run"] = dry_run
+        deleted = {"groups": 0, "files": 0, "bytes": 0, "errors": 0}
+        if not dry_run:
+            interval = 1.0 / self.settings.gc_delete_per_second if self.settings.gc_delete_per_second > 0 else 0.0
+            freed: Dict[str, int] = {}
+            for group in plan.deletions:
+                try:
+                    removed = await asyncio.to_thread(_unlink, group.paths)
+                except OSError as e:
+                    deleted["errors"] += 1
+                    self.delete_errors.inc()
+                    self.logger.warning("删除输出文件失败 %s: %s", group.paths[0], e)
+                    continue
+                deleted["groups"] += 1
+                deleted["files"] += removed
+                deleted["bytes"] += group.size
+                freed[group.user] = freed.get(group.user, 0) + group.size
+                self.deleted_files.inc(removed, reason=group.reason)
+                self.deleted_bytes.inc(group.size, reason=group.reason)
+                if interval:
+                    await asyncio.sleep(interval)
+        for tenant, usage in plan.tenants.items():
+            self.tenant_bytes.set(usage["bytes_after"] if not dry_run else usage["bytes"], tenant=tenant)
+        report["deleted"] = deleted
+        report["seconds"] = round(time.perf_counter() - started, 3)
+        self.run_seconds.observe(report["seconds"], dry_run=str(dry_run).lower())
+        planned = report["planned"]
+        self.logger.info(
+            "输出清理%s: 扫描 %d 组 %d 字节；计划删除 孤儿 %d / 过期 %d / 超额 %d 组（截断 %d）；已删除 %d 组 %d 字节，%.1fs",
+            "（试运行）" if dry_run else "", report["scanned"]["groups"], report["scanned"]["bytes"],
+            planned["orphan"]["groups"], planned["retention"]["groups"], planned["quota"]["groups"],
+            plan.truncated, deleted["groups"], deleted["bytes"], report["seconds"],
+        )
+        return report
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self.logger.info("输出清理已启动，间隔 %.0fs%s", self.settings.gc_interval_seconds,
+                             "（试运行）" if self.settings.gc_dry_run else "")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.settings.gc_interval_seconds)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.logger.exception("输出清理出错: %s", e)
+
+
+_output_gc: Optional[OutputGarbageCollector] = None
+
+
+def get_output_gc() -> OutputGarbageCollector:
+    global _output_gc
+    if _output_gc is None:
+        _output_gc = OutputGarbageCollector()
+    return _output_gc
+
+
+async def _main(apply: bool) -> Dict[str, Any]:
+    from ..models.database import close_storage
+    from .dual_write import close_dual_write_engine
+
+    try:
+        return await get_output_gc().run_once(dry_run=not apply)
+    finally:
+        await close_storage()
+        await close_dual_write_engine()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="输出文件清理（默认试运行，只输出报告）")
+    parser.add_argument("--apply", action="store_true", help="按计划删除文件")
+    args = parser.parse_args(argv)
+    report = asyncio.run(_main(args.apply))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""
+本地配色提取引擎
+基于 NumPy 在 CIELAB 感知色彩空间上做加权 k-means，作为 LLM 配色的快速路径
+返回格式与 palette_from_image 保持一致：{ "groups": [ { "colors": [ {r,g,b}, ... ] }, ... ] }
+"""
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+from ..services.logger import get_proxy_logger
+
+# sRGB(D65) -> XYZ 转换矩阵与参考白点
+_RGB_TO_XYZ = (
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041),
+)
+_WHITE_POINT = (0.95047, 1.0, 1.08883)
+
+
+def rgb_to_lab(rgb: "np.ndarray") -> "np.ndarray":
+    """sRGB(0-255) -> CIELAB"""
+    c = rgb / 255.0
+    linear = np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ np.asarray(_RGB_TO_XYZ, dtype=np.float32).T
+    xyz = xyz / np.asarray(_WHITE_POINT, dtype=np.float32)
+    epsilon = 216 / 24389
+    kappa = 24389 / 27
+    f = np.where(xyz > epsilon, np.cbrt(xyz), (kappa * xyz + 16) / 116)
+    L = 116 * f[:, 1] - 16
+    a = 500 * (f[:, 0] - f[:, 1])
+    b = 200 * (f[:, 1] - f[:, 2])
+    return np.stack([L, a, b], axis=1)
+
+
+def lab_to_rgb(lab: "np.ndarray") -> "np.ndarray":
+    """CIELAB -> sRGB(0-255)，结果已裁剪并取整"""
+    L, a, b = lab[:, 0], lab[:, 1], lab[:, 2]
+    fy = (L + 16) / 116
+    fx = fy + a / 500
+    fz = fy - b / 200
+    epsilon = 216 / 24389
+    kappa = 24389 / 27
+    f = np.stack([fx, fy, fz], axis=1)
+    xyz = np.where(f ** 3 > epsilon, f ** 3, (116 * f - 16) / kappa)
+    # 亮度分量使用 L 直接反算更稳定
+    xyz[:, 1] = np.where(L > kappa * epsilon, fy ** 3, L / kappa)
+    xyz = xyz * np.asarray(_WHITE_POINT, dtype=np.float64)
+    linear = xyz @ np.linalg.inv(np.asarray(_RGB_TO_XYZ, dtype=np.float64)).T
+    linear = np.clip(linear, 0.0, 1.0)
+    c = np.where(linear <= 0.0031308, linear * 12.92, 1.055 * np.power(linear, 1 / 2.4) - 0.055)
+    return np.clip(np.rint(c * 255), 0, 255).astype(int)
+
+
+class PaletteEngine:
+    """本地确定性配色提取引擎"""
+
+    SAMPLE_SIDE = 96          # 降采样后的最长边（像素）
+    CLUSTER_COUNT = 8         # k-means 聚类数量
+    MAX_ITERATIONS = 16       # k-means 最大迭代次数
+    CONVERGENCE_DELTA = 0.5   # 聚类中心最大位移（ΔE）小于该值即视为收敛
+    MERGE_DELTA_E = 8.0       # 色差小于该值的聚类中心合并
+    MIN_CLUSTER_SHARE = 0.01  # 占比低于该值的聚类视为噪声
+
+    def is_available(self) -> bool:
+        """NumPy 与 Pillow 均已安装时本地引擎可用"""
+        return np is not None and Image is not None
+
+    def extract_palette(
+        self,
+        image_bytes: bytes,
+        mask_bytes: Optional[bytes] = None,
+        colors_per_group: int = 5,
+    ) -> Dict[str, Any]:
+        """
+        从图片中提取配色组
+
+        Args:
+            image_bytes: 原始图片字节
+            mask_bytes: 可选的服装蒙版（灰度，越亮权重越高）
+            colors_per_group: 每组颜色数量
+
+        Returns:
+            { "groups": [...], "source": "local", "elapsedMs": float }
+        """
+        if not self.is_available():
+            raise RuntimeError("本地配色引擎不可用：需要安装 numpy 与 Pillow")
+
+        started = time.perf_counter()
+        pixels, weights = self._load_pixels(image_bytes, mask_bytes)
+        lab = rgb_to_lab(pixels)
+        samples, sample_weights = self._quantize(lab, weights)
+        centers, shares = self._weighted_kmeans(samples, sample_weights)
+        centers, shares = self._merge_similar(centers, shares)
+
+        groups = self._build_groups(centers, shares, max(1, colors_per_group))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        get_proxy_logger().info(
+            f"本地配色提取完成: 聚类数={len(centers)}, 配色组={len(groups)}, 耗时={elapsed_ms:.1f}ms"
+        )
+        return {
+            "groups": groups,
+            "source": "local",
+            "elapsedMs": round(elapsed_ms, 1),
+        }
+
+    # ---- 像素采样 ----
+
+    def _load_pixels(self, image_bytes: bytes, mask_bytes: Optional[bytes]) -> Tuple["np.ndarray", "np.ndarray"]:
+        """解码并降采样图片，返回 (N,3) 的 RGB 像素与 (N,) 的权重"""
+        with Image.open(BytesIO(image_bytes)) as img:
+            # JPEG 可直接在解码阶段缩小，避免解码整幅大图
+            img.draft("RGB", (self.SAMPLE_SIDE * 2, self.SAMPLE_SIDE * 2))
+            img = img.convert("RGBA")
+            img.thumbnail((self.SAMPLE_SIDE, self.SAMPLE_SIDE), Image.BILINEAR)
+            rgba = np.asarray(img, dtype=np.float32)
+
+        height, width = rgba.shape[:2]
+        pixels = rgba[..., :3].reshape(-1, 3)
+        weights = (rgba[..., 3] / 255.0).reshape(-1)
+
+        if mask_bytes:
+            try:
+                with Image.open(BytesIO(mask_bytes)) as mask_img:
+                    mask_img = mask_img.convert("L").resize((width, height), Image.BILINEAR)
+                    mask = np.asarray(mask_img, dtype=np.float32).reshape(-1) / 255.0
+                # 保留少量背景权重，避免蒙版全黑时无像素可用
+                weights = weights * (0.02 + 0.98 * mask)
+            except Exception as e:
+                get_proxy_logger().warning(f"服装蒙版解析失败，忽略蒙版: {e}")
+
+        if float(weights.sum()) <= 0:
+            weights = np.ones_like(weights)
+        return pixels, weights
+
+    @staticmethod
+    def _quantize(lab: "np.ndarray", weights: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """按 1 ΔE 网格合并相同颜色，减少 k-means 的样本数量"""
+        keys = np.rint(lab).astype(np.int32)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        totals = np.bincount(inverse, weights=weights, minlength=len(unique))
+        sums = np.stack(
+            [np.bincount(inverse, weights=lab[:, i] * weights, minlength=len(unique)) for i in range(3)],
+            axis=1,
+        )
+        keep = totals > 0
+        return sums[keep] / totals[keep, None], totals[keep]
+
+    # ---- 聚类 ----
+
+    def _initial_centers(self, samples: "np.ndarray", weights: "np.ndarray", k: int) -> "np.ndarray":
+        """确定性初始化：从权重最大的颜色开始，依次选取加权距离最远的颜色"""
+        centers = [samples[int(np.argmax(weights))]]
+        min_dist = np.sum((samples - centers[0]) ** 2, axis=1)
+        for _ in range(1, k):
+            score = min_dist * weights
+            index = int(np.argmax(score))
+            if score[index] <= 0:
+                break
+            centers.append(samples[index])
+            min_dist = np.minimum(min_dist, np.sum((samples - samples[index]) ** 2, axis=1))
+        return np.asarray(centers, dtype=np.float64)
+
+    def _weighted_kmeans(self, samples: "np.ndarray", weights: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """加权 k-means，返回按占比降序排列的聚类中心与占比"""
+        k = min(self.CLUSTER_COUNT, len(samples))
+        centers = self._initial_centers(samples, weights, k)
+        k = len(centers)
+        labels = np.zeros(len(samples), dtype=np.int64)
+
+        for _ in range(self.MAX_ITERATIONS):
+            distances = ((samples[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = np.argmin(distances, axis=1)
+            totals = np.bincount(labels, weights=weights, minlength=k)
+            sums = np.stack(
+                [np.bincount(labels, weights=samples[:, i] * weights, minlength=k) for i in range(3)],
+                axis=1,
+            )
+            non_empty = totals > 0
+            new_centers = centers.copy()
+            new_centers[non_empty] = sums[non_empty] / totals[non_empty, None]
+            shift = float(np.sqrt(((new_centers - centers) ** 2).sum(axis=1)).max())
+            centers = new_centers
+            if shift < self.CONVERGENCE_DELTA:
+                break
+
+        totals = np.bincount(labels, weights=weights, minlength=k)
+        shares = totals / max(float(totals.sum()), 1e-9)
+        order = np.argsort(-shares, kind="stable")
+        centers, shares = centers[order], shares[order]
+        keep = shares >= self.MIN_CLUSTER_SHARE
+        if not keep.any():
+            keep[0] = True
+        return centers[keep], shares[keep]
+
+    def _merge_similar(self, centers: "np.ndarray", shares: "np.ndarray") -> Tuple["np.ndarray", "np.ndarray"]:
+        """合并色差过小的聚类中心（按占比加权）"""
+        merged_centers: List["np.ndarray"] = []
+        merged_shares: List[float] = []
+        for center, share in zip(centers, shares):
+            for idx, existing in enumerate(merged_centers):
+                if float(np.sqrt(((existing - center) ** 2).sum())) < self.MERGE_DELTA_E:
+                    total = merged_shares[idx] + float(share)
+                    merged_centers[idx] = (existing * merged_shares[idx] + center * share) / total
+                    merged_shares[idx] = total
+                    break
+            else:
+                merged_centers.append(center.copy())
+                merged_shares.append(float(share))
+        return np.asarray(merged_centers), np.asarray(merged_shares)
+
+    # ---- 配色组 ----
+
+    def _build_groups(self, centers: "np.ndarray", shares: "np.ndarray", colors_per_group: int) -> List[Dict[str, Any]]:
+        """
+        生成配色组：
+        1. 主色组：按占比排序的主要颜色
+        2. 邻近色组：主色在 LCh 空间中色相偏移 ±30°
+        3. 互补色组：主色与其互补色相
+        4. 明度组：主色的深浅层次
+        """
+        groups = [centers[:colors_per_group]]
+
+        primary = centers[0]
+        chroma = float(np.hypot(primary[1], primary[2]))
+        hue = float(np.arctan2(primary[2], primary[1]))
+        # 主色过于接近无彩色时，色相衍生没有意义，改用占比第二的彩色
+        if chroma < 10:
+            for candidate in centers[1:]:
+                candidate_chroma = float(np.hypot(candidate[1], candidate[2]))
+                if candidate_chroma >= 10:
+                    chroma = candidate_chroma
+                    hue = float(np.arctan2(candidate[2], candidate[1]))
+                    break
+
+        def lch(lightness: float, c: float, h: float) -> List[float]:
+            return [lightness, c * np.cos(h), c * np.sin(h)]
+
+        if chroma >= 10:
+            step = np.deg2rad(30)
+            analogous = [lch(primary[0], chroma, hue + offset * step) for offset in (-2, -1, 0, 1, 2)]
+            groups.append(np.asarray(analogous[:colors_per_group]))
+
+            complement = hue + np.pi
+            complementary = [
+                lch(primary[0], chroma, hue),
+                lch(min(95.0, primary[0] + 20), chroma * 0.5, hue),
+                lch(primary[0], chroma, complement),
+                lch(max(15.0, primary[0] - 20), chroma * 0.8, complement),
+                lch(90.0, 8.0, complement),
+            ]
+            groups.append(np.asarray(complementary[:colors_per_group]))
+
+        lightness_levels = np.linspace(90, 20, num=colors_per_group)
+        tonal = [lch(level, chroma * (0.4 + 0.6 * (1 - abs(level - 55) / 45)), hue) for level in lightness_levels]
+        groups.append(np.asarray(tonal))
+
+        result = []
+        for group in groups:
+            rgb = lab_to_rgb(np.asarray(group, dtype=np.float64))
+            colors = []
+            seen = set()
+            for r, g, b in rgb.tolist():
+                if (r, g, b) in seen:
+                    continue
+                seen.add((r, g, b))
+                colors.append({"r": r, "g": g, "b": b})
+            result.append({"colors": colors})
+        return result
+
+
+# 全局实例
+palette_engine = PaletteEngine()
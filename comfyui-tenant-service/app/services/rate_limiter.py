@@ -0,0 +1,363 @@
+"""
+请求限流
+按 (租户, 用户) 维护令牌桶：容量为 Settings.rate_limit_per_minute，按每分钟同样的速率回填；
+不同端点消耗不同令牌数（创建任务远比查询状态昂贵）。
+任务状态轮询（前端每 2 秒轮询一次每个任务）使用独立的令牌桶（Settings.rate_limit_poll_per_minute），
+不占用创建任务等请求的额度。
+
+未登录请求按客户端 IP 限流；经由受信任代理（Settings.rate_limit_trusted_proxies，例如前端 Next.js 服务）
+转发的请求取 X-Forwarded-For 中最右侧的非受信任地址，否则所有通过前端登录的用户会共用同一个桶。
+
+后端：
+- memory：进程内字典，单个 uvicorn worker 内生效
+- sqlite：借助 SQLite 文件锁（BEGIN IMMEDIATE）在同一主机的多个 worker 之间共享桶状态
+"""
+import asyncio
+import ipaddress
+import math
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Tuple
+
+from jose import JWTError, jwt
+
+from .config import get_settings
+from .logger import get_proxy_logger
+
+# "METHOD 路径前缀" -> 令牌消耗；按最长前缀匹配，未匹配的请求消耗 1 个令牌
+DEFAULT_ENDPOINT_COSTS: Dict[str, int] = {
+    "POST /proxy/complete_image_edit": 10,
+    "POST /proxy/complete_image_edit:batch": 30,
+    "POST /proxy/complete_pattern_extract": 10,
+    "POST /proxy/complete_video_generation": 20,
+    "POST /proxy/variant_overlay": 10,
+    "POST /proxy/generate": 10,
+    "POST /proxy/pipelines": 30,
+    "POST /proxy/upload": 3,
+    "POST /proxy/llm/": 5,
+    "POST /proxy/tasks/": 3,
+    "GET /proxy/static/": 0,
+    "GET /proxy/stripes/tiles/": 0,
+    "GET /docs": 0,
+    "GET /openapi.json": 0,
+    "GET /health": 0,
+    "GET /metrics": 0,
+}
+
+# 状态轮询："METHOD 路径前缀"，每次消耗轮询桶的 1 个令牌
+DEFAULT_POLL_ENDPOINTS = (
+    "GET /proxy/tasks/",
+    "POST /proxy/tasks/status:batch",
+    "GET /proxy/pipelines/",
+)
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    reset_seconds: int
+    retry_after: int = 0
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(self.remaining),
+            "RateLimit-Reset": str(self.reset_seconds),
+            "RateLimit-Policy": f"{self.limit};w=60",
+        }
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+
+def _refill(tokens: float, updated_at: float, now: float, capacity: float, rate: float) -> float:
+    return min(capacity, tokens + max(0.0, now - updated_at) * rate)
+
+
+def _decide(tokens: float, cost: int, capacity: float, rate: float) -> Tuple[bool, float, RateLimitDecision]:
+    """在已回填的令牌数上尝试扣减 cost，返回 (是否放行, 扣减后令牌数, 决策)"""
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    deficit = 0.0 if allowed else cost - tokens
+    decision = RateLimitDecision(
+        allowed=allowed,
+        limit=int(capacity),
+        remaining=int(tokens),
+        reset_seconds=int(math.ceil((capacity - tokens) / rate)),
+        retry_after=int(math.ceil(deficit / rate)) if deficit else 0,
+    )
+    return allowed, tokens, decision
+
+
+class MemoryRateLimitBackend:
+    """进程内令牌桶"""
+
+    # 桶数量超过该值时清理已回满的桶（回满的桶与不存在等价）
+    PRUNE_THRESHOLD = 10000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, cost: int, capacity: float, rate: float) -> RateLimitDecision:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = _refill(tokens, updated_at, now, capacity, rate)
+            _, tokens, decision = _decide(tokens, cost, capacity, rate)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.PRUNE_THRESHOLD:
+                self._prune(now, capacity, rate)
+        return decision
+
+    def _prune(self, now: float, capacity: float, rate: float):
+        full_after = capacity / rate
+        stale = [k for k, (_, updated_at) in self._buckets.items() if now - updated_at >= full_after]
+        for k in stale:
+            del self._buckets[k]
+
+
+class SQLiteRateLimitBackend:
+    """
+    基于 SQLite 的共享令牌桶
+    每次扣减在 BEGIN IMMEDIATE 事务中完成，由 SQLite 的文件锁保证多进程间的原子性
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._calls = 0
+        conn = self._connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            " bucket_key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # 限流状态可以容忍崩溃丢失，不需要每次提交都落盘
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+        return conn
+
+    def consume(self, key: str, cost: int, capacity: float, rate: float) -> RateLimitDecision:
+        # 多进程共享，必须使用墙上时钟
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_limit_buckets WHERE bucket_key = ?", (key,)
+            ).fetchone()
+            tokens = capacity if row is None else _refill(row[0], row[1], now, capacity, rate)
+            _, tokens, decision = _decide(tokens, cost, capacity, rate)
+            conn.execute(
+                "INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(bucket_key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (key, tokens, now),
+            )
+            self._calls += 1
+            if self._calls % self.PRUNE_EVERY == 0:
+                conn.execute(
+                    "DELETE FROM rate_limit_buckets WHERE updated_at < ?", (now - capacity / rate,)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return decision
+
+
+class RateLimiter:
+    """令牌桶限流器：负责端点计费与限流键解析，桶状态交给后端保存"""
+
+    def __init__(
+        self,
+        per_minute: int,
+        backend,
+        endpoint_costs: Optional[Dict[str, int]] = None,
+        poll_per_minute: int = 0,
+    ):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.poll_capacity = float(poll_per_minute)
+        self.poll_rate = poll_per_minute / 60.0
+        self.backend = backend
+        # 轮询规则与计费规则一起按最长前缀匹配，cost 为 None 表示走轮询桶；配置覆盖的规则走主桶
+        rules: Dict[str, Optional[int]] = dict(DEFAULT_ENDPOINT_COSTS)
+        rules.update({rule: None for rule in DEFAULT_POLL_ENDPOINTS})
+        rules.update(endpoint_costs or {})
+        # 最长前缀优先
+        self._costs = sorted(
+            ((rule.split(" ", 1)[0].upper(), rule.split(" ", 1)[1], cost) for rule, cost in rules.items()),
+            key=lambda item: len(item[1]),
+            reverse=True,
+        )
+        self._offload = isinstance(backend, SQLiteRateLimitBackend)
+
+    def bucket_for(self, method: str, path: str) -> Tuple[int, bool]:
+        """返回 (令牌消耗, 是否使用轮询桶)；消耗 <= 0 表示不限流"""
+        for rule_method, prefix, cost in self._costs:
+            if rule_method == method and path.startswith(prefix):
+                if cost is None:
+                    # 轮询桶未启用（<= 0）时轮询请求不限流
+                    return (1 if self.poll_capacity > 0 else 0), True
+                return cost, False
+        return 1, False
+
+    def cost_for(self, method: str, path: str) -> int:
+        return self.bucket_for(method, path)[0]
+
+    async def consume(self, key: str, cost: int, poll: bool = False) -> RateLimitDecision:
+        capacity, rate = (self.poll_capacity, self.poll_rate) if poll else (self.capacity, self.rate)
+        if poll:
+            key = f"{key}:poll"
+        # 单次消耗不能超过桶容量，否则该端点永远无法放行
+        cost = min(cost, int(capacity))
+        if self._offload:
+            # SQLite 事务可能等待文件锁，避免阻塞事件循环
+            return await asyncio.to_thread(self.backend.consume, key, cost, capacity, rate)
+        return self.backend.consume(key, cost, capacity, rate)
+
+
+def _parse_networks(entries: Iterable[str]):
+    networks = []
+    for entry in entries:
+        try:
+            networks.append(ipaddress.ip_network(entry.strip(), strict=False))
+        except ValueError:
+            get_proxy_logger().warning("忽略无效的受信任代理地址: %s", entry)
+    return networks
+
+
+def _is_trusted(address: str, networks) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def _forwarded_client(scope, peer: str, trusted_proxies) -> str:
+    """
+    对端是受信任代理时，从 X-Forwarded-For 右侧开始跳过受信任代理，取第一个地址作为客户端；
+    最左侧的地址可以由客户端随意伪造，不能直接使用
+    """
+    if not trusted_proxies or not _is_trusted(peer, trusted_proxies):
+        return peer
+    hops = []
+    for name, value in scope.get("headers", ()):
+        if name == b"x-forwarded-for":
+            hops.extend(h.strip() for h in value.decode("latin-1").split(",") if h.strip())
+    for hop in reversed(hops):
+        if not _is_trusted(hop, trusted_proxies):
+            return hop
+    return hops[0] if hops else peer
+
+
+def _client_key(scope, secret_key: str, algorithm: str, trusted_proxies=()) -> str:
+    """从 Bearer token 中解析 租户:用户；未登录请求按客户端 IP 限流（受信任代理转发时取 X-Forwarded-For）"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                try:
+                    payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+                    return f"tenant:{payload.get('tenant_id')}:user:{payload.get('sub')}"
+                except JWTError:
+                    break
+            break
+    client = scope.get("client")
+    if not client:
+        return "ip:unknown"
+    return f"ip:{_forwarded_client(scope, client[0], trusted_proxies)}"
+
+
+class RateLimitMiddleware:
+    """ASGI 限流中间件：超限返回 429 + Retry-After，所有计费请求附带 RateLimit-* 响应头"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+        settings = get_settings()
+        self.secret_key = settings.secret_key
+        self.algorithm = settings.algorithm
+        self.trusted_proxies = _parse_networks(settings.rate_limit_trusted_proxies)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        cost, poll = self.limiter.bucket_for(scope["method"], scope["path"])
+        if cost <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        key = _client_key(scope, self.secret_key, self.algorithm, self.trusted_proxies)
+        try:
+            decision = await self.limiter.consume(key, cost, poll)
+        except Exception as e:
+            # 限流后端故障时放行，不影响正常业务
+            get_proxy_logger().error("限流后端异常，放行请求: %s", e)
+            await self.app(scope, receive, send)
+            return
+
+        rate_headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in decision.headers().items()]
+
+        if not decision.allowed:
+            get_proxy_logger().warning(
+                "请求被限流: %s %s, key=%s, cost=%d, retry_after=%ds",
+                scope["method"], scope["path"], key, cost, decision.retry_after,
+            )
+            body = b'{"detail":"Rate limit exceeded"}'
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                ] + rate_headers,
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message = dict(message)
+                message["headers"] = list(message.get("headers", [])) + rate_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+
+RATE_LIMIT_HEADERS = ["Retry-After", "RateLimit-Limit", "RateLimit-Remaining", "RateLimit-Reset", "RateLimit-Policy"]
+
+
+def build_rate_limiter(settings=None) -> Optional[RateLimiter]:
+    """根据配置创建限流器；rate_limit_per_minute <= 0 时不启用"""
+    settings = settings or get_settings()
+    if settings.rate_limit_per_minute <= 0:
+        return None
+    if settings.rate_limit_backend == "sqlite":
+        backend = SQLiteRateLimitBackend(settings.rate_limit_sqlite_path)
+    else:
+        backend = MemoryRateLimitBackend()
+    return RateLimiter(
+        settings.rate_limit_per_minute,
+        backend,
+        settings.rate_limit_endpoint_costs,
+        poll_per_minute=settings.rate_limit_poll_per_minute,
+    )
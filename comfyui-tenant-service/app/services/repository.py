@@ -0,0 +1,177 @@
+"""
+存储仓库（异步）
+路由与后台任务通过 StorageRepository 访问用户、租户、任务记录与用量统计，不再区分存储类型。
+每种存储一个实现，各自使用适合自己的索引、批量写入与缓存：
+- JSONRepository（services/json_repository.py）：JSONStorage 在线程池中执行，解析结果按文件签名缓存
+- SQLiteRepository / MySQLRepository（services/sql_repository.py）：SQLAlchemy asyncio
+  （aiosqlite / aiomysql），查询期间让出事件循环，数据库延迟不会串行化同一 worker 上的并发请求
+
+所有方法返回普通字典（与 JSON 存储的记录格式一致），时间字段为 ISO 字符串；
+用量行例外，created_at 为 datetime（供按时间分桶）。
+各实现的行为由 benchmarks/storage_suite.py 的一致性检查约束。
+JSON 存储迁移到数据库期间可开启双写（STORAGE_DUAL_WRITE，见 services/dual_write.py）。
+用法：repo = Depends(get_repository)；后台任务使用 async with repository_session() as repo。
+"""
+import contextlib
+import functools
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .logger import get_task_record_logger
+from .metrics import get_metrics_registry
+from .tracing import span
+
+logger = get_task_record_logger()
+
+storage_seconds = get_metrics_registry().histogram(
+    "tenant_storage_operation_seconds", "任务记录存储操作耗时", ("operation", "backend")
+)
+
+
+def _timed(operation: str):
+    """记录存储操作耗时（tenant_storage_operation_seconds），同时作为请求中的 storage 阶段"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                with span("storage", operation=operation):
+                    return await func(self, *args, **kwargs)
+            finally:
+                storage_seconds.observe(time.perf_counter() - started, operation=operation, backend=self.backend)
+        return wrapper
+    return decorator
+
+
+def new_tenant_task_id() -> str:
+    return f"tenant_{uuid.uuid4().hex[:16]}"
+
+
+class StorageRepository(ABC):
+    """存储仓库接口；create_task_record 之外的方法由各存储实现，缺少实现的类无法实例化"""
+
+    backend = ""
+
+    # 用户
+    @abstractmethod
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def create_user(self, username: str, password_hash: str, tenant_id: int, email: str = None) -> Dict[str, Any]:
+        """用户名或邮箱已存在时抛出 ValueError"""
+
+    # 租户
+    @abstractmethod
+    async def get_tenant_by_id(self, tenant_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_tenant_by_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        """只返回启用中的租户"""
+
+    @abstractmethod
+    async def create_tenant(self, name: str, settings: str = "{}", tenant_id: int = None) -> Dict[str, Any]:
+        """租户名已存在时抛出 ValueError；tenant_id 只有数据库存储使用（JSON 存储按顺序分配）"""
+
+    # 任务记录
+    @abstractmethod
+    async def create_task_records(
+        self, user_id: str, runninghub_task_ids: List[str], task_type: str = None
+    ) -> List[str]:
+        """在一个事务（一次文件写入）中创建多条 PENDING 记录，返回对应的 tenant_task_id"""
+
+    async def create_task_record(self, user_id: str, runninghub_task_id: str, task_type: str = None) -> str:
+        tenant_task_ids = await self.create_task_records(user_id, [runninghub_task_id], task_type)
+        logger.info("创建任务记录: %s, 用户: %s, RunningHub任务: %s", tenant_task_ids[0], user_id, runninghub_task_id)
+        return tenant_task_ids[0]
+
+    @abstractmethod
+    async def get_task_record(self, tenant_task_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_tasks_by_runninghub_ids(
+        self, user_id: str, runninghub_task_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        """runninghub_task_id -> 记录；不属于该用户的任务不会出现在结果中"""
+
+    @abstractmethod
+    async def get_user_tasks(
+        self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None
+    ) -> List[Dict[str, Any]]:
+        """按创建时间倒序（同一时间按 id 倒序）分页，task_type 在分页之前筛选"""
+
+    @abstractmethod
+    async def get_pending_tasks(self, limit: int = 500) -> List[Dict[str, Any]]:
+        """所有用户仍处于 PENDING 的记录，最早创建的优先"""
+
+    @abstractmethod
+    async def get_task_outputs(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        id 大于 after_id 且有输出文件的记录，按 id 升序（输出清理按页遍历全部记录，见 services/output_gc.py）：
+        id, user_id, task_type, created_at, completed_at, storage_paths
+        """
+
+    @abstractmethod
+    async def update_task_success(
+        self, tenant_task_id: str, result_data: Dict[str, Any], storage_paths: List[Any]
+    ) -> bool:
+        """记录不存在时返回 False"""
+
+    @abstractmethod
+    async def update_task_failed(self, tenant_task_id: str, error_message: str) -> bool:
+        """记录不存在时返回 False"""
+
+    @abstractmethod
+    async def update_task_runninghub_id(self, tenant_task_id: str, runninghub_task_id: str) -> bool:
+        """排队票据派发后改记 RunningHub taskId（见 TaskFinalizer.adopt_upstream_id）；记录不存在时返回 False"""
+
+    # 用量统计（按分钟聚合的行，见 services/usage_accounting.py）
+    @abstractmethod
+    async def append_api_usage(self, rows: List[Dict[str, Any]]):
+        """批量写入聚合行：tenant_id, user_id, endpoint, request_count, created_at(datetime)"""
+
+    @abstractmethod
+    async def get_api_usage(self, tenant_id: int, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        """租户 start <= created_at < end 的聚合行：user_id, endpoint, request_count, created_at(datetime)"""
+
+
+@contextlib.asynccontextmanager
+async def repository_session() -> AsyncIterator[StorageRepository]:
+    """打开一个仓库会话（数据库存储为一个 AsyncSession，JSON 存储无状态）；存储尚未初始化时先等待初始化"""
+    from ..models import database
+
+    await database.init_storage()
+    AsyncSessionLocal, async_engine = database.AsyncSessionLocal, database.async_engine
+
+    if AsyncSessionLocal is None:
+        from .config import get_settings
+        from .json_repository import JSONRepository, get_json_storage
+
+        repo = JSONRepository(get_json_storage())
+        if get_settings().storage_dual_write:
+            from .dual_write import DualWriteRepository
+
+            repo = DualWriteRepository(repo)
+        yield repo
+        return
+
+    from .sql_repository import MySQLRepository, SQLiteRepository
+
+    repository_class = MySQLRepository if async_engine.dialect.name == "mysql" else SQLiteRepository
+    async with AsyncSessionLocal() as session:
+        yield repository_class(session)
+
+
+async def get_repository() -> AsyncIterator[StorageRepository]:
+    """FastAPI 依赖"""
+    async with repository_session() as repo:
+        yield repo
@@ -0,0 +1,351 @@
+"""
+数据库存储仓库（SQLAlchemy asyncio）
+使用 Core 语句返回字典，不经过 ORM 身份映射（重复读取总是拿到最新数据）。
+- SQLAlchemyRepository：两种数据库共用的实现；租户记录在进程内缓存 tenant_cache_seconds 秒
+  （每个代理请求都要读取租户配置，而租户几乎不变）
+- SQLiteRepository：同一进程内的写事务排队执行。SQLite 只有一把写锁，连接池中的多个连接同时写时
+  只能在 busy_timeout 内反复重试，排队比重试更快也更公平
+- MySQLRepository：历史分页使用延迟关联，大 offset 时只在索引上跳过行
+import_records 按原 ID 批量导入 JSON 存储的记录（迁移工具与双写使用，见 services/json_migration.py），
+冲突处理使用各数据库自己的语法（SQLite ON CONFLICT / MySQL INSERT IGNORE、ON DUPLICATE KEY UPDATE）。
+"""
+import asyncio
+import json
+import uuid
+import weakref
+from abc import abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from ..models.database import APIUsage, Tenant, TenantTaskRecord, User
+from .config import get_settings
+from .memo_cache import AsyncMemoCache
+from .repository import StorageRepository, _timed, logger, new_tenant_task_id
+
+_tenant_cache: Optional[AsyncMemoCache] = None
+
+
+def _get_tenant_cache() -> AsyncMemoCache:
+    global _tenant_cache
+    if _tenant_cache is None:
+        _tenant_cache = AsyncMemoCache(max_entries=1024, ttl_seconds=get_settings().tenant_cache_seconds)
+    return _tenant_cache
+
+
+# 任务记录导入时覆盖的列；status 必须最后赋值（MySQL 按顺序求值 ON DUPLICATE KEY UPDATE）
+TASK_IMPORT_COLUMNS = (
+    "user_id", "runninghub_task_id", "task_type", "completed_at", "result_data", "storage_paths", "error_message", "status",
+)
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+
+class SQLAlchemyRepository(StorageRepository):
+    """SQLite 与 MySQL 共用的实现"""
+
+    users = User.__table__
+    tenants = Tenant.__table__
+    tasks = TenantTaskRecord.__table__
+    usage = APIUsage.__table__
+
+    def __init__(self, session):
+        self.session = session
+
+    async def _first(self, statement) -> Optional[Dict[str, Any]]:
+        row = (await self.session.execute(statement)).mappings().first()
+        return _row_to_dict(row) if row is not None else None
+
+    async def _all(self, statement) -> List[Dict[str, Any]]:
+        return [_row_to_dict(row) for row in (await self.session.execute(statement)).mappings().all()]
+
+    async def _write(self, statement, params=None):
+        """执行一条写语句并提交；params 为列表时按 executemany 批量执行"""
+        try:
+            result = await self.session.execute(statement, params)
+            await self.session.commit()
+            return result
+        except Exception:
+            await self.session.rollback()
+            raise
+
+    # 用户
+    @_timed("get_user")
+    async def get_user_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return await self._first(select(self.users).where(self.users.c.username == username))
+
+    @_timed("get_user")
+    async def get_user_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return await self._first(select(self.users).where(self.users.c.email == email))
+
+    @_timed("create_user")
+    async def create_user(self, username: str, password_hash: str, tenant_id: int, email: str = None) -> Dict[str, Any]:
+        try:
+            await self._write(insert(self.users).values(
+                username=username, email=email, hashed_password=password_hash, tenant_id=tenant_id, is_active=True,
+            ))
+        except IntegrityError:
+            raise ValueError("Username or email already exists")
+        return await self._first(select(self.users).where(self.users.c.username == username))
+
+    # 租户
+    @_timed("get_tenant")
+    async def get_tenant_by_id(self, tenant_id: int) -> Optional[Dict[str, Any]]:
+        cache = _get_tenant_cache()
+        key = str(tenant_id)
+        tenant = cache.get(key)
+        if tenant is None:
+            tenant = await self._first(select(self.tenants).where(self.tenants.c.id == tenant_id))
+            if tenant is None:
+                return None
+            cache.set(key, tenant)
+        return dict(tenant)
+
+    @_timed("get_tenant")
+    async def get_tenant_by_api_key(self, api_key: str) -> Optional[Dict[str, Any]]:
+        return await self._first(
+            select(self.tenants).where(self.tenants.c.api_key == api_key, self.tenants.c.is_active.is_(True))
+        )
+
+    @_timed("create_tenant")
+    async def create_tenant(self, name: str, settings: str = "{}", tenant_id: int = None) -> Dict[str, Any]:
+        values = {"name": name, "api_key": str(uuid.uuid4()), "is_active": True, "settings": settings}
+        if tenant_id is not None:
+            values["id"] = tenant_id
+        try:
+            await self._write(insert(self.tenants).values(**values))
+        except IntegrityError:
+            raise ValueError("Tenant name already exists")
+        tenant = await self._first(select(self.tenants).where(self.tenants.c.name == name))
+        _get_tenant_cache().invalidate(str(tenant["id"]))
+        return tenant
+
+    # 任务记录
+    @_timed("create_task_records")
+    async def create_task_records(
+        self, user_id: str, runninghub_task_ids: List[str], task_type: str = None
+    ) -> List[str]:
+        tenant_task_ids = [new_tenant_task_id() for _ in runninghub_task_ids]
+        if not tenant_task_ids:
+            return []
+        await self._write(insert(self.tasks), [
+            {
+                "tenant_task_id": tenant_task_id,
+                "user_id": user_id,
+                "runninghub_task_id": runninghub_task_id,
+                "task_type": task_type,
+                "status": "PENDING",
+            }
+            for tenant_task_id, runninghub_task_id in zip(tenant_task_ids, runninghub_task_ids)
+        ])
+        return tenant_task_ids
+
+    @_timed("get_task_record")
+    async def get_task_record(self, tenant_task_id: str) -> Optional[Dict[str, Any]]:
+        return await self._first(select(self.tasks).where(self.tasks.c.tenant_task_id == tenant_task_id))
+
+    @_timed("get_tasks_by_runninghub_ids")
+    async def get_tasks_by_runninghub_ids(
+        self, user_id: str, runninghub_task_ids: List[str]
+    ) -> Dict[str, Dict[str, Any]]:
+        if not runninghub_task_ids:
+            return {}
+        records = await self._all(select(self.tasks).where(
+            self.tasks.c.user_id == user_id, self.tasks.c.runninghub_task_id.in_(runninghub_task_ids)
+        ))
+        return {record["runninghub_task_id"]: record for record in records}
+
+    def _user_tasks_page(self, columns, user_id: str, limit: int, offset: int, task_type: Optional[str]):
+        statement = select(*columns).where(self.tasks.c.user_id == user_id)
+        if task_type:
+            statement = statement.where(self.tasks.c.task_type == task_type)
+        return statement.order_by(self.tasks.c.created_at.desc(), self.tasks.c.id.desc()).offset(offset).limit(limit)
+
+    @_timed("get_user_tasks")
+    async def get_user_tasks(
+        self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None
+    ) -> List[Dict[str, Any]]:
+        return await self._all(self._user_tasks_page([self.tasks], user_id, limit, offset, task_type))
+
+    @_timed("get_pending_tasks")
+    async def get_pending_tasks(self, limit: int = 500) -> List[Dict[str, Any]]:
+        return await self._all(
+            select(self.tasks).where(self.tasks.c.status == "PENDING")
+            .order_by(self.tasks.c.created_at, self.tasks.c.id).limit(limit)
+        )
+
+    @_timed("get_task_outputs")
+    async def get_task_outputs(self, after_id: int = 0, limit: int = 1000) -> List[Dict[str, Any]]:
+        tasks = self.tasks
+        return await self._all(
+            select(tasks.c.id, tasks.c.user_id, tasks.c.task_type, tasks.c.created_at, tasks.c.completed_at,
+                   tasks.c.storage_paths)
+            .where(tasks.c.id > after_id, tasks.c.storage_paths.isnot(None), tasks.c.storage_paths != "[]")
+            .order_by(tasks.c.id).limit(limit)
+        )
+
+    @_timed("update_task_success")
+    async def update_task_success(
+        self, tenant_task_id: str, result_data: Dict[str, Any], storage_paths: List[Any]
+    ) -> bool:
+        result = await self._write(
+            update(self.tasks).where(self.tasks.c.tenant_task_id == tenant_task_id).values(
+                status="SUCCESS",
+                completed_at=datetime.now(),
+                result_data=json.dumps(result_data, ensure_ascii=False),
+                storage_paths=json.dumps(storage_paths, ensure_ascii=False),
+            )
+        )
+        if result.rowcount == 0:
+            logger.error("未找到任务记录: %s", tenant_task_id)
+            return False
+        logger.info("任务记录更新为成功: %s", tenant_task_id)
+        return True
+
+    @_timed("update_task_failed")
+    async def update_task_failed(self, tenant_task_id: str, error_message: str) -> bool:
+        result = await self._write(
+            update(self.tasks).where(self.tasks.c.tenant_task_id == tenant_task_id).values(
+                status="FAILED", completed_at=datetime.now(), error_message=error_message,
+            )
+        )
+        if result.rowcount == 0:
+            logger.error("未找到任务记录: %s", tenant_task_id)
+            return False
+        logger.info("任务记录更新为失败: %s", tenant_task_id)
+        return True
+
+    @_timed("update_task_runninghub_id")
+    async def update_task_runninghub_id(self, tenant_task_id: str, runninghub_task_id: str) -> bool:
+        result = await self._write(
+            update(self.tasks).where(self.tasks.c.tenant_task_id == tenant_task_id).values(
+                runninghub_task_id=runninghub_task_id,
+            )
+        )
+        if result.rowcount == 0:
+            logger.error("未找到任务记录: %s", tenant_task_id)
+            return False
+        logger.info("任务记录改用 RunningHub 任务: %s -> %s", tenant_task_id, runninghub_task_id)
+        return True
+
+    # 用量统计
+    @_timed("append_api_usage")
+    async def append_api_usage(self, rows: List[Dict[str, Any]]):
+        if rows:
+            await self._write(insert(self.usage), rows)
+
+    @_timed("get_api_usage")
+    async def get_api_usage(self, tenant_id: int, start: datetime, end: datetime) -> List[Dict[str, Any]]:
+        result = await self.session.execute(
+            select(self.usage.c.user_id, self.usage.c.endpoint, self.usage.c.created_at, self.usage.c.request_count)
+            .where(self.usage.c.tenant_id == tenant_id, self.usage.c.created_at >= start, self.usage.c.created_at < end)
+        )
+        return [
+            {"user_id": row.user_id, "endpoint": row.endpoint, "created_at": row.created_at, "request_count": row.request_count or 0}
+            for row in result
+        ]
+
+    # 导入
+    @abstractmethod
+    def _insert_ignore(self, table):
+        """忽略主键冲突的批量插入语句"""
+
+    @abstractmethod
+    def _upsert_pending_tasks(self):
+        """任务记录导入语句：已存在的记录只在仍为 PENDING 时覆盖"""
+
+    def import_statement(self, collection: str):
+        """
+        导入语句：
+        - tenants / users：按主键与唯一键去重，已存在的不变（服务不会修改已创建的用户与租户）
+        - task_records：按 tenant_task_id 合并，只覆盖仍为 PENDING 的记录。终态不会再变，
+          因此无论双写与批量复制谁先写入，最终都是较新的状态
+        - api_usage：直接追加（聚合行没有自然键，由调用方保证不重复）
+        """
+        if collection == "tenants":
+            return self._insert_ignore(self.tenants)
+        if collection == "users":
+            return self._insert_ignore(self.users)
+        if collection == "task_records":
+            return self._upsert_pending_tasks()
+        if collection == "api_usage":
+            return insert(self.usage)
+        raise ValueError(f"Unknown collection: {collection}")
+
+    @_timed("import_records")
+    async def import_records(self, collection: str, rows: List[Dict[str, Any]]):
+        """按原 ID 批量导入行（列名与表一致，见 json_migration.to_row）"""
+        if not rows:
+            return
+        await self._write(self.import_statement(collection), rows)
+        if collection == "tenants":
+            for row in rows:
+                _get_tenant_cache().invalidate(str(row.get("id")))
+
+
+# 每个事件循环一把写锁（asyncio.Lock 不能跨事件循环使用）
+_sqlite_write_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+
+def _sqlite_write_lock() -> asyncio.Lock:
+    loop = asyncio.get_running_loop()
+    lock = _sqlite_write_locks.get(loop)
+    if lock is None:
+        lock = _sqlite_write_locks[loop] = asyncio.Lock()
+    return lock
+
+
+class SQLiteRepository(SQLAlchemyRepository):
+    """SQLite：写事务在进程内排队，读不受影响（WAL）"""
+
+    backend = "sqlite"
+
+    async def _write(self, statement, params=None):
+        async with _sqlite_write_lock():
+            return await super()._write(statement, params)
+
+    def _insert_ignore(self, table):
+        return sqlite_insert(table).on_conflict_do_nothing()
+
+    def _upsert_pending_tasks(self):
+        statement = sqlite_insert(self.tasks)
+        return statement.on_conflict_do_update(
+            index_elements=[self.tasks.c.tenant_task_id],
+            set_={column: statement.excluded[column] for column in TASK_IMPORT_COLUMNS},
+            where=self.tasks.c.status == "PENDING",
+        )
+
+
+class MySQLRepository(SQLAlchemyRepository):
+    """MySQL（InnoDB）"""
+
+    backend = "mysql"
+
+    def _insert_ignore(self, table):
+        return insert(table).prefix_with("IGNORE")
+
+    def _upsert_pending_tasks(self):
+        statement = mysql_insert(self.tasks)
+        pending = self.tasks.c.status == "PENDING"
+        return statement.on_duplicate_key_update([
+            (column, func.if_(pending, statement.inserted[column], self.tasks.c[column]))
+            for column in TASK_IMPORT_COLUMNS
+        ])
+
+    @_timed("get_user_tasks")
+    async def get_user_tasks(
+        self, user_id: str, limit: int = 50, offset: int = 0, task_type: str = None
+    ) -> List[Dict[str, Any]]:
+        # 延迟关联：先在 (user_id, [task_type,] created_at) 索引上分页取主键（二级索引包含主键，不回表），
+        # 再只为当前页的行回表读取 TEXT 列；否则 InnoDB 要为 offset 跳过的每一行读取整行
+        page = self._user_tasks_page([self.tasks.c.id], user_id, limit, offset, task_type).subquery()
+        return await self._all(
+            select(self.tasks).join(page, self.tasks.c.id == page.c.id)
+            .order_by(self.tasks.c.created_at.desc(), self.tasks.c.id.desc())
+        )
@@ -0,0 +1,354 @@
+"""
+条纹印花服务
+服务端检测最小条纹循环单元，并渲染可缓存的旋转平铺预览
+"""
+import hashlib
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+from ..services.logger import get_proxy_logger
+from ..services.palette_engine import lab_to_rgb, rgb_to_lab
+
+
+class TileCache:
+    """按条纹单元签名缓存渲染结果的内存 LRU（同时限制条目数与总字节数）"""
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._total_bytes -= len(previous)
+            self._entries[key] = data
+            self._total_bytes += len(data)
+            while self._entries and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._total_bytes -= len(evicted)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class StripeEngine:
+    """条纹循环检测与平铺渲染"""
+
+    SAMPLE_SIDE = 512          # 检测时降采样后的最长边
+    MIN_PERIOD_PX = 4          # 最小循环宽度（降采样后像素）
+    PEAK_RATIO = 0.85          # 取不低于最高峰该比例的最短周期，避免选中倍周期
+    MIN_CONFIDENCE = 0.35      # 自相关峰值低于该值视为非条纹
+    BAND_DELTA_E = 12.0        # 相邻像素色差超过该值即视为色带边界
+    MIN_BAND_PX = 2            # 小于该宽度的色带并入相邻色带
+    MAX_TILE_SIDE = 4096
+    MAX_UNITS = 256
+    DEFAULT_UNIT_WIDTH = 120   # relativeWidth 单元的默认循环宽度（像素）
+
+    def __init__(self):
+        self.tile_cache = TileCache()
+
+    def is_available(self) -> bool:
+        """NumPy 与 Pillow 均已安装时可用"""
+        return np is not None and Image is not None
+
+    # ---- 检测 ----
+
+    def extract_stripe_units(self, image_bytes: bytes) -> Dict[str, Any]:
+        """
+        检测图片中的最小条纹循环单元
+
+        Args:
+            image_bytes: 原始图片字节
+
+        Returns:
+            {
+                "isStripePattern": bool,
+                "stripePatternUnit": [ { "color": {r,g,b}, "widthPx": number }, ... ],
+                "orientation": "vertical" | "horizontal",
+                "periodPx": number,
+                "confidence": float,
+                "elapsedMs": float
+            }
+            widthPx 已换算回原图尺寸
+        """
+        if not self.is_available():
+            raise RuntimeError("条纹引擎不可用：需要安装 numpy 与 Pillow")
+
+        started = time.perf_counter()
+        with Image.open(BytesIO(image_bytes)) as img:
+            original_size = img.size
+            img.draft("RGB", (self.SAMPLE_SIDE * 2, self.SAMPLE_SIDE * 2))
+            img = img.convert("RGB")
+            img.thumbnail((self.SAMPLE_SIDE, self.SAMPLE_SIDE), Image.BILINEAR)
+            rgb = np.asarray(img, dtype=np.float32)
+
+        height, width = rgb.shape[:2]
+        lab = rgb_to_lab(rgb.reshape(-1, 3)).reshape(height, width, 3)
+
+        orientation, profile = self._dominant_profile(lab)
+        scale = (original_size[0] / width) if orientation == "vertical" else (original_size[1] / height)
+
+        period, confidence = self._find_period(profile)
+        units: List[Dict[str, Any]] = []
+        if period and confidence >= self.MIN_CONFIDENCE:
+            cycle = self._fold_cycle(profile, period)
+            units = self._segment_cycle(cycle, scale)
+
+        is_stripe = len(units) >= 2
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        get_proxy_logger().info(
+            f"条纹检测完成: 方向={orientation}, 周期={period}, 置信度={confidence:.2f}, "
+            f"色带数={len(units)}, 耗时={elapsed_ms:.1f}ms"
+        )
+        return {
+            "isStripePattern": is_stripe,
+            "stripePatternUnit": units if is_stripe else [],
+            "orientation": orientation,
+            "periodPx": round(period * scale, 2) if period else 0,
+            "confidence": round(float(confidence), 3),
+            "elapsedMs": round(elapsed_ms, 1),
+        }
+
+    @staticmethod
+    def _dominant_profile(lab: "np.ndarray") -> Tuple[str, "np.ndarray"]:
+        """
+        选择条纹方向并返回一维投影
+        竖条纹沿 x 变化、沿 y 不变：列均值的方差大、列内方差小
+        """
+        column_profile = lab.mean(axis=0)   # (W,3)，竖条纹的投影
+        row_profile = lab.mean(axis=1)      # (H,3)，横条纹的投影
+        column_noise = float(lab.var(axis=0).sum(axis=1).mean()) + 1e-6
+        row_noise = float(lab.var(axis=1).sum(axis=1).mean()) + 1e-6
+        vertical_score = float(column_profile.var(axis=0).sum()) / column_noise
+        horizontal_score = float(row_profile.var(axis=0).sum()) / row_noise
+        if vertical_score >= horizontal_score:
+            return "vertical", column_profile
+        return "horizontal", row_profile
+
+    def _find_period(self, profile: "np.ndarray") -> Tuple[int, float]:
+        """基于 FFT 自相关找到最小重复周期，返回 (周期, 归一化自相关峰值)"""
+        n = len(profile)
+        centered = profile - profile.mean(axis=0)
+        size = 1 << (2 * n - 1).bit_length()
+        spectrum = np.fft.rfft(centered, n=size, axis=0)
+        acf = np.fft.irfft(spectrum * np.conj(spectrum), n=size, axis=0)[:n].sum(axis=1)
+        if acf[0] <= 1e-9:
+            return 0, 0.0
+        # 无偏归一化：补偿滞后增大时重叠样本数减少
+        acf = acf / acf[0] * (n / (n - np.arange(n)))
+
+        max_lag = n // 2
+        if max_lag <= self.MIN_PERIOD_PX + 1:
+            return 0, 0.0
+        window = acf[self.MIN_PERIOD_PX:max_lag]
+        peaks = np.where((window[1:-1] > window[:-2]) & (window[1:-1] >= window[2:]))[0] + 1
+        if len(peaks) == 0:
+            return 0, 0.0
+        peak_values = window[peaks]
+        best = float(peak_values.max())
+        if best <= 0:
+            return 0, 0.0
+        first = int(peaks[np.argmax(peak_values >= best * self.PEAK_RATIO)])
+        return first + self.MIN_PERIOD_PX, float(min(1.0, window[first]))
+
+    @staticmethod
+    def _fold_cycle(profile: "np.ndarray", period: int) -> "np.ndarray":
+        """将投影按周期折叠并取中位数，抑制噪声"""
+        repeats = len(profile) // period
+        folded = profile[: repeats * period].reshape(repeats, period, 3)
+        return np.median(folded, axis=0)
+
+    def _segment_cycle(self, cycle: "np.ndarray", scale: float) -> List[Dict[str, Any]]:
+        """将一个循环切分为色带，返回原图尺寸下的条纹单元"""
+        # 从色差最大的位置开始切分，避免把跨越循环边界的色带拆成两段
+        diffs = np.sqrt(((np.roll(cycle, -1, axis=0) - cycle) ** 2).sum(axis=1))
+        start = (int(np.argmax(diffs)) + 1) % len(cycle)
+        cycle = np.roll(cycle, -start, axis=0)
+
+        bands: List[List[Any]] = []  # [颜色累加, 像素数]
+        for pixel in cycle:
+            if bands:
+                mean = bands[-1][0] / bands[-1][1]
+                if float(np.sqrt(((pixel - mean) ** 2).sum())) <= self.BAND_DELTA_E:
+                    bands[-1][0] = bands[-1][0] + pixel
+                    bands[-1][1] += 1
+                    continue
+            bands.append([pixel.astype(np.float64).copy(), 1])
+
+        # 过窄的色带（多为抗锯齿过渡）并入色差更小的相邻色带
+        merged = True
+        while merged and len(bands) > 2:
+            merged = False
+            for idx, (total, count) in enumerate(bands):
+                if count >= self.MIN_BAND_PX:
+                    continue
+                mean = total / count
+                neighbours = [i for i in (idx - 1, idx + 1) if 0 <= i < len(bands)]
+                target = min(
+                    neighbours,
+                    key=lambda i: float(np.sqrt(((bands[i][0] / bands[i][1] - mean) ** 2).sum())),
+                )
+                bands[target][0] = bands[target][0] + total
+                bands[target][1] += count
+                del bands[idx]
+                merged = True
+                break
+
+        means = np.asarray([total / count for total, count in bands])
+        colors = lab_to_rgb(means)
+        return [
+            {
+                "color": {"r": int(r), "g": int(g), "b": int(b)},
+                "widthPx": round(count * scale, 2),
+            }
+            for (r, g, b), (_, count) in zip(colors.tolist(), bands)
+        ]
+
+    # ---- 渲染 ----
+
+    def normalize_units(self, stripe_units: List[Dict[str, Any]], unit_width: Optional[float] = None) -> List[Tuple[Tuple[int, int, int], float]]:
+        """
+        规范化条纹单元，兼容 widthPx 与 relativeWidth（LLM 衍生方案）两种格式
+
+        Returns:
+            [ ((r,g,b), 宽度像素), ... ]
+        """
+        if not isinstance(stripe_units, list) or not stripe_units:
+            raise ValueError("stripeUnits are required")
+        if len(stripe_units) > self.MAX_UNITS:
+            raise ValueError(f"stripeUnits must contain at most {self.MAX_UNITS} items")
+
+        unit_width = float(unit_width or self.DEFAULT_UNIT_WIDTH)
+        normalized = []
+        for unit in stripe_units:
+            if not isinstance(unit, dict):
+                continue
+            color = unit.get("color") or {}
+            try:
+                rgb = tuple(max(0, min(255, int(color.get(channel, 0)))) for channel in ("r", "g", "b"))
+            except Exception:
+                rgb = (0, 0, 0)
+            try:
+                if unit.get("widthPx") is not None:
+                    width = float(unit["widthPx"])
+                else:
+                    width = float(unit.get("relativeWidth", 0)) * unit_width
+            except Exception:
+                width = 0.0
+            if width > 0 and math.isfinite(width):
+                normalized.append((rgb, round(width, 2)))
+
+        if not normalized:
+            raise ValueError("No valid stripe units provided")
+        return normalized
+
+    @staticmethod
+    def tile_signature(units: List[Tuple[Tuple[int, int, int], float]], width: int, height: int, angle: float) -> str:
+        """条纹单元 + 渲染参数的规范化签名，用作缓存键与 ETag"""
+        canonical = json.dumps(
+            {
+                "units": [[list(rgb), w] for rgb, w in units],
+                "width": width,
+                "height": height,
+                "angle": round(angle % 360, 1),
+            },
+            separators=(",", ":"),
+        )
+        return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+    def render_tile(
+        self,
+        stripe_units: List[Dict[str, Any]],
+        width: int,
+        height: int,
+        angle: float = 0.0,
+        unit_width: Optional[float] = None,
+    ) -> Tuple[str, bytes, bool]:
+        """
+        渲染旋转后的条纹平铺图（PNG）
+
+        Args:
+            stripe_units: 条纹单元列表
+            width, height: 输出尺寸（像素）
+            angle: 旋转角度（度），与前端 drawStripesWithRotation 保持一致
+            unit_width: relativeWidth 单元对应的循环宽度
+
+        Returns:
+            (签名, PNG字节, 是否命中缓存)
+        """
+        if not self.is_available():
+            raise RuntimeError("条纹引擎不可用：需要安装 numpy 与 Pillow")
+        if not (1 <= width <= self.MAX_TILE_SIDE and 1 <= height <= self.MAX_TILE_SIDE):
+            raise ValueError(f"width/height must be between 1 and {self.MAX_TILE_SIDE}")
+
+        units = self.normalize_units(stripe_units, unit_width)
+        # 角度先规范化再渲染：θ 与 θ+180° 的条纹方向相反（渲染结果是镜像），不能共用缓存
+        angle = round(angle % 360, 1)
+        signature = self.tile_signature(units, width, height, angle)
+        cached = self.tile_cache.get(signature)
+        if cached is not None:
+            return signature, cached, True
+
+        colors = np.asarray([rgb for rgb, _ in units], dtype=np.uint8)
+        widths = np.asarray([w for _, w in units], dtype=np.float64)
+        boundaries = np.cumsum(widths)
+        period = float(boundaries[-1])
+
+        # 逆旋转像素坐标到条纹坐标系：条纹在旋转后的坐标系中为竖直色带
+        theta = math.radians(angle)
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float64)
+        cx, cy = width / 2, height / 2
+        diagonal = math.hypot(width, height)
+        u = (xs - cx) * math.cos(theta) + (ys - cy) * math.sin(theta) + cx + diagonal
+        phase = np.mod(u, period)
+        band_index = np.minimum(np.searchsorted(boundaries, phase, side="right"), len(units) - 1)
+        pixels = colors[band_index]
+
+        buffer = BytesIO()
+        Image.fromarray(pixels, mode="RGB").save(buffer, format="PNG", optimize=False)
+        data = buffer.getvalue()
+        self.tile_cache.put(signature, data)
+        return signature, data, False
+
+
+# 全局实例
+stripe_engine = StripeEngine()
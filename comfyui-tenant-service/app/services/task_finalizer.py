@@ -0,0 +1,428 @@
+"""
+任务完成处理器
+后台定时扫描 PENDING 任务记录，任务在 RunningHub 进入终态后由服务端完成收尾：
+下载输出、生成缩略图并更新任务记录。客户端关闭页面不影响结果入库，
+POST /proxy/tasks/{task_id}/complete 只读取已完成的记录。
+
+每个任务一条持久化作业（SQLite），保证每个任务只被收尾一次：
+- 认领作业使用 BEGIN IMMEDIATE，多个 worker 之间只有一个执行者；执行中的作业带租约，
+  持有者崩溃后租约过期可被重新认领
+- 任务记录的更新是提交点：执行前重新读取记录，已不是 PENDING 的直接标记完成，不会重复下载
+- 下载失败按指数退避重试，超过次数后任务记录标记为失败
+- RunningHub 服务并发预算已满时返回排队票据（q 开头），状态响应带回 upstreamTaskId 后，
+  任务记录与作业改用真正的 RunningHub taskId（adopt_upstream_id），不再依赖票据映射
+"""
+import asyncio
+import contextlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from .config import get_settings
+from .logger import get_finalizer_logger
+from .log_policy import loggable
+from .metrics import get_metrics_registry
+from .tracing import KIND_CLIENT, inject_headers, span
+
+# 任务从建立作业到收尾完成的耗时（秒）
+LIFECYCLE_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0, 3600.0, 21600.0, 86400.0)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# RunningHub 服务排队票据的前缀（见 comfyui-runninghub app/services/task_scheduler.py）
+TICKET_PREFIX = "q"
+
+
+class FinalizeQueue:
+    """持久化的完成作业队列，按 RunningHub 任务 ID 去重"""
+
+    PRUNE_EVERY = 200
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._claims = 0
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS finalize_jobs ("
+            " task_id TEXT PRIMARY KEY, tenant_task_id TEXT NOT NULL, user_id TEXT NOT NULL,"
+            " state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, available_at REAL NOT NULL,"
+            " lease_until REAL NOT NULL DEFAULT 0, result TEXT, error TEXT,"
+            " created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection().execute(
+            "CREATE INDEX IF NOT EXISTS idx_finalize_jobs_state ON finalize_jobs (state, available_at)"
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.path), timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, records: List[Dict[str, Any]]) -> int:
+        """为 PENDING 任务记录建立作业，已存在的作业不变；返回新建数量"""
+        now = time.time()
+        conn = self._connection()
+        before = conn.total_changes
+        conn.executemany(
+            "INSERT OR IGNORE INTO finalize_jobs"
+            " (task_id, tenant_task_id, user_id, state, available_at, created_at, updated_at)"
+            " VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+            [(r["runninghub_task_id"], r["tenant_task_id"], r["user_id"], now, now, now) for r in records],
+        )
+        return conn.total_changes - before
+
+    def expedite(self, task_id: str):
+        """让排队中的作业排到最前、立即可被认领（客户端在等待结果）"""
+        self._connection().execute(
+            "UPDATE finalize_jobs SET available_at = 0 WHERE task_id = ? AND state = 'queued'", (task_id,)
+        )
+
+    def rename(self, task_id: str, new_task_id: str):
+        """作业改用新的任务 ID；新 ID 已有作业时保留已有的，删除旧作业"""
+        conn = self._connection()
+        conn.execute("UPDATE OR IGNORE finalize_jobs SET task_id = ? WHERE task_id = ?", (new_task_id, task_id))
+        conn.execute("DELETE FROM finalize_jobs WHERE task_id = ?", (task_id,))
+
+    def claim(self, limit: int, lease_seconds: float, task_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """认领到期的排队作业与租约过期的执行中作业；指定 task_id 时只认领该作业"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT task_id, tenant_task_id, user_id, attempts, created_at FROM finalize_jobs"
+                " WHERE ((state = 'queued' AND available_at <= ?) OR (state = 'running' AND lease_until < ?))"
+                " AND (? IS NULL OR task_id = ?)"
+                " ORDER BY available_at LIMIT ?",
+                (now, now, task_id, task_id, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE finalize_jobs SET state = 'running', lease_until = ?, updated_at = ? WHERE task_id = ?",
+                [(now + lease_seconds, now, row[0]) for row in rows],
+            )
+            self._claims += 1
+            if self._claims % self.PRUNE_EVERY == 0:
+                # 已完成的作业保留一周，供 /complete 查询与排查
+                conn.execute(
+                    "DELETE FROM finalize_jobs WHERE state IN ('done', 'failed') AND updated_at < ?",
+                    (now - 7 * 86400,),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return [
+            {"task_id": r[0], "tenant_task_id": r[1], "user_id": r[2], "attempts": r[3], "created_at": r[4]}
+            for r in rows
+        ]
+
+    def release(self, task_id: str, delay_seconds: float, failed_attempt: bool = False, error: Optional[str] = None):
+        """放回队列，delay_seconds 后再处理"""
+        now = time.time()
+        self._connection().execute(
+            "UPDATE finalize_jobs SET state = 'queued', available_at = ?, lease_until = 0,"
+            " attempts = attempts + ?, error = COALESCE(?, error), updated_at = ? WHERE task_id = ?",
+            (now + delay_seconds, 1 if failed_attempt else 0, error, now, task_id),
+        )
+
+    def finish(self, task_id: str, state: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None):
+        self._connection().execute(
+            "UPDATE finalize_jobs SET state = ?, lease_until = 0, result = ?, error = ?, updated_at = ?"
+            " WHERE task_id = ?",
+            (state, json.dumps(result, ensure_ascii=False) if result is not None else None, error, time.time(), task_id),
+        )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connection().execute(
+            "SELECT state, attempts, error FROM finalize_jobs WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"state": row[0], "attempts": row[1], "error": row[2]}
+
+    def counts(self) -> Dict[str, int]:
+        rows = self._connection().execute("SELECT state, COUNT(*) FROM finalize_jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+
+class TaskFinalizer:
+    """后台完成处理器：扫描 PENDING 记录 → 批量查询上游状态 → 终态任务收尾"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self.queue = FinalizeQueue(self.settings.finalizer_queue_path)
+        self.logger = get_finalizer_logger()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_scan = 0.0
+        self._tenants: Dict[str, Any] = {}
+        metrics = get_metrics_registry()
+        self.lifecycle_seconds = metrics.histogram(
+            "tenant_task_lifecycle_seconds", "任务从发现（PENDING）到收尾完成的耗时",
+            ("task_type", "outcome"), buckets=LIFECYCLE_BUCKETS,
+        )
+        self.finalize_seconds = metrics.histogram(
+            "tenant_task_finalize_seconds", "单个任务收尾（获取输出、下载、缩略图、更新记录）的耗时", ("outcome",)
+        )
+        metrics.register_collector(self.collect)
+
+    async def _call(self, method, *args):
+        # SQLite 事务可能等待文件锁，避免阻塞事件循环
+        return await asyncio.to_thread(method, *args)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self.logger.info("任务完成处理器已启动，扫描间隔 %.1fs", self.settings.finalizer_poll_seconds)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.logger.exception("任务完成处理出错: %s", e)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.settings.finalizer_poll_seconds)
+            self._wakeup.clear()
+
+    async def run_once(self) -> int:
+        """扫描一次并处理到期的作业，返回处理（放回队列以外）的作业数"""
+        from .repository import repository_session
+
+        now = time.monotonic()
+        if now - self._last_scan >= self.settings.finalizer_scan_seconds:
+            self._last_scan = now
+            async with repository_session() as repo:
+                pending = await repo.get_pending_tasks(self.settings.finalizer_scan_limit)
+            if pending:
+                created = await self._call(self.queue.enqueue, pending)
+                if created:
+                    self.logger.info("新增待完成任务: %d 条", created)
+
+        jobs = await self._call(self.queue.claim, self.settings.finalizer_batch_size, self.settings.finalizer_lease_seconds)
+        return await self._run_jobs(jobs)
+
+    async def _run_jobs(self, jobs: List[Dict[str, Any]]) -> int:
+        """批量查询上游状态并处理已认领的作业，返回处理（放回队列以外）的作业数"""
+        from .repository import repository_session
+
+        if not jobs:
+            return 0
+
+        async with repository_session() as repo:
+            statuses = await self._fetch_statuses(jobs, repo)
+            finished = 0
+            for job in jobs:
+                try:
+                    upstream = statuses.get(job["task_id"]) or {}
+                    upstream_id = upstream.get("upstreamTaskId")
+                    if upstream_id and upstream_id != job["task_id"]:
+                        await self.adopt_upstream_id(repo, job["tenant_task_id"], job["task_id"], upstream_id)
+                        job["task_id"] = upstream_id
+                    if await self._process(job, upstream, repo):
+                        finished += 1
+                except Exception as e:
+                    # 存储暂时不可用：放回队列稍后重试，不影响同批其它作业
+                    self.logger.error("任务收尾出错: %s, %s", job["task_id"], e)
+                    await self._call(self.queue.release, job["task_id"], self.settings.finalizer_poll_seconds, True, str(e))
+        return finished
+
+    async def adopt_upstream_id(self, repo, tenant_task_id: str, task_id: str, upstream_task_id: str) -> bool:
+        """
+        排队票据已派发：任务记录与完成作业改用 RunningHub taskId。
+        票据映射只保存在 RunningHub 服务中，改记后状态/输出查询不再依赖它
+        """
+        updated = await repo.update_task_runninghub_id(tenant_task_id, upstream_task_id)
+        await self._call(self.queue.rename, task_id, upstream_task_id)
+        if updated:
+            self.logger.info("排队票据已派发，任务记录改用 RunningHub 任务: %s -> %s", task_id, upstream_task_id)
+        return updated
+
+    async def _tenant_of(self, username: str, repo):
+        if username not in self._tenants:
+            user = await repo.get_user_by_username(username)
+            self._tenants[username] = user.get("tenant_id") if user else None
+        return self._tenants[username]
+
+    async def _fetch_statuses(self, jobs: List[Dict[str, Any]], repo) -> Dict[str, Dict[str, Any]]:
+        """按租户分组，调用 RunningHub 服务的批量状态接口"""
+        groups: Dict[Any, List[str]] = {}
+        for job in jobs:
+            groups.setdefault(await self._tenant_of(job["user_id"], repo), []).append(job["task_id"])
+
+        statuses: Dict[str, Dict[str, Any]] = {}
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            for tenant_id, task_ids in groups.items():
+                headers = {"X-Tenant-ID": str(tenant_id)} if tenant_id is not None else {}
+                try:
+                    with span("runninghub_service", kind=KIND_CLIENT, endpoint="tasks/status:batch"):
+                        response = await client.post(
+                            f"{self.settings.runninghub_service_url}/v1/tasks/status:batch",
+                            json={"taskIds": task_ids},
+                            headers=inject_headers(headers),
+                        )
+                    response.raise_for_status()
+                    statuses.update(response.json().get("statuses", {}))
+                except Exception as e:
+                    self.logger.warning("批量查询任务状态失败: 租户=%s, 任务数=%d, %s", tenant_id, len(task_ids), e)
+        return statuses
+
+    def _observe_lifecycle(self, job: Dict[str, Any], record: Dict[str, Any], outcome: str):
+        self.lifecycle_seconds.observe(
+            time.time() - job["created_at"], task_type=record.get("task_type") or "unknown", outcome=outcome
+        )
+
+    async def _process(self, job: Dict[str, Any], upstream: Dict[str, Any], repo) -> bool:
+        task_id = job["task_id"]
+        record = await repo.get_task_record(job["tenant_task_id"])
+        if record is None or record.get("status") != "PENDING":
+            # 记录已被其它途径更新（或已删除）：视为已完成
+            await self._call(self.queue.finish, task_id, DONE)
+            return True
+
+        status = upstream.get("status")
+        if status == "FAILED":
+            error = upstream.get("error") or "RunningHub 任务失败"
+            await repo.update_task_failed(job["tenant_task_id"], error)
+            await self._call(self.queue.finish, task_id, DONE, {"status": "FAILED"}, error)
+            self._observe_lifecycle(job, record, "failed")
+            self.logger.info("任务失败已记录: %s", task_id)
+            return True
+
+        if status != "SUCCESS":
+            age_hours = (time.time() - job["created_at"]) / 3600
+            if age_hours >= self.settings.finalizer_max_pending_hours:
+                error = f"任务在 {self.settings.finalizer_max_pending_hours} 小时内未完成（最后状态: {status or 'UNKNOWN'}）"
+                await repo.update_task_failed(job["tenant_task_id"], error)
+                await self._call(self.queue.finish, task_id, FAILED, None, error)
+                self._observe_lifecycle(job, record, "expired")
+                self.logger.warning("放弃等待任务完成: %s, %s", task_id, error)
+                return True
+            await self._call(self.queue.release, task_id, self.settings.finalizer_poll_seconds)
+            return False
+
+        started = time.perf_counter()
+        try:
+            result = await self._store_outputs(job)
+        except Exception as e:
+            self.finalize_seconds.observe(time.perf_counter() - started, outcome="error")
+            attempts = job["attempts"] + 1
+            if attempts >= self.settings.finalizer_max_attempts:
+                error = f"输出下载失败: {e}"
+                await repo.update_task_failed(job["tenant_task_id"], error)
+                await self._call(self.queue.finish, task_id, FAILED, None, error)
+                self._observe_lifecycle(job, record, "download_failed")
+                self.logger.error("任务收尾失败，已放弃: %s, 尝试 %d 次, %s", task_id, attempts, e)
+                return True
+            delay = min(300.0, self.settings.finalizer_poll_seconds * (2 ** attempts))
+            self.logger.warning("任务收尾失败，%.0fs 后重试: %s, 第 %d 次, %s", delay, task_id, attempts, e)
+            await self._call(self.queue.release, task_id, delay, True, str(e))
+            return False
+
+        if not await repo.update_task_success(
+            job["tenant_task_id"], result["outputs_data"], result["storage_entries"]
+        ):
+            await self._call(self.queue.release, task_id, self.settings.finalizer_poll_seconds, True, "任务记录更新失败")
+            return False
+        await self._call(
+            self.queue.finish, task_id, DONE,
+            {"status": "SUCCESS", "outputCount": result["output_count"]},
+        )
+        self.finalize_seconds.observe(time.perf_counter() - started, outcome="success")
+        self._observe_lifecycle(job, record, "success")
+        self.logger.info("任务收尾完成: %s, 文件 %d 个", task_id, len(result["storage_entries"]))
+        return True
+
+    async def _store_outputs(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """获取任务输出，下载文件并生成缩略图"""
+        from .image_storage import image_storage_service
+
+        task_id = job["task_id"]
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            with span("runninghub_service", kind=KIND_CLIENT, endpoint="tasks/{id}/outputs"):
+                response = await client.get(
+                    f"{self.settings.runninghub_service_url}/v1/tasks/{task_id}/outputs",
+                    headers=inject_headers({}),
+                )
+            response.raise_for_status()
+            outputs_data = response.json()
+
+        outputs = outputs_data.get("outputs") or []
+        self.logger.debug("任务 %s 输出: %s", task_id, loggable(outputs))
+        stored_outputs = []
+        if outputs:
+            with span("store_outputs", taskId=task_id, outputCount=len(outputs)):
+                stored_outputs = await image_storage_service.download_and_store_images(job["user_id"], outputs)
+
+        storage_entries = [
+            {"original": output["localPath"], "thumbnail": output.get("thumbnailPath")}
+            for output in stored_outputs
+            if "localPath" in output
+        ]
+        if outputs and not storage_entries:
+            raise RuntimeError("没有任何输出文件下载成功")
+        return {"outputs_data": outputs_data, "storage_entries": storage_entries, "output_count": len(stored_outputs)}
+
+    async def finalize_now(self, record: Dict[str, Any], wait_seconds: float) -> Optional[Dict[str, Any]]:
+        """
+        客户端等待结果时调用：确保作业存在并立即处理，最多等待 wait_seconds 秒
+
+        Returns:
+            作业状态（{"state", "attempts", "error"}），作业仍未结束时 state 为 queued/running
+        """
+        task_id = record["runninghub_task_id"]
+        await self._call(self.queue.enqueue, [record])
+        await self._call(self.queue.expedite, task_id)
+        if self._task is None:
+            # 后台处理器未启动（FINALIZER_ENABLED=false）时就地处理，只处理调用方自己的作业
+            jobs = await self._call(self.queue.claim, 1, self.settings.finalizer_lease_seconds, task_id)
+            await self._run_jobs(jobs)
+        else:
+            self._wakeup.set()
+
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            job = await self._call(self.queue.get, task_id)
+            if job is None or job["state"] in (DONE, FAILED) or time.monotonic() >= deadline:
+                return job
+            await asyncio.sleep(0.5)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self._task is not None, "jobs": self.queue.counts()}
+
+    def collect(self):
+        """/metrics：各状态的作业数"""
+        counts = self.queue.counts()
+        yield "tenant_finalizer_jobs", "gauge", "完成处理器各状态的作业数", [
+            ({"state": state}, counts.get(state, 0)) for state in (QUEUED, RUNNING, DONE, FAILED)
+        ]
+
+
+_finalizer: Optional[TaskFinalizer] = None
+
+
+def get_task_finalizer() -> TaskFinalizer:
+    global _finalizer
+    if _finalizer is None:
+        _finalizer = TaskFinalizer()
+    return _finalizer
@@ -0,0 +1,189 @@
+"""
+API 用量统计
+请求路径上只在内存中累加计数（租户、用户、接口、分钟），后台定时把已结束的分钟批量写入存储：
+- 通过存储仓库的 append_api_usage 批量写入：数据库存储为一次 executemany 插入 api_usage，
+  JSON 存储追加写入 api_usage.jsonl（每行一条聚合记录），不重写整个文件
+- 每行的 request_count 为该分钟的请求数
+关闭服务时写出全部剩余计数（包括当前分钟）。多进程部署时同一分钟可能有多行，查询时求和。
+"""
+import asyncio
+import calendar
+import contextlib
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from .config import get_settings
+from .logger import get_main_logger
+from .metrics import get_metrics_registry
+
+# (tenant_id, user_id, endpoint, 分钟起始时间戳)
+UsageKey = Tuple[Any, Any, str, int]
+
+GRANULARITIES = {"minute": 60, "hour": 3600, "day": 86400}
+GROUP_FIELDS = ("endpoint", "user_id")
+
+
+def _to_datetime(minute: int) -> datetime:
+    return datetime.utcfromtimestamp(minute)
+
+
+def _to_minute(created_at: datetime) -> int:
+    """_to_datetime 的逆运算：created_at 是 naive UTC，不能用 .timestamp()（会按本地时区解释）"""
+    return calendar.timegm(created_at.timetuple())
+
+
+class UsageAccounting:
+    """按分钟聚合的用量计数器"""
+
+    def __init__(self, settings=None):
+        self.settings = settings or get_settings()
+        self.logger = get_main_logger()
+        self._counts: Dict[UsageKey, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        metrics = get_metrics_registry()
+        self.flushed_rows = metrics.counter("tenant_usage_flushed_rows_total", "写入存储的用量聚合行数")
+        self.flush_errors = metrics.counter("tenant_usage_flush_errors_total", "用量写入失败次数")
+        metrics.register_collector(self.collect)
+
+    def record(self, tenant_id, user_id, endpoint: str):
+        """请求路径上调用：只做一次字典累加"""
+        minute = int(time.time()) // 60 * 60
+        with self._lock:
+            self._counts[(tenant_id, user_id, endpoint[:100], minute)] += 1
+
+    def _take(self, include_current: bool) -> List[Dict[str, Any]]:
+        current_minute = int(time.time()) // 60 * 60
+        with self._lock:
+            if include_current:
+                taken, self._counts = self._counts, defaultdict(int)
+            else:
+                taken = {key: count for key, count in self._counts.items() if key[3] < current_minute}
+                for key in taken:
+                    del self._counts[key]
+        return [
+            {
+                "tenant_id": tenant_id,
+                "user_id": user_id,
+                "endpoint": endpoint,
+                "request_count": count,
+                "created_at": _to_datetime(minute),
+            }
+            for (tenant_id, user_id, endpoint, minute), count in taken.items()
+        ]
+
+    def _restore(self, rows: List[Dict[str, Any]]):
+        """写入失败时把计数放回内存，下次再写"""
+        with self._lock:
+            for row in rows:
+                key = (row["tenant_id"], row["user_id"], row["endpoint"], _to_minute(row["created_at"]))
+                self._counts[key] += row["request_count"]
+
+    async def flush(self, include_current: bool = False) -> int:
+        """把已结束分钟的计数写入存储，返回写入行数"""
+        from .repository import repository_session
+
+        rows = self._take(include_current)
+        if not rows:
+            return 0
+        try:
+            async with repository_session() as repo:
+                await repo.append_api_usage(rows)
+        except Exception as e:
+            self._restore(rows)
+            self.flush_errors.inc()
+            self.logger.warning("写入用量统计失败（%d 行，稍后重试）: %s", len(rows), e)
+            return 0
+        self.flushed_rows.inc(len(rows))
+        return len(rows)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            self.logger.info("用量统计已启动，写入间隔 %.1fs", self.settings.usage_flush_seconds)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        written = await self.flush(True)
+        if written:
+            self.logger.info("关闭前写出用量统计 %d 行", written)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.settings.usage_flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.logger.exception("用量统计写入出错: %s", e)
+
+    def _pending_rows(self, tenant_id) -> List[Dict[str, Any]]:
+        with self._lock:
+            items = [(key, count) for key, count in self._counts.items() if key[0] == tenant_id]
+        return [
+            {"user_id": key[1], "endpoint": key[2], "request_count": count, "created_at": _to_datetime(key[3])}
+            for key, count in items
+        ]
+
+    async def query(
+        self,
+        repo,
+        tenant_id,
+        start: datetime,
+        end: datetime,
+        granularity: str = "hour",
+        group_by: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        租户在 [start, end) 内的请求数，按时间粒度（minute/hour/day）分桶，可再按 endpoint 或 user_id 分组。
+        结果包含尚未写入存储的内存计数。
+        """
+        rows = await repo.get_api_usage(tenant_id, start, end)
+        rows += [row for row in self._pending_rows(tenant_id) if start <= row["created_at"] < end]
+
+        step = GRANULARITIES[granularity]
+        buckets: Dict[Tuple[datetime, Any], int] = defaultdict(int)
+        total = 0
+        for row in rows:
+            created_at = row["created_at"]
+            epoch = int((created_at - datetime(1970, 1, 1)).total_seconds())
+            bucket = datetime(1970, 1, 1) + timedelta(seconds=epoch // step * step)
+            buckets[(bucket, row[group_by] if group_by else None)] += row["request_count"]
+            total += row["request_count"]
+
+        series = []
+        for (bucket, group), count in sorted(buckets.items(), key=lambda item: (item[0][0], str(item[0][1]))):
+            entry = {"start": bucket.isoformat() + "Z", "requests": count}
+            if group_by:
+                entry[group_by] = group
+            series.append(entry)
+        return {
+            "tenantId": tenant_id,
+            "start": start.isoformat() + "Z",
+            "end": end.isoformat() + "Z",
+            "granularity": granularity,
+            "groupBy": group_by,
+            "total": total,
+            "series": series,
+        }
+
+    def collect(self):
+        with self._lock:
+            pending = len(self._counts)
+        yield "tenant_usage_pending_keys", "gauge", "内存中尚未写入的用量聚合键数", [({}, pending)]
+
+
+_usage_accounting: Optional[UsageAccounting] = None
+
+
+def get_usage_accounting() -> UsageAccounting:
+    global _usage_accounting
+    if _usage_accounting is None:
+        _usage_accounting = UsageAccounting()
+    return _usage_accounting